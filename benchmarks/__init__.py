@@ -0,0 +1,2 @@
+""" Benchmarks for measuring the performance of site rankings, event records, and leaderboards at scale, against a
+synthetic dataset. See `benchmarks.run` for usage. """
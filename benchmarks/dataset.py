@@ -0,0 +1,381 @@
+""" Generates a synthetic, but realistic-ish, dataset of users and their competition histories for benchmarking.
+
+Each user has an overall skill level and an activity level. Users take part in a random subset of competitions based
+on their activity level, and in each competition they compete in a random subset of that competition's events. Solve
+times are spread around the user's skill level relative to the world record for the event, with occasional DNFs. MBLD
+results use the coded XXYYYYZZ representation, and a small fraction of results are blacklisted. PB flags are calculated
+the same way `recalculate_user_pbs_for_event` does, so the data is ready for site rankings to be calculated.
+
+The scrambles, solves, settings, and scramble pool which hang off those users and results are only needed by some
+benchmarks, so they're generated separately. """
+
+from datetime import datetime, timedelta
+import random
+from typing import Dict, List, Tuple
+
+from sqlalchemy import insert
+
+from cubersio import DB
+from cubersio.business.user_results.blacklisting import __AUTO_BLACKLIST_THRESHOLDS
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, EventFormat, User, UserEventResults,\
+    Scramble, ScramblePool, UserSetting, UserSolve
+from cubersio.persistence.settings_manager import SETTING_INFO_MAP
+from cubersio.util.events.resources import WCA_EVENTS, NON_WCA_EVENTS, BONUS_EVENTS, EVENT_MBLD, EVENT_FMC, EVENT_3BLD,\
+    EVENT_4BLD, EVENT_5BLD
+from cubersio.util.ranks import to_sort_value, DNF_SORT_VALUE, MISSING_SORT_VALUE
+
+# -------------------------------------------------------------------------------------------------
+
+DNF = 'DNF'
+
+# Events which are held as best-of-3
+__BEST_OF_3_EVENTS = {EVENT_3BLD.name, EVENT_4BLD.name, EVENT_5BLD.name, EVENT_MBLD.name}
+
+# Baseline (WR single, WR average) for events which don't have auto-blacklist thresholds
+__DEFAULT_WR_TIMES = (500, 700)
+
+# Chance of any individual solve being a DNF, and of any result being blacklisted
+__DNF_CHANCE       = 0.03
+__BLACKLIST_CHANCE = 0.01
+
+# Chance of a bonus event being held in any given competition
+__BONUS_EVENT_CHANCE = 0.3
+
+# How many rows to insert at a time
+__INSERT_BATCH_SIZE = 5000
+
+# Chance of a user having visited their settings page, which creates every setting for them
+__SETTINGS_CHANCE = 0.5
+
+# The moves scrambles are made of, for plausible-looking scrambles
+__SCRAMBLE_MOVES = [face + suffix for face in 'RLUDFB' for suffix in ('', "'", '2')]
+__SCRAMBLE_LENGTH = 20
+
+# -------------------------------------------------------------------------------------------------
+
+def generate_dataset(user_count: int, comp_count: int, seed: int = 0) -> Dict[str, int]:
+    """ Generates `user_count` users with histories across `comp_count` competitions into the database, which is
+    expected to be empty. Returns a dict of counts of the records created. """
+
+    rng = random.Random(seed)
+
+    events = __create_events()
+    comp_events = __create_competitions(comp_count, events, rng)
+    user_ids = __create_users(user_count, rng)
+
+    results_count = 0
+    pending_rows = list()
+
+    for user_id in user_ids:
+        pending_rows.extend(__generate_user_results(user_id, comp_events, events, rng))
+        if len(pending_rows) >= __INSERT_BATCH_SIZE:
+            results_count += __insert_rows(UserEventResults, pending_rows)
+            pending_rows = list()
+
+    results_count += __insert_rows(UserEventResults, pending_rows)
+
+    return {
+        'users': len(user_ids),
+        'competitions': comp_count,
+        'comp_events': sum(len(comp) for comp in comp_events),
+        'results': results_count,
+    }
+
+
+def generate_supporting_data(seed: int = 0) -> Dict[str, int]:
+    """ Generates the records which hang off the users and results of a dataset created by `generate_dataset`: each
+    competition event's scrambles along with a solve for each of them in every result, every setting for a fraction of
+    users, and a topped-off scramble pool for every event. Returns a dict of counts of the records created. """
+
+    rng = random.Random(seed)
+
+    scramble_rows = [{'competition_event_id': comp_event_id, 'scramble': __generate_scramble(rng)}
+                     for comp_event_id, total_solves in DB.session.query(CompetitionEvent.id, Event.totalSolves).
+                     join(Event).order_by(CompetitionEvent.id)
+                     for _ in range(total_solves)]
+    scrambles_count = __insert_rows(Scramble, scramble_rows)
+
+    # Map of comp event ID to the IDs of its scrambles, in order
+    scramble_ids = dict()
+    for scramble_id, comp_event_id in DB.session.query(Scramble.id, Scramble.competition_event_id).\
+            order_by(Scramble.id):
+        scramble_ids.setdefault(comp_event_id, list()).append(scramble_id)
+
+    solves_count = 0
+    pending_rows = list()
+
+    results = DB.session.query(UserEventResults.id, UserEventResults.comp_event_id).\
+        order_by(UserEventResults.id).\
+        all()
+
+    for results_id, comp_event_id in results:
+        pending_rows.extend({'user_event_results_id': results_id, 'scramble_id': scramble_id,
+                             'time': rng.randint(500, 6000), 'is_dnf': rng.random() < __DNF_CHANCE,
+                             'is_inspection_dnf': False, 'is_plus_two': False}
+                            for scramble_id in scramble_ids[comp_event_id])
+        if len(pending_rows) >= __INSERT_BATCH_SIZE:
+            solves_count += __insert_rows(UserSolve, pending_rows)
+            pending_rows = list()
+
+    solves_count += __insert_rows(UserSolve, pending_rows)
+
+    settings_rows = [{'user_id': user_id, 'setting_code': code, 'setting_value': info.default_value}
+                     for (user_id,) in DB.session.query(User.id).order_by(User.id)
+                     if rng.random() < __SETTINGS_CHANCE
+                     for code, info in SETTING_INFO_MAP.items()]
+    settings_count = __insert_rows(UserSetting, settings_rows)
+
+    # The scramble pool is kept topped off at twice as many scrambles as each event needs
+    pool_rows = [{'event_id': event_id, 'scramble': __generate_scramble(rng)}
+                 for event_id, total_solves in DB.session.query(Event.id, Event.totalSolves).order_by(Event.id)
+                 for _ in range(2 * total_solves)]
+    pool_count = __insert_rows(ScramblePool, pool_rows)
+
+    return {
+        'scrambles': scrambles_count,
+        'solves': solves_count,
+        'settings': settings_count,
+        'scramble_pool': pool_count,
+    }
+
+# -------------------------------------------------------------------------------------------------
+
+def __create_events() -> List[Event]:
+    """ Creates an Event record for every event. """
+
+    events = list()
+    for event_definition in WCA_EVENTS + NON_WCA_EVENTS:
+        event = Event(name=event_definition.name, totalSolves=event_definition.num_scrambles,
+                      eventFormat=__event_format(event_definition))
+        DB.session.add(event)
+        events.append(event)
+
+    DB.session.commit()
+
+    # Detach the events so they aren't expired, and reloaded, every time a batch of results is committed
+    for event in events:
+        DB.session.refresh(event)
+        DB.session.expunge(event)
+
+    return events
+
+
+def __event_format(event_definition) -> str:
+    """ Determines a plausible event format for an event definition. """
+
+    if event_definition.name in __BEST_OF_3_EVENTS:
+        return EventFormat.Bo3
+    if event_definition.num_scrambles == 1:
+        return EventFormat.Bo1
+    if event_definition.num_scrambles == 3:
+        return EventFormat.Mo3
+    return EventFormat.Ao5
+
+
+def __create_competitions(comp_count: int, events: List[Event], rng: random.Random) -> List[List[Tuple[int, Event]]]:
+    """ Creates weekly competitions, each holding every WCA and weekly event, and a random selection of bonus events.
+    The last competition is the active one. Returns, for each competition in order, a list of (comp event ID, Event)
+    for the events held in that competition. """
+
+    bonus_event_names = set(e.name for e in BONUS_EVENTS)
+    first_start = datetime(2019, 1, 1) - timedelta(weeks=comp_count)
+
+    comp_events = list()
+    for i in range(comp_count):
+        start = first_start + timedelta(weeks=i)
+        competition = Competition(title=f'Benchmark Competition {i + 1}', start_timestamp=start,
+                                  end_timestamp=start + timedelta(weeks=1), active=(i == comp_count - 1))
+        DB.session.add(competition)
+        DB.session.flush()
+
+        held = list()
+        for event in events:
+            if event.name in bonus_event_names and rng.random() > __BONUS_EVENT_CHANCE:
+                continue
+            comp_event = CompetitionEvent(competition_id=competition.id, event_id=event.id)
+            DB.session.add(comp_event)
+            held.append((comp_event, event))
+
+        DB.session.flush()
+        comp_events.append([(comp_event.id, event) for comp_event, event in held])
+
+    DB.session.commit()
+    return comp_events
+
+
+def __create_users(user_count: int, rng: random.Random) -> List[int]:
+    """ Creates users, and returns their IDs. """
+
+    rows = [{'username': f'benchmark_user_{i}', 'is_verified': rng.random() < 0.2, 'is_admin': False}
+            for i in range(user_count)]
+    __insert_rows(User, rows)
+
+    return [user_id for (user_id,) in DB.session.query(User.id).order_by(User.id).all()]
+
+
+def __insert_rows(model, rows: List[Dict]) -> int:
+    """ Inserts rows for the specified model in batches, and returns how many were inserted. """
+
+    for i in range(0, len(rows), __INSERT_BATCH_SIZE):
+        DB.session.execute(insert(model), rows[i:i + __INSERT_BATCH_SIZE])
+    DB.session.commit()
+
+    return len(rows)
+
+# -------------------------------------------------------------------------------------------------
+
+def __generate_user_results(user_id: int,
+                            comp_events: List[List[Tuple[int, Event]]],
+                            events: List[Event],
+                            rng: random.Random) -> List[Dict]:
+    """ Generates a user's results across all competitions, as rows ready for insertion, with PB flags set. """
+
+    # How good this user is (as a multiple of WR pace), how often they compete, and which events they like
+    skill = 1.3 + rng.lognormvariate(0.8, 0.5)
+    activity = rng.betavariate(0.8, 3)
+    event_interest = {event.id: rng.random() for event in events}
+
+    # Map of event ID to the user's results rows in that event, in chronological order
+    user_event_rows = dict()
+
+    for comp in comp_events:
+        if rng.random() > activity:
+            continue
+        for comp_event_id, event in comp:
+            if rng.random() > event_interest[event.id]:
+                continue
+            row = __generate_result(user_id, comp_event_id, event, skill, rng)
+            user_event_rows.setdefault(event.id, list()).append(row)
+
+    rows = list()
+    for event in events:
+        event_rows = user_event_rows.get(event.id, list())
+        __set_pb_flags(event_rows, event)
+        rows.extend(event_rows)
+
+    return rows
+
+
+def __generate_result(user_id: int, comp_event_id: int, event: Event, skill: float, rng: random.Random) -> Dict:
+    """ Generates a single result row for a user in a competition event. """
+
+    if event.name == EVENT_MBLD.name:
+        solves = [__generate_mbld_solve(skill, rng) for _ in range(event.totalSolves)]
+    else:
+        wr_single, wr_average = __AUTO_BLACKLIST_THRESHOLDS.get(event.name, __DEFAULT_WR_TIMES)
+        solves = [__generate_solve(wr_average, skill, event.name == EVENT_FMC.name, rng)
+                  for _ in range(event.totalSolves)]
+
+    single = __best_of(solves)
+    average = __average_of(solves, event.eventFormat) if event.name != EVENT_MBLD.name else ''
+    result = single if event.eventFormat in (EventFormat.Bo1, EventFormat.Bo3) else average
+
+    return {
+        'user_id': user_id,
+        'comp_event_id': comp_event_id,
+        'single': single,
+        'average': average,
+        'result': result,
+        'single_sort_value': to_sort_value(single),
+        'average_sort_value': to_sort_value(average),
+        'result_sort_value': to_sort_value(result),
+        'comment': '',
+        'is_complete': True,
+        'times_string': '',
+        'is_blacklisted': rng.random() < __BLACKLIST_CHANCE,
+    }
+
+
+def __generate_scramble(rng: random.Random) -> str:
+    """ Generates a scramble. It doesn't need to be a valid scramble for any particular event, just the right size. """
+
+    return ' '.join(rng.choice(__SCRAMBLE_MOVES) for _ in range(__SCRAMBLE_LENGTH))
+
+
+def __generate_solve(wr_average: int, skill: float, is_fmc: bool, rng: random.Random):
+    """ Generates a solve time in centiseconds (or "centi-moves" for FMC) around the user's skill level, or a DNF. """
+
+    if rng.random() < __DNF_CHANCE:
+        return DNF
+
+    value = int(wr_average * skill * rng.uniform(0.8, 1.25))
+    if is_fmc:
+        value = max(value, 1600) // 100 * 100
+
+    return value
+
+
+def __generate_mbld_solve(skill: float, rng: random.Random):
+    """ Generates a coded MBLD result of the form XXYYYYZZ, where XX is (99 - points), YYYY is elapsed seconds, and ZZ
+    is the number of cubes missed, or a DNF if the attempt scores no points. """
+
+    attempted = max(2, int(rng.uniform(20, 45) / skill))
+    missed = rng.randint(0, attempted // 3)
+    points = attempted - 2 * missed
+    if points <= 0 or rng.random() < __DNF_CHANCE:
+        return DNF
+
+    seconds = rng.randint(600, 3600)
+    return int(f'{99 - points:02d}{seconds:04d}{missed:02d}')
+
+
+def __best_of(solves: List) -> str:
+    """ Returns the best solve as a result value. For MBLD, a lower coded value is a better result. """
+
+    completed = [solve for solve in solves if solve != DNF]
+    return str(min(completed)) if completed else DNF
+
+
+def __average_of(solves: List, event_format: str) -> str:
+    """ Returns the average (for Ao5) or mean (for Mo3) of the solves as a result value. Best-of formats don't have an
+    average. """
+
+    if event_format in (EventFormat.Bo1, EventFormat.Bo3):
+        return ''
+
+    dnf_count = solves.count(DNF)
+    if event_format == EventFormat.Ao5:
+        if dnf_count > 1:
+            return DNF
+        # Drop the best and worst solves. If there's a DNF, it's the worst solve.
+        counted = sorted(solve for solve in solves if solve != DNF)[1:4]
+        return str(int(sum(counted) / len(counted)))
+
+    if dnf_count:
+        return DNF
+    return str(int(sum(solves) / len(solves)))
+
+
+def __set_pb_flags(event_rows: List[Dict], event: Event) -> None:
+    """ Sets the PB flags on a user's chronologically ordered results rows for an event, in the same way as
+    `recalculate_user_pbs_for_event`. """
+
+    pb_single_so_far = MISSING_SORT_VALUE
+    pb_average_so_far = MISSING_SORT_VALUE
+    checks_average = event.eventFormat != EventFormat.Bo1
+
+    for row in event_rows:
+        row['was_pb_single'] = False
+        row['was_pb_average'] = False
+        row['is_latest_pb_single'] = False
+        row['is_latest_pb_average'] = False
+
+        if row['is_blacklisted']:
+            continue
+
+        current_single = to_sort_value(row['single'])
+        if not (pb_single_so_far == DNF_SORT_VALUE == current_single) and current_single <= pb_single_so_far:
+            pb_single_so_far = current_single
+            row['was_pb_single'] = True
+
+        current_average = to_sort_value(row['average'])
+        if checks_average and not (pb_average_so_far == DNF_SORT_VALUE == current_average) and\
+                current_average <= pb_average_so_far:
+            pb_average_so_far = current_average
+            row['was_pb_average'] = True
+
+    for flag, latest_flag in (('was_pb_single', 'is_latest_pb_single'), ('was_pb_average', 'is_latest_pb_average')):
+        for row in reversed(event_rows):
+            if row[flag]:
+                row[latest_flag] = True
+                break
@@ -0,0 +1,284 @@
+""" Benchmarks the indexes behind the hot result, solve, setting, and scramble pool queries against a synthetic dataset.
+Each query's plan and timing are recorded without its indexes (as the tables were indexed before them) and then with
+them, along with how long the indexes took to build, and emitted as JSON, so each index can be shown to pay for itself.
+
+Usage:
+    python -m benchmarks.indexes --size 10k --output indexes.json
+    python -m benchmarks.indexes --users 2500 --comps 10 --database postgresql://localhost/cubersio_benchmark
+
+This uses the same benchmark database as `benchmarks.run`, and generates the scrambles, solves, settings, and scramble
+pool the queries need into it the first time. The indexes are dropped and recreated along the way, and are always
+left in place afterwards. Never point this at a database holding real data. """
+
+import argparse
+from collections import namedtuple
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+from timeit import default_timer
+
+from benchmarks.run import SIZES, DEFAULT_SIZE, default_database_url, prepare_dataset
+
+# -------------------------------------------------------------------------------------------------
+
+# How many lookups with different parameters are timed for each query, in each run
+LOOKUPS_PER_RUN = 200
+
+# A query whose indexes are benchmarked. `indexes` are the model indexes which serve the query, and `replaced_indexes`
+# are (name, DDL) for any indexes they replaced, which are recreated to benchmark the query as it was before.
+# `build_query` builds the query from a dict of parameters, and `sample_params` picks the parameters for each lookup.
+IndexedQuery = namedtuple('IndexedQuery', ['name', 'indexes', 'replaced_indexes', 'build_query', 'sample_params'])
+
+# -------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    """ Entry point for the index benchmarks. """
+
+    args = __parse_args(argv)
+
+    user_count, comp_count = SIZES[args.size]
+    user_count = args.users or user_count
+    comp_count = args.comps or comp_count
+
+    # The database URL has to be in place before the app is imported, since it's read from the environment then
+    os.environ['DATABASE_URL'] = args.database or default_database_url(user_count, comp_count, args.seed)
+
+    from cubersio import app, DB
+
+    with app.app_context():
+        dataset = prepare_dataset(DB, user_count, comp_count, args.seed)
+        dataset.update(__prepare_supporting_data(DB, args.seed))
+
+        results = dict()
+        for indexed_query in __build_indexed_queries():
+            results[indexed_query.name] = __benchmark_indexed_query(DB, indexed_query, args.repeat,
+                                                                    random.Random(args.seed))
+
+        report = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'database': DB.engine.dialect.name,
+            },
+            'dataset': dataset,
+            'repeat': args.repeat,
+            'lookups_per_run': LOOKUPS_PER_RUN,
+            'results': results,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+def __parse_args(argv):
+    """ Parses the command-line arguments. """
+
+    parser = argparse.ArgumentParser(description='Benchmark the cubers.io hot query indexes.')
+    parser.add_argument('--size', choices=SIZES.keys(), default=DEFAULT_SIZE, help='preset dataset size')
+    parser.add_argument('--users', type=int, help='number of users, overriding the preset size')
+    parser.add_argument('--comps', type=int, help='number of competitions, overriding the preset size')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for dataset generation and lookups')
+    parser.add_argument('--database', help='database URL to generate the dataset into and benchmark against')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to run each set of lookups')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+
+    return parser.parse_args(argv)
+
+
+def __prepare_supporting_data(DB, seed):
+    """ Generates the scrambles, solves, settings, and scramble pool into the benchmark database if they aren't there
+    yet, otherwise reuses what's already there. Returns a dict describing them. """
+
+    from cubersio.persistence.models import Scramble, ScramblePool, UserSetting, UserSolve
+    from benchmarks.dataset import generate_supporting_data
+
+    if not DB.session.query(UserSolve.id).first():
+        t0 = default_timer()
+        counts = generate_supporting_data(seed)
+        counts['supporting_generation_seconds'] = round(default_timer() - t0, 3)
+        print(f"[BENCHMARK] Generated supporting data: {counts}", file=sys.stderr)
+    else:
+        counts = {
+            'scrambles': DB.session.query(Scramble).count(),
+            'solves': DB.session.query(UserSolve).count(),
+            'settings': DB.session.query(UserSetting).count(),
+            'scramble_pool': DB.session.query(ScramblePool).count(),
+        }
+        print(f"[BENCHMARK] Reusing existing supporting data: {counts}", file=sys.stderr)
+
+    return counts
+
+
+def __build_indexed_queries():
+    """ Builds the queries to benchmark, each the same as what the app runs on a hot path. """
+
+    from sqlalchemy import select
+
+    from cubersio import DB
+    from cubersio.persistence.models import CompetitionEvent, Event, ScramblePool, UserEventResults, UserSetting,\
+        UserSolve
+
+    def index(model, name):
+        return next(i for i in model.__table__.indexes if i.name == name)
+
+    def sample_rows(query):
+        rows = DB.session.execute(query).all()
+        return lambda rng: dict(rng.choice(rows)._mapping)
+
+    def latest_pbs_query(value, is_latest_pb):
+        # What `get_ordered_pb_singles_for_event` and `get_ordered_pb_averages_for_event` filter on
+        return lambda params: select(UserEventResults.user_id, value).\
+            join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+            where(CompetitionEvent.event_id == params['event_id']).\
+            where(UserEventResults.is_complete).\
+            where(is_latest_pb).\
+            where(UserEventResults.is_blacklisted.isnot(True))
+
+    sample_event = sample_rows(select(Event.id.label('event_id')))
+
+    return [
+        # `get_event_results_for_user`, which the timer and results pages run for every event
+        IndexedQuery('user_event_results.for_user_and_comp_event',
+                     [index(UserEventResults, 'ix_user_event_results_user_comp_event')], [],
+                     lambda params: select(UserEventResults).
+                     where(UserEventResults.user_id == params['user_id']).
+                     where(UserEventResults.comp_event_id == params['comp_event_id']).
+                     limit(1),
+                     sample_rows(select(UserEventResults.user_id, UserEventResults.comp_event_id))),
+
+        IndexedQuery('user_event_results.latest_pb_singles_for_event',
+                     [index(UserEventResults, 'ix_user_event_results_latest_pb_single')], [],
+                     latest_pbs_query(UserEventResults.single, UserEventResults.is_latest_pb_single),
+                     sample_event),
+
+        IndexedQuery('user_event_results.latest_pb_averages_for_event',
+                     [index(UserEventResults, 'ix_user_event_results_latest_pb_average')], [],
+                     latest_pbs_query(UserEventResults.average, UserEventResults.is_latest_pb_average),
+                     sample_event),
+
+        # Loading a result's solves through `UserEventResults.solves`
+        IndexedQuery('user_solves.for_user_event_results',
+                     [index(UserSolve, 'ix_user_solves_user_event_results_scramble')], [],
+                     lambda params: select(UserSolve).
+                     where(UserSolve.user_event_results_id == params['user_event_results_id']).
+                     order_by(UserSolve.scramble_id),
+                     sample_rows(select(UserEventResults.id.label('user_event_results_id')))),
+
+        # `get_setting_for_user`, and `get_bulk_settings_for_user_as_dict` for each setting code
+        IndexedQuery('user_settings.for_user_and_setting_code',
+                     [index(UserSetting, 'ix_user_settings_user_setting_code')],
+                     [('ix_user_settings_user_id', 'CREATE INDEX ix_user_settings_user_id ON user_settings (user_id)')],
+                     lambda params: select(UserSetting).
+                     where(UserSetting.user_id == params['user_id']).
+                     where(UserSetting.setting_code == params['setting_code']).
+                     limit(1),
+                     sample_rows(select(UserSetting.user_id, UserSetting.setting_code))),
+
+        # `retrieve_from_scramble_pool_for_event`, when generating a new competition
+        IndexedQuery('scramble_pool.for_event',
+                     [index(ScramblePool, 'ix_scramble_pool_event_id')], [],
+                     lambda params: select(ScramblePool).
+                     where(ScramblePool.event_id == params['event_id']).
+                     limit(5),
+                     sample_event),
+    ]
+
+
+def __benchmark_indexed_query(DB, indexed_query, repeat, rng):
+    """ Times a query and records its plan without its indexes, then builds the indexes and does the same again. The
+    indexes are left in place afterwards. Returns a dict of the results. """
+
+    from sqlalchemy import text
+
+    lookups = [indexed_query.sample_params(rng) for _ in range(LOOKUPS_PER_RUN)]
+
+    # Put the tables back the way they were before these indexes
+    connection = DB.session.connection()
+    for index in indexed_query.indexes:
+        index.drop(bind=connection, checkfirst=True)
+    for name, ddl in indexed_query.replaced_indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        connection.execute(text(ddl))
+    __analyze(connection)
+    DB.session.commit()
+
+    without_indexes = __time_and_explain(DB, indexed_query, lookups, repeat)
+
+    t0 = default_timer()
+    connection = DB.session.connection()
+    for name, _ in indexed_query.replaced_indexes:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    for index in indexed_query.indexes:
+        index.create(bind=connection)
+    DB.session.commit()
+    build_seconds = default_timer() - t0
+
+    __analyze(DB.session.connection())
+    DB.session.commit()
+
+    with_indexes = __time_and_explain(DB, indexed_query, lookups, repeat)
+
+    speedup = without_indexes['median'] / with_indexes['median'] if with_indexes['median'] else None
+    print(f"[BENCHMARK] {indexed_query.name}: median {without_indexes['median']}s without indexes, "
+          f"{with_indexes['median']}s with them", file=sys.stderr)
+
+    return {
+        'indexes': [index.name for index in indexed_query.indexes],
+        'replaced_indexes': [name for name, _ in indexed_query.replaced_indexes],
+        'index_build_seconds': round(build_seconds, 4),
+        'without_indexes': without_indexes,
+        'with_indexes': with_indexes,
+        'speedup': round(speedup, 2) if speedup else None,
+    }
+
+
+def __time_and_explain(DB, indexed_query, lookups, repeat):
+    """ Runs the query for every set of lookup parameters `repeat` times, and returns its timings along with the
+    database's plan for the first lookup. """
+
+    from sqlalchemy import text
+
+    connection = DB.session.connection()
+    queries = [indexed_query.build_query(params) for params in lookups]
+
+    runs = list()
+    for _ in range(repeat):
+        t0 = default_timer()
+        for query in queries:
+            connection.execute(query).all()
+        runs.append(default_timer() - t0)
+
+    sql = str(queries[0].compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'sqlite':
+        plan = [detail for _, _, _, detail in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+    else:
+        plan = [line for (line,) in connection.execute(text(f'EXPLAIN {sql}'))]
+
+    return {
+        'plan': plan,
+        'runs': [round(run, 4) for run in runs],
+        'min': round(min(runs), 4),
+        'median': round(statistics.median(runs), 4),
+        'mean': round(statistics.mean(runs), 4),
+    }
+
+
+def __analyze(connection):
+    """ Refreshes the database's statistics, so the planner knows about the indexes which were just changed. """
+
+    from sqlalchemy import text
+
+    connection.execute(text('ANALYZE'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+""" Runs the site rankings, event records, and leaderboards benchmarks against a synthetic dataset, and emits the
+timings as JSON for regression comparison.
+
+Usage:
+    python -m benchmarks.run --size 10k --output results.json
+    python -m benchmarks.run --size 100k --output results.json --compare baseline.json
+    python -m benchmarks.run --users 2500 --comps 10 --database postgresql://localhost/cubersio_benchmark
+
+The dataset is generated into the benchmark database the first time, and reused by later runs against the same
+database. By default this is a SQLite database in the system temp directory, named after the dataset parameters. Never
+point this at a database holding real data, since the benchmarks recalculate site rankings. """
+
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from timeit import default_timer
+
+# -------------------------------------------------------------------------------------------------
+
+# Dataset sizes, as (number of users, number of competitions)
+SIZES = {
+    '10k':  (10000, 20),
+    '100k': (100000, 20),
+}
+
+DEFAULT_SIZE = '10k'
+
+# The event whose records export is benchmarked
+RECORDS_EVENT_NAME = '3x3'
+
+# The page size for the paginated leaderboards benchmarks
+LEADERBOARD_PAGE_SIZE = 100
+
+# -------------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    """ Entry point for the benchmarks. """
+
+    args = __parse_args(argv)
+
+    user_count, comp_count = SIZES[args.size]
+    user_count = args.users or user_count
+    comp_count = args.comps or comp_count
+
+    # The database URL has to be in place before the app is imported, since it's read from the environment then
+    os.environ['DATABASE_URL'] = args.database or default_database_url(user_count, comp_count, args.seed)
+
+    from cubersio import app, DB
+
+    with app.app_context():
+        dataset = prepare_dataset(DB, user_count, comp_count, args.seed)
+        results = __run_benchmarks(app, args.repeat, args.workers)
+
+        report = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'database': DB.engine.dialect.name,
+            },
+            'dataset': dataset,
+            'repeat': args.repeat,
+            'results': results,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            __print_comparison(json.load(baseline_file), report)
+
+
+def __parse_args(argv):
+    """ Parses the command-line arguments. """
+
+    parser = argparse.ArgumentParser(description='Run the cubers.io rankings benchmarks.')
+    parser.add_argument('--size', choices=SIZES.keys(), default=DEFAULT_SIZE, help='preset dataset size')
+    parser.add_argument('--users', type=int, help='number of users, overriding the preset size')
+    parser.add_argument('--comps', type=int, help='number of competitions, overriding the preset size')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for dataset generation')
+    parser.add_argument('--database', help='database URL to generate the dataset into and benchmark against')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times to run each benchmark')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes for the parallel rankings benchmark')
+    parser.add_argument('--output', help='file to write the JSON results to, instead of stdout')
+    parser.add_argument('--compare', help='JSON results from a previous run to compare against')
+
+    return parser.parse_args(argv)
+
+
+def default_database_url(user_count, comp_count, seed):
+    """ Returns the URL of the default SQLite benchmark database for the dataset parameters, which is in the system temp
+    directory. """
+
+    return 'sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                       f'cubersio_benchmark_{user_count}u_{comp_count}c_{seed}.sqlite')
+
+
+def prepare_dataset(DB, user_count, comp_count, seed):
+    """ Generates the dataset into the benchmark database if it's empty, otherwise reuses what's already there.
+    Returns a dict describing the dataset. """
+
+    from cubersio.persistence.models import Competition, CompetitionEvent, User, UserEventResults
+    from benchmarks.dataset import generate_dataset
+
+    DB.create_all()
+
+    if not DB.session.query(User.id).first():
+        t0 = default_timer()
+        counts = generate_dataset(user_count, comp_count, seed)
+        counts['generation_seconds'] = round(default_timer() - t0, 3)
+        print(f"[BENCHMARK] Generated dataset: {counts}", file=sys.stderr)
+    else:
+        counts = {
+            'users': DB.session.query(User).count(),
+            'competitions': DB.session.query(Competition).count(),
+            'comp_events': DB.session.query(CompetitionEvent).count(),
+            'results': DB.session.query(UserEventResults).count(),
+        }
+        print(f"[BENCHMARK] Reusing existing dataset: {counts}", file=sys.stderr)
+
+    counts['seed'] = seed
+    return counts
+
+
+def __run_benchmarks(app, repeat, workers):
+    """ Runs each benchmark `repeat` times, and returns a dict of benchmark name to timings. """
+
+    from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+    from cubersio.business.competition.overall_points import calculate_overall_points
+    from cubersio.business.competition.snapshots import snapshot_competition
+    from cubersio.business.event_records import get_event_records, refresh_stale_event_records
+    from cubersio.business.rankings import calculate_user_site_rankings, calculate_user_site_rankings_incremental,\
+        get_ordered_pb_singles_for_event, get_ordered_pb_averages_for_event, RANKINGS_ENGINE_PYTHON,\
+        RANKINGS_ENGINE_SQL
+    from cubersio.persistence.comp_event_leaderboards_manager import invalidate_comp_event_leaderboard
+    from cubersio.persistence.comp_manager import get_active_competition, get_all_comp_events_for_comp,\
+        get_previous_competition
+    from cubersio.persistence.events_manager import get_all_events
+    from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event
+    from cubersio.persistence.user_site_rankings_manager import mark_event_site_rankings_dirty,\
+        get_all_site_rankings_user_ids, get_sum_of_ranks_page, get_sum_of_ranks_page_for_user, get_kinchranks_page,\
+        LEADERBOARD_TYPE_ALL
+    from cubersio.util.sorting import sort_user_results_with_rankings
+
+    all_event_ids = [event.id for event in get_all_events()]
+    client = app.test_client()
+
+    def mark_some_events_dirty():
+        for event_id in all_event_ids[:3]:
+            mark_event_site_rankings_dirty(event_id)
+
+    # Load the active competition's results before timing, so only the sorting and ranking is timed
+    active_comp_results = list()
+
+    def load_active_comp_results():
+        active_comp_results.clear()
+        for comp_event in get_all_comp_events_for_comp(get_active_competition().id):
+            results = get_all_complete_user_results_for_comp_event(comp_event.id)
+            active_comp_results.append((list(results), comp_event.Event.eventFormat))
+
+    def sort_active_comp_results():
+        for results, event_format in active_comp_results:
+            sort_user_results_with_rankings(list(results), event_format)
+
+    # Time the active competition's leaderboards both when they have to be built, and when they're cached
+    def get_active_comp_leaderboards():
+        for comp_event in get_all_comp_events_for_comp(get_active_competition().id):
+            get_comp_event_leaderboard(comp_event)
+
+    def invalidate_active_comp_leaderboards():
+        for comp_event in get_all_comp_events_for_comp(get_active_competition().id):
+            invalidate_comp_event_leaderboard(comp_event.id)
+
+    # Time a finished competition's leaderboards when they're served from their snapshots, rather than the cache
+    def get_previous_comp_leaderboards():
+        for comp_event in get_all_comp_events_for_comp(get_previous_competition().id):
+            get_comp_event_leaderboard(comp_event)
+
+    def snapshot_previous_comp():
+        snapshot_competition(get_previous_competition().id)
+        for comp_event in get_all_comp_events_for_comp(get_previous_competition().id):
+            invalidate_comp_event_leaderboard(comp_event.id)
+
+    # Pick a user from the middle of the site rankings to jump to, once the rankings have been calculated
+    leaderboard_user_ids = list()
+
+    def pick_leaderboard_user():
+        user_ids = get_all_site_rankings_user_ids()
+        leaderboard_user_ids[:] = [user_ids[len(user_ids) // 2]]
+
+    # Each benchmark is (name, function to time, optional setup function which isn't timed). The rankings are
+    # calculated first, since the leaderboards depend on them.
+    benchmarks = [
+        ('rankings.full', lambda: calculate_user_site_rankings(worker_count=1, streaming=False,
+                                                               engine=RANKINGS_ENGINE_PYTHON), None),
+        ('rankings.streaming', lambda: calculate_user_site_rankings(streaming=True, engine=RANKINGS_ENGINE_PYTHON),
+         None),
+        ('rankings.parallel', lambda: calculate_user_site_rankings(worker_count=workers, streaming=False,
+                                                                   engine=RANKINGS_ENGINE_PYTHON), None),
+        ('rankings.sql', lambda: calculate_user_site_rankings(engine=RANKINGS_ENGINE_SQL), None),
+        ('rankings.incremental',
+         lambda: calculate_user_site_rankings_incremental(worker_count=1, streaming=False,
+                                                          engine=RANKINGS_ENGINE_PYTHON),
+         mark_some_events_dirty),
+        ('rankings.incremental_parallel',
+         lambda: calculate_user_site_rankings_incremental(worker_count=workers, streaming=False,
+                                                          engine=RANKINGS_ENGINE_PYTHON),
+         mark_some_events_dirty),
+        ('rankings.incremental_sql', lambda: calculate_user_site_rankings_incremental(engine=RANKINGS_ENGINE_SQL),
+         mark_some_events_dirty),
+        ('records.ordered_pb_singles_all_events',
+         lambda: [get_ordered_pb_singles_for_event(event_id) for event_id in all_event_ids], None),
+        ('records.ordered_pb_averages_all_events',
+         lambda: [get_ordered_pb_averages_for_event(event_id) for event_id in all_event_ids], None),
+        ('records.event_records_all_events', lambda: [get_event_records(event_id) for event_id in all_event_ids],
+         refresh_stale_event_records),
+        ('records.event_records_export', lambda: client.get(f'/event/{RECORDS_EVENT_NAME}/export/'),
+         refresh_stale_event_records),
+        ('results.sort_user_results_with_rankings', sort_active_comp_results, load_active_comp_results),
+        ('results.comp_event_leaderboards_uncached', get_active_comp_leaderboards,
+         invalidate_active_comp_leaderboards),
+        ('results.comp_event_leaderboards_cached', get_active_comp_leaderboards, get_active_comp_leaderboards),
+        ('results.comp_event_leaderboards_snapshotted', get_previous_comp_leaderboards, snapshot_previous_comp),
+        ('results.overall_points', lambda: calculate_overall_points(get_active_competition().id), None),
+        ('leaderboards.sum_of_ranks_first_page',
+         lambda: get_sum_of_ranks_page(LEADERBOARD_TYPE_ALL, False, LEADERBOARD_PAGE_SIZE), None),
+        ('leaderboards.sum_of_ranks_page_for_user',
+         lambda: get_sum_of_ranks_page_for_user(LEADERBOARD_TYPE_ALL, False, LEADERBOARD_PAGE_SIZE,
+                                                leaderboard_user_ids[0]), pick_leaderboard_user),
+        ('leaderboards.kinchranks_first_page',
+         lambda: get_kinchranks_page(LEADERBOARD_TYPE_ALL, LEADERBOARD_PAGE_SIZE), None),
+    ]
+
+    if workers <= 1:
+        benchmarks = [b for b in benchmarks if b[0] != 'rankings.parallel']
+
+    results = dict()
+    for name, function, setup in benchmarks:
+        runs = list()
+        for _ in range(repeat):
+            if setup:
+                setup()
+            t0 = default_timer()
+            function()
+            runs.append(default_timer() - t0)
+
+        results[name] = {
+            'runs': [round(run, 4) for run in runs],
+            'min': round(min(runs), 4),
+            'median': round(statistics.median(runs), 4),
+            'mean': round(statistics.mean(runs), 4),
+        }
+        print(f"[BENCHMARK] {name}: median {results[name]['median']}s", file=sys.stderr)
+
+    return results
+
+
+def __print_comparison(baseline, report):
+    """ Prints the median timing of each benchmark compared with a baseline report. """
+
+    print(f"{'benchmark':<45}{'baseline':>12}{'current':>12}{'change':>10}", file=sys.stderr)
+    for name, timings in report['results'].items():
+        baseline_timings = baseline.get('results', dict()).get(name, None)
+        if not baseline_timings:
+            print(f"{name:<45}{'-':>12}{timings['median']:>12}{'new':>10}", file=sys.stderr)
+            continue
+
+        change = (timings['median'] - baseline_timings['median']) / baseline_timings['median'] * 100\
+            if baseline_timings['median'] else 0
+        print(f"{name:<45}{baseline_timings['median']:>12}{timings['median']:>12}{change:>+9.1f}%", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,16 @@ DEFAULT_ADMIN_REDDIT_USER = 'euphwes'
 
 DEFAULT_CODE_TOP_OFF_THRESHOLD = 3
 
+DEFAULT_RANKINGS_WORKER_COUNT = 1
+DEFAULT_RANKINGS_MEMORY_CEILING_MB = 0
+DEFAULT_RANKINGS_ENGINE = 'python'
+DEFAULT_LIVE_RANKS_CHECK_INTERVAL_SECONDS = 10
+DEFAULT_USERNAME_INDEX_TTL_SECONDS = 300
+DEFAULT_EVENT_RECORDS_REFRESH_DELAY_SECONDS = 60
+DEFAULT_LEADERBOARD_PAGE_SIZE = 100
+DEFAULT_COMP_LEADERBOARD_CACHE_MAX_ENTRIES = 512
+DEFAULT_COMP_LEADERBOARD_CACHE_TTL_SECONDS = 3600
+
 # -------------------------------------------------------------------------------------------------
 
 class Config(object):
@@ -64,6 +74,84 @@ class Config(object):
     TARGET_SUBREDDIT = environ.get('TARGET_SUBREDDIT', TEST_SUBREDDIT)
     IS_DEVO          = TARGET_SUBREDDIT == TEST_SUBREDDIT
 
+    # ------------------------------------------------------
+    # Config related to calculating user site rankings.
+    # A worker count greater than 1 calculates each event's
+    # rankings in parallel across that many processes, in
+    # both full and incremental runs, where only the changed
+    # events are spread across them.
+    # Streaming mode keeps memory usage bounded, saving
+    # batches early and shrinking them if memory usage
+    # exceeds the ceiling (in MB, 0 for no ceiling), in
+    # both full and incremental runs. The engine is either
+    # 'python', or 'sql' to have the database do the ranking
+    # in both full and incremental runs, in which case the
+    # worker count and streaming mode don't apply.
+    # ------------------------------------------------------
+    try:
+        RANKINGS_WORKER_COUNT = int(environ.get('RANKINGS_WORKER_COUNT', DEFAULT_RANKINGS_WORKER_COUNT))
+    except ValueError:
+        RANKINGS_WORKER_COUNT = DEFAULT_RANKINGS_WORKER_COUNT
+
+    RANKINGS_STREAMING = environ.get('RANKINGS_STREAMING', 'false').lower() == 'true'
+
+    try:
+        RANKINGS_MEMORY_CEILING_MB = int(environ.get('RANKINGS_MEMORY_CEILING_MB', DEFAULT_RANKINGS_MEMORY_CEILING_MB))
+    except ValueError:
+        RANKINGS_MEMORY_CEILING_MB = DEFAULT_RANKINGS_MEMORY_CEILING_MB
+
+    RANKINGS_ENGINE = environ.get('RANKINGS_ENGINE', DEFAULT_RANKINGS_ENGINE).lower()
+
+    # How often each process checks whether an event's PBs have changed elsewhere, before trusting its live site ranks
+    try:
+        LIVE_RANKS_CHECK_INTERVAL_SECONDS = int(environ.get('LIVE_RANKS_CHECK_INTERVAL_SECONDS',
+                                                            DEFAULT_LIVE_RANKS_CHECK_INTERVAL_SECONDS))
+    except ValueError:
+        LIVE_RANKS_CHECK_INTERVAL_SECONDS = DEFAULT_LIVE_RANKS_CHECK_INTERVAL_SECONDS
+
+    # How long each process trusts its index of active users' usernames before rebuilding it, to pick up users whose
+    # first results were saved somewhere else
+    try:
+        USERNAME_INDEX_TTL_SECONDS = int(environ.get('USERNAME_INDEX_TTL_SECONDS', DEFAULT_USERNAME_INDEX_TTL_SECONDS))
+    except ValueError:
+        USERNAME_INDEX_TTL_SECONDS = DEFAULT_USERNAME_INDEX_TTL_SECONDS
+
+    # How long to wait after an event's PBs change before rebuilding its records, so that a burst of new PBs in the same
+    # event is handled by a single rebuild
+    try:
+        EVENT_RECORDS_REFRESH_DELAY_SECONDS = int(environ.get('EVENT_RECORDS_REFRESH_DELAY_SECONDS',
+                                                              DEFAULT_EVENT_RECORDS_REFRESH_DELAY_SECONDS))
+    except ValueError:
+        EVENT_RECORDS_REFRESH_DELAY_SECONDS = DEFAULT_EVENT_RECORDS_REFRESH_DELAY_SECONDS
+
+    # How many users are shown on each page of the Sum of Ranks and Kinchranks leaderboards
+    try:
+        LEADERBOARD_PAGE_SIZE = int(environ.get('LEADERBOARD_PAGE_SIZE', DEFAULT_LEADERBOARD_PAGE_SIZE))
+    except ValueError:
+        LEADERBOARD_PAGE_SIZE = DEFAULT_LEADERBOARD_PAGE_SIZE
+
+    # ------------------------------------------------------
+    # Competition event leaderboards cache config
+    # ------------------------------------------------------
+    # The cache is shared through Redis if it's available, like the Huey task queue. Otherwise each process keeps its
+    # own in-memory cache. Either way cached leaderboards are keyed by their competition event's leaderboard version in
+    # the database, so invalidating a leaderboard reaches every process.
+    REDIS_URL = environ.get('REDIS_URL', None)
+    COMP_LEADERBOARD_CACHE_BACKEND = environ.get('COMP_LEADERBOARD_CACHE_BACKEND',
+                                                 'redis' if REDIS_URL else 'memory').lower()
+
+    try:
+        COMP_LEADERBOARD_CACHE_MAX_ENTRIES = int(environ.get('COMP_LEADERBOARD_CACHE_MAX_ENTRIES',
+                                                             DEFAULT_COMP_LEADERBOARD_CACHE_MAX_ENTRIES))
+    except ValueError:
+        COMP_LEADERBOARD_CACHE_MAX_ENTRIES = DEFAULT_COMP_LEADERBOARD_CACHE_MAX_ENTRIES
+
+    try:
+        COMP_LEADERBOARD_CACHE_TTL_SECONDS = int(environ.get('COMP_LEADERBOARD_CACHE_TTL_SECONDS',
+                                                             DEFAULT_COMP_LEADERBOARD_CACHE_TTL_SECONDS))
+    except ValueError:
+        COMP_LEADERBOARD_CACHE_TTL_SECONDS = DEFAULT_COMP_LEADERBOARD_CACHE_TTL_SECONDS
+
     # ------------------------------------------------------
     # Database config
     # ------------------------------------------------------
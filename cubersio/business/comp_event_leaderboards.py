@@ -0,0 +1,161 @@
+""" Business logic for building and caching each competition event's leaderboard, and for freezing the leaderboards of
+competitions which are over into snapshots. """
+
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from cubersio.persistence.comp_event_leaderboards_manager import get_cached_comp_event_leaderboard,\
+    cache_comp_event_leaderboard
+from cubersio.persistence.comp_event_snapshots_manager import get_comp_event_snapshot, save_comp_event_snapshot
+from cubersio.persistence.models import CompetitionEvent, UserSolve
+from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event,\
+    get_solves_and_scrambles_for_results
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+# -------------------------------------------------------------------------------------------------
+
+# A lightweight stand-in for a UserEventResults on a leaderboard, holding just what the leaderboard shows. `User` holds
+# the username and verified status of the user the results belong to, so templates can treat these the same as
+# UserEventResults.
+LeaderboardUser   = namedtuple('LeaderboardUser', ['username', 'is_verified'])
+LeaderboardResult = namedtuple('LeaderboardResult', ['id', 'User', 'comment', 'single', 'average', 'result',
+                                                     'is_blacklisted', 'was_gold_medal', 'was_silver_medal',
+                                                     'was_bronze_medal', 'solves_helper'])
+
+# A competition event's leaderboard: every complete result including blacklisted ones, the event's scrambles, and the
+# rankings of those results both without and with the blacklisted results, as (rank, visible rank, index into results)
+CompEventLeaderboard = namedtuple('CompEventLeaderboard', ['results', 'scrambles', 'public_ranks', 'all_ranks'])
+
+__FMC = 'FMC'
+
+# How many solves are shown for each result on the leaderboard
+__SOLVES_SHOWN = 5
+
+# -------------------------------------------------------------------------------------------------
+
+def get_comp_event_leaderboard(comp_event: CompetitionEvent) -> CompEventLeaderboard:
+    """ Returns the leaderboard for the specified competition event, from the cache if it's there. Otherwise, if the
+    competition is over the leaderboard comes from its snapshot, and if it's still going (or there's no snapshot yet)
+    it's built from the competition event's results. Either way it's cached afterwards, under the version of the
+    leaderboard read before the results were. """
+
+    leaderboard_version = comp_event.leaderboard_version or 0
+
+    cached = get_cached_comp_event_leaderboard(comp_event.id, leaderboard_version)
+    if cached is None:
+        if comp_event.Competition.active:
+            cached = __build_cacheable_leaderboard(comp_event)
+        else:
+            cached = get_comp_event_snapshot(comp_event.id)
+            if cached is None:
+                cached = __build_cacheable_leaderboard(comp_event)
+                save_comp_event_snapshot(comp_event.id, cached)
+
+        cache_comp_event_leaderboard(comp_event.id, leaderboard_version, cached)
+
+    return __from_cacheable_leaderboard(cached)
+
+
+def snapshot_comp_event_leaderboard(comp_event: CompetitionEvent) -> None:
+    """ Rebuilds the leaderboard for the specified competition event from its results, and saves it as the competition
+    event's snapshot, replacing any existing one. This should only be done once the competition is over, since the
+    snapshot is served as-is from then on. """
+
+    leaderboard_version = comp_event.leaderboard_version or 0
+
+    leaderboard = __build_cacheable_leaderboard(comp_event)
+    save_comp_event_snapshot(comp_event.id, leaderboard)
+    cache_comp_event_leaderboard(comp_event.id, leaderboard_version, leaderboard)
+
+
+def get_ranked_results_for_viewer(leaderboard: CompEventLeaderboard,
+                                  event_format: str,
+                                  show_admin: bool,
+                                  viewer_username: Optional[str]) -> List[Tuple[int, str, LeaderboardResult]]:
+    """ Returns a leaderboard's ranked results as seen by a specific viewer, in the same form as
+    `sort_user_results_with_rankings`. Admins see all results, and everybody else only sees results which aren't
+    blacklisted, except for logged-in viewers who also see their own blacklisted results. """
+
+    results = leaderboard.results
+
+    if show_admin:
+        ranks = leaderboard.all_ranks
+
+    # The rare viewer with their own blacklisted results sees a ranking nobody else does, so rank it for them
+    elif viewer_username and any(r.is_blacklisted and r.User.username == viewer_username for r in results):
+        visible_results = [r for r in results if (not r.is_blacklisted) or (r.User.username == viewer_username)]
+        return sort_user_results_with_rankings(visible_results, event_format)
+
+    else:
+        ranks = leaderboard.public_ranks
+
+    return [(rank, visible_rank, results[i]) for rank, visible_rank, i in ranks]
+
+# -------------------------------------------------------------------------------------------------
+
+def __build_cacheable_leaderboard(comp_event: CompetitionEvent) -> dict:
+    """ Builds a competition event's leaderboard from its results, in a JSON-serializable form for caching. """
+
+    user_results = get_all_complete_user_results_for_comp_event(comp_event.id, omit_blacklisted=False)
+
+    # FMC leaderboards show every solve's scramble and solution, so load them all up front
+    fmc_solves = None
+    if comp_event.Event.name == __FMC:
+        fmc_solves = get_solves_and_scrambles_for_results(r.id for r in user_results)
+
+    results = [LeaderboardResult(r.id, LeaderboardUser(r.User.username, r.User.is_verified), r.comment, r.single,
+                                 r.average, r.result, r.is_blacklisted, r.was_gold_medal, r.was_silver_medal,
+                                 r.was_bronze_medal, __build_solves_helper(r, fmc_solves))
+               for r in user_results]
+
+    event_format = comp_event.Event.eventFormat
+
+    return {
+        'results': results,
+        'scrambles': [s.scramble for s in comp_event.scrambles],
+        'public_ranks': __rank_results(results, [r for r in results if not r.is_blacklisted], event_format),
+        'all_ranks': __rank_results(results, results, event_format),
+    }
+
+
+def __build_solves_helper(user_results, fmc_solves: Optional[Dict[int, List[Tuple[UserSolve, str]]]]) -> list:
+    """ Splits the results' solves into the list shown on the leaderboard, padded out to the number of solves shown.
+    For FMC each solve is a (scramble, solution, moves) tuple built from `fmc_solves`, which are the solves and
+    scrambles of every result on the leaderboard. For everything else it's the friendly solve time. """
+
+    if fmc_solves is not None:
+        solves_helper = [(scramble, solve.fmc_explanation, solve.get_friendly_time())
+                         for solve, scramble in fmc_solves.get(user_results.id, list())]
+        padding = (None, None, None)
+    else:
+        solves_helper = user_results.times_string.split(', ')
+        padding = ''
+
+    while len(solves_helper) < __SOLVES_SHOWN:
+        solves_helper.append(padding)
+
+    return solves_helper
+
+
+def __rank_results(all_results: List[LeaderboardResult],
+                   results_to_rank: List[LeaderboardResult],
+                   event_format: str) -> List[Tuple[int, str, int]]:
+    """ Ranks a subset of a leaderboard's results, returning (rank, visible rank, index into all results) tuples. """
+
+    if not results_to_rank:
+        return list()
+
+    index_by_result = {id(result): i for i, result in enumerate(all_results)}
+    ranked = sort_user_results_with_rankings(list(results_to_rank), event_format)
+
+    return [(rank, visible_rank, index_by_result[id(result)]) for rank, visible_rank, result in ranked]
+
+
+def __from_cacheable_leaderboard(cached: dict) -> CompEventLeaderboard:
+    """ Rebuilds a CompEventLeaderboard from its cached form. A serializing cache backend hands back lists where
+    there were namedtuples, so those are rebuilt too. """
+
+    results = [LeaderboardResult(result_id, LeaderboardUser(*user), *fields)
+               for result_id, user, *fields in cached['results']]
+
+    return CompEventLeaderboard(results, cached['scrambles'], cached['public_ranks'], cached['all_ranks'])
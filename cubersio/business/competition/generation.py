@@ -7,7 +7,7 @@ from cubersio import app
 from cubersio.persistence.comp_manager import get_competition_gen_resources,\
     save_competition_gen_resources, save_new_competition
 from cubersio.persistence.events_manager import retrieve_from_scramble_pool_for_event,\
-    get_events_name_id_mapping, delete_from_scramble_pool
+    get_events_name_id_mapping, delete_from_scramble_pool, invalidate_event_catalog
 from cubersio.persistence.models import CompetitionGenResources
 from cubersio.util.events.resources import get_bonus_events_rotation_starting_at,\
     BONUS_EVENTS, EVENT_COLL, COLL_LIST, WEEKLY_EVENTS
@@ -31,6 +31,9 @@ if IS_DEVO:
 def generate_new_competition():
     """ Generate a new competition. """
 
+    # Events may have been added or changed since this process loaded them, so make sure they're reloaded
+    invalidate_event_catalog()
+
     # Get the info required to know what events and COLL to do next
     comp_gen_data: CompetitionGenResources = get_competition_gen_resources()
     was_all_events: bool = comp_gen_data.all_events
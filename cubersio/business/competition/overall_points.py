@@ -0,0 +1,88 @@
+""" Business logic for calculating a competition's overall points standings. Each event gives every participant
+`# of participants - rank` points, and a user's overall points are the total across every event. """
+
+import json
+from typing import List, Tuple
+
+import numpy as np
+
+from cubersio.persistence.comp_manager import get_competition, get_competition_overall_points,\
+    save_competition_overall_points
+from cubersio.persistence.models import EventFormat
+from cubersio.persistence.user_results_manager import get_complete_result_values_for_comp
+from cubersio.util.ranks import to_sort_values, rank_results_by_group
+
+# -------------------------------------------------------------------------------------------------
+
+# Best-of-N results are only ranked by singles, which is what the overall result is for those formats
+__BEST_OF_FORMATS = (EventFormat.Bo1, EventFormat.Bo3)
+
+# -------------------------------------------------------------------------------------------------
+
+def get_overall_points(comp_id: int) -> List[Tuple[str, int]]:
+    """ Returns the overall points standings for the specified competition, as a list of (username, points) ordered by
+    points descending. Once a competition is over its standings are cached permanently, until blacklisting changes
+    its results. """
+
+    competition = get_competition(comp_id)
+    is_over = competition is not None and not competition.active
+
+    if is_over:
+        cached = get_competition_overall_points(comp_id)
+        if cached is not None:
+            return [(username, points) for username, points in json.loads(cached)]
+
+    if is_over:
+        return refresh_overall_points(comp_id)
+
+    return calculate_overall_points(comp_id)
+
+
+def refresh_overall_points(comp_id: int) -> List[Tuple[str, int]]:
+    """ Recalculates the overall points standings for the specified competition and caches them, replacing whatever
+    was cached before. This should only be done once the competition is over. """
+
+    overall_points = calculate_overall_points(comp_id)
+    save_competition_overall_points(comp_id, json.dumps(overall_points))
+
+    return overall_points
+
+
+def calculate_overall_points(comp_id: int) -> List[Tuple[str, int]]:
+    """ Calculates the overall points standings for the specified competition from every complete, non-blacklisted
+    result in it, ranking every event at once. Users with the same points are ordered by when they first appear when
+    going through the events in order, each from first place to last. """
+
+    rows = get_complete_result_values_for_comp(comp_id)
+    if not rows:
+        return list()
+
+    event_ids, event_formats, user_ids, usernames, results, singles = zip(*rows)
+
+    event_ids = np.fromiter(event_ids, dtype=np.int64, count=len(rows))
+    result_values = to_sort_values(results)
+
+    # Ties are broken by singles, except in best-of-N events where singles are already the result. A constant single
+    # for those means it never breaks a tie.
+    is_best_of = np.fromiter((event_format in __BEST_OF_FORMATS for event_format in event_formats), dtype=bool,
+                             count=len(rows))
+    single_values = np.where(is_best_of, 0, to_sort_values(singles))
+
+    order, ranks = rank_results_by_group(event_ids, result_values, single_values)
+
+    # Each participant gets the number of participants in the event, less their rank, as points
+    _, event_index, participant_counts = np.unique(event_ids, return_inverse=True, return_counts=True)
+    points = participant_counts[event_index[order]] - ranks
+
+    # Total up the points for each user, and find where each user first appears in ranked order
+    unique_user_ids, user_index = np.unique(np.fromiter(user_ids, dtype=np.int64, count=len(rows))[order],
+                                            return_inverse=True)
+    total_points = np.bincount(user_index, weights=points, minlength=len(unique_user_ids)).astype(np.int64)
+
+    first_appearance = np.full(len(unique_user_ids), len(rows), dtype=np.int64)
+    np.minimum.at(first_appearance, user_index, np.arange(len(rows)))
+
+    # lexsort sorts by the last key first
+    standings = np.lexsort((first_appearance, -total_points))
+
+    return [(usernames[order[first_appearance[i]]], int(total_points[i])) for i in standings]
@@ -2,6 +2,7 @@
 scoring users, and posting the results. """
 
 from cubersio import app
+from cubersio.business.competition.overall_points import get_overall_points
 from cubersio.persistence.comp_manager import get_competition, save_competition
 from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event
 from cubersio.integrations.reddit import submit_post, update_post
@@ -49,8 +50,6 @@ __LEADERBOARDS_URL_TEMPLATE = __URL_ROOT + 'leaderboards/{comp_id}/'
 def post_results_thread(competition_id, is_rerun=False):
     """ Iterate over the events in the competition being scored """
 
-    user_points = dict()
-
     # Retrieve the competition being scored
     comp = get_competition(competition_id)
 
@@ -58,8 +57,7 @@ def post_results_thread(competition_id, is_rerun=False):
     post_body = __RESULTS_BODY_START_TEMPLATE.format(comp_title=comp.title, point_user_limit=__USER_LIMIT_IN_POINTS,
         event_user_limit=__USER_PER_EVENT_LIMIT, leaderboards_url=__LEADERBOARDS_URL_TEMPLATE.format(comp_id=comp.id))
 
-    # Iterate over all the events in the competition, simultaneously building up the post body and
-    # tallying user points
+    # Iterate over all the events in the competition, building up the post body
     for comp_event in sort_comp_events_by_global_sort_order(list(comp.events)):
         results = list(get_all_complete_user_results_for_comp_event(comp_event.id))
         if not results:
@@ -69,19 +67,15 @@ def post_results_thread(competition_id, is_rerun=False):
 
         post_body += __RESULTS_EVENT_HEADER_TEMPLATE.format(event_name=comp_event.Event.name)
 
-        total_participants = len(results)
         for i, _, result in results_with_ranks:
+            if i > __USER_PER_EVENT_LIMIT:
+                break
             username = result.User.username
-            if username not in user_points.keys():
-                user_points[username] = 0
-            user_points[username] += (total_participants - i)
-
-            if i <= __USER_PER_EVENT_LIMIT:
-                post_body += __RESULTS_USER_LINE_TEMPLATE.format(username=__escape_username(username),
-                    profile_url=__profile_for(username), result=result.friendly_result())
+            post_body += __RESULTS_USER_LINE_TEMPLATE.format(username=__escape_username(username),
+                profile_url=__profile_for(username), result=result.friendly_result())
 
-    user_points = [(username, points) for username, points in user_points.items()]
-    user_points.sort(key=lambda x: x[1], reverse=True)
+    # The overall points use the same calculation as the overall leaderboard
+    user_points = get_overall_points(comp.id)
 
     post_body += __RESULTS_POINTS_SECTION_HEADER
     for username, points in user_points[:__USER_LIMIT_IN_POINTS]:
@@ -0,0 +1,34 @@
+""" Business logic for freezing a competition's leaderboards and overall points standings once it's over, so they can be
+served as-is rather than recalculated on every view. """
+
+from cubersio.business.comp_event_leaderboards import snapshot_comp_event_leaderboard
+from cubersio.business.competition.overall_points import refresh_overall_points
+from cubersio.persistence.comp_manager import get_competition, get_all_comp_events_for_comp
+from cubersio.persistence.models import CompetitionEvent
+
+# -------------------------------------------------------------------------------------------------
+
+def snapshot_competition(comp_id: int) -> bool:
+    """ Snapshots the leaderboard of every event in the specified competition, and caches its overall points
+    standings, replacing any existing snapshots. Returns whether the competition was snapshotted, which it isn't if
+    it doesn't exist or is still active, since its results could still change. """
+
+    competition = get_competition(comp_id)
+    if not competition or competition.active:
+        return False
+
+    for comp_event in get_all_comp_events_for_comp(comp_id):
+        snapshot_comp_event_leaderboard(comp_event)
+
+    refresh_overall_points(comp_id)
+
+    return True
+
+
+def refresh_comp_event_snapshot(comp_event: CompetitionEvent) -> None:
+    """ Re-snapshots the leaderboard of the specified competition event, and recalculates its competition's overall
+    points standings, after an admin changes which of its results are blacklisted. This should only be done once the
+    competition is over. """
+
+    snapshot_comp_event_leaderboard(comp_event)
+    refresh_overall_points(comp_event.competition_id)
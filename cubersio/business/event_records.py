@@ -0,0 +1,109 @@
+""" Business logic for maintaining and retrieving each event's materialized records leaderboard. """
+
+from datetime import datetime
+from timeit import default_timer
+from typing import List, Tuple
+
+import numpy as np
+
+from cubersio.business.rankings import get_ordered_pb_singles_for_event, get_ordered_pb_averages_for_event
+from cubersio.persistence.event_records_manager import get_event_records_for_event, replace_event_records
+from cubersio.persistence.events_manager import get_all_events
+from cubersio.persistence.models import PersonalBestRecord
+from cubersio.persistence.user_site_rankings_manager import get_event_site_rankings_state,\
+    get_event_site_rankings_states
+from cubersio.util.ranks import visible_ranks_mask
+
+# -------------------------------------------------------------------------------------------------
+
+def get_event_records(event_id: int) -> Tuple[List[PersonalBestRecord], List[PersonalBestRecord]]:
+    """ Returns a tuple of the ordered and ranked PB singles and PB averages for the specified event, as lists of
+    PersonalBestRecords in the same form as `get_ordered_pb_singles_for_event` and `get_ordered_pb_averages_for_event`.
+    These are read from the event's materialized records as they are. Rebuilding them when the event's PBs change is
+    left to the tasks, so they can briefly lag behind the latest PBs. """
+
+    singles  = __build_personal_best_records(get_event_records_for_event(event_id, is_average=False))
+    averages = __build_personal_best_records(get_event_records_for_event(event_id, is_average=True))
+
+    return singles, averages
+
+
+def refresh_event_records(event_id: int) -> bool:
+    """ Rebuilds the materialized records for the specified event from the current PBs. Returns whether they were
+    replaced, which they aren't if another refresh which started later has already finished. """
+
+    # Remember when the refresh started, so any PB changes that happen while we're working leave the records stale
+    refreshed_timestamp = datetime.utcnow()
+
+    singles  = get_ordered_pb_singles_for_event(event_id)
+    averages = get_ordered_pb_averages_for_event(event_id)
+
+    rows = __build_event_record_rows(event_id, singles, is_average=False)
+    rows.extend(__build_event_record_rows(event_id, averages, is_average=True))
+
+    return replace_event_records(event_id, rows, refreshed_timestamp)
+
+
+def refresh_event_records_if_stale(event_id: int) -> bool:
+    """ Rebuilds the materialized records for the specified event if its PBs have changed since its records were last
+    refreshed, or if they've never been built. Returns whether the records were replaced. """
+
+    state = get_event_site_rankings_state(event_id)
+    if state and not state.records_are_stale:
+        return False
+
+    return refresh_event_records(event_id)
+
+
+def refresh_stale_event_records() -> None:
+    """ Rebuilds the materialized records for every event whose PBs have changed since its records were last
+    refreshed, or which has never had its records built. """
+
+    event_states = get_event_site_rankings_states()
+    stale_event_ids = [event.id for event in get_all_events()
+                       if event.id not in event_states or event_states[event.id].records_are_stale]
+
+    t0 = default_timer()
+
+    for event_id in stale_event_ids:
+        refresh_event_records(event_id)
+
+    t1 = default_timer()
+    print(f"[RECORDS] {t1 - t0}s elapsed to refresh event records for {len(stale_event_ids)} events.")
+
+# -------------------------------------------------------------------------------------------------
+# Functions below are not meant to be used directly; instead these are just dependencies of the
+# publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+def __build_event_record_rows(event_id: int, personal_bests: List[PersonalBestRecord], is_average: bool):
+    """ Builds rows for inserting EventRecords from an ordered list of ranked PersonalBestRecords. """
+
+    return [{
+        'event_id':      event_id,
+        'is_average':    is_average,
+        'position':      position,
+        'rank':          personal_best.numerical_rank,
+        'user_id':       personal_best.user_id,
+        'comp_id':       personal_best.comp_id,
+        'personal_best': personal_best.personal_best,
+        'comment':       personal_best.comment,
+    } for position, personal_best in enumerate(personal_bests)]
+
+
+def __build_personal_best_records(event_records) -> List[PersonalBestRecord]:
+    """ Builds ranked PersonalBestRecords from the ordered tuples returned by `get_event_records_for_event`. Tied
+    records after the first have an empty visible rank, the same as when the PBs are ranked directly. """
+
+    personal_bests = list()
+    ranks = np.fromiter((event_record[-1] for event_record in event_records), dtype=np.int64)
+
+    for event_record, is_visible in zip(event_records, visible_ranks_mask(ranks).tolist()):
+        user_id, result, comp_id, comp_title, username, comment, user_is_verified, rank = event_record
+        personal_best = PersonalBestRecord(personal_best=result, user_id=user_id, username=username, comp_id=comp_id,
+                                           comp_title=comp_title, comment=comment, user_is_verified=user_is_verified)
+        personal_best.rank = rank if is_visible else ''
+        personal_best.numerical_rank = rank
+        personal_bests.append(personal_best)
+
+    return personal_bests
@@ -1,28 +1,849 @@
 """ Business logic for determining user site rankings and PBs. """
 
+from array import array
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import json
 from timeit import default_timer
-from typing import Dict, List, Set
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
-from ranking import Ranking
+import numpy as np
+from sqlalchemy import BigInteger, Float, and_, case, cast, func, select, true, union
 
-from cubersio import DB
+from cubersio import app, DB
 from cubersio.util.events.mbld import MbldSolve
 from cubersio.persistence.models import Competition, CompetitionEvent, Event, UserEventResults, User, UserSiteRankings,\
-    EventFormat, PersonalBestRecord
-from cubersio.persistence.events_manager import get_all_events, get_all_WCA_events
-from cubersio.persistence.user_site_rankings_manager import bulk_update_site_rankings
-from cubersio.util.sorting import sort_personal_best_records
+    EventFormat, PersonalBestRecord, EventSiteRankingsState
+from cubersio.persistence.events_manager import get_all_events, get_all_WCA_events, EventInfo
+from cubersio.persistence.user_site_rankings_manager import bulk_update_site_rankings, get_site_rankings_for_users,\
+    get_all_site_rankings_user_ids, get_event_site_rankings_states, save_event_site_rankings_states
+from cubersio.util.memory import get_current_rss_mb, get_peak_rss_mb
+from cubersio.util.ranks import to_sort_value, to_sort_values, from_sort_value, sort_order, competition_ranks,\
+    visible_ranks_mask, DNF_SORT_VALUE, MISSING_SORT_VALUE
+
+# For retrieving site rankings calculation settings from app config
+__KEY_RANKINGS_WORKER_COUNT      = 'RANKINGS_WORKER_COUNT'
+__KEY_RANKINGS_STREAMING         = 'RANKINGS_STREAMING'
+__KEY_RANKINGS_MEMORY_CEILING_MB = 'RANKINGS_MEMORY_CEILING_MB'
+__KEY_RANKINGS_ENGINE            = 'RANKINGS_ENGINE'
+
+# Site rankings calculation engines. The Python engine ranks PBs in this process, and the SQL engine has the database
+# rank them.
+RANKINGS_ENGINE_PYTHON = 'python'
+RANKINGS_ENGINE_SQL    = 'sql'
+
+# How many users' site rankings are calculated and saved at a time in the streaming modes, unless the memory ceiling
+# forces an earlier save
+__STREAMING_BATCH_SIZE = 250
+
+# How many users' site rankings are calculated in the streaming modes between checks of the process' memory usage
+# against the memory ceiling, and the smallest the batch size is shrunk to whenever the memory usage is over it
+__MEMORY_CHECK_INTERVAL    = 50
+__MIN_STREAMING_BATCH_SIZE = 25
+
+# How many rows the SQL engine pulls from the database at a time
+__SQL_ENGINE_FETCH_SIZE = 5000
+
+# How many rows to pull from the database at a time when streaming PB records for many events at once
+__PB_RECORDS_STREAM_BATCH_SIZE = 5000
+
+__DNF = 'DNF'
+
+
+def calculate_user_site_rankings(worker_count: Optional[int] = None,
+                                 streaming: Optional[bool] = None,
+                                 engine: Optional[str] = None) -> None:
+    """ Calculate user event site rankings based on PBs. If `engine` is the SQL engine, the database does the ranking.
+    Otherwise if `streaming` is set, rankings are calculated in the bounded-memory streaming mode, or if `worker_count`
+    is greater than 1, each event's rankings are calculated in parallel across that many processes. If any of these
+    isn't specified, the configured value is used. """
+
+    if engine is None:
+        engine = app.config[__KEY_RANKINGS_ENGINE]
+
+    if engine == RANKINGS_ENGINE_SQL:
+        if _sql_engine_supported():
+            _calculate_user_site_rankings_sql()
+            return
+        print("[RANKINGS] This database doesn't support the SQL engine, falling back to the Python engine.")
+
+    if streaming is None:
+        streaming = app.config[__KEY_RANKINGS_STREAMING]
+
+    if worker_count is None:
+        worker_count = app.config[__KEY_RANKINGS_WORKER_COUNT]
+
+    if streaming:
+        _calculate_user_site_rankings_streaming(app.config[__KEY_RANKINGS_MEMORY_CEILING_MB])
+        return
+
+    if worker_count > 1:
+        _calculate_user_site_rankings_parallel(worker_count)
+        return
 
+    all_events = [e for e in get_all_events() if e.name != "COLL"]
+    wca_event_ids = set(e.id for e in get_all_WCA_events())
+
+    # Remember when this calculation started, so any PB changes that happen while we're working are picked up by the
+    # next incremental run
+    calculation_timestamp = datetime.utcnow()
+
+    t0 = default_timer()
+
+    events_pb_singles, events_pb_singles_ix, events_singles_len, events_pb_averages, events_pb_averages_ix,\
+        events_averages_len, all_user_ids = _load_ordered_pbs_for_events(all_events)
+
+    # We'll update the users' site rankings in bulk.
+    site_rankings = list()
+    bulk_update_count = 0
+    bulk_update_limit = 250
+
+    # Iterate through all users to determine their site rankings and PBs
+    for user_id in all_user_ids:
+        rankings = _calculate_site_rankings_for_user(user_id, events_pb_singles, events_pb_singles_ix,
+                                                     events_singles_len, events_pb_averages, events_pb_averages_ix,
+                                                     events_averages_len, wca_event_ids, all_events)
+
+        site_rankings.append(rankings)
+        bulk_update_count += 1
+
+        # Save/update site rankings in bulk
+        if bulk_update_count == bulk_update_limit:
+            bulk_update_site_rankings(site_rankings)
+            site_rankings = list()
+            bulk_update_count = 0
+
+    # If there's any left that didn't get updated in bulk, do that now.
+    if site_rankings:
+        bulk_update_site_rankings(site_rankings)
+
+    # Every event's rankings are now up-to-date
+    _record_events_calculated(all_events, events_singles_len, events_averages_len, calculation_timestamp)
+
+    t1 = default_timer()
+    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {len(all_user_ids)} users.")
+
+
+def _calculate_user_site_rankings_parallel(worker_count: int) -> None:
+    """ Calculate user event site rankings based on PBs, with each event's ordered PBs and every participant's rankings
+    in that event calculated in a separate worker process. The per-event results are then merged here to build each
+    user's overall site rankings. """
+
+    all_events = [e for e in get_all_events() if e.name != "COLL"]
+    wca_event_ids = set(e.id for e in get_all_WCA_events())
+
+    calculation_timestamp = datetime.utcnow()
+
+    t0 = default_timer()
+
+    events_user_rankings, events_singles_len, events_averages_len, all_user_ids =\
+        _calculate_events_rankings_parallel(all_events, worker_count)
+
+    site_rankings = list()
+    bulk_update_limit = 250
+
+    for user_id in all_user_ids:
+        user_rankings_data = OrderedDict()
+        for event in all_events:
+            if event in events_user_rankings:
+                user_rankings_data[event.id] = _get_event_rankings_for_user(user_id, event, events_user_rankings,
+                                                                            events_singles_len, events_averages_len)
+
+        site_rankings.append(_build_user_site_rankings(user_id, user_rankings_data, wca_event_ids, all_events))
+
+        # Save/update site rankings in bulk
+        if len(site_rankings) == bulk_update_limit:
+            bulk_update_site_rankings(site_rankings)
+            site_rankings = list()
+
+    # If there's any left that didn't get updated in bulk, do that now.
+    if site_rankings:
+        bulk_update_site_rankings(site_rankings)
+
+    _record_events_calculated(all_events, events_singles_len, events_averages_len, calculation_timestamp)
+
+    t1 = default_timer()
+    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {len(all_user_ids)} users " +
+          f"across {worker_count} workers.")
+
+
+def _calculate_events_rankings_parallel(events: List[EventInfo], worker_count: int):
+    """ Calculates the site rankings of every participant in each of the specified events, with each event calculated
+    in a separate worker process. Returns a tuple of the form (dict[EventInfo, dict[user ID, event rankings tuple]],
+    dict[EventInfo, number of PB singles], dict[EventInfo, number of PB averages], set of all user IDs seen). Events
+    nobody has competed in aren't included. """
+
+    with ProcessPoolExecutor(max_workers=worker_count, initializer=_init_rankings_worker) as executor:
+        events_rankings = list(executor.map(_calculate_event_rankings_for_all_users, events))
+
+    events_user_rankings = dict()
+    events_singles_len = dict()
+    events_averages_len = dict()
+
+    all_user_ids = set()
+    for event, (user_rankings, singles_len, averages_len) in zip(events, events_rankings):
+        if not singles_len:
+            continue
+        events_user_rankings[event] = user_rankings
+        events_singles_len[event] = singles_len
+        events_averages_len[event] = averages_len
+        all_user_ids.update(user_rankings.keys())
+
+    return events_user_rankings, events_singles_len, events_averages_len, all_user_ids
+
+
+def _get_event_rankings_for_user(user_id: int,
+                                 event: EventInfo,
+                                 events_user_rankings: Dict[EventInfo, Dict[int, Tuple]],
+                                 events_singles_len: Dict[EventInfo, int],
+                                 events_averages_len: Dict[EventInfo, int]) -> Tuple:
+    """ Returns a user's site rankings tuple for an event, out of the precalculated rankings of every participant in
+    it. If the user has no result in the event, they are ranked after everybody who does. """
+
+    event_rankings = events_user_rankings[event].get(user_id, None)
+    if not event_rankings:
+        event_rankings = _build_event_rankings_without_result(events_singles_len[event], events_averages_len[event])
+
+    return event_rankings
+
+
+def _init_rankings_worker() -> None:
+    """ Initializes a site rankings worker process. If the worker was forked, it inherited the parent process' database
+    connection pool, which must not be shared across processes, so discard it and let this worker open its own. """
+
+    with app.app_context():
+        DB.engine.dispose(close=False)
+
+
+def _calculate_event_rankings_for_all_users(event: EventInfo) -> Tuple[Dict[int, Tuple], int, int]:
+    """ Calculates the site rankings for a single event for every user who has a result in it. Returns a tuple of the
+    form (dict[user ID, event rankings tuple], number of PB singles, number of PB averages). """
+
+    with app.app_context():
+        ordered_pb_singles = get_ordered_pb_singles_for_event(event.id)
+
+        # If nobody at all has competed in this event, there's nothing to rank
+        if not ordered_pb_singles:
+            return dict(), 0, 0
+
+        ordered_pb_averages = get_ordered_pb_averages_for_event(event.id)
+
+    singles_ix_map = {pb_record.user_id: i for i, pb_record in enumerate(ordered_pb_singles)}
+    averages_ix_map = {pb_record.user_id: i for i, pb_record in enumerate(ordered_pb_averages)}
+
+    singles_len = len(ordered_pb_singles)
+    averages_len = len(ordered_pb_averages)
+
+    user_rankings = dict()
+    for user_id in singles_ix_map.keys() | averages_ix_map.keys():
+        user_rankings[user_id] = _calculate_event_rankings_for_user(user_id, event, ordered_pb_singles,
+                                                                    singles_ix_map, singles_len, ordered_pb_averages,
+                                                                    averages_ix_map, averages_len)
+
+    return user_rankings, singles_len, averages_len
+
+
+class _CompactEventPBs:
+    """ Compact arrays of the latest PB (either single or average) of every user in an event, and the site rank of
+    each of those PBs, all ordered by user ID. This holds the same information about an event needed to calculate site
+    rankings as a list of PersonalBestRecords, in a fraction of the memory. """
+
+    def __init__(self, user_ids: np.ndarray, pb_values: np.ndarray):
+        self.count = len(user_ids)
+
+        # The best PB in the event, which is the Kinchrank baseline
+        self.best = ''
+
+        self.user_ids  = user_ids
+        self.pb_values = pb_values
+        self.ranks     = np.empty(self.count, dtype=np.int64)
+
+        if not self.count:
+            return
+
+        order = sort_order(pb_values)
+        self.ranks[order] = competition_ranks(pb_values[order])
+        self.best = from_sort_value(int(pb_values[order[0]]))
+
+        by_user = np.argsort(user_ids, kind='stable')
+        self.user_ids  = user_ids[by_user]
+        self.pb_values = pb_values[by_user]
+        self.ranks     = self.ranks[by_user]
+
+    def lookup(self, user_ids: np.ndarray) -> Tuple[List[int], List[int]]:
+        """ Looks up the PBs and ranks of the specified user IDs, which must be sorted. Returns a tuple of
+        (ranks, PB values), in the same order as the user IDs. Users without a PB in this event are ranked
+        (1 + number of PBs in this event), and their PB value is the missing result sort value. """
+
+        if not self.count:
+            return [1] * len(user_ids), [MISSING_SORT_VALUE] * len(user_ids)
+
+        # A user whose PB record is empty is ranked the same as a user without one
+        positions = np.minimum(np.searchsorted(self.user_ids, user_ids), self.count - 1)
+        found = (self.user_ids[positions] == user_ids) & (self.pb_values[positions] != MISSING_SORT_VALUE)
+
+        ranks = np.where(found, self.ranks[positions], self.count + 1)
+        pb_values = np.where(found, self.pb_values[positions], MISSING_SORT_VALUE)
+
+        return ranks.tolist(), pb_values.tolist()
+
+
+def _calculate_user_site_rankings_streaming(memory_ceiling_mb: int) -> None:
+    """ Calculate user event site rankings based on PBs, while keeping memory usage bounded. Only compact arrays of each
+    event's PBs and ranks are held in memory, users' site rankings are generated as they're needed, and they are saved
+    in batches with the session cleared in between. If `memory_ceiling_mb` is set, the process' memory usage is checked
+    every so often, and whenever it's over the ceiling the current batch is saved early and later ones are smaller. """
+
+    all_events = [e for e in get_all_events() if e.name != "COLL"]
+    wca_event_ids = set(e.id for e in get_all_WCA_events())
+
+    calculation_timestamp = datetime.utcnow()
+
+    t0 = default_timer()
+
+    events_singles, events_averages = _load_compact_event_pbs(all_events)
+    DB.session.expunge_all()
+
+    all_user_ids = _get_all_user_ids(events_singles, events_averages)
+
+    site_rankings = list()
+    batch_size = __STREAMING_BATCH_SIZE
+    users_since_memory_check = 0
+    ceiling_exceeded = False
+
+    for rankings in _generate_user_site_rankings(all_user_ids, events_singles, events_averages, wca_event_ids,
+                                                 all_events):
+        site_rankings.append(rankings)
+        users_since_memory_check += 1
+
+        batch_is_full = len(site_rankings) >= batch_size
+        if memory_ceiling_mb and users_since_memory_check >= __MEMORY_CHECK_INTERVAL:
+            users_since_memory_check = 0
+            shrunk_batch_size = __shrink_batch_size_over_memory_ceiling(batch_size, memory_ceiling_mb)
+            if shrunk_batch_size is not None:
+                batch_size = shrunk_batch_size
+                batch_is_full = ceiling_exceeded = True
+
+        if batch_is_full:
+            bulk_update_site_rankings(site_rankings)
+            DB.session.expunge_all()
+            site_rankings = list()
+
+    if site_rankings:
+        bulk_update_site_rankings(site_rankings)
+        DB.session.expunge_all()
+
+    events_singles_len  = {event: pbs.count for event, pbs in events_singles.items()}
+    events_averages_len = {event: pbs.count for event, pbs in events_averages.items()}
+    _record_events_calculated(all_events, events_singles_len, events_averages_len, calculation_timestamp)
+
+    t1 = default_timer()
+    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {len(all_user_ids)} users in streaming mode.")
+    __report_peak_memory(memory_ceiling_mb, ceiling_exceeded)
+
+
+def __shrink_batch_size_over_memory_ceiling(batch_size: int, memory_ceiling_mb: int) -> Optional[int]:
+    """ Checks the process' memory usage against the memory ceiling. If it's over, returns the smaller batch size to
+    use from now on, otherwise returns None. """
+
+    if get_current_rss_mb() <= memory_ceiling_mb:
+        return None
+
+    return max(batch_size // 2, __MIN_STREAMING_BATCH_SIZE)
+
+
+def __report_peak_memory(memory_ceiling_mb: int, ceiling_exceeded: bool) -> None:
+    """ Reports the peak memory usage of a site rankings calculation, and whether it exceeded the memory ceiling. """
+
+    print(f"[RANKINGS] Peak RSS {get_peak_rss_mb():.1f} MB.")
+    if ceiling_exceeded:
+        print(f"[RANKINGS] Memory usage exceeded the {memory_ceiling_mb} MB ceiling, batches were saved early and " +
+              "shrunk.")
+
+
+def _load_compact_event_pbs(events: List[EventInfo]) -> Tuple[Dict[EventInfo, _CompactEventPBs],
+                                                              Dict[EventInfo, _CompactEventPBs]]:
+    """ Loads compact PB singles and averages arrays for each of the specified events, returning a tuple of maps of
+    event to singles and event to averages. Events nobody has competed in are omitted from both maps. """
+
+    events_singles  = dict()
+    events_averages = dict()
+
+    for event in events:
+        singles = _load_compact_pbs_for_event(event.id, UserEventResults.single, UserEventResults.is_latest_pb_single)
+        if not singles.count:
+            continue
+
+        events_singles[event] = singles
+        events_averages[event] = _load_compact_pbs_for_event(event.id, UserEventResults.average,
+                                                             UserEventResults.is_latest_pb_average)
+
+    return events_singles, events_averages
+
+
+def _load_compact_pbs_for_event(event_id: int, pb_column, latest_pb_flag_column) -> _CompactEventPBs:
+    """ Retrieves the latest PB (either single or average, depending on the supplied columns) which doesn't belong to a
+    blacklisted result, one per user, for the specified event, as a _CompactEventPBs. """
+
+    results = DB.session.\
+        query(UserEventResults).\
+        join(User).\
+        join(CompetitionEvent).\
+        filter(CompetitionEvent.event_id == event_id).\
+        filter(UserEventResults.is_complete).\
+        filter(latest_pb_flag_column).\
+        filter(UserEventResults.is_blacklisted.isnot(True)).\
+        with_entities(UserEventResults.user_id, pb_column).\
+        yield_per(__PB_RECORDS_STREAM_BATCH_SIZE)
+
+    user_ids  = array('q')
+    pb_values = array('q')
+    for user_id, pb in results:
+        user_ids.append(user_id)
+        pb_values.append(to_sort_value(pb))
 
-def calculate_user_site_rankings() -> None:
-    """ Calculate user event site rankings based on PBs. """
+    return _CompactEventPBs(np.array(user_ids, dtype=np.int64), np.array(pb_values, dtype=np.int64))
+
+
+def _get_all_user_ids(events_singles: Dict[EventInfo, _CompactEventPBs],
+                      events_averages: Dict[EventInfo, _CompactEventPBs]) -> np.ndarray:
+    """ Returns a sorted array of the IDs of all users with a PB in any of the events. """
+
+    all_pbs = list(events_singles.values()) + list(events_averages.values())
+    if not all_pbs:
+        return np.empty(0, dtype=np.int64)
+
+    return np.unique(np.concatenate([pbs.user_ids for pbs in all_pbs]))
+
+
+def _generate_user_site_rankings(user_ids: np.ndarray,
+                                 events_singles: Dict[EventInfo, _CompactEventPBs],
+                                 events_averages: Dict[EventInfo, _CompactEventPBs],
+                                 wca_event_ids: Set[int],
+                                 all_events: List[EventInfo]) -> Iterator[UserSiteRankings]:
+    """ Generates a UserSiteRankings record for each of the specified users, which must be sorted. Users' event
+    rankings are looked up a batch of users at a time. """
+
+    for i in range(0, len(user_ids), __STREAMING_BATCH_SIZE):
+        batch_user_ids = user_ids[i:i + __STREAMING_BATCH_SIZE]
+
+        batch_event_rankings = dict()
+        for event, singles in events_singles.items():
+            batch_event_rankings[event.id] = _calculate_event_rankings_for_users(batch_user_ids, event, singles,
+                                                                                 events_averages[event])
+
+        for j, user_id in enumerate(batch_user_ids.tolist()):
+            user_rankings_data = OrderedDict()
+            for event in all_events:
+                if event.id in batch_event_rankings:
+                    user_rankings_data[event.id] = batch_event_rankings[event.id][j]
+
+            yield _build_user_site_rankings(user_id, user_rankings_data, wca_event_ids, all_events)
+
+
+def _calculate_event_rankings_for_users(user_ids: np.ndarray,
+                                        event,
+                                        singles: _CompactEventPBs,
+                                        averages: _CompactEventPBs) -> List[Tuple]:
+    """ Calculates the site rankings for a single event for each of the specified users, which must be sorted, from
+    the event's compact PB arrays. Returns a list of tuples of the form
+    (pb_single, single_rank, pb_average, average_rank, kinchrank), in the same order as the user IDs. """
+
+    single_ranks, single_values = singles.lookup(user_ids)
+    average_ranks, average_values = averages.lookup(user_ids)
+
+    event_rankings = list()
+    for single_rank, average_rank, single_value, average_value in zip(single_ranks, average_ranks, single_values,
+                                                                      average_values):
+        pb_single  = from_sort_value(single_value)
+        pb_average = from_sort_value(average_value)
+        event_kinch = _calculate_event_kinch(event, pb_single, pb_average, singles.best, averages.best)
+        event_rankings.append((pb_single, single_rank, pb_average, average_rank, format(event_kinch, '.3f')))
+
+    return event_rankings
+
+
+def _sql_engine_supported() -> bool:
+    """ Returns whether the database supports the window functions the SQL site rankings engine relies on. PostgreSQL
+    always does, and SQLite has since version 3.25. """
+
+    if DB.engine.dialect.name != 'sqlite':
+        return True
+
+    return DB.engine.dialect.dbapi.sqlite_version_info >= (3, 25)
+
+
+def _calculate_user_site_rankings_sql() -> None:
+    """ Calculate user event site rankings based on PBs, with each event's ranks, the rank of users without a result in
+    the event, and each user's Kinchrank ratio for the event all calculated by the database in a single query. This
+    just assembles the resulting rows into each user's UserSiteRankings, and saves them in batches. """
 
     all_events = [e for e in get_all_events() if e.name != "COLL"]
     wca_event_ids = set(e.id for e in get_all_WCA_events())
 
+    calculation_timestamp = datetime.utcnow()
+
+    t0 = default_timer()
+
+    statement = _build_event_site_rankings_statement([event.id for event in all_events])
+    rows = DB.session.connection().execution_options(stream_results=True, yield_per=__SQL_ENGINE_FETCH_SIZE).\
+        execute(statement)
+
+    events_by_id = {event.id: event for event in all_events}
+    events_singles_len = dict()
+    events_averages_len = dict()
+
+    site_rankings = list()
+    bulk_update_limit = 250
+    user_count = 0
+
+    # The rows are ordered by user, and then by event in the same order as `all_events`, so each user's rankings data
+    # can be assembled as their rows go by
+    current_user_id = None
+    user_rankings_data = OrderedDict()
+
+    for user_id, event_id, pb_single, single_rank, pb_average, average_rank, kinch_ratio, singles_len, averages_len\
+            in rows:
+        if user_id != current_user_id:
+            if current_user_id is not None:
+                site_rankings.append(_build_user_site_rankings(current_user_id, user_rankings_data, wca_event_ids,
+                                                               all_events))
+                user_count += 1
+            current_user_id = user_id
+            user_rankings_data = OrderedDict()
+
+            # Save/update site rankings in bulk
+            if len(site_rankings) == bulk_update_limit:
+                bulk_update_site_rankings(site_rankings)
+                site_rankings = list()
+
+        user_rankings_data[event_id] = _build_event_rankings_from_sql(pb_single, single_rank, pb_average,
+                                                                      average_rank, kinch_ratio)
+
+        event = events_by_id[event_id]
+        events_singles_len[event] = singles_len
+        events_averages_len[event] = averages_len
+
+    if current_user_id is not None:
+        site_rankings.append(_build_user_site_rankings(current_user_id, user_rankings_data, wca_event_ids, all_events))
+        user_count += 1
+
+    # If there's any left that didn't get updated in bulk, do that now.
+    if site_rankings:
+        bulk_update_site_rankings(site_rankings)
+
+    _record_events_calculated(all_events, events_singles_len, events_averages_len, calculation_timestamp)
+
+    t1 = default_timer()
+    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {user_count} users in the database.")
+
+
+def _calculate_events_rankings_sql(events: List[EventInfo]):
+    """ Calculates the site rankings of every participant in each of the specified events in the database, in a single
+    query. Returns a tuple of the same form as `_calculate_events_rankings_parallel`. """
+
+    statement = _build_event_site_rankings_statement([event.id for event in events])
+    rows = DB.session.connection().execution_options(stream_results=True, yield_per=__SQL_ENGINE_FETCH_SIZE).\
+        execute(statement)
+
+    events_by_id = {event.id: event for event in events}
+    events_user_rankings = dict()
+    events_singles_len = dict()
+    events_averages_len = dict()
+
+    all_user_ids = set()
+    for user_id, event_id, pb_single, single_rank, pb_average, average_rank, kinch_ratio, singles_len, averages_len\
+            in rows:
+        event = events_by_id[event_id]
+        events_user_rankings.setdefault(event, dict())[user_id] = _build_event_rankings_from_sql(
+            pb_single, single_rank, pb_average, average_rank, kinch_ratio)
+        events_singles_len[event] = singles_len
+        events_averages_len[event] = averages_len
+        all_user_ids.add(user_id)
+
+    return events_user_rankings, events_singles_len, events_averages_len, all_user_ids
+
+
+def _build_event_rankings_from_sql(pb_single: str,
+                                   single_rank: int,
+                                   pb_average: str,
+                                   average_rank: int,
+                                   kinch_ratio: Optional[float]) -> Tuple:
+    """ Builds a site rankings tuple of the form (pb_single, single_rank, pb_average, average_rank, kinchrank) from a
+    row of the SQL engine's query. Kinchrank ratios are rounded here rather than in the database, so they match the
+    other engines exactly. """
+
+    event_kinch = round(kinch_ratio, 3) if kinch_ratio else 0
+    return pb_single, single_rank, pb_average, average_rank, format(event_kinch, '.3f')
+
+
+def _build_event_site_rankings_statement(event_ids: List[int]):
+    """ Builds a query which calculates the site rankings for every user with a PB in any of the specified events, for
+    every one of those events which has PB singles. Each row is of the form (user_id, event_id, pb_single, single_rank,
+    pb_average, average_rank, kinch_ratio, singles_count, averages_count), ordered by user ID and then event ID, where
+    `kinch_ratio` is the unrounded Kinchrank component for the event.
+
+    This mirrors `_calculate_event_rankings_for_user` and `_calculate_event_kinch`. PBs are ranked with RANK() over
+    each event, with DNFs and empty PBs tied after all real results, and users without a PB are ranked one after
+    the number of PBs in the event. """
+
+    singles = _build_ranked_pbs_cte(event_ids, UserEventResults.single, UserEventResults.is_latest_pb_single,
+                                    'ranked_singles')
+    averages = _build_ranked_pbs_cte(event_ids, UserEventResults.average, UserEventResults.is_latest_pb_average,
+                                     'ranked_averages')
+
+    # The number of PBs in each event, and the best of them, which is the Kinchrank baseline. Only events with PB
+    # singles are ranked at all.
+    singles_stats = select(singles.c.event_id,
+                           func.count().label('pb_count'),
+                           func.min(singles.c.sort_value).label('best')).\
+        group_by(singles.c.event_id).\
+        cte('singles_stats')
+    averages_stats = select(averages.c.event_id,
+                            func.count().label('pb_count'),
+                            func.min(averages.c.sort_value).label('best')).\
+        group_by(averages.c.event_id).\
+        cte('averages_stats')
+
+    # Everybody with a PB in any ranked event gets rankings for all of them
+    ranked_users = union(select(singles.c.user_id),
+                         select(averages.c.user_id).where(averages.c.event_id.in_(select(singles_stats.c.event_id)))).\
+        cte('ranked_users')
+
+    has_single = and_(singles.c.pb.isnot(None), singles.c.pb != '')
+    has_average = and_(averages.c.pb.isnot(None), averages.c.pb != '')
+    averages_count = func.coalesce(averages_stats.c.pb_count, 0)
+
+    single_rank = case((has_single, singles.c.rank), else_=singles_stats.c.pb_count + 1)
+    average_rank = case((has_average, averages.c.rank), else_=averages_count + 1)
+
+    # Kinchrank ratios of the user's PB to the best PB in the event, which are 0 for a DNF or no PB
+    single_ratio = case((and_(has_single, singles.c.pb != __DNF),
+                         cast(singles_stats.c.best, Float) / cast(singles.c.sort_value, Float) * 100), else_=0)
+    average_ratio = case((and_(has_average, averages.c.pb != __DNF),
+                          cast(averages_stats.c.best, Float) / cast(averages.c.sort_value, Float) * 100), else_=0)
+    mbld_ratio = case((and_(has_single, singles.c.pb != __DNF),
+                       _mbld_points_expression(singles.c.sort_value) /
+                       _mbld_points_expression(singles_stats.c.best) * 100), else_=0)
+
+    kinch_ratio = case(
+        (Event.name == 'MBLD', mbld_ratio),
+        (Event.name.in_(('FMC', '3BLD')), case((single_ratio >= average_ratio, single_ratio), else_=average_ratio)),
+        (Event.eventFormat.in_((EventFormat.Bo1, EventFormat.Bo3)), single_ratio),
+        else_=average_ratio)
+
+    return select(ranked_users.c.user_id,
+                  singles_stats.c.event_id,
+                  func.coalesce(singles.c.pb, ''),
+                  single_rank,
+                  func.coalesce(averages.c.pb, ''),
+                  average_rank,
+                  kinch_ratio,
+                  singles_stats.c.pb_count,
+                  averages_count).\
+        select_from(ranked_users).\
+        join(singles_stats, true()).\
+        join(Event, Event.id == singles_stats.c.event_id).\
+        outerjoin(singles, and_(singles.c.event_id == singles_stats.c.event_id,
+                                singles.c.user_id == ranked_users.c.user_id)).\
+        outerjoin(averages_stats, averages_stats.c.event_id == singles_stats.c.event_id).\
+        outerjoin(averages, and_(averages.c.event_id == singles_stats.c.event_id,
+                                 averages.c.user_id == ranked_users.c.user_id)).\
+        order_by(ranked_users.c.user_id, singles_stats.c.event_id)
+
+
+def _build_ranked_pbs_cte(event_ids: List[int], pb_column, latest_pb_flag_column, name: str):
+    """ Builds a CTE of the latest PB (either single or average, depending on the supplied columns) which doesn't belong
+    to a blacklisted result, one per user, for each of the specified events, along with the PB's sort value and its
+    rank within the event. Empty PBs sort the same as DNFs. """
+
+    sort_value = case((pb_column == __DNF, DNF_SORT_VALUE),
+                      (pb_column.is_(None), DNF_SORT_VALUE),
+                      (pb_column == '', DNF_SORT_VALUE),
+                      else_=cast(pb_column, BigInteger))
+
+    return select(CompetitionEvent.event_id,
+                  UserEventResults.user_id,
+                  pb_column.label('pb'),
+                  sort_value.label('sort_value'),
+                  func.rank().over(partition_by=CompetitionEvent.event_id, order_by=sort_value).label('rank')).\
+        select_from(UserEventResults).\
+        join(User, UserEventResults.user_id == User.id).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        where(CompetitionEvent.event_id.in_(event_ids)).\
+        where(UserEventResults.is_complete).\
+        where(latest_pb_flag_column).\
+        where(UserEventResults.is_blacklisted.isnot(True)).\
+        cte(name)
+
+
+def _mbld_points_expression(coded_value):
+    """ Builds an expression for the points of a coded MBLD result, plus the fraction of the hour remaining, which is
+    the same as `MbldSolve.sort_value`. The coded value is of the form XXYYYYZZ, where XX is (99 - points) and YYYY is
+    elapsed seconds. """
+
+    points = 99 - coded_value // 1000000
+    elapsed_seconds = cast((coded_value // 100) % 10000, Float)
+
+    return points + (60 - elapsed_seconds / 60.0) / 60.0
+
+
+def calculate_user_site_rankings_incremental(worker_count: Optional[int] = None,
+                                             streaming: Optional[bool] = None,
+                                             engine: Optional[str] = None) -> None:
+    """ Calculate user event site rankings based on PBs, but only recalculate rankings for the events whose PBs have
+    changed (new PBs, blacklisting, etc) since the last time site rankings were calculated. Each user's existing
+    rankings for the unchanged events are kept as-is, and their sum of ranks and Kinchranks are recalculated from the
+    combination of the existing and newly-calculated event rankings. If `engine` is the SQL engine, the database ranks
+    the changed events. Otherwise if `streaming` is set, the changed events' rankings are calculated in the
+    bounded-memory streaming mode, which shrinks its batches of users while the process' memory usage is over the
+    configured memory ceiling, or if `worker_count` is greater than 1, each changed event's rankings are calculated in
+    parallel across that many processes. If any of these isn't specified, the configured value is used. """
+
+    if engine is None:
+        engine = app.config[__KEY_RANKINGS_ENGINE]
+
+    use_sql_engine = engine == RANKINGS_ENGINE_SQL and _sql_engine_supported()
+    if engine == RANKINGS_ENGINE_SQL and not use_sql_engine:
+        print("[RANKINGS] This database doesn't support the SQL engine, falling back to the Python engine.")
+
+    # The database ranks the changed events all at once, so the SQL engine doesn't stream
+    if use_sql_engine:
+        streaming = False
+    elif streaming is None:
+        streaming = app.config[__KEY_RANKINGS_STREAMING]
+
+    if worker_count is None:
+        worker_count = app.config[__KEY_RANKINGS_WORKER_COUNT]
+
+    all_events = [e for e in get_all_events() if e.name != "COLL"]
+    wca_event_ids = set(e.id for e in get_all_WCA_events())
+
+    # Events which have never had their rankings calculated, or whose PBs have changed since, need to be recalculated
+    event_states = get_event_site_rankings_states()
+    dirty_events = [e for e in all_events if (e.id not in event_states) or event_states[e.id].is_dirty]
+
+    if not dirty_events:
+        print("[RANKINGS] No events have changed since the last calculation, nothing to do.")
+        return
+
+    # Keep just the PB counts from the event states, since the records themselves won't survive the session being
+    # cleared in streaming mode
+    events_counts = {event_id: (state.singles_count, state.averages_count) for event_id, state in event_states.items()}
+
+    calculation_timestamp = datetime.utcnow()
+
+    t0 = default_timer()
+
+    # When the changed events' rankings are calculated up front for every participant at once, rather than as each
+    # batch of users goes by, they're of the form dict[EventInfo, dict[user ID, event rankings tuple]]
+    events_user_rankings = None
+
+    if use_sql_engine:
+        events_user_rankings, events_singles_len, events_averages_len, dirty_user_ids =\
+            _calculate_events_rankings_sql(dirty_events)
+    elif streaming:
+        events_singles, events_averages = _load_compact_event_pbs(dirty_events)
+        events_singles_len  = {event: pbs.count for event, pbs in events_singles.items()}
+        events_averages_len = {event: pbs.count for event, pbs in events_averages.items()}
+        dirty_user_ids = set(_get_all_user_ids(events_singles, events_averages).tolist())
+        DB.session.expunge_all()
+    elif worker_count > 1:
+        events_user_rankings, events_singles_len, events_averages_len, dirty_user_ids =\
+            _calculate_events_rankings_parallel(dirty_events, worker_count)
+    else:
+        events_pb_singles, events_pb_singles_ix, events_singles_len, events_pb_averages, events_pb_averages_ix,\
+            events_averages_len, dirty_user_ids = _load_ordered_pbs_for_events(dirty_events)
+
+    # Anybody who participated in a changed event needs updated rankings, but so does everybody who already has site
+    # rankings, because the rank assigned for *not* having a result in an event depends on the number of participants
+    all_user_ids = sorted(dirty_user_ids.union(get_all_site_rankings_user_ids()))
+
+    dirty_event_ids = set(e.id for e in dirty_events)
+
+    memory_ceiling_mb = app.config[__KEY_RANKINGS_MEMORY_CEILING_MB] if streaming else 0
+    batch_size = __STREAMING_BATCH_SIZE
+    users_since_memory_check = 0
+    ceiling_exceeded = False
+
+    i = 0
+    while i < len(all_user_ids):
+        user_ids = all_user_ids[i:i + batch_size]
+        i += len(user_ids)
+        existing_rankings = get_site_rankings_for_users(user_ids)
+
+        # In streaming mode, calculate the changed events' rankings for this whole batch of users at once
+        if streaming:
+            batch_user_ids = np.array(user_ids, dtype=np.int64)
+            batch_event_rankings = dict()
+            for event, singles in events_singles.items():
+                batch_event_rankings[event.id] = _calculate_event_rankings_for_users(batch_user_ids, event, singles,
+                                                                                     events_averages[event])
+
+        site_rankings = list()
+        for j, user_id in enumerate(user_ids):
+            existing = existing_rankings.get(user_id, None)
+            existing_data = existing.get_site_rankings_and_pbs() if existing else dict()
+
+            user_rankings_data = OrderedDict()
+            for event in all_events:
+
+                # Recalculate rankings for events which have changed. If nobody has competed in the event, skip it.
+                if event.id in dirty_event_ids:
+                    if streaming:
+                        if event.id in batch_event_rankings:
+                            user_rankings_data[event.id] = batch_event_rankings[event.id][j]
+                        continue
+                    if events_user_rankings is not None:
+                        if event in events_user_rankings:
+                            user_rankings_data[event.id] = _get_event_rankings_for_user(
+                                user_id, event, events_user_rankings, events_singles_len, events_averages_len)
+                        continue
+                    if not events_pb_singles.get(event, None):
+                        continue
+                    user_rankings_data[event.id] = _calculate_event_rankings_for_user(
+                        user_id, event, events_pb_singles[event], events_pb_singles_ix[event],
+                        events_singles_len[event], events_pb_averages[event], events_pb_averages_ix[event],
+                        events_averages_len[event])
+
+                # Otherwise keep the user's existing rankings for this event. If they don't have any, they don't have
+                # a result in this event, so they are ranked after everybody who does.
+                elif event.id in existing_data:
+                    user_rankings_data[event.id] = existing_data[event.id]
+
+                elif events_counts[event.id][0]:
+                    user_rankings_data[event.id] = _build_event_rankings_without_result(*events_counts[event.id])
+
+            site_rankings.append(_build_user_site_rankings(user_id, user_rankings_data, wca_event_ids, all_events))
+
+        bulk_update_site_rankings(site_rankings)
+        if streaming:
+            DB.session.expunge_all()
+
+        users_since_memory_check += len(user_ids)
+        if memory_ceiling_mb and users_since_memory_check >= __MEMORY_CHECK_INTERVAL:
+            users_since_memory_check = 0
+            shrunk_batch_size = __shrink_batch_size_over_memory_ceiling(batch_size, memory_ceiling_mb)
+            if shrunk_batch_size is not None:
+                batch_size = shrunk_batch_size
+                ceiling_exceeded = True
+
+    # The changed events' rankings are now up-to-date
+    _record_events_calculated(dirty_events, events_singles_len, events_averages_len, calculation_timestamp)
+
+    t1 = default_timer()
+    print(f"[RANKINGS] {t1 - t0}s elapsed to incrementally calculate site rankings for {len(dirty_events)} events " +
+          f"and {len(all_user_ids)} users.")
+    if streaming:
+        __report_peak_memory(memory_ceiling_mb, ceiling_exceeded)
+
+
+def _load_ordered_pbs_for_events(events: List[EventInfo]):
+    """ Retrieves the ordered PB singles and averages for each of the specified events, along with maps of user ID to
+    each user's index in those ordered PB lists, the number of PB singles and averages in each event, and the set of
+    all user IDs seen. """
+
     # These are of the form dict[Event, [ordered list of PersonalBestRecords]]
     events_pb_singles = dict()
     events_pb_averages = dict()
@@ -38,12 +859,15 @@ def calculate_user_site_rankings() -> None:
     # All user IDs seen, so we only iterate over users that have participated in something
     all_user_ids = set()
 
-    t0 = default_timer()
+    # Retrieve the ordered lists of PersonalBestRecords for singles and averages for all of these events at once
+    event_ids = [event.id for event in events]
+    all_ordered_pb_singles = get_ordered_pb_singles_for_events(event_ids)
+    all_ordered_pb_averages = get_ordered_pb_averages_for_events(event_ids)
 
-    for event in all_events:
+    for event in events:
 
-        # Retrieve the the ordered list of PersonalBestRecords for singles for this event
-        ordered_pb_singles = get_ordered_pb_singles_for_event(event.id)
+        # Get the the ordered list of PersonalBestRecords for singles for this event
+        ordered_pb_singles = all_ordered_pb_singles.get(event.id, None)
 
         # If nobody at all has competed in this event, just move on to the next
         if not ordered_pb_singles:
@@ -62,8 +886,8 @@ def calculate_user_site_rankings() -> None:
 
         events_pb_singles_ix[event] = user_single_ix_map
 
-        # Retrieve the the ordered list of PersonalBestRecords for averages for this event
-        ordered_pb_averages = get_ordered_pb_averages_for_event(event.id)
+        # Get the the ordered list of PersonalBestRecords for averages for this event
+        ordered_pb_averages = all_ordered_pb_averages.get(event.id, list())
         events_pb_averages[event] = ordered_pb_averages
         events_averages_len[event] = len(ordered_pb_averages)
 
@@ -77,43 +901,41 @@ def calculate_user_site_rankings() -> None:
 
         events_pb_averages_ix[event] = user_average_ix_map
 
-    # We'll update the users' site rankings in bulk.
-    site_rankings = list()
-    bulk_update_count = 0
-    bulk_update_limit = 250
+    return events_pb_singles, events_pb_singles_ix, events_singles_len, events_pb_averages, events_pb_averages_ix,\
+        events_averages_len, all_user_ids
 
-    # Iterate through all users to determine their site rankings and PBs
-    for user_id in all_user_ids:
-        rankings = _calculate_site_rankings_for_user(user_id, events_pb_singles, events_pb_singles_ix,
-                                                     events_singles_len, events_pb_averages, events_pb_averages_ix,
-                                                     events_averages_len, wca_event_ids, all_events)
 
-        site_rankings.append(rankings)
-        bulk_update_count += 1
+def _record_events_calculated(events: List[EventInfo],
+                              events_singles_len: Dict[EventInfo, int],
+                              events_averages_len: Dict[EventInfo, int],
+                              calculation_timestamp: datetime) -> None:
+    """ Records that site rankings for the specified events were calculated as of the specified timestamp, along with
+    the number of PB singles and averages in each event at that time. """
 
-        # Save/update site rankings in bulk
-        if bulk_update_count == bulk_update_limit:
-            bulk_update_site_rankings(site_rankings)
-            site_rankings = list()
-            bulk_update_count = 0
+    event_states = get_event_site_rankings_states()
 
-    # If there's any left that didn't get updated in bulk, do that now.
-    if site_rankings:
-        bulk_update_site_rankings(site_rankings)
+    for event in events:
+        state = event_states.get(event.id, None)
+        if not state:
+            state = EventSiteRankingsState(event_id=event.id)
+            event_states[event.id] = state
 
-    t1 = default_timer()
-    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {len(all_user_ids)} users.")
+        state.last_calculated = calculation_timestamp
+        state.singles_count   = events_singles_len.get(event, 0)
+        state.averages_count  = events_averages_len.get(event, 0)
+
+    save_event_site_rankings_states(event_states.values())
 
 
 def _calculate_site_rankings_for_user(user_id: int,
-                                      event_singles_map: Dict[Event, List[PersonalBestRecord]],
-                                      event_singles_ix_map: Dict[Event, Dict[int, int]],
-                                      events_singles_len: Dict[Event, int],
-                                      event_averages_map: Dict[Event, List[PersonalBestRecord]],
-                                      event_averages_ix_map: Dict[Event, Dict[int, int]],
-                                      events_averages_len: Dict[Event, int],
+                                      event_singles_map: Dict[EventInfo, List[PersonalBestRecord]],
+                                      event_singles_ix_map: Dict[EventInfo, Dict[int, int]],
+                                      events_singles_len: Dict[EventInfo, int],
+                                      event_averages_map: Dict[EventInfo, List[PersonalBestRecord]],
+                                      event_averages_ix_map: Dict[EventInfo, Dict[int, int]],
+                                      events_averages_len: Dict[EventInfo, int],
                                       wca_event_ids: Set[int],
-                                      all_events: List[Event]) -> UserSiteRankings:
+                                      all_events: List[EventInfo]) -> UserSiteRankings:
     """ Calculates the user's site rankings for all events, and returns a UserSiteRankings object which contains the raw
     data (for each event, PB single and average, the site rank for those results, and Kinchranks), and also wraps up
     the user's combined sum of ranks, separate sum of ranks for WCA and non-WCA events, and overall Kinchrank.
@@ -132,6 +954,125 @@ def _calculate_site_rankings_for_user(user_id: int,
     # Holds the user's various types of rankings for each event
     user_rankings_data = OrderedDict()
 
+    for event in all_events:
+        # Get the lists ranked singles and averages for the current event. If there's nothing in the map for that event,
+        # nobody has competed in it yet, so we can skip to the next.
+        ranked_singles = event_singles_map.get(event, None)
+        if not ranked_singles:
+            continue
+
+        # Records the user's rankings, PBs, and Kinchrank component for this event
+        user_rankings_data[event.id] = _calculate_event_rankings_for_user(user_id, event, ranked_singles,
+                                                                          event_singles_ix_map[event],
+                                                                          events_singles_len[event],
+                                                                          event_averages_map[event],
+                                                                          event_averages_ix_map[event],
+                                                                          events_averages_len[event])
+
+    return _build_user_site_rankings(user_id, user_rankings_data, wca_event_ids, all_events)
+
+
+def _calculate_event_rankings_for_user(user_id: int,
+                                       event: EventInfo,
+                                       ranked_singles: List[PersonalBestRecord],
+                                       singles_ix_map: Dict[int, int],
+                                       singles_len: int,
+                                       ranked_averages: List[PersonalBestRecord],
+                                       averages_ix_map: Dict[int, int],
+                                       averages_len: int) -> Tuple:
+    """ Calculates the user's site rankings for a single event, returning a tuple of the form
+    (pb_single, single_rank, pb_average, average_rank, kinchrank). """
+
+    pb_single    = ''
+    single_rank  = ''
+    pb_average   = ''
+    average_rank = ''
+
+    # See if there's a result for our user in the singles
+    single_ix = singles_ix_map.get(user_id, None)
+    if single_ix is not None:
+        pb_single   = ranked_singles[single_ix].personal_best
+        single_rank = ranked_singles[single_ix].numerical_rank
+
+    # If our user has no single for this event, their site ranking is (1 + number of people in this event)
+    if not pb_single:
+        single_rank = singles_len + 1
+
+    # See if there's a result for our user in the averages. It's ok if there isn't, either because the user doesn't
+    # have an average or this event doesn't have averages. We'll just record blank values.
+    average_ix = averages_ix_map.get(user_id, None)
+    if average_ix is not None:
+        pb_average   = ranked_averages[average_ix].personal_best
+        average_rank = ranked_averages[average_ix].numerical_rank
+
+    # If our user has no average for this event, their site ranking is (1 + number of people in this event)
+    if not pb_average:
+        average_rank = averages_len + 1
+
+    # The best single and average in the event are the baselines for the Kinchrank component
+    best_single  = ranked_singles[0].personal_best
+    best_average = ranked_averages[0].personal_best if ranked_averages else ''
+    event_kinch  = _calculate_event_kinch(event, pb_single, pb_average, best_single, best_average)
+
+    return (pb_single, single_rank, pb_average, average_rank, format(event_kinch, '.3f'))
+
+
+def _calculate_event_kinch(event, pb_single: str, pb_average: str, best_single: str, best_average: str) -> float:
+    """ Calculates a user's Kinchrank component for an event, given their PB single and average, and the best single
+    and average in the event. """
+
+    event_kinch = 0
+
+    # MBLD is ranked by single, where more points is better. Its sort value is the points plus the fraction of the hour
+    # left unused, so the Kinchrank is this user's sort value as a percentage of the best one.
+    if event.name == 'MBLD':
+        best_mbld = int(best_single)
+        baseline_mbld = MbldSolve(best_mbld).sort_value
+        if pb_single and pb_single != 'DNF':
+            coded_mbld = int(pb_single)
+            this_mbld  = MbldSolve(coded_mbld).sort_value
+            event_kinch = round((this_mbld / baseline_mbld) * 100, 3)
+
+    # FMC and 3BLD are competed for singles as much as for averages, so the Kinchrank is the better of the two ratios of
+    # the event's best single or average to this user's, as a percentage.
+    elif event.name in ('FMC', '3BLD'):
+        single_kinch = 0
+        average_kinch = 0
+        if pb_single and pb_single != 'DNF':
+            single_kinch = round(int(best_single) / int(pb_single) * 100, 3)
+        if pb_average and pb_average != 'DNF':
+            average_kinch = round(int(best_average) / int(pb_average) * 100, 3)
+        event_kinch = max([single_kinch, average_kinch])
+
+    # Best-of-1 and best-of-3 events are ranked by single, so the Kinchrank compares only the singles
+    elif event.eventFormat in (EventFormat.Bo1, EventFormat.Bo3):
+        if pb_single and pb_single != 'DNF':
+            event_kinch = round(int(best_single) / int(pb_single) * 100, 3)
+
+    # Every other event is ranked by average, so the Kinchrank compares only the averages. In all cases a missing or DNF
+    # PB scores 0.
+    else:
+        if pb_average and pb_average != 'DNF':
+            event_kinch = round(int(best_average) / int(pb_average) * 100, 3)
+
+    return event_kinch
+
+
+def _build_event_rankings_without_result(singles_len: int, averages_len: int) -> Tuple:
+    """ Returns the site rankings tuple for an event in which the user has no results, of the form
+    (pb_single, single_rank, pb_average, average_rank, kinchrank). """
+
+    return ('', singles_len + 1, '', averages_len + 1, format(0, '.3f'))
+
+
+def _build_user_site_rankings(user_id: int,
+                              user_rankings_data: Dict[int, Tuple],
+                              wca_event_ids: Set[int],
+                              all_events: List[EventInfo]) -> UserSiteRankings:
+    """ Builds a UserSiteRankings record from a user's per-event rankings data, of the form
+    dict[event ID, (pb_single, single_rank, pb_average, average_rank, kinchrank)], summing up the user's combined, WCA,
+    and non-WCA sum of ranks and Kinchranks. """
+
     # Create the actual UserSiteRankings object to stick the data in when we're done, which will hold both the raw
     # ranking data as well as sum of ranks, total Kinchranks, etc
     user_site_rankings = UserSiteRankings()
@@ -149,68 +1090,14 @@ def _calculate_site_rankings_for_user(user_id: int,
     non_wca_kinchranks = list()
 
     for event in all_events:
-        pb_single    = ''
-        single_rank  = ''
-        pb_average   = ''
-        average_rank = ''
-        event_kinch  = 0
+        event_rankings = user_rankings_data.get(event.id, None)
+        if not event_rankings:
+            continue
 
+        _, single_rank, _, average_rank, event_kinch = event_rankings
+        event_kinch = float(event_kinch)
         event_is_wca = event.id in wca_event_ids
 
-        # Get the lists ranked singles and averages for the current event. If there's nothing in the map for that event,
-        # nobody has competed in it yet, so we can skip to the next.
-        ranked_singles = event_singles_map.get(event, None)
-        if not ranked_singles:
-            continue
-        ranked_averages = event_averages_map[event]
-        singles_ix_map = event_singles_ix_map[event]
-        averages_ix_map = event_averages_ix_map[event]
-
-        # See if there's a result for our user in the singles
-        single_ix = singles_ix_map.get(user_id, None)
-        if single_ix:
-            pb_single   = ranked_singles[single_ix].personal_best
-            single_rank = ranked_singles[single_ix].numerical_rank
-
-        # If our user has no single for this event, their site ranking is (1 + number of people in this event)
-        if not pb_single:
-            single_rank = events_singles_len[event] + 1
-
-        # See if there's a result for our user in the averages. It's ok if there isn't, either because the user doesn't
-        # have an average or this event doesn't have averages. We'll just record blank values.
-        average_ix = averages_ix_map.get(user_id, None)
-        if average_ix:
-            pb_average   = ranked_averages[average_ix].personal_best
-            average_rank = ranked_averages[average_ix].numerical_rank
-
-        # If our user has no average for this event, their site ranking is (1 + number of people in this event)
-        if not pb_average:
-            average_rank = events_averages_len[event] + 1
-
-        # Determine Kinchrank component for this event
-        # TODO: add explanations below
-        if event.name == 'MBLD':
-            best_mbld = int(ranked_singles[0].personal_best)
-            baseline_mbld = MbldSolve(best_mbld).sort_value
-            if pb_single and pb_single != 'DNF':
-                coded_mbld = int(pb_single)
-                this_mbld  = MbldSolve(coded_mbld).sort_value
-                event_kinch = round((this_mbld / baseline_mbld) * 100, 3)
-        elif event.name in ('FMC', '3BLD'):
-            single_kinch = 0
-            average_kinch = 0
-            if pb_single and pb_single != 'DNF':
-                single_kinch = round(int(ranked_singles[0].personal_best) / int(pb_single) * 100, 3)
-            if pb_average and pb_average != 'DNF':
-                average_kinch = round(int(ranked_averages[0].personal_best) / int(pb_average) * 100, 3)
-            event_kinch = max([single_kinch, average_kinch])
-        elif event.eventFormat in (EventFormat.Bo1, EventFormat.Bo3):
-            if pb_single and pb_single != 'DNF':
-                event_kinch = round(int(ranked_singles[0].personal_best) / int(pb_single) * 100, 3)
-        else:
-            if pb_average and pb_average != 'DNF':
-                event_kinch = round(int(ranked_averages[0].personal_best) / int(pb_average) * 100, 3)
-
         # Accumulate Kinchranks
         overall_kinchranks.append(event_kinch)
         if event_is_wca:
@@ -218,9 +1105,6 @@ def _calculate_site_rankings_for_user(user_id: int,
         else:
             non_wca_kinchranks.append(event_kinch)
 
-        # Records the user's rankings, PBs, and Kinchrank component for this event
-        user_rankings_data[event.id] = (pb_single, single_rank, pb_average, average_rank, format(event_kinch, '.3f'))
-
         # Accumulate sum of ranks
         sor_all[0] += single_rank
         sor_all[1] += average_rank if average_rank else 0
@@ -270,41 +1154,40 @@ def _build_personal_best_record(query_tuple):
                               comp_title=comp_title, comment=comment, user_is_verified=user_is_verified)
 
 
-def _determine_ranks(personal_bests):
+def _sort_and_rank_personal_bests(personal_bests: List[PersonalBestRecord]) -> List[PersonalBestRecord]:
+    """ Sorts a list of PersonalBestRecords in place by their personal best values (lack of a result sorted to the end,
+    DNFs right before that), and assigns each PersonalBestRecord a rank. """
+
+    pb_values = to_sort_values(personal_best.personal_best for personal_best in personal_bests)
+    order = sort_order(pb_values)
+
+    personal_bests[:] = [personal_bests[i] for i in order]
+
+    return _determine_ranks(personal_bests, pb_values[order])
+
+
+def _determine_ranks(personal_bests: List[PersonalBestRecord], pb_values=None) -> List[PersonalBestRecord]:
     """ Takes an ordered list of PersonalBestRecords and assigns each PersonalBestRecord a rank.
     Ranks are the same for PersonalBestRecords with identical times.
-    Ex: [12, 13, 14, 14, 15] would have ranks [1, 2, 3, 3, 5] """
+    Ex: [12, 13, 14, 14, 15] would have ranks [1, 2, 3, 3, 5]
+
+    `pb_values` optionally holds the already-computed sort values of the PersonalBestRecords, in the same order. """
 
-    # If `personal_bests` is empty, we can't use the ranking mechanism below, so just return
-    # the empty list
+    # If `personal_bests` is empty, there's nothing to rank so just return the empty list
     if not personal_bests:
         return personal_bests
 
-    # Build a list of just the time values of the personal bests, to be fed into the ranking
-    # mechanism. If the PB time value cannot be interpreted as an int, it's probably a DNF so
-    # just pretend it's some humongous value which would sorted to the end
-    times_values = list()
-    for personal_best in personal_bests:
-        try:
-            times_values.append(int(personal_best.personal_best))
-        except ValueError:
-            times_values.append(9999999999999)
-
-    # Rank the list of times. The result from this is (rank, time value) where the index
-    # of the element for each time value doesn't change from the input to the output
-    ranked_times = list(Ranking(times_values, start=1, reverse=True))
-
-    # Give each PersonalBestRecord its rank from the corresponding element in ranked_times
-    ranks_seen = set()
-    for i, personal_best in enumerate(personal_bests):
-        rank = ranked_times[i][0]
-        if rank not in ranks_seen:
-            ranks_seen.add(rank)
-            personal_best.rank = rank
-            personal_best.numerical_rank = rank
-        else:
-            personal_best.rank = ''
-            personal_best.numerical_rank = rank
+    if pb_values is None:
+        pb_values = to_sort_values(personal_best.personal_best for personal_best in personal_bests)
+
+    # Rank the list of times. DNFs are all considered tied with each other
+    ranks = competition_ranks(pb_values)
+    visible = visible_ranks_mask(ranks)
+
+    # Give each PersonalBestRecord its rank. Tied records after the first have an empty visible rank
+    for personal_best, rank, is_visible in zip(personal_bests, ranks.tolist(), visible.tolist()):
+        personal_best.rank = rank if is_visible else ''
+        personal_best.numerical_rank = rank
 
     return personal_bests
 
@@ -330,11 +1213,11 @@ def get_ordered_pb_singles_for_event(event_id):
 
     # NOTE: if adding anything to this tuple being selected in values(...) above, add it to the
     # end so that code indexing this tuple doesn't get all jacked. Make sure to make an identical
-    # addition to `get_ordered_pb_averages_for_event` and update `_build_PersonalBestRecord`
+    # addition to `get_ordered_pb_averages_for_event` and `_get_ordered_pbs_for_events`, and update
+    # `_build_PersonalBestRecord`
 
     personal_bests = [_build_personal_best_record(result) for result in results]
-    personal_bests.sort(key=sort_personal_best_records)
-    personal_bests = _determine_ranks(personal_bests)
+    personal_bests = _sort_and_rank_personal_bests(personal_bests)
 
     return personal_bests
 
@@ -360,7 +1243,8 @@ def get_ordered_pb_averages_for_event(event_id):
 
     # NOTE: if adding anything to this tuple being selected in values(...) above, add it to the
     # end so that code indexing this tuple doesn't get all jacked. Make sure to make an identical
-    # addition to `get_ordered_pb_singles_for_event` and update `_build_PersonalBestRecord`
+    # addition to `get_ordered_pb_singles_for_event` and `_get_ordered_pbs_for_events`, and update
+    # `_build_PersonalBestRecord`
 
     personal_bests = [_build_personal_best_record(result) for result in results]
 
@@ -370,7 +1254,59 @@ def get_ordered_pb_averages_for_event(event_id):
     if not personal_bests:
         return list()
 
-    personal_bests.sort(key=sort_personal_best_records)
-    personal_bests = _determine_ranks(personal_bests)
+    personal_bests = _sort_and_rank_personal_bests(personal_bests)
 
     return personal_bests
+
+
+def get_ordered_pb_singles_for_events(event_ids: List[int]) -> Dict[int, List[PersonalBestRecord]]:
+    """ Gets the ordered lists of PersonalBestRecords for singles for all of the specified events at once, in the same
+    form as `get_ordered_pb_singles_for_event`. Returns a map of event ID to ordered PB singles for that event. Events
+    nobody has competed in are omitted from the map. """
+
+    return _get_ordered_pbs_for_events(event_ids, UserEventResults.single, UserEventResults.is_latest_pb_single)
+
+
+def get_ordered_pb_averages_for_events(event_ids: List[int]) -> Dict[int, List[PersonalBestRecord]]:
+    """ Gets the ordered lists of PersonalBestRecords for averages for all of the specified events at once, in the same
+    form as `get_ordered_pb_averages_for_event`. Returns a map of event ID to ordered PB averages for that event. Events
+    without any averages are omitted from the map. """
+
+    return _get_ordered_pbs_for_events(event_ids, UserEventResults.average, UserEventResults.is_latest_pb_average)
+
+
+def _get_ordered_pbs_for_events(event_ids, pb_column, latest_pb_flag_column):
+    """ Retrieves the latest PB (either single or average, depending on the supplied columns) which doesn't belong to a
+    blacklisted result, one per user, for every one of the specified events in a single streamed query. The rows are
+    partitioned by event, and each event's PersonalBestRecords are sorted and ranked. """
+
+    if not event_ids:
+        return dict()
+
+    # Each result belongs to exactly one comp event, user, and competition, so there's no need to group these rows
+    results = DB.session.\
+        query(UserEventResults).\
+        join(User).\
+        join(CompetitionEvent).\
+        join(Competition).\
+        filter(CompetitionEvent.event_id.in_(event_ids)).\
+        filter(UserEventResults.is_complete).\
+        filter(latest_pb_flag_column).\
+        filter(UserEventResults.is_blacklisted.isnot(True)).\
+        with_entities(CompetitionEvent.event_id, UserEventResults.user_id, pb_column, Competition.id,
+                      Competition.title, User.username, UserEventResults.comment, User.is_verified).\
+        yield_per(__PB_RECORDS_STREAM_BATCH_SIZE)
+
+    # The query above selects the event ID followed by the same tuple as the single-event queries, so the rest of the
+    # tuple can go straight into `_build_personal_best_record`
+    events_personal_bests = dict()
+    for result in results:
+        event_id = result[0]
+        if event_id not in events_personal_bests:
+            events_personal_bests[event_id] = list()
+        events_personal_bests[event_id].append(_build_personal_best_record(result[1:]))
+
+    for event_id, personal_bests in events_personal_bests.items():
+        events_personal_bests[event_id] = _sort_and_rank_personal_bests(personal_bests)
+
+    return events_personal_bests
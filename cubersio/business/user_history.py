@@ -2,58 +2,70 @@
 
 from collections import OrderedDict
 
-from cubersio.persistence.comp_manager import get_all_competitions_user_has_participated_in
-from cubersio.persistence.events_manager import get_all_events_user_has_participated_in
-from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_and_user
+from cubersio.persistence.user_results_manager import get_all_complete_user_results_history_for_user,\
+    get_solves_and_scrambles_for_results
 from cubersio.util.events.resources import sort_events_by_global_sort_order
 
 # -------------------------------------------------------------------------------------------------
 
-def get_user_competition_history(user, include_blacklisted=False):
+# How many competitions are on each page of a user's history, when it's paginated
+COMPS_PER_PAGE = 25
+
+# -------------------------------------------------------------------------------------------------
+
+def get_user_competition_history(user, include_blacklisted=False, comps_page=None, comps_per_page=COMPS_PER_PAGE):
     """ Returns user competition history in the following format:
-    dict[Event][dict[Competition][UserEventResults]] """
-
-    history = OrderedDict()
-    id_to_events = dict()
-
-    all_events = get_all_events_user_has_participated_in(user.id)
-    all_events = sort_events_by_global_sort_order(all_events)
-
-    # Iterate over all competitions checking for results for this user. Reverse the order of
-    # the comps so they are displayed in the user profile page with most recent comps first
-    all_comps = get_all_competitions_user_has_participated_in(user.id)
-    all_comps.reverse()
-
-    # Prepare a results history in the master history for each event the user has participated in
-    for event in all_events:
-        history[event] = OrderedDict()
-        id_to_events[event.id] = event
-
-    for comp in all_comps:
-        for results in get_all_complete_user_results_for_comp_and_user(comp.id, user.id,\
-                include_blacklisted=include_blacklisted):
-
-            event = id_to_events[results.CompetitionEvent.event_id]
-
-            if event.name == 'FMC':
-                solves_helper = list()
-                for i, solve in enumerate(results.solves):
-                    scramble = solve.Scramble.scramble
-                    solution = solve.fmc_explanation
-                    moves    = solve.get_friendly_time()
-                    solves_helper.append((scramble, solution, moves))
-                while len(solves_helper) < 5:
-                    solves_helper.append((None, None, None))
-            else:
-                # Split the times string into components, add to a list called `"solves_helper` which
-                # is used in the UI to show individual solves, and make sure the length == 5, filled
-                # with empty strings if necessary
-                solves_helper = results.times_string.split(', ')
-                while len(solves_helper) < 5:
-                    solves_helper.append('')
+    dict[Event][dict[Competition][UserEventResults]]
+
+    Events are in the global event sort order, and each event's competitions are ordered from most recent to oldest.
+    Optionally the history only covers a page of the competitions the user has participated in, where page 0 is the
+    `comps_per_page` most recent competitions. """
+
+    if comps_page is None:
+        all_results = get_all_complete_user_results_history_for_user(user.id)
+    else:
+        all_results = get_all_complete_user_results_history_for_user(user.id, comps_limit=comps_per_page,
+                                                                      comps_offset=comps_page * comps_per_page)
+
+    # Prepare a results history in the master history for each event the user has participated in, even if all of
+    # their results in it are blacklisted and won't be shown
+    all_events = {results.CompetitionEvent.Event.id: results.CompetitionEvent.Event for results in all_results}
+    history = OrderedDict((event, OrderedDict()) for event in sort_events_by_global_sort_order(list(all_events.values())))
+
+    # FMC results show every solve's scramble and solution, which are loaded for all of them at once afterwards
+    fmc_results = list()
+
+    # The results are already ordered with the most recent comps first, which is how they're displayed in the user
+    # profile page
+    for results in all_results:
+        if results.is_blacklisted and not include_blacklisted:
+            continue
+
+        event = results.CompetitionEvent.Event
+
+        if event.name == 'FMC':
+            fmc_results.append(results)
+        else:
+            # Split the times string into components, add to a list called `"solves_helper` which
+            # is used in the UI to show individual solves, and make sure the length == 5, filled
+            # with empty strings if necessary
+            solves_helper = results.times_string.split(', ')
+            while len(solves_helper) < 5:
+                solves_helper.append('')
             setattr(results, 'solves_helper', solves_helper)
 
-            # Store these UserEventResults for this Competition
-            history[event][comp] = results
+        # Store these UserEventResults for this Competition
+        history[event][results.CompetitionEvent.Competition] = results
+
+    fmc_solves = get_solves_and_scrambles_for_results(results.id for results in fmc_results)
+    for results in fmc_results:
+        solves_helper = list()
+        for solve, scramble in fmc_solves.get(results.id, list()):
+            solution = solve.fmc_explanation
+            moves    = solve.get_friendly_time()
+            solves_helper.append((scramble, solution, moves))
+        while len(solves_helper) < 5:
+            solves_helper.append((None, None, None))
+        setattr(results, 'solves_helper', solves_helper)
 
     return history
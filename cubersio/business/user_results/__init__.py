@@ -1,6 +1,9 @@
 """ A package for creating and managing user event results. """
 
+from cubersio.persistence.comp_event_leaderboards_manager import invalidate_comp_event_leaderboard
+from cubersio.persistence.comp_event_snapshots_manager import delete_comp_event_snapshot
 from cubersio.persistence.user_results_manager import bulk_save_event_results, get_results_for_comp_event
+from cubersio.persistence.user_stats_manager import add_to_user_stats
 from cubersio.util.sorting import sort_user_results_with_rankings
 
 # -------------------------------------------------------------------------------------------------
@@ -21,6 +24,9 @@ def set_medals_on_best_event_results(comp_events):
     for comp_event in comp_events:
         results = get_results_for_comp_event(comp_event.id)
 
+        # Remember each result's medals, so only the medals which change are applied to their users' stats
+        medals_before = {result.id: __get_medals(result) for result in results}
+
         # Simultaneously pull out the unblacklisted results, and ensure that blacklisted
         # results do not have any medals set.
         unblacklisted_results = list()
@@ -32,8 +38,7 @@ def set_medals_on_best_event_results(comp_events):
             else:
                 unblacklisted_results.append(result)
 
-        # Handle the case where nobody participated in an event. The Ranking(...) mechanism used
-        # in sort_user_results_with_rankings chokes on empty iterables.
+        # Handle the case where nobody participated in an event, there's nothing to rank or award.
         if not unblacklisted_results:
             print('Skipping {}, no results to process'.format(comp_event.Event.name))
             continue
@@ -56,5 +61,21 @@ def set_medals_on_best_event_results(comp_events):
             result.was_silver_medal = (ranking == silver_rank) and result.result != 'DNF'
             result.was_bronze_medal = (ranking == bronze_rank) and result.result != 'DNF'
 
-        # Save all event results with their updated medal flags
+        # Apply the medals which changed to their users' stats, which are saved along with the medal flags
+        for result in results:
+            medals_after = __get_medals(result)
+            if medals_after != medals_before[result.id]:
+                gold, silver, bronze = (int(after) - int(before)
+                                        for after, before in zip(medals_after, medals_before[result.id]))
+                add_to_user_stats(result.user_id, gold_count=gold, silver_count=silver, bronze_count=bronze)
+
+        # Save all event results with their updated medal flags, which show on the leaderboard
         bulk_save_event_results(results)
+        invalidate_comp_event_leaderboard(comp_event.id)
+        delete_comp_event_snapshot(comp_event.id)
+
+
+def __get_medals(result):
+    """ Returns which medals the results have, as a (gold, silver, bronze) tuple of bools. """
+
+    return (bool(result.was_gold_medal), bool(result.was_silver_medal), bool(result.was_bronze_medal))
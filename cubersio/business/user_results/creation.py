@@ -5,6 +5,7 @@ from sys import maxsize
 from cubersio.persistence.models import EventFormat
 from cubersio.util.times import convert_centiseconds_to_friendly_time
 from cubersio.util.events.mbld import MbldSolve
+from cubersio.util.ranks import to_sort_value
 from cubersio.business.user_results import DNF, DNS
 from cubersio.business.user_results.personal_bests import set_pb_flags
 from cubersio.business.user_results.blacklisting import take_blacklist_action_if_necessary
@@ -39,6 +40,7 @@ def process_event_results(results, comp_event, user):
 
     # If the results are not yet complete, go ahead and return now.
     if not results.is_complete:
+        __set_sort_values(results)
         return results
 
     # A couple of "is_<thisThing>" flags to facilitate some one-off logic
@@ -52,6 +54,7 @@ def process_event_results(results, comp_event, user):
 
     # Set the result (either best single, mean, or average) depending on event format
     results.result = __determine_event_result(results.single, results.average, event_format)
+    __set_sort_values(results)
 
     # Store the "times string" so we don't have to recalculate this again later.
     # It's fairly expensive, so doing this for every UserEventResults in the competition slows
@@ -102,6 +105,15 @@ def __set_single_and_average(user_event_results, expected_num_solves, event_form
         user_event_results.average = average
 
 
+def __set_sort_values(user_event_results):
+    """ Sets the integer sort values which mirror the single, average, and result, so the database can order results
+    by them. """
+
+    user_event_results.single_sort_value  = to_sort_value(user_event_results.single)
+    user_event_results.average_sort_value = to_sort_value(user_event_results.average)
+    user_event_results.result_sort_value  = to_sort_value(user_event_results.result)
+
+
 def __build_times_string(results, event_format, is_fmc, is_blind, is_mbld):
     """ Builds a list of individual times, with best and worst times in parentheses if appropriate
     for the given event format. """
@@ -1,10 +1,10 @@
 """ Stuff related to handling user PBs (personal bests) in user event results. """
 
 from cubersio.persistence.models import EventFormat, UserEventResults
-from cubersio.persistence.events_manager import get_event_format_for_event, get_events_name_id_mapping
-from cubersio.persistence.user_results_manager import get_pb_single_event_results_except_current_comp,\
-    bulk_save_event_results, get_pb_average_event_results_except_current_comp,\
-    get_all_complete_user_results_for_user_and_event
+from cubersio.persistence.events_manager import get_event_format_for_event, get_event_info_by_name
+from cubersio.persistence.user_results_manager import get_pb_sort_values_except_current_comp,\
+    bulk_save_event_results, get_all_complete_user_results_for_user_and_event
+from cubersio.persistence.user_site_rankings_manager import mark_event_site_rankings_dirty
 from cubersio.util.events.resources import EVENT_MBLD
 
 from cubersio.business.user_results import DNF
@@ -31,7 +31,7 @@ def set_pb_flags(user_id: int, event_result: UserEventResults, event_id: int, ev
 
     # PB average flag isn't valid for Bo1, so don't bother checking
     # PB average flag isn't valid for MBLD, so don't bother checking
-    if (event_format in EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK) or (event_id in [get_events_name_id_mapping()[EVENT_MBLD.name]]):
+    if (event_format in EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK) or (event_id == get_event_info_by_name(EVENT_MBLD.name).id):
         event_result.was_pb_average = False
     else:
         if pb_average == __DNF_AS_PB and __pb_representation(event_result.average) == pb_average:
@@ -49,13 +49,16 @@ def set_pb_flags(user_id: int, event_result: UserEventResults, event_id: int, ev
     return event_result
 
 
-def recalculate_user_pbs_for_event(user_id, event_id):
-    """ Recalculates PBs for all UserEventResults for the specified user and event. """
+def recalculate_user_pbs_for_event(user_id, event_id, mark_dirty=True):
+    """ Recalculates PBs for all UserEventResults for the specified user and event. Returns whether any of the latest
+    PB flags changed, and if so also marks the event's site rankings dirty unless `mark_dirty` is False. """
 
     # Get the user's event results for this event. If they don't have any, we can just bail
     results = get_all_complete_user_results_for_user_and_event(user_id, event_id)
     if not results:
-        return
+        return False
+
+    previous_flags = [(bool(r.is_latest_pb_single), bool(r.is_latest_pb_average)) for r in results]
 
     event_format = get_event_format_for_event(event_id)
 
@@ -115,6 +118,14 @@ def recalculate_user_pbs_for_event(user_id, event_id):
     # Save all the UserEventResults with the modified PB flags
     bulk_save_event_results(results)
 
+    # This is run when results are blacklisted or unblacklisted, so if that moved the user's latest PBs then the site
+    # rankings for this event are now stale
+    changed = previous_flags != [(bool(r.is_latest_pb_single), bool(r.is_latest_pb_average)) for r in results]
+    if changed and mark_dirty:
+        mark_event_site_rankings_dirty(event_id)
+
+    return changed
+
 # -------------------------------------------------------------------------------------------------
 # Functions and types below are not meant to be used directly; instead these are just dependencies
 # of the publicly-visible functions above.
@@ -150,12 +161,10 @@ def __get_pbs_for_user_and_event_excluding_latest(user_id, event_id):
     results for this comp, and the logic determining if this comp has a PB result doesn't include
     this comp itself. """
 
-    results_with_pb_singles = get_pb_single_event_results_except_current_comp(user_id, event_id)
-    singles = [__pb_representation(r.single) for r in results_with_pb_singles]
-    pb_single = min(singles) if singles else __NO_PB_YET
+    # The sort values use the same representations for DNFs and missing values as `__pb_representation`
+    pb_single, pb_average = get_pb_sort_values_except_current_comp(user_id, event_id)
 
-    results_with_pb_averages = get_pb_average_event_results_except_current_comp(user_id, event_id)
-    averages = [__pb_representation(r.average) for r in results_with_pb_averages]
-    pb_average = min(averages) if averages else __NO_PB_YET
+    pb_single = pb_single if pb_single is not None else __NO_PB_YET
+    pb_average = pb_average if pb_average is not None else __NO_PB_YET
 
     return pb_single, pb_average
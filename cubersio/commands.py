@@ -14,11 +14,15 @@ from cubersio.persistence.comp_manager import get_complete_competitions, get_all
 from cubersio.persistence.events_manager import get_all_events
 from cubersio.persistence.gift_code_manager import bulk_add_gift_codes
 from cubersio.persistence.user_results_manager import get_event_results_for_user, save_event_results
+from cubersio.persistence.user_stats_manager import rebuild_all_user_stats
+from cubersio.persistence.user_site_rankings_manager import mark_event_site_rankings_dirty
 from cubersio.persistence.user_manager import get_all_users, get_all_admins, set_user_as_admin,\
     unset_user_as_admin, UserDoesNotExistException, get_user_by_username,\
     update_or_create_user_for_reddit
 from cubersio.business.user_results import set_medals_on_best_event_results
 from cubersio.business.user_results.creation import process_event_results
+from cubersio.business.rankings import RANKINGS_ENGINE_PYTHON, RANKINGS_ENGINE_SQL
+from cubersio.business.competition.snapshots import snapshot_competition
 from cubersio.tasks.competition_management import post_results_thread_task,\
     generate_new_competition_task, wrap_weekly_competition, run_user_site_rankings, update_pbs
 from cubersio.tasks.scramble_generation import check_scramble_pool
@@ -83,10 +87,16 @@ def generate_new_comp_only(all_events, title):
 
 
 @app.cli.command()
-def calculate_all_user_site_rankings():
-    """ Calculates UserSiteRankings for all users as of the current comp. """
+@click.option('--incremental', is_flag=True, default=False)
+@click.option('--workers', '-w', type=int, default=None)
+@click.option('--streaming/--no-streaming', default=None)
+@click.option('--engine', '-e', type=click.Choice([RANKINGS_ENGINE_PYTHON, RANKINGS_ENGINE_SQL]), default=None)
+def calculate_all_user_site_rankings(incremental, workers, streaming, engine):
+    """ Calculates UserSiteRankings for all users as of the current comp, optionally only recalculating the events
+    which have changed since the last calculation, spreading the calculation across several worker processes,
+    calculating in the bounded-memory streaming mode, or having the database do the ranking. """
 
-    run_user_site_rankings()
+    run_user_site_rankings(incremental=incremental, worker_count=workers, streaming=streaming, engine=engine)
 
 
 @app.cli.command()
@@ -151,11 +161,17 @@ def recalculate_pbs():
     user_count = len(all_users)
 
     all_events = get_all_events()
+    changed_event_ids = set()
 
     for i, user in enumerate(all_users):
         print("Recalculating PBs for {} ({}/{})".format(user.username, i + 1, user_count))
         for event in all_events:
-            recalculate_user_pbs_for_event(user.id, event.id)
+            if recalculate_user_pbs_for_event(user.id, event.id, mark_dirty=False):
+                changed_event_ids.add(event.id)
+
+    # Mark each event whose latest PBs changed dirty just once, rather than once per user
+    for event_id in sorted(changed_event_ids):
+        mark_event_site_rankings_dirty(event_id)
 
 
 @app.cli.command()
@@ -188,6 +204,26 @@ def backfill_results_medals():
         print('\nBackfilling for comp {} ({}/{})'.format(comp.id, i + 1, total_num))
         set_medals_on_best_event_results(get_all_comp_events_for_comp(comp.id))
 
+
+@app.cli.command()
+@click.option('--comp_id', '-i', type=int, default=None)
+def backfill_comp_snapshots(comp_id):
+    """ Utility command to snapshot the leaderboards and overall points of a specific past competition, or of every
+    past competition if none is specified. """
+
+    all_comps = [get_competition(comp_id)] if comp_id else get_complete_competitions()
+    total_num = len(all_comps)
+    for i, comp in enumerate(all_comps):
+        print('Snapshotting comp {} ({}/{})'.format(comp.id, i + 1, total_num))
+        snapshot_competition(comp.id)
+
+
+@app.cli.command()
+def rebuild_user_stats():
+    """ Utility command to rebuild every user's stats from their results, in case they've drifted or are missing. """
+
+    print('Rebuilt stats for {} users'.format(rebuild_all_user_stats()))
+
 # -------------------------------------------------------------------------------------------------
 # Below are utility commands intended just for development use
 # -------------------------------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+""" Utility module for caching each competition event's leaderboard, so the leaderboards pages don't reload, rebuild, and
+re-rank every result in a competition event on every view. """
+
+from threading import Lock
+from typing import Any, Optional
+
+from sqlalchemy import func, select, update
+
+from cubersio import app, DB
+from cubersio.persistence.models import CompetitionEvent, UserEventResults
+from cubersio.util.cache import CacheBackend, LRUCacheBackend, NullCacheBackend, RedisCacheBackend,\
+    CACHE_BACKEND_MEMORY, CACHE_BACKEND_REDIS, CACHE_BACKEND_NONE
+
+# -------------------------------------------------------------------------------------------------
+
+# For retrieving the leaderboards cache settings from app config
+__KEY_COMP_LEADERBOARD_CACHE_BACKEND     = 'COMP_LEADERBOARD_CACHE_BACKEND'
+__KEY_COMP_LEADERBOARD_CACHE_MAX_ENTRIES = 'COMP_LEADERBOARD_CACHE_MAX_ENTRIES'
+__KEY_COMP_LEADERBOARD_CACHE_TTL_SECONDS = 'COMP_LEADERBOARD_CACHE_TTL_SECONDS'
+__KEY_REDIS_URL                          = 'REDIS_URL'
+
+# Namespaces the cache keys in Redis. Bump the version whenever the shape of a cached leaderboard changes, so entries
+# cached by a previous deploy are ignored rather than misread.
+__REDIS_KEY_PREFIX = 'cubersio:comp_event_leaderboard:v2:'
+
+# The cache backend, which is built from app config the first time it's needed
+__CACHE_BACKEND = None
+__CACHE_BACKEND_LOCK = Lock()
+
+# -------------------------------------------------------------------------------------------------
+
+def get_cached_comp_event_leaderboard(comp_event_id: int, leaderboard_version: int) -> Optional[Any]:
+    """ Returns the cached leaderboard for the specified version of the specified competition event's leaderboard, or
+    None if it isn't cached. """
+
+    return __get_cache_backend().get(__build_cache_key(comp_event_id, leaderboard_version))
+
+
+def cache_comp_event_leaderboard(comp_event_id: int, leaderboard_version: int, leaderboard: Any) -> None:
+    """ Caches the leaderboard for the specified competition event, as of the specified version of its leaderboard.
+    That's the version the competition event had before its results were read to build the leaderboard, so a
+    leaderboard built from results which changed while it was being built is cached under a version nobody reads
+    anymore. The leaderboard must be JSON-serializable, and mustn't be mutated afterwards. """
+
+    __get_cache_backend().set(__build_cache_key(comp_event_id, leaderboard_version), leaderboard)
+
+
+def invalidate_comp_event_leaderboard(comp_event_id: int) -> None:
+    """ Invalidates the cached leaderboard for the specified competition event, by bumping the version of its
+    leaderboard in the database. Every process reads the version before reading its cache, so this invalidates the
+    leaderboard everywhere, whichever cache backend is used. This must be called whenever any results in the
+    competition event change in a way that's visible on its leaderboard, after those changes are committed. """
+
+    DB.session.execute(update(CompetitionEvent).
+                       where(CompetitionEvent.id == comp_event_id).
+                       values(leaderboard_version=func.coalesce(CompetitionEvent.leaderboard_version, 0) + 1))
+    DB.session.commit()
+
+
+def invalidate_comp_event_leaderboards_for_user(user_id: int) -> None:
+    """ Invalidates the cached leaderboards of every competition event the specified user has results in, the same way
+    as `invalidate_comp_event_leaderboard`, for when something about the user which is shown on those leaderboards
+    changes. """
+
+    comp_event_ids = select(UserEventResults.comp_event_id).\
+        where(UserEventResults.user_id == user_id)
+
+    DB.session.execute(update(CompetitionEvent).
+                       where(CompetitionEvent.id.in_(comp_event_ids)).
+                       values(leaderboard_version=func.coalesce(CompetitionEvent.leaderboard_version, 0) + 1))
+    DB.session.commit()
+
+
+def set_comp_event_leaderboards_cache_backend(backend: Optional[CacheBackend]) -> None:
+    """ Replaces the cache backend, for example with a local stand-in in tests. If `backend` is None, the backend is
+    rebuilt from app config the next time it's needed. """
+
+    global __CACHE_BACKEND
+    with __CACHE_BACKEND_LOCK:
+        __CACHE_BACKEND = backend
+
+
+def __build_cache_key(comp_event_id: int, leaderboard_version: int) -> str:
+    """ Builds the cache key for a version of a competition event's leaderboard. """
+
+    return f'{comp_event_id}:{leaderboard_version}'
+
+
+def __get_cache_backend() -> CacheBackend:
+    """ Returns the cache backend, building it from app config if it hasn't been built yet. """
+
+    global __CACHE_BACKEND
+    if __CACHE_BACKEND is None:
+        with __CACHE_BACKEND_LOCK:
+            if __CACHE_BACKEND is None:
+                __CACHE_BACKEND = __build_cache_backend()
+
+    return __CACHE_BACKEND
+
+
+def __build_cache_backend() -> CacheBackend:
+    """ Builds the cache backend specified by app config. """
+
+    backend = app.config[__KEY_COMP_LEADERBOARD_CACHE_BACKEND]
+    ttl_seconds = app.config[__KEY_COMP_LEADERBOARD_CACHE_TTL_SECONDS]
+
+    if backend == CACHE_BACKEND_NONE:
+        return NullCacheBackend()
+
+    if backend == CACHE_BACKEND_REDIS:
+        redis_url = app.config[__KEY_REDIS_URL]
+        if redis_url:
+            # Redis is only required when it's actually used as the cache backend
+            from redis import Redis
+            return RedisCacheBackend(Redis.from_url(redis_url), __REDIS_KEY_PREFIX, ttl_seconds)
+
+        print('[CACHE] No REDIS_URL is set, falling back to an in-memory competition event leaderboards cache')
+
+    elif backend != CACHE_BACKEND_MEMORY:
+        print(f'[CACHE] Unknown competition event leaderboards cache backend "{backend}", using an in-memory cache')
+
+    return LRUCacheBackend(app.config[__KEY_COMP_LEADERBOARD_CACHE_MAX_ENTRIES], ttl_seconds)
@@ -0,0 +1,66 @@
+""" Utility module for persisting and retrieving the frozen leaderboard snapshots of competition events whose
+competitions are over. """
+
+from datetime import datetime
+import json
+from typing import Any, Optional
+import zlib
+
+from sqlalchemy import delete, insert, select
+
+from cubersio import DB
+from cubersio.persistence.models import CompEventSnapshot, UserEventResults
+
+# -------------------------------------------------------------------------------------------------
+
+# Snapshots are written once and read many times, so it's worth compressing them as much as possible
+__COMPRESSION_LEVEL = 9
+
+# -------------------------------------------------------------------------------------------------
+
+def get_comp_event_snapshot(comp_event_id: int) -> Optional[Any]:
+    """ Returns the snapshot of the leaderboard for the specified competition event, or None if there isn't one. """
+
+    query = select(CompEventSnapshot.leaderboard).\
+        where(CompEventSnapshot.comp_event_id == comp_event_id)
+
+    compressed = DB.session.connection().execute(query).scalar()
+    if compressed is None:
+        return None
+
+    return json.loads(zlib.decompress(compressed))
+
+
+def save_comp_event_snapshot(comp_event_id: int, leaderboard: Any) -> None:
+    """ Saves a snapshot of the leaderboard for the specified competition event, replacing any existing snapshot. The
+    leaderboard must be JSON-serializable. """
+
+    compressed = zlib.compress(json.dumps(leaderboard).encode('utf-8'), __COMPRESSION_LEVEL)
+
+    DB.session.execute(delete(CompEventSnapshot).where(CompEventSnapshot.comp_event_id == comp_event_id))
+    DB.session.execute(insert(CompEventSnapshot.__table__), [{
+        'comp_event_id': comp_event_id,
+        'leaderboard':   compressed,
+        'created':       datetime.utcnow(),
+    }])
+
+    DB.session.commit()
+
+
+def delete_comp_event_snapshot(comp_event_id: int) -> None:
+    """ Deletes the snapshot of the leaderboard for the specified competition event, if there is one. This must be
+    called whenever any results in the competition event change in a way that's visible on its leaderboard. """
+
+    DB.session.execute(delete(CompEventSnapshot).where(CompEventSnapshot.comp_event_id == comp_event_id))
+    DB.session.commit()
+
+
+def delete_comp_event_snapshots_for_user(user_id: int) -> None:
+    """ Deletes the snapshots of the leaderboards of every competition event the specified user has results in, for
+    when something about the user which is shown on those leaderboards changes. """
+
+    comp_event_ids = select(UserEventResults.comp_event_id).\
+        where(UserEventResults.user_id == user_id)
+
+    DB.session.execute(delete(CompEventSnapshot).where(CompEventSnapshot.comp_event_id.in_(comp_event_ids)))
+    DB.session.commit()
@@ -4,6 +4,7 @@ to Competitions. """
 from datetime import datetime
 from functools import lru_cache
 from random import choice
+from typing import Optional
 
 from sqlalchemy.orm import joinedload
 
@@ -184,6 +185,26 @@ def get_all_competitions_user_has_participated_in(user_id):
         all()
 
 
+def get_competition_overall_points(comp_id) -> Optional[str]:
+    """ Returns the cached overall points standings JSON for the specified competition, or None if it isn't cached. """
+
+    return DB.session.\
+        query(Competition.overall_points).\
+        filter(Competition.id == comp_id).\
+        scalar()
+
+
+def save_competition_overall_points(comp_id, overall_points: Optional[str]):
+    """ Caches the overall points standings JSON for the specified competition. Saving None clears the cache. """
+
+    DB.session.\
+        query(Competition).\
+        filter(Competition.id == comp_id).\
+        update({Competition.overall_points: overall_points}, synchronize_session=False)
+
+    DB.session.commit()
+
+
 def save_competition(competition):
     """ Save a modified competition object. """
 
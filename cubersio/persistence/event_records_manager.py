@@ -0,0 +1,58 @@
+""" Utility module for persisting and retrieving the materialized EventRecords for each event. """
+
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import delete, insert, select
+
+from cubersio import DB
+from cubersio.persistence.models import EventRecord, EventSiteRankingsState, User, Competition
+
+
+def get_event_records_for_event(event_id: int, is_average: bool):
+    """ Retrieves the materialized PB singles (or averages, if `is_average` is set) for the specified event, in ranked
+    order. Each row is a tuple of (user_id, personal_best, comp_id, comp_title, username, comment, user_is_verified,
+    rank). """
+
+    # This is executed directly on the connection rather than through the ORM, since these lists can be long and
+    # building ORM rows for them is most of the cost of reading them
+    query = select(EventRecord.user_id, EventRecord.personal_best, EventRecord.comp_id, Competition.title,
+                   User.username, EventRecord.comment, User.is_verified, EventRecord.rank).\
+        join(User, EventRecord.user_id == User.id).\
+        join(Competition, EventRecord.comp_id == Competition.id).\
+        where(EventRecord.event_id == event_id).\
+        where(EventRecord.is_average == is_average).\
+        order_by(EventRecord.position)
+
+    return DB.session.connection().execute(query).all()
+
+
+def replace_event_records(event_id: int, rows: List[Dict], refreshed_timestamp: datetime) -> bool:
+    """ Replaces all of the materialized EventRecords for the specified event with the supplied rows, and records that
+    the event's records were refreshed as of the specified timestamp, all in a single transaction. Refreshes of the same
+    event are serialized by locking its EventSiteRankingsState row first. If another refresh which started at or after
+    `refreshed_timestamp` already finished, its newer records are kept. Returns whether the records were replaced. """
+
+    state = DB.session.\
+        query(EventSiteRankingsState).\
+        filter(EventSiteRankingsState.event_id == event_id).\
+        with_for_update().\
+        populate_existing().\
+        first()
+
+    if not state:
+        state = EventSiteRankingsState(event_id=event_id)
+        DB.session.add(state)
+
+    elif state.records_refreshed and state.records_refreshed >= refreshed_timestamp:
+        DB.session.rollback()
+        return False
+
+    DB.session.execute(delete(EventRecord).where(EventRecord.event_id == event_id))
+    if rows:
+        DB.session.execute(insert(EventRecord.__table__), rows)
+
+    state.records_refreshed = refreshed_timestamp
+    DB.session.commit()
+
+    return True
@@ -1,13 +1,49 @@
 """ Utility module for persisting and retrieving Events, and information related to Events. """
 
 from collections import OrderedDict
-from functools import lru_cache
-from typing import List
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, select
 
 from cubersio import DB
 from cubersio.persistence.models import Event, CompetitionEvent, UserEventResults, ScramblePool
-from cubersio.util.events.resources import WCA_EVENTS, NON_WCA_EVENTS, BONUS_EVENTS
+from cubersio.util.events.resources import WCA_EVENTS, NON_WCA_EVENTS, BONUS_EVENTS, sort_events_by_global_sort_order
+
+# -------------------------------------------------------------------------------------------------
+
+class EventInfo(NamedTuple):
+    """ An immutable copy of an Event record, along with what kind of event it is and its position in the global event
+    sort order. Unlike an Event record, this can be shared by every request and stays usable outside of a session. """
+
+    id: int
+    name: str
+    totalSolves: int
+    description: Optional[str]
+    eventFormat: str
+    is_wca: bool
+    is_non_wca: bool
+    is_bonus: bool
+
+    # The event's index in the global event sort order, or None if it isn't in it
+    sort_order: Optional[int]
+
+
+class _EventCatalog(NamedTuple):
+    """ Every event, ordered by ID, and indexed by ID and by name. """
+
+    events: Tuple[EventInfo, ...]
+    by_id: Mapping[int, EventInfo]
+    by_name: Mapping[str, EventInfo]
+
+
+# The event catalog, which is loaded the first time it's needed. Events are only ever added or changed by migrations
+# and competition generation, so each process keeps its own until it's invalidated.
+__EVENT_CATALOG = None
+__EVENT_CATALOG_LOCK = Lock()
 
+# -------------------------------------------------------------------------------------------------
 
 def get_event_by_name(name):
     """ Returns an event by name. """
@@ -17,54 +53,64 @@ def get_event_by_name(name):
         first()
 
 
-def get_all_events() -> List[Event]:
-    """ Returns a list of all events. """
+def get_all_events() -> List[EventInfo]:
+    """ Returns a list of all events, ordered by ID. """
 
-    return DB.session.\
-        query(Event).\
-        order_by(Event.id).\
-        all()
+    return list(__get_event_catalog().events)
+
+
+def get_all_events_in_global_sort_order() -> List[EventInfo]:
+    """ Returns a list of all events in the global event sort order, leaving out any events which aren't in it. """
+
+    sorted_events = [e for e in __get_event_catalog().events if e.sort_order is not None]
+    return sorted(sorted_events, key=lambda e: e.sort_order)
+
+
+def get_event_info_by_name(name: str) -> Optional[EventInfo]:
+    """ Returns the event with the specified name, or None if there isn't one. """
+
+    return __get_event_catalog().by_name.get(name, None)
 
 
-@lru_cache()
 def get_event_format_for_event(event_id):
     """ Gets the event format for the specified event. """
 
-    return Event.query.\
-        filter(Event.id == event_id).\
-        first().\
-        eventFormat
+    return __get_event_catalog().by_id[event_id].eventFormat
 
 
 def get_all_WCA_events():
     """ Returns a list of all WCA events. """
 
-    wca_names = set(e.name for e in WCA_EVENTS)
-    return [e for e in get_all_events() if e.name in wca_names]
+    return [e for e in __get_event_catalog().events if e.is_wca]
 
 
 def get_all_non_WCA_events():
     """ Returns a list of all non-WCA events. """
 
-    non_wca_names = set(e.name for e in NON_WCA_EVENTS)
-    return [e for e in get_all_events() if e.name in non_wca_names]
+    return [e for e in __get_event_catalog().events if e.is_non_wca]
 
 
 def get_all_bonus_events():
     """ Returns a list of all bonus events. """
 
-    bonus_event_names = set(e.name for e in BONUS_EVENTS)
-    return [e for e in get_all_events() if e.name in bonus_event_names]
+    return [e for e in __get_event_catalog().events if e.is_bonus]
 
 
 def get_events_name_id_mapping():
     """ Returns a dictionary of event name to ID mappings. """
 
-    mapping = OrderedDict()
-    for event in get_all_events():
-        mapping[event.name] = event.id
+    return OrderedDict((e.name, e.id) for e in __get_event_catalog().events)
+
+
+def invalidate_event_catalog() -> None:
+    """ Discards this process' event catalog, along with the event names UserEventResults keeps for competition events,
+    so they're reloaded the next time they're needed. This must be called whenever events are added or changed. """
 
-    return mapping
+    global __EVENT_CATALOG
+    with __EVENT_CATALOG_LOCK:
+        __EVENT_CATALOG = None
+
+    UserEventResults.forget_event_names()
 
 
 def get_all_events_user_has_participated_in(user_id):
@@ -90,6 +136,16 @@ def retrieve_from_scramble_pool_for_event(event_id, num_scrambles):
         all()
 
 
+def get_scramble_pool_counts() -> Dict[int, int]:
+    """ Returns a map of event ID to the number of scrambles in the scramble pool for that event. Events without any
+    scrambles in the pool are omitted. """
+
+    query = select(ScramblePool.event_id, func.count(ScramblePool.id)).\
+        group_by(ScramblePool.event_id)
+
+    return dict(DB.session.connection().execute(query).all())
+
+
 def delete_from_scramble_pool(scrambles):
     """ Deletes the specified scrambles from the scramble pool. """
 
@@ -104,3 +160,41 @@ def add_scramble_to_scramble_pool(scramble: str, event_id: int) -> None:
 
     DB.session.add(ScramblePool(scramble=scramble, event_id=event_id))
     DB.session.commit()
+
+# -------------------------------------------------------------------------------------------------
+
+def __get_event_catalog() -> _EventCatalog:
+    """ Returns the event catalog, loading it if it hasn't been loaded yet. """
+
+    global __EVENT_CATALOG
+    with __EVENT_CATALOG_LOCK:
+        if __EVENT_CATALOG is None:
+            __EVENT_CATALOG = __load_event_catalog()
+        return __EVENT_CATALOG
+
+
+def __load_event_catalog() -> _EventCatalog:
+    """ Loads every event in a single query, and builds the event catalog from them. """
+
+    query = select(Event.id, Event.name, Event.totalSolves, Event.description, Event.eventFormat).\
+        order_by(Event.id)
+    rows = DB.session.connection().execute(query).all()
+
+    wca_names = set(e.name for e in WCA_EVENTS)
+    non_wca_names = set(e.name for e in NON_WCA_EVENTS)
+    bonus_names = set(e.name for e in BONUS_EVENTS)
+    sort_orders = {row.name: i for i, row in enumerate(sort_events_by_global_sort_order(rows))}
+
+    events = tuple(EventInfo(id=row.id,
+                             name=row.name,
+                             totalSolves=row.totalSolves,
+                             description=row.description,
+                             eventFormat=row.eventFormat,
+                             is_wca=row.name in wca_names,
+                             is_non_wca=row.name in non_wca_names,
+                             is_bonus=row.name in bonus_names,
+                             sort_order=sort_orders.get(row.name, None)) for row in rows)
+
+    return _EventCatalog(events=events,
+                         by_id=MappingProxyType({e.id: e for e in events}),
+                         by_name=MappingProxyType({e.name: e for e in events}))
@@ -4,7 +4,8 @@ from collections import namedtuple
 import json
 
 from flask_login import LoginManager, UserMixin, AnonymousUserMixin
-from sqlalchemy.orm import relationship, reconstructor
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import deferred, relationship
 
 from cubersio import DB, app
 from cubersio.util.times import convert_centiseconds_to_friendly_time
@@ -39,6 +40,8 @@ Boolean    = DB.Boolean
 Integer    = DB.Integer
 DateTime   = DB.DateTime
 ForeignKey = DB.ForeignKey
+BigInteger = DB.BigInteger
+LargeBinary = DB.LargeBinary
 
 class EventFormat():
     """ Competition event formats: Average of 5, Mean of 3, Best of 3, Best of 1. """
@@ -70,6 +73,11 @@ class User(UserMixin, Model):
     results          = relationship("UserEventResults", backref="User")
 
 
+# Profile links look users up by username case-insensitively, so usernames are indexed that way too. Both SQLite and
+# Postgres support indexes on expressions, and use this one for any query filtering on lower(username).
+DB.Index('ix_users_username_lower', func.lower(User.username))
+
+
 class Nobody(AnonymousUserMixin):
     """ Utility class for an anonymous user. Subclasses Flask-Login AnonymousUserMixin to provide the
     default behavior given to non-logged-in users, but also evaluates to false in a boolean context,
@@ -115,7 +123,7 @@ class ScramblePool(Model):
 
     __tablename__ = 'scramble_pool'
     id            = Column(Integer, primary_key=True)
-    event_id      = Column(Integer, ForeignKey('events.id'))
+    event_id      = Column(Integer, ForeignKey('events.id'), index=True)
     scramble      = Column(Text())
     event         = relationship("Event", backref="scramble_pool")
 
@@ -149,6 +157,19 @@ class UserEventResults(Model):
     centiseconds (ex: "1234" = 12.34s), 10x units for FMC (ex: "2833" = 28.33 moves) or "DNF". """
 
     __tablename__        = 'user_event_results'
+    __table_args__       = (
+        DB.Index('ix_user_event_results_comp_event_result_sort', 'comp_event_id', 'result_sort_value',
+                 'single_sort_value'),
+        DB.Index('ix_user_event_results_comp_event_single_sort', 'comp_event_id', 'single_sort_value'),
+        DB.Index('ix_user_event_results_user_comp_event', 'user_id', 'comp_event_id'),
+        # Only a user's latest PBs are indexed for the PB lookups, which is a tiny fraction of all results. The index
+        # predicates are spelled out per-dialect so they match how each dialect renders the queries' boolean filters.
+        DB.Index('ix_user_event_results_latest_pb_single', 'comp_event_id', 'user_id',
+                 sqlite_where=text('is_latest_pb_single = 1'), postgresql_where=text('is_latest_pb_single')),
+        DB.Index('ix_user_event_results_latest_pb_average', 'comp_event_id', 'user_id',
+                 sqlite_where=text('is_latest_pb_average = 1'), postgresql_where=text('is_latest_pb_average')),
+    )
+
     id                   = Column(Integer, primary_key=True)
     user_id              = Column(Integer, ForeignKey('users.id'))
     comp_event_id        = Column(Integer, ForeignKey('competition_event.id'), index=True)
@@ -170,16 +191,76 @@ class UserEventResults(Model):
     was_silver_medal     = Column(Boolean)
     was_bronze_medal     = Column(Boolean)
 
-    @reconstructor
-    def init_on_load(self):
-        """ Determine on load if these results are for FMC, or for a blind event, to facilitate
-        getting user-friendly representations of individual solve times and overall result, single
-        or average. """
+    # Integer sort values mirroring `single`, `average`, and `result`, so results can be ordered by the database. A lower
+    # value is always a better result, with DNFs and missing values replaced by the sentinels from `cubersio.util.ranks`.
+    # Coded MBLD results already sort by points (and then time) this way, so they're used as-is.
+    single_sort_value    = Column(BigInteger)
+    average_sort_value   = Column(BigInteger)
+    result_sort_value    = Column(BigInteger)
+
+    # The name of the event each competition event is for, by competition event ID. A competition event never changes
+    # which event it's for, so this is shared by every UserEventResults in this process. That way using results doesn't
+    # also lazily load each of their CompetitionEvents and Events. It's filled in a competition at a time as results are
+    # used, and cleared along with the event catalog.
+    __event_names_by_comp_event_id = dict()
+
+    @property
+    def is_fmc(self):
+        """ Whether these results are for FMC, to facilitate getting user-friendly representations of individual solve
+        times and overall result, single or average. """
+
+        return UserEventResults.__get_event_name(self.comp_event_id) == 'FMC'
+
+
+    @property
+    def is_blind(self):
+        """ Whether these results are for a blind event. """
+
+        return UserEventResults.__get_event_name(self.comp_event_id) in ('2BLD', '3BLD', '4BLD', '5BLD')
+
+
+    @property
+    def is_mbld(self):
+        """ Whether these results are for MBLD. """
+
+        return UserEventResults.__get_event_name(self.comp_event_id) == 'MBLD'
+
+
+    @classmethod
+    def forget_event_names(cls):
+        """ Discards the event name of every competition event, so they're looked up again the next time they're
+        needed. """
 
-        event_name = self.CompetitionEvent.Event.name
-        self.is_fmc   = event_name == 'FMC'
-        self.is_blind = event_name in ('2BLD', '3BLD', '4BLD', '5BLD')
-        self.is_mbld  = event_name == 'MBLD'
+        cls.__event_names_by_comp_event_id.clear()
+
+
+    @classmethod
+    def __get_event_name(cls, comp_event_id):
+        """ Returns the name of the event the specified competition event is for, or None if there's no such competition
+        event. This is looked up the first time results' event flags are used rather than while they're being loaded, so
+        it doesn't query the database in the middle of loading them. On a miss, every competition event in the same
+        competition is loaded along with the missing one in a single query, since results are usually used a
+        competition at a time. Competition events which don't exist aren't remembered. """
+
+        if comp_event_id is None:
+            return None
+
+        event_names = cls.__event_names_by_comp_event_id
+        event_name = event_names.get(comp_event_id)
+        if event_name is None:
+            comp_id = select(CompetitionEvent.competition_id).\
+                where(CompetitionEvent.id == comp_event_id).\
+                scalar_subquery()
+
+            query = select(CompetitionEvent.id, Event.name).\
+                join(Event, CompetitionEvent.event_id == Event.id).\
+                where(CompetitionEvent.competition_id == comp_id)
+
+            comp_event_names = dict(DB.session.connection().execute(query).all())
+            event_names.update(comp_event_names)
+            event_name = comp_event_names.get(comp_event_id)
+
+        return event_name
 
 
     def set_solves(self, incoming_solves):
@@ -230,16 +311,18 @@ class UserEventResults(Model):
 
 class CompetitionEvent(Model):
     """ Associative model for an event held at a competition - FKs to the competition and event,
-    and a JSON array of scrambles. """
+    and a JSON array of scrambles. The leaderboard version is bumped whenever the results change in
+    a way that shows on the competition event's leaderboard, so cached leaderboards are keyed by it. """
 
-    __tablename__  = 'competition_event'
-    id             = Column(Integer, primary_key=True)
-    competition_id = Column(Integer, ForeignKey('competitions.id'), index=True)
-    event_id       = Column(Integer, ForeignKey('events.id'), index=True)
-    scrambles      = relationship('Scramble', backref='CompetitionEvent',
-                                  primaryjoin=id == Scramble.competition_event_id, order_by=lambda: Scramble.id)
-    user_results   = relationship('UserEventResults', backref='CompetitionEvent',
-                                  primaryjoin=id == UserEventResults.comp_event_id)
+    __tablename__       = 'competition_event'
+    id                  = Column(Integer, primary_key=True)
+    competition_id      = Column(Integer, ForeignKey('competitions.id'), index=True)
+    event_id            = Column(Integer, ForeignKey('events.id'), index=True)
+    leaderboard_version = Column(Integer, default=0)
+    scrambles           = relationship('Scramble', backref='CompetitionEvent',
+                                       primaryjoin=id == Scramble.competition_event_id, order_by=lambda: Scramble.id)
+    user_results        = relationship('UserEventResults', backref='CompetitionEvent',
+                                       primaryjoin=id == UserEventResults.comp_event_id)
 
     def to_front_end_consolidated_dict(self):
         """ Returns a dictionary representation of this object for use in the front-end.
@@ -271,6 +354,22 @@ class Competition(Model):
     events           = relationship('CompetitionEvent', backref='Competition',
                                     primaryjoin=id == CompetitionEvent.competition_id)
 
+    # The overall points standings, cached as JSON once the competition is over. This is deferred since it's large, and
+    # only needed for the overall points leaderboard.
+    overall_points   = deferred(Column(Text))
+
+
+class CompEventSnapshot(Model):
+    """ A frozen snapshot of a competition event's leaderboard, taken once its competition is over, so the leaderboards
+    of old competitions can be served without reloading and re-ranking their results. The leaderboard is held as
+    zlib-compressed JSON. """
+
+    __tablename__ = 'comp_event_snapshot'
+    id            = Column(Integer, primary_key=True)
+    comp_event_id = Column(Integer, ForeignKey('competition_event.id'), index=True, unique=True)
+    leaderboard   = Column(LargeBinary)
+    created       = Column(DateTime)
+
 
 class CompetitionGenResources(Model):
     """ A record for maintaining the current state of the competition generation. """
@@ -286,25 +385,41 @@ class CompetitionGenResources(Model):
     title_override      = Column(String(128))
 
 
+class UserStats(Model):
+    """ A record of a user's overall stats across every competition: their medal counts, and how many solves, competitions,
+    and events they've completed. These are kept up to date as the user's results are saved or deleted, and as medals
+    are awarded, so they don't need to be counted from the user's results every time they're shown. """
+
+    __tablename__ = 'user_stats'
+    id            = Column(Integer, primary_key=True)
+    user_id       = Column(Integer, ForeignKey('users.id'), index=True, unique=True)
+    gold_count    = Column(Integer, default=0)
+    silver_count  = Column(Integer, default=0)
+    bronze_count  = Column(Integer, default=0)
+    solves_count  = Column(Integer, default=0)
+    comps_count   = Column(Integer, default=0)
+    events_count  = Column(Integer, default=0)
+
+
 class UserSiteRankings(Model):
     """ A record for holding pre-calculated user PB single and averages, and site rankings,
     for each event they have participated in."""
 
     __tablename__  = 'user_site_rankings'
     id                  = Column(Integer, primary_key=True)
-    user_id             = Column(Integer, ForeignKey('users.id'), index=True)
+    user_id             = Column(Integer, ForeignKey('users.id'), index=True, unique=True)
     user                = relationship('User', primaryjoin=user_id == User.id)
     data                = Column(String(2048))
     timestamp           = Column(DateTime)
-    sum_all_single      = Column(Integer)
-    sum_all_average     = Column(Integer)
-    sum_wca_single      = Column(Integer)
-    sum_wca_average     = Column(Integer)
-    sum_non_wca_single  = Column(Integer)
-    sum_non_wca_average = Column(Integer)
-    wca_kinchrank       = Column(Float)
-    non_wca_kinchrank   = Column(Float)
-    all_kinchrank       = Column(Float)
+    sum_all_single      = Column(Integer, index=True)
+    sum_all_average     = Column(Integer, index=True)
+    sum_wca_single      = Column(Integer, index=True)
+    sum_wca_average     = Column(Integer, index=True)
+    sum_non_wca_single  = Column(Integer, index=True)
+    sum_non_wca_average = Column(Integer, index=True)
+    wca_kinchrank       = Column(Float, index=True)
+    non_wca_kinchrank   = Column(Float, index=True)
+    all_kinchrank       = Column(Float, index=True)
 
     # Save the data as a dict so we don't have to deserialize it every time it's
     # retrieved for the same object
@@ -376,6 +491,94 @@ class UserSiteRankings(Model):
             display=format(self.non_wca_kinchrank, '.3f'))
 
 
+class UserEventSiteRanking(Model):
+    """ A user's PB single and average, the site rankings for those PBs, and Kinchrank component for one event. This is
+    the same per-event data held serialized in UserSiteRankings.data, but stored one row per user and event so that
+    a single event's rankings can be updated or queried without touching the rest. """
+
+    __tablename__  = 'user_event_site_ranking'
+    __table_args__ = (
+        DB.UniqueConstraint('user_id', 'event_id', name='unique_user_event_site_ranking'),
+        DB.Index('ix_user_event_site_ranking_event_single_rank', 'event_id', 'single_rank'),
+        DB.Index('ix_user_event_site_ranking_event_average_rank', 'event_id', 'average_rank'),
+    )
+
+    id           = Column(Integer, primary_key=True)
+    user_id      = Column(Integer, ForeignKey('users.id'), index=True)
+    user         = relationship('User', primaryjoin=user_id == User.id)
+    event_id     = Column(Integer, ForeignKey('events.id'))
+    pb_single    = Column(String(10))
+    single_rank  = Column(Integer)
+    pb_average   = Column(String(10))
+    average_rank = Column(Integer)
+    kinchrank    = Column(Float)
+
+    def as_site_rankings_tuple(self):
+        """ Returns this event's rankings in the same form as the values in UserSiteRankings.get_site_rankings_and_pbs,
+        (pb_single, single_rank, pb_average, average_rank, kinchrank). """
+
+        return (self.pb_single, self.single_rank, self.pb_average, self.average_rank, format(self.kinchrank, '.3f'))
+
+
+class EventSiteRankingsState(Model):
+    """ A record for tracking, per event, when the PB data feeding the site rankings last changed and when the site
+    rankings for that event were last calculated. An event whose PBs changed after its last calculation (or which has
+    never been calculated) is "dirty", and is recalculated by an incremental site rankings run. Also holds the number
+    of people with PB singles and averages as of the last calculation, which is needed to rank users who don't have
+    results in the event without reloading the event's PBs, and when the event's materialized EventRecords were last
+    refreshed, since those go stale the same way. """
+
+    __tablename__     = 'event_site_rankings_state'
+    id                = Column(Integer, primary_key=True)
+    event_id          = Column(Integer, ForeignKey('events.id'), index=True, unique=True)
+    last_changed      = Column(DateTime)
+    last_calculated   = Column(DateTime)
+    singles_count     = Column(Integer)
+    averages_count    = Column(Integer)
+    records_refreshed = Column(DateTime)
+
+    @property
+    def is_dirty(self):
+        """ Returns whether this event's site rankings need to be recalculated. """
+
+        if not self.last_calculated:
+            return True
+
+        return bool(self.last_changed) and self.last_changed >= self.last_calculated
+
+    @property
+    def records_are_stale(self):
+        """ Returns whether this event's materialized EventRecords need to be refreshed. """
+
+        if not self.records_refreshed:
+            return True
+
+        return bool(self.last_changed) and self.last_changed >= self.records_refreshed
+
+
+class EventRecord(Model):
+    """ One entry in an event's records leaderboard: a user's latest non-blacklisted PB single or average for the event,
+    where it was set, and its rank. This materializes the ordered PB singles and averages for an event, so the event
+    records page and its CSV export can be read in order without sorting and ranking every PB on each view. The
+    username, verification status, and competition title are joined in when read, so they never go stale. Each position
+    in an event's singles or averages can only be held once. """
+
+    __tablename__  = 'event_record'
+    __table_args__ = (
+        DB.Index('ix_event_record_event_average_position', 'event_id', 'is_average', 'position', unique=True),
+    )
+
+    id            = Column(Integer, primary_key=True)
+    event_id      = Column(Integer, ForeignKey('events.id'))
+    is_average    = Column(Boolean, default=False)
+    position      = Column(Integer)
+    rank          = Column(Integer)
+    user_id       = Column(Integer, ForeignKey('users.id'))
+    comp_id       = Column(Integer, ForeignKey('competitions.id'))
+    personal_best = Column(String(10))
+    comment       = Column(Text)
+
+
 class UserSolve(Model):
     """ A user's solve for a specific scramble, in a specific event, at a competition.
     Solve times are in centiseconds (ex: 1234 = 12.34s)."""
@@ -383,6 +586,8 @@ class UserSolve(Model):
     __tablename__  = 'user_solves'
     __table_args__ = (
         DB.UniqueConstraint('scramble_id', 'user_event_results_id', name='unique_scramble_user_results'),
+        # The unique constraint leads with the scramble, so it's no help when loading a result's solves
+        DB.Index('ix_user_solves_user_event_results_scramble', 'user_event_results_id', 'scramble_id'),
     )
 
     id                    = Column(Integer, primary_key=True)
@@ -431,9 +636,14 @@ class UserSolve(Model):
 class UserSetting(Model):
     """ A user's preferences. """
 
-    __tablename__ = 'user_settings'
+    __tablename__  = 'user_settings'
+    __table_args__ = (
+        # Settings are always looked up by user and setting code together
+        DB.Index('ix_user_settings_user_setting_code', 'user_id', 'setting_code'),
+    )
+
     id            = Column(Integer, primary_key=True)
-    user_id       = Column(Integer, ForeignKey('users.id'), index=True)
+    user_id       = Column(Integer, ForeignKey('users.id'))
     user          = relationship('User', primaryjoin=user_id == User.id)
     setting_code  = Column(String(128), index=True)
     setting_value = Column(String(128), index=True)
@@ -1,8 +1,16 @@
 """ Utility module for persisting and retrieving users. """
 
-from sqlalchemy import func
+from bisect import bisect_left, insort
+from random import choice
+from threading import Lock
+from time import monotonic
+from typing import List, Optional
 
-from cubersio import DB
+from sqlalchemy import func, select
+
+from cubersio import app, DB
+from cubersio.persistence.comp_event_leaderboards_manager import invalidate_comp_event_leaderboards_for_user
+from cubersio.persistence.comp_event_snapshots_manager import delete_comp_event_snapshots_for_user
 from cubersio.persistence.models import User, UserEventResults
 
 # -------------------------------------------------------------------------------------------------
@@ -19,23 +27,92 @@ class UserDoesNotExistException(Exception):
 
 # -------------------------------------------------------------------------------------------------
 
+__KEY_USERNAME_INDEX_TTL_SECONDS = 'USERNAME_INDEX_TTL_SECONDS'
+
+
+class _UsernameIndex:
+    """ The usernames of every active user, sorted case-insensitively, so they can be searched by prefix. """
+
+    def __init__(self, users):
+        # Sorted (lowercase username, username) tuples, and the IDs of the users in them
+        self.entries = sorted((username.lower(), username) for _, username in users)
+        self.user_ids = set(user_id for user_id, _ in users)
+        self.built_at = monotonic()
+
+    def search(self, prefix: str, limit: int) -> List[str]:
+        """ Returns up to `limit` usernames which start with `prefix`, ignoring case, in sorted order. """
+
+        prefix = prefix.lower()
+        usernames = list()
+
+        i = bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(usernames) < limit and self.entries[i][0].startswith(prefix):
+            usernames.append(self.entries[i][1])
+            i += 1
+
+        return usernames
+
+    def add(self, user_id: int, username: str) -> None:
+        """ Adds the specified user's username to the index. """
+
+        insort(self.entries, (username.lower(), username))
+        self.user_ids.add(user_id)
+
+
+# The index of active users' usernames, which is built the first time it's needed and rebuilt once it's older than the
+# configured TTL. Users whose first results are saved in this process are added to it as that happens.
+__USERNAME_INDEX = None
+__USERNAME_INDEX_LOCK = Lock()
+
+# -------------------------------------------------------------------------------------------------
+
 def get_all_users():
     """ Get all users. """
 
     return User.query.all()
 
 
-def get_all_active_usernames():
-    """ Get all usernames for users with at least one UserEventResults. """
+def search_active_usernames(prefix: str, limit: int) -> List[str]:
+    """ Returns up to `limit` usernames of users with at least one UserEventResults which start with `prefix`, ignoring
+    case, in case-insensitive sorted order. """
 
-    # list of 1-tuples of usernames
-    usernames = User.query.with_entities(User.username).\
-        join(UserEventResults).\
-        filter(UserEventResults.is_blacklisted.isnot(True)).\
-        distinct(User.id).\
-        all()
+    username_index = __get_username_index()
+    with __USERNAME_INDEX_LOCK:
+        return username_index.search(prefix, limit)
+
+
+def get_random_active_username() -> Optional[str]:
+    """ Returns the username of a random user with at least one UserEventResults, or None if there aren't any. """
+
+    username_index = __get_username_index()
+    with __USERNAME_INDEX_LOCK:
+        return choice(username_index.entries)[1] if username_index.entries else None
+
+
+def add_user_to_username_index(user_id: int) -> None:
+    """ Adds the specified user to the index of active users' usernames, if they aren't in it already. This should be
+    called whenever a user might have become active, like when their results are saved. """
 
-    return sorted([r[0] for r in usernames])
+    with __USERNAME_INDEX_LOCK:
+        username_index = __USERNAME_INDEX
+        if username_index is None or user_id in username_index.user_ids:
+            return
+
+    user = get_user_by_id(user_id)
+    if not user:
+        return
+
+    with __USERNAME_INDEX_LOCK:
+        if user_id not in username_index.user_ids:
+            username_index.add(user_id, user.username)
+
+
+def invalidate_username_index() -> None:
+    """ Discards this process' index of active users' usernames, so it's rebuilt the next time it's needed. """
+
+    global __USERNAME_INDEX
+    with __USERNAME_INDEX_LOCK:
+        __USERNAME_INDEX = None
 
 
 def get_user_count():
@@ -112,16 +189,13 @@ def get_user_by_username(username):
 
 def get_user_by_username_case_insensitive(username):
     """ Case-insensitive query to return the user with this username, or else `None` if no such
-    user exists. """
-
-    # Let's try regular query first, assuming the username is cased correctly, so we're making
-    # use of the fact the username column is indexed
-    user = get_user_by_username(username)
-    if user:
-        return user
+    user exists. If several usernames only differ by case, the one cased exactly like this is preferred. """
 
-    # otherwise let's fall back on the case-insensitive query
-    return User.query.filter(func.lower(User.username) == func.lower(username)).first()
+    # This filters on the same expression as the lowercase username index, so it's an index lookup
+    return User.query.\
+        filter(func.lower(User.username) == func.lower(username)).\
+        order_by((User.username == username).desc()).\
+        first()
 
 
 def get_user_by_reddit_id(reddit_id):
@@ -201,6 +275,11 @@ def verify_user(user_id):
     DB.session.add(user)
     DB.session.commit()
 
+    # Verification status shows on the leaderboards, so the user's cached leaderboards and the snapshots of their old
+    # leaderboards are stale now
+    delete_comp_event_snapshots_for_user(user_id)
+    invalidate_comp_event_leaderboards_for_user(user_id)
+
 
 def unverify_user(user_id):
     """ Removes verified flag for a user. """
@@ -213,6 +292,11 @@ def unverify_user(user_id):
     DB.session.add(user)
     DB.session.commit()
 
+    # Verification status shows on the leaderboards, so the user's cached leaderboards and the snapshots of their old
+    # leaderboards are stale now
+    delete_comp_event_snapshots_for_user(user_id)
+    invalidate_comp_event_leaderboards_for_user(user_id)
+
 
 def get_all_admins():
     """ Returns a list of all admin users. """
@@ -230,3 +314,26 @@ def get_username_id_map():
         mapping[user.username] = user.id
 
     return mapping
+
+# -------------------------------------------------------------------------------------------------
+
+def __get_username_index() -> _UsernameIndex:
+    """ Returns the index of active users' usernames, building it if it hasn't been built yet or has expired. """
+
+    global __USERNAME_INDEX
+    with __USERNAME_INDEX_LOCK:
+        username_index = __USERNAME_INDEX
+    if username_index and monotonic() - username_index.built_at < app.config[__KEY_USERNAME_INDEX_TTL_SECONDS]:
+        return username_index
+
+    # Users with at least one UserEventResults which isn't blacklisted
+    query = select(User.id, User.username).\
+        join(UserEventResults, UserEventResults.user_id == User.id).\
+        where(UserEventResults.is_blacklisted.isnot(True)).\
+        distinct()
+
+    username_index = _UsernameIndex(DB.session.connection().execute(query).all())
+    with __USERNAME_INDEX_LOCK:
+        __USERNAME_INDEX = username_index
+
+    return username_index
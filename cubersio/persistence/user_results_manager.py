@@ -1,12 +1,18 @@
 """ Utility module for persisting and retrieving UserEventResults """
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.orm import contains_eager, joinedload
 
 from cubersio import DB
-from cubersio.persistence.comp_manager import get_active_competition
+from cubersio.persistence.comp_event_leaderboards_manager import invalidate_comp_event_leaderboard
+from cubersio.persistence.comp_event_snapshots_manager import delete_comp_event_snapshot
+from cubersio.persistence.comp_manager import get_active_competition, save_competition_overall_points
 from cubersio.persistence.models import Competition, CompetitionEvent, Event, UserEventResults,\
-    User, UserSolve
+    User, UserSolve, Scramble
+from cubersio.persistence.user_manager import add_user_to_username_index
+from cubersio.persistence.user_site_rankings_manager import mark_event_site_rankings_dirty
+from cubersio.persistence.user_stats_manager import add_to_user_stats, update_user_stats_for_results
 
 # -------------------------------------------------------------------------------------------------
 
@@ -40,6 +46,11 @@ def blacklist_results(results_id, note):
     DB.session.add(results)
     DB.session.commit()
 
+    # Blacklisting changes the competition's leaderboards and overall points even once it's over
+    invalidate_comp_event_leaderboard(results.comp_event_id)
+    delete_comp_event_snapshot(results.comp_event_id)
+    save_competition_overall_points(results.CompetitionEvent.competition_id, None)
+
     return results
 
 
@@ -60,6 +71,14 @@ def unblacklist_results(results_id):
     DB.session.add(results)
     DB.session.commit()
 
+    # Blacklisting changes the competition's leaderboards and overall points even once it's over
+    invalidate_comp_event_leaderboard(results.comp_event_id)
+    delete_comp_event_snapshot(results.comp_event_id)
+    save_competition_overall_points(results.CompetitionEvent.competition_id, None)
+
+    # The user may not have had any other results which weren't blacklisted
+    add_user_to_username_index(results.user_id)
+
     return results
 
 
@@ -118,6 +137,32 @@ def get_user_solve_for_scramble_id(user_id, scramble_id):
         count()
 
 
+def get_solves_and_scrambles_for_results(results_ids: Iterable[int]) -> Dict[int, List[Tuple[UserSolve, str]]]:
+    """ Returns the solves of each of the specified UserEventResults along with their scrambles' text, loaded all at
+    once rather than through each result's and solve's relationships. Each solve's UserEventResults is loaded with it,
+    so its friendly time doesn't need another query. Returns a map of UserEventResults ID to a list of
+    (UserSolve, scramble) for its solves, in scramble order. Results without any solves are omitted from the map. """
+
+    results_ids = list(results_ids)
+    if not results_ids:
+        return dict()
+
+    rows = DB.session.\
+        query(UserSolve, Scramble.scramble).\
+        join(Scramble, UserSolve.scramble_id == Scramble.id).\
+        join(UserSolve.UserEventResults).\
+        options(contains_eager(UserSolve.UserEventResults)).\
+        filter(UserSolve.user_event_results_id.in_(results_ids)).\
+        order_by(UserSolve.user_event_results_id, UserSolve.scramble_id).\
+        all()
+
+    solves_by_results_id = dict()
+    for solve, scramble in rows:
+        solves_by_results_id.setdefault(solve.user_event_results_id, list()).append((solve, scramble))
+
+    return solves_by_results_id
+
+
 def get_event_results_for_user(comp_event_id, user):
     """ Retrieves a UserEventResults for a specific user and competition event. """
 
@@ -147,46 +192,25 @@ def get_results_for_comp_event(comp_event_id):
         all()
 
 
-def get_pb_single_event_results_except_current_comp(user_id, event_id):
-    """ Returns the UserEventResults which were a PB single for the specified user and event. """
+def get_pb_sort_values_except_current_comp(user_id, event_id) -> Tuple[Optional[int], Optional[int]]:
+    """ Returns the sort values of the specified user's best PB single and PB average for the specified event, except
+    for the current comp, as a tuple of (single, average). Either is None if the user has no such PBs. """
 
     current_comp_id = get_active_competition().id
 
-    return DB.session.\
-        query(UserEventResults).\
-        join(User).\
-        join(CompetitionEvent).\
-        join(Competition).\
-        join(Event).\
-        filter(Event.id == event_id).\
-        filter(User.id == user_id).\
-        filter(Competition.id != current_comp_id).\
-        filter(UserEventResults.was_pb_single).\
-        filter(UserEventResults.is_blacklisted.isnot(True)).\
-        filter(UserEventResults.is_complete).\
-        order_by(UserEventResults.id).\
-        all()
+    # The database picks out the best PBs by their sort values, so none of the results themselves need to be loaded
+    query = select(func.min(case((UserEventResults.was_pb_single, UserEventResults.single_sort_value))),
+                   func.min(case((UserEventResults.was_pb_average, UserEventResults.average_sort_value)))).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        where(CompetitionEvent.event_id == event_id).\
+        where(CompetitionEvent.competition_id != current_comp_id).\
+        where(UserEventResults.user_id == user_id).\
+        where(or_(UserEventResults.was_pb_single, UserEventResults.was_pb_average)).\
+        where(UserEventResults.is_blacklisted.isnot(True)).\
+        where(UserEventResults.is_complete)
 
-
-def get_pb_average_event_results_except_current_comp(user_id, event_id):
-    """ Returns the UserEventResults which were a PB average for the specified user and event. """
-
-    current_comp_id = get_active_competition().id
-
-    return DB.session.\
-        query(UserEventResults).\
-        join(User).\
-        join(CompetitionEvent).\
-        join(Competition).\
-        join(Event).\
-        filter(Event.id == event_id).\
-        filter(User.id == user_id).\
-        filter(Competition.id != current_comp_id).\
-        filter(UserEventResults.was_pb_average).\
-        filter(UserEventResults.is_blacklisted.isnot(True)).\
-        filter(UserEventResults.is_complete).\
-        order_by(UserEventResults.id).\
-        all()
+    pb_single, pb_average = DB.session.connection().execute(query).one()
+    return pb_single, pb_average
 
 
 def get_all_complete_user_results_for_comp(comp_id, omit_blacklisted=True):
@@ -228,6 +252,25 @@ def get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted
     return results_query.all()
 
 
+def get_complete_result_values_for_comp(comp_id):
+    """ Gets the values needed to rank every complete, non-blacklisted UserEventResults in the specified competition, as
+    tuples of (event_id, event_format, user_id, username, result, single), ordered by event. """
+
+    # This is executed directly on the connection rather than through the ORM, since it covers every result in the
+    # competition and only a few plain values are needed from each
+    query = select(Event.id, Event.eventFormat, UserEventResults.user_id, User.username, UserEventResults.result,
+                   UserEventResults.single).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        join(Event, CompetitionEvent.event_id == Event.id).\
+        join(User, UserEventResults.user_id == User.id).\
+        where(CompetitionEvent.competition_id == comp_id).\
+        where(UserEventResults.is_complete).\
+        where(UserEventResults.is_blacklisted.isnot(True)).\
+        order_by(Event.id, UserEventResults.id)
+
+    return DB.session.connection().execute(query).all()
+
+
 def get_blacklisted_entries_for_comp(comp_id):
     """ Returns a list of tuples of (user_id, event_id) for all blacklisted UserEventResults in
     the specified competition. """
@@ -269,6 +312,40 @@ def get_all_complete_user_results_for_comp_and_user(comp_id, user_id, include_bl
     return results_query.all()
 
 
+def get_all_complete_user_results_history_for_user(user_id: int,
+                                                   comps_limit: Optional[int] = None,
+                                                   comps_offset: int = 0) -> List[UserEventResults]:
+    """ Gets all complete UserEventResults for the specified user, including blacklisted ones, in a single query which
+    loads each result's competition event, competition, and event alongside it. The results are ordered by competition
+    from most recent to oldest, and then by event. Optionally only the results in a page of the competitions the user
+    has participated in are returned, by skipping the `comps_offset` most recent of them and taking `comps_limit`. """
+
+    results_query = DB.session.\
+        query(UserEventResults).\
+        join(UserEventResults.CompetitionEvent).\
+        join(CompetitionEvent.Competition).\
+        join(CompetitionEvent.Event).\
+        options(contains_eager(UserEventResults.CompetitionEvent).contains_eager(CompetitionEvent.Competition),
+                contains_eager(UserEventResults.CompetitionEvent).contains_eager(CompetitionEvent.Event)).\
+        filter(UserEventResults.user_id == user_id).\
+        filter(UserEventResults.is_complete)
+
+    if comps_limit is not None:
+        comp_ids = select(CompetitionEvent.competition_id).\
+            join(UserEventResults, UserEventResults.comp_event_id == CompetitionEvent.id).\
+            where(UserEventResults.user_id == user_id).\
+            where(UserEventResults.is_complete).\
+            distinct().\
+            order_by(CompetitionEvent.competition_id.desc()).\
+            limit(comps_limit).\
+            offset(comps_offset)
+        results_query = results_query.filter(Competition.id.in_(comp_ids))
+
+    return results_query.\
+        order_by(Competition.id.desc(), Event.id).\
+        all()
+
+
 def get_all_user_results_for_comp_and_user(comp_id, user_id):
     """ Gets all UserEventResults for the specified competition and user. """
 
@@ -313,35 +390,55 @@ def get_all_user_results_for_user(user_id):
 
 
 def save_event_results(new_results: UserEventResults, event_id: int):
-    """ Saves a UserEventResults record. """
+    """ Saves a UserEventResults record, along with the change it makes to the user's stats. """
+
+    # The results' solves, or whether they're complete, may have changed since they were last saved, so the user's
+    # stats may have too
+    was_complete, solves_before = __get_saved_completeness_and_solves_count(new_results)
 
     DB.session.add(new_results)
+    DB.session.flush()
+
+    is_complete = bool(new_results.is_complete)
+    update_user_stats_for_results(new_results.user_id, new_results.id, new_results.comp_event_id, was_complete,
+                                  solves_before, is_complete, len(new_results.solves) if is_complete else 0)
     DB.session.commit()
 
+    invalidate_comp_event_leaderboard(new_results.comp_event_id)
+
+    # If these are the user's first results, they can now be found by searching active users' usernames
+    if not new_results.is_blacklisted:
+        add_user_to_username_index(new_results.user_id)
+
     # Make sure the latest PB flags are appropriately set for all UserEventResults for this user and event
-    calculate_latest_user_pbs_for_event(new_results.user_id, event_id)
+    latest_pbs_changed = calculate_latest_user_pbs_for_event(new_results.user_id, event_id)
+
+    # If the latest PBs moved to different results, or these results are themselves a latest PB (whose value may have
+    # just changed), the site rankings for this event are now out of date. Only this user's PBs changed, so the live
+    # site ranks can be updated in place.
+    if latest_pbs_changed or new_results.is_latest_pb_single or new_results.is_latest_pb_average:
+        mark_event_site_rankings_dirty(event_id, user_id=new_results.user_id)
 
     # Need to do this! When posting the first solve for an event, a new UserEventResults is created. This record only
     # has a comp_event_id, but the associated CompetitionEvent is not loaded with it. If we do not expunge the record
-    # then when we go refresh the timer page, query again for this record, it gets loaded from the session directly.
-    # The CompetitionEvent is not populated, the UserEventResults::init_on_load isn't run, and the `is_fmc` and other
-    # attributes aren't populated. This causes us not to be able to build the list of times (from the solves associated
-    # with the UserEventResults) because we can't check if it's for FMC, MBLD, etc.
+    # then when we go refresh the timer page, query again for this record, it gets loaded from the session directly,
+    # still without its CompetitionEvent.
     #
-    # Expunging here makes the follow-up query reload from the database, so UserEventResults::init_on_load runs, and
-    # those helper attributes get populated.
+    # Expunging here makes the follow-up query load a fresh copy of it from the database instead.
     DB.session.expunge(new_results)
 
     return new_results
 
 
 def calculate_latest_user_pbs_for_event(user_id, event_id):
-    """ Calculates latest PBs for the specified user and event. """
+    """ Calculates latest PBs for the specified user and event. Returns whether any of the latest PB flags changed. """
 
     # Get the user's event results for this event. If they don't have any, we can just bail
     results = get_all_complete_user_results_for_user_and_event(user_id, event_id)
     if not results:
-        return
+        return False
+
+    previous_flags = [(bool(r.is_latest_pb_single), bool(r.is_latest_pb_average)) for r in results]
 
     for result in results:
         result.is_latest_pb_single = False
@@ -359,18 +456,46 @@ def calculate_latest_user_pbs_for_event(user_id, event_id):
 
     bulk_save_event_results(results)
 
+    return previous_flags != [(bool(r.is_latest_pb_single), bool(r.is_latest_pb_average)) for r in results]
+
 
 def delete_event_results(comp_event_results):
-    """ Deletes a UserEventResults record. """
+    """ Deletes a UserEventResults record, and takes it out of the user's stats. """
+
+    # If these results hold a latest PB, the site rankings for this event will be out of date once they're gone
+    was_latest_pb = comp_event_results.is_latest_pb_single or comp_event_results.is_latest_pb_average
+    event_id = comp_event_results.CompetitionEvent.event_id
+    comp_event_id = comp_event_results.comp_event_id
+    user_id = comp_event_results.user_id
+    results_id = comp_event_results.id
+
+    was_complete = bool(comp_event_results.is_complete)
+    solves_before = len(comp_event_results.solves) if was_complete else 0
+    gold, silver, bronze = (comp_event_results.was_gold_medal, comp_event_results.was_silver_medal,
+                            comp_event_results.was_bronze_medal)
 
     DB.session.delete(comp_event_results)
+    DB.session.flush()
+
+    update_user_stats_for_results(user_id, results_id, comp_event_id, was_complete, solves_before, False, 0)
+    add_to_user_stats(user_id, gold_count=-int(bool(gold)), silver_count=-int(bool(silver)),
+                      bronze_count=-int(bool(bronze)))
     DB.session.commit()
 
+    invalidate_comp_event_leaderboard(comp_event_id)
+
+    if was_latest_pb:
+        mark_event_site_rankings_dirty(event_id)
+
 
 def delete_user_solve(user_solve):
-    """ Deletes a user solve. """
+    """ Deletes a user solve. If its results are complete, the solve is taken out of the user's stats. """
+
+    results = user_solve.UserEventResults
 
     DB.session.delete(user_solve)
+    if results.is_complete:
+        add_to_user_stats(results.user_id, solves_count=-1)
     DB.session.commit()
 
 
@@ -380,3 +505,25 @@ def bulk_save_event_results(results_list):
     for result in results_list:
         DB.session.add(result)
     DB.session.commit()
+
+# -------------------------------------------------------------------------------------------------
+
+def __get_saved_completeness_and_solves_count(results: UserEventResults) -> Tuple[bool, int]:
+    """ Returns whether the specified results were complete, and how many solves they had, as of the last time they
+    were saved. Results which have never been saved weren't complete and didn't have any solves. """
+
+    if results.id is None:
+        return False, 0
+
+    # This is executed directly on the connection so that any unsaved changes aren't flushed first
+    query = select(UserEventResults.is_complete, func.count(UserSolve.id)).\
+        outerjoin(UserSolve, UserSolve.user_event_results_id == UserEventResults.id).\
+        where(UserEventResults.id == results.id).\
+        group_by(UserEventResults.id)
+
+    saved = DB.session.connection().execute(query).one_or_none()
+    if not saved:
+        return False, 0
+
+    is_complete, solves_count = saved
+    return bool(is_complete), solves_count
@@ -1,12 +1,31 @@
 """ Utility module for persisting and retrieving UserSiteRankings. """
 
+from collections import namedtuple
+from datetime import datetime
 import json
-from typing import List, Optional, Dict
-
+from threading import Lock
+from time import monotonic
+from typing import Callable, List, Optional, Dict, Iterable, Tuple
+
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql import func
 
-from cubersio import DB
-from cubersio.persistence.models import UserSiteRankings, User
+from cubersio import DB, app
+from cubersio.persistence.models import UserSiteRankings, User, EventSiteRankingsState, UserEventSiteRanking,\
+    UserEventResults, CompetitionEvent
+from cubersio.util.leaderboards import encode_leaderboard_cursor, decode_leaderboard_cursor
+from cubersio.util.rank_index import PBRankIndex
+from cubersio.util.ranks import to_sort_value, from_sort_value, MISSING_SORT_VALUE
+
+# For retrieving live site ranks settings from app config
+__KEY_LIVE_RANKS_CHECK_INTERVAL_SECONDS = 'LIVE_RANKS_CHECK_INTERVAL_SECONDS'
+
+# The rank a hypothetical PB would have in an event, the percentage of PBs in the event it's at least as fast as, and
+# the number of PBs it was ranked among
+HypotheticalSiteRank = namedtuple('HypotheticalSiteRank', ['rank', 'percentile', 'count'])
 
 
 def get_site_rankings_for_user(user_id) -> Optional[UserSiteRankings]:
@@ -29,192 +48,657 @@ def get_site_rankings_for_users(user_ids) -> Dict[int, UserSiteRankings]:
     return {ranking.user_id: ranking for ranking in rankings}
 
 
-def get_user_site_rankings_all_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by combined single sum of ranks, excluding records
-    with the maximum combined single sum of ranks. These indicate users who haven't participated
-    at all. """
+# The UserSiteRankings columns written by a bulk update, everything except the primary key
+__SITE_RANKINGS_UPSERT_COLUMNS = ('user_id', 'data', 'timestamp', 'sum_all_single', 'sum_all_average', 'sum_wca_single',
+                                  'sum_wca_average', 'sum_non_wca_single', 'sum_non_wca_average', 'all_kinchrank',
+                                  'wca_kinchrank', 'non_wca_kinchrank')
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_all_single)).\
-        first()[0]
+# Dialect-specific INSERT constructs which support ON CONFLICT DO UPDATE
+__UPSERT_INSERTS = {
+    'postgresql': postgresql_insert,
+    'sqlite': sqlite_insert,
+}
 
-    return DB.session.\
-        query(UserSiteRankings.sum_all_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_all_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_all_single.asc()).\
-        all()
 
+def bulk_update_site_rankings(site_rankings: List[UserSiteRankings]):
+    """ Create or update UserSiteRankings records in bulk. On databases which support it, the whole batch is written in
+    a single INSERT ... ON CONFLICT (user_id) DO UPDATE statement. """
 
-def get_user_site_rankings_all_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by combined average sum of ranks, excluding records
-    with the maximum combined average sum of ranks. These indicate users who haven't participated
-    at all. """
+    if not site_rankings:
+        return
 
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_all_average)).\
-        first()[0]
+    upsert_insert = __UPSERT_INSERTS.get(DB.engine.dialect.name, None)
+    if not upsert_insert:
+        __bulk_update_site_rankings_orm(site_rankings)
+        return
 
-    return DB.session.\
-        query(UserSiteRankings.sum_all_average, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_all_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_all_average.asc()).\
-        all()
+    rows = [{column: getattr(rankings, column) for column in __SITE_RANKINGS_UPSERT_COLUMNS}
+            for rankings in site_rankings]
 
+    statement = upsert_insert(UserSiteRankings.__table__).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserSiteRankings.user_id],
+        set_={column: statement.excluded[column] for column in __SITE_RANKINGS_UPSERT_COLUMNS if column != 'user_id'}
+    )
 
-def get_user_site_rankings_wca_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by WCA single sum of ranks, excluding records
-    with the maximum WCA single sum of ranks. These indicate users who haven't participated
-    at all. """
+    DB.session.execute(statement)
+    __replace_user_event_site_rankings(site_rankings)
+    DB.session.commit()
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_wca_single)).\
-        first()[0]
 
-    return DB.session.\
-        query(UserSiteRankings.sum_wca_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_wca_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_wca_single.asc()).\
-        all()
+def __bulk_update_site_rankings_orm(site_rankings: List[UserSiteRankings]):
+    """ Create or update UserSiteRankings records in bulk through the ORM, for databases without upsert support. """
+
+    user_ids = [rankings.user_id for rankings in site_rankings]
+    user_ids_rankings_map = get_site_rankings_for_users(user_ids)
+
+    for new_user_site_rankings in site_rankings:
+        existing_ranking = user_ids_rankings_map.get(new_user_site_rankings.user_id, None)
 
+        # If this user already has a site rankings record, just update it
+        if existing_ranking:
+            for column in __SITE_RANKINGS_UPSERT_COLUMNS:
+                setattr(existing_ranking, column, getattr(new_user_site_rankings, column))
+            DB.session.add(existing_ranking)
 
-def get_user_site_rankings_wca_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by WCA average sum of ranks, excluding records
-    with the maximum WCA average sum of ranks. These indicate users who haven't participated
-    at all. """
+        # If not, create a new one
+        else:
+            DB.session.add(new_user_site_rankings)
 
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_wca_average)).\
-        first()[0]
+    __replace_user_event_site_rankings(site_rankings)
+    DB.session.commit()
 
-    return DB.session.\
-        query(UserSiteRankings.sum_wca_average, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_wca_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_wca_average.asc()).\
-        all()
 
+def __replace_user_event_site_rankings(site_rankings: List[UserSiteRankings]):
+    """ Replaces the UserEventSiteRanking rows for each of the users in `site_rankings` with the per-event rankings
+    held in their UserSiteRankings data. Doesn't commit, so this is written in the same transaction as the
+    UserSiteRankings records themselves. """
+
+    user_ids = [rankings.user_id for rankings in site_rankings]
 
-def get_user_site_rankings_non_wca_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by non-WCA single sum of ranks, excluding records
-    with the maximum non-WCA single sum of ranks. These indicate users who haven't participated
-    at all. """
+    rows = list()
+    for rankings in site_rankings:
+        for event_id, event_rankings in rankings.get_site_rankings_and_pbs().items():
+            rows.append(__build_user_event_site_ranking_row(rankings.user_id, event_id, event_rankings))
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_non_wca_single)).\
-        first()[0]
+    DB.session.execute(delete(UserEventSiteRanking).where(UserEventSiteRanking.user_id.in_(user_ids)))
+    if rows:
+        DB.session.execute(insert(UserEventSiteRanking.__table__), rows)
 
-    return DB.session.\
-        query(UserSiteRankings.sum_non_wca_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_non_wca_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_non_wca_single.asc()).\
+
+def __build_user_event_site_ranking_row(user_id: int, event_id: int, event_rankings) -> Dict:
+    """ Builds a UserEventSiteRanking row from a user's site rankings tuple for an event, of the form
+    (pb_single, single_rank, pb_average, average_rank, kinchrank). """
+
+    pb_single, single_rank, pb_average, average_rank, kinchrank = event_rankings
+    return {
+        'user_id': user_id,
+        'event_id': event_id,
+        'pb_single': pb_single,
+        'single_rank': single_rank,
+        'pb_average': pb_average,
+        'average_rank': average_rank,
+        'kinchrank': float(kinchrank),
+    }
+
+
+def update_one_event_site_rankings_for_user(user_id, new_site_rankings, event):
+    """ Update just one event's info for a user's UserSiteRankings if the record already exists.
+    dict[event ID][(single, single_site_ranking, average, average_site_ranking, kinchrank)] """
+
+    rankings_record = get_site_rankings_for_user(user_id)
+
+    # Rankings record doesn't yet exist for this user, no need to create a new one
+    if not rankings_record:
+        return
+
+    # Get dict representation of existing site rankings data, and then update the entry
+    # for the specified event with the new data for that event
+    existing_data = rankings_record.get_site_rankings_and_pbs()
+    existing_data[event.id] = new_site_rankings[event.id]
+
+    # Serialize the modified rankings data back into the rankings record
+    rankings_record.data = json.dumps(existing_data)
+    DB.session.add(rankings_record)
+
+    # Update just this event's normalized rankings row
+    row = __build_user_event_site_ranking_row(user_id, event.id, new_site_rankings[event.id])
+    event_ranking = DB.session.\
+        query(UserEventSiteRanking).\
+        filter(UserEventSiteRanking.user_id == user_id).\
+        filter(UserEventSiteRanking.event_id == event.id).\
+        first()
+
+    if not event_ranking:
+        event_ranking = UserEventSiteRanking()
+
+    for column, value in row.items():
+        setattr(event_ranking, column, value)
+
+    DB.session.add(event_ranking)
+    DB.session.commit()
+
+
+def get_all_site_rankings_user_ids() -> List[int]:
+    """ Retrieves the user IDs of all users who have a UserSiteRankings record. """
+
+    return [r[0] for r in DB.session.query(UserSiteRankings.user_id).all()]
+
+# -------------------------------------------------------------------------------------------------
+#       Keyset-paginated Sum of Ranks and Kinchranks leaderboards
+# -------------------------------------------------------------------------------------------------
+
+# Leaderboard types, for both Sum of Ranks and Kinchranks
+LEADERBOARD_TYPE_ALL     = 'all'
+LEADERBOARD_TYPE_WCA     = 'wca'
+LEADERBOARD_TYPE_NON_WCA = 'non_wca'
+
+# A row on a leaderboard page, and a page of those rows along with cursors for the pages either side of it (or None if
+# there isn't one)
+LeaderboardRow  = namedtuple('LeaderboardRow', ['position', 'value', 'username', 'user_id'])
+LeaderboardPage = namedtuple('LeaderboardPage', ['rows', 'previous_cursor', 'next_cursor'])
+
+# A leaderboard's column, and whether it's sorted best-first descending. Sums of ranks are better when lower, and
+# Kinchranks are better when higher.
+__Leaderboard = namedtuple('__Leaderboard', ['column', 'descending'])
+
+__SUM_OF_RANKS_LEADERBOARDS = {
+    (LEADERBOARD_TYPE_ALL, False):     __Leaderboard(UserSiteRankings.sum_all_single, False),
+    (LEADERBOARD_TYPE_ALL, True):      __Leaderboard(UserSiteRankings.sum_all_average, False),
+    (LEADERBOARD_TYPE_WCA, False):     __Leaderboard(UserSiteRankings.sum_wca_single, False),
+    (LEADERBOARD_TYPE_WCA, True):      __Leaderboard(UserSiteRankings.sum_wca_average, False),
+    (LEADERBOARD_TYPE_NON_WCA, False): __Leaderboard(UserSiteRankings.sum_non_wca_single, False),
+    (LEADERBOARD_TYPE_NON_WCA, True):  __Leaderboard(UserSiteRankings.sum_non_wca_average, False),
+}
+
+__KINCHRANKS_LEADERBOARDS = {
+    LEADERBOARD_TYPE_ALL:     __Leaderboard(UserSiteRankings.all_kinchrank, True),
+    LEADERBOARD_TYPE_WCA:     __Leaderboard(UserSiteRankings.wca_kinchrank, True),
+    LEADERBOARD_TYPE_NON_WCA: __Leaderboard(UserSiteRankings.non_wca_kinchrank, True),
+}
+
+
+def get_sum_of_ranks_page(sor_type: str,
+                          is_average: bool,
+                          page_size: int,
+                          after: Optional[str] = None,
+                          before: Optional[str] = None) -> LeaderboardPage:
+    """ Retrieves a page of the specified Sum of Ranks leaderboard, excluding users with the maximum sum of ranks since
+    they haven't participated at all. The page starts after the `after` cursor or ends before the `before` cursor, or
+    is the first page if neither is a valid cursor. """
+
+    return __get_leaderboard_page(__SUM_OF_RANKS_LEADERBOARDS[(sor_type, is_average)], page_size, after, before)
+
+
+def get_sum_of_ranks_page_for_user(sor_type: str,
+                                   is_average: bool,
+                                   page_size: int,
+                                   user_id: int) -> Optional[LeaderboardPage]:
+    """ Retrieves the page of the specified Sum of Ranks leaderboard with the specified user in the middle of it, or
+    None if that user isn't on the leaderboard. """
+
+    return __get_leaderboard_page_for_user(__SUM_OF_RANKS_LEADERBOARDS[(sor_type, is_average)], page_size, user_id)
+
+
+def get_kinchranks_page(kinch_type: str,
+                        page_size: int,
+                        after: Optional[str] = None,
+                        before: Optional[str] = None) -> LeaderboardPage:
+    """ Retrieves a page of the specified Kinchranks leaderboard, excluding users with a Kinchrank of 0 since they
+    haven't participated at all. The page starts after the `after` cursor or ends before the `before` cursor, or is
+    the first page if neither is a valid cursor. """
+
+    return __get_leaderboard_page(__KINCHRANKS_LEADERBOARDS[kinch_type], page_size, after, before)
+
+
+def get_kinchranks_page_for_user(kinch_type: str, page_size: int, user_id: int) -> Optional[LeaderboardPage]:
+    """ Retrieves the page of the specified Kinchranks leaderboard with the specified user in the middle of it, or
+    None if that user isn't on the leaderboard. """
+
+    return __get_leaderboard_page_for_user(__KINCHRANKS_LEADERBOARDS[kinch_type], page_size, user_id)
+
+
+def __get_leaderboard_page(leaderboard: __Leaderboard,
+                           page_size: int,
+                           after: Optional[str],
+                           before: Optional[str]) -> LeaderboardPage:
+    """ Retrieves a page of a leaderboard by seeking past the row a cursor points at, rather than by offset, in a single
+    query. One extra row is fetched to tell if there are more rows beyond the page. Cursors come from the client, so
+    the page's positions come from counting the rows ahead of the cursor in the same query. That count walks the
+    leaderboard's index up to the cursor, so its cost grows linearly with how deep into the leaderboard the page is,
+    while fetching the page's rows themselves costs the same at any depth. """
+
+    before_cursor = decode_leaderboard_cursor(before)
+    if before_cursor:
+        value, user_id = before_cursor
+        rows_ahead = __count_leaderboard_rows_ahead(leaderboard, value, user_id)
+        rows = __leaderboard_rows_query(leaderboard, rows_ahead).\
+            filter(__leaderboard_seek(leaderboard, value, user_id, backwards=True)).\
+            order_by(*__leaderboard_ordering(leaderboard, backwards=True)).\
+            limit(page_size + 1).\
+            all()
+
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        first_position = rows[0].rows_ahead - len(rows) + 1 if rows else 1
+        return __build_leaderboard_page(rows, first_position, has_previous, True)
+
+    after_cursor = decode_leaderboard_cursor(after)
+    if not after_cursor:
+        rows = __leaderboard_rows_query(leaderboard).\
+            order_by(*__leaderboard_ordering(leaderboard)).\
+            limit(page_size + 1).\
+            all()
+
+        return __build_leaderboard_page(rows[:page_size], 1, False, len(rows) > page_size)
+
+    value, user_id = after_cursor
+    rows_ahead = __count_leaderboard_rows_ahead(leaderboard, value, user_id, inclusive=True)
+    rows = __leaderboard_rows_query(leaderboard, rows_ahead).\
+        filter(__leaderboard_seek(leaderboard, value, user_id)).\
+        order_by(*__leaderboard_ordering(leaderboard)).\
+        limit(page_size + 1).\
         all()
 
+    first_position = rows[0].rows_ahead + 1 if rows else 1
+    return __build_leaderboard_page(rows[:page_size], first_position, first_position > 1, len(rows) > page_size)
 
-def get_user_site_rankings_non_wca_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by non-WCA average sum of ranks, excluding records
-    with the maximum non-WCA average sum of ranks. These indicate users who haven't participated
-    at all. """
 
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_non_wca_average)).\
-        first()[0]
+def __get_leaderboard_page_for_user(leaderboard: __Leaderboard,
+                                    page_size: int,
+                                    user_id: int) -> Optional[LeaderboardPage]:
+    """ Retrieves the page of a leaderboard with the specified user in the middle of it, or None if the user isn't on
+    the leaderboard. The user's position is found by counting the rows ahead of them in the same query which fetches
+    them and the rows following them, which costs more the deeper into the leaderboard they are. """
 
-    return DB.session.\
-        query(UserSiteRankings.sum_non_wca_average, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_non_wca_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_non_wca_average.asc()).\
+    value = DB.session.\
+        query(leaderboard.column).\
+        filter(UserSiteRankings.user_id == user_id).\
+        filter(__leaderboard_exclusion(leaderboard)).\
+        scalar()
+
+    if value is None:
+        return None
+
+    # Fetch enough rows either side to fill the page even when the user is near the start or end of the leaderboard
+    preceding_rows = __leaderboard_rows_query(leaderboard).\
+        filter(__leaderboard_seek(leaderboard, value, user_id, backwards=True)).\
+        order_by(*__leaderboard_ordering(leaderboard, backwards=True)).\
+        limit(page_size - 1).\
+        all()
+
+    rows_ahead = __count_leaderboard_rows_ahead(leaderboard, value, user_id)
+    following_rows = __leaderboard_rows_query(leaderboard, rows_ahead).\
+        filter(__leaderboard_seek(leaderboard, value, user_id, inclusive=True)).\
+        order_by(*__leaderboard_ordering(leaderboard)).\
+        limit(page_size + 1).\
         all()
 
+    preceding_count = min(len(preceding_rows), max(page_size // 2, page_size - len(following_rows)))
+    rows = preceding_rows[:preceding_count][::-1] + following_rows
+    first_position = (following_rows[0].rows_ahead if following_rows else 0) - preceding_count + 1
+
+    return __build_leaderboard_page(rows[:page_size], first_position, first_position > 1, len(rows) > page_size)
+
+
+def __count_leaderboard_rows_ahead(leaderboard: __Leaderboard, value, user_id: int, inclusive: bool = False):
+    """ Returns a scalar subquery counting the leaderboard rows ahead of the row with the specified value and user ID,
+    in leaderboard order, to select alongside a page's rows. If `inclusive` is set, that row is counted too if it's on
+    the leaderboard. """
+
+    return select(func.count(UserSiteRankings.id)).\
+        where(__leaderboard_exclusion(leaderboard)).\
+        where(__leaderboard_seek(leaderboard, value, user_id, backwards=True, inclusive=inclusive)).\
+        correlate(None).\
+        scalar_subquery()
+
 
-def get_user_kinchranks_wca_sorted():
-    """ Retrieves all Kinchranks sorted by WCA Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
+def __leaderboard_exclusion(leaderboard: __Leaderboard):
+    """ Returns a filter excluding the users who haven't participated at all from a leaderboard. For Sum of Ranks
+    that's those with the maximum sum, which is folded into the same query as a scalar subquery; for Kinchranks it's
+    those with a Kinchrank of 0. """
+
+    if leaderboard.descending:
+        return leaderboard.column != 0
+
+    return leaderboard.column != select(func.max(leaderboard.column)).scalar_subquery()
+
+
+def __leaderboard_rows_query(leaderboard: __Leaderboard, rows_ahead=None):
+    """ Returns a query for the (value, username, user ID) rows of a leaderboard, without ordering. If `rows_ahead` is
+    given, it's selected alongside each row as `rows_ahead`, so a page's position comes back with its rows. """
+
+    columns = [leaderboard.column, User.username, UserSiteRankings.user_id]
+    if rows_ahead is not None:
+        columns.append(rows_ahead.label('rows_ahead'))
 
     return DB.session.\
-        query(UserSiteRankings.wca_kinchrank, User.username).\
+        query(*columns).\
         join(User).\
-        filter(UserSiteRankings.wca_kinchrank != 0).\
-        order_by(UserSiteRankings.wca_kinchrank.desc()).\
+        filter(__leaderboard_exclusion(leaderboard))
+
+
+def __leaderboard_ordering(leaderboard: __Leaderboard, backwards: bool = False):
+    """ Returns the ORDER BY clauses for a leaderboard, best first. Ties are broken by user ID so every row has a
+    unique position for cursors to seek from. If `backwards` is set, the order is reversed. """
+
+    column_descending = leaderboard.descending != backwards
+    return (leaderboard.column.desc() if column_descending else leaderboard.column.asc(),
+            UserSiteRankings.user_id.desc() if backwards else UserSiteRankings.user_id.asc())
+
+
+def __leaderboard_seek(leaderboard: __Leaderboard,
+                       value,
+                       user_id: int,
+                       backwards: bool = False,
+                       inclusive: bool = False):
+    """ Returns a filter for the leaderboard rows after (or if `backwards` is set, before) the row with the specified
+    value and user ID, in leaderboard order. If `inclusive` is set, that row is included too. """
+
+    column = leaderboard.column
+    if leaderboard.descending != backwards:
+        beyond_value = column < value
+    else:
+        beyond_value = column > value
+
+    if backwards:
+        beyond_user = UserSiteRankings.user_id <= user_id if inclusive else UserSiteRankings.user_id < user_id
+    else:
+        beyond_user = UserSiteRankings.user_id >= user_id if inclusive else UserSiteRankings.user_id > user_id
+
+    return or_(beyond_value, and_(column == value, beyond_user))
+
+
+def __build_leaderboard_page(rows, first_position: int, has_previous: bool, has_next: bool) -> LeaderboardPage:
+    """ Numbers a leaderboard page's (value, username, user ID) rows from `first_position`, and builds the cursors for
+    the pages either side of it. """
+
+    page_rows = [LeaderboardRow(first_position + i, value, username, user_id)
+                 for i, (value, username, user_id, *_) in enumerate(rows)]
+
+    if not page_rows:
+        return LeaderboardPage(page_rows, None, None)
+
+    first, last = page_rows[0], page_rows[-1]
+    previous_cursor = encode_leaderboard_cursor(first.value, first.user_id) if has_previous else None
+    next_cursor = encode_leaderboard_cursor(last.value, last.user_id) if has_next else None
+
+    return LeaderboardPage(page_rows, previous_cursor, next_cursor)
+
+# -------------------------------------------------------------------------------------------------
+#       Stuff for UserEventSiteRanking, which holds a user's site rankings for a single event
+# -------------------------------------------------------------------------------------------------
+
+def get_event_site_rankings_for_user(user_id: int) -> Dict[int, Tuple]:
+    """ Retrieves a user's site rankings for all events, as a map of event ID to a tuple of the form
+    (pb_single, single_rank, pb_average, average_rank, kinchrank). This is the same form as
+    UserSiteRankings.get_site_rankings_and_pbs. """
+
+    event_rankings = DB.session.\
+        query(UserEventSiteRanking).\
+        filter(UserEventSiteRanking.user_id == user_id).\
+        order_by(UserEventSiteRanking.event_id).\
         all()
 
+    return {ranking.event_id: ranking.as_site_rankings_tuple() for ranking in event_rankings}
 
-def get_user_kinchranks_non_wca_sorted():
-    """ Retrieves all Kinchranks sorted by non-WCA Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
+
+def get_event_site_ranking_for_user(user_id: int, event_id: int) -> Optional[UserEventSiteRanking]:
+    """ Retrieves a user's site rankings for the specified event. """
 
     return DB.session.\
-        query(UserSiteRankings.non_wca_kinchrank, User.username).\
-        join(User).\
-        filter(UserSiteRankings.non_wca_kinchrank != 0).\
-        order_by(UserSiteRankings.non_wca_kinchrank.desc()).\
-        all()
+        query(UserEventSiteRanking).\
+        filter(UserEventSiteRanking.user_id == user_id).\
+        filter(UserEventSiteRanking.event_id == event_id).\
+        first()
+
 
+def get_top_site_rankings_for_event(event_id: int, limit: int, average: bool = False) -> List[UserEventSiteRanking]:
+    """ Retrieves the top `limit` UserEventSiteRankings for the specified event, ordered by single site rank, or by
+    average site rank if `average` is set. Users without a single or average in the event aren't included. """
 
-def get_user_kinchranks_all_sorted():
-    """ Retrieves all Kinchranks sorted by combined Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
+    if average:
+        rank_column, pb_column = UserEventSiteRanking.average_rank, UserEventSiteRanking.pb_average
+    else:
+        rank_column, pb_column = UserEventSiteRanking.single_rank, UserEventSiteRanking.pb_single
 
     return DB.session.\
-        query(UserSiteRankings.all_kinchrank, User.username).\
-        join(User).\
-        filter(UserSiteRankings.all_kinchrank != 0).\
-        order_by(UserSiteRankings.all_kinchrank.desc()).\
+        query(UserEventSiteRanking).\
+        options(joinedload(UserEventSiteRanking.user)).\
+        filter(UserEventSiteRanking.event_id == event_id).\
+        filter(pb_column != '').\
+        order_by(rank_column.asc(), UserEventSiteRanking.user_id.asc()).\
+        limit(limit).\
         all()
 
+# -------------------------------------------------------------------------------------------------
+#       Stuff for EventSiteRankingsState, which tracks which events need their rankings updated
+# -------------------------------------------------------------------------------------------------
 
-def bulk_update_site_rankings(site_rankings: List[UserSiteRankings]):
-    """ Create or update UserSiteRankings records in bulk """
+# Functions to call with an event's ID whenever its PBs change. See `add_event_pbs_changed_listener`.
+__EVENT_PBS_CHANGED_LISTENERS = list()
 
-    user_ids = [rankings.user_id for rankings in site_rankings]
-    user_ids_rankings_map = get_site_rankings_for_users(user_ids)
 
-    for new_user_site_rankings in site_rankings:
-        existing_ranking = user_ids_rankings_map.get(new_user_site_rankings.user_id, None)
+def mark_event_site_rankings_dirty(event_id: int, user_id: Optional[int] = None) -> None:
+    """ Records that the PB data for the specified event has changed, so the event's site rankings need to be
+    recalculated on the next incremental site rankings run. If `user_id` is set, only that user's PBs changed, and this
+    process' live site ranks for the event are updated in place. Otherwise they're dropped, and reloaded the next time
+    they're used. """
 
-        # If this user already has a site rankings record, just update it
-        if existing_ranking:
-            existing_ranking.data                = new_user_site_rankings.data
-            existing_ranking.timestamp           = new_user_site_rankings.timestamp
-            existing_ranking.sum_all_single      = new_user_site_rankings.sum_all_single
-            existing_ranking.sum_all_average     = new_user_site_rankings.sum_all_average
-            existing_ranking.sum_wca_single      = new_user_site_rankings.sum_wca_single
-            existing_ranking.sum_wca_average     = new_user_site_rankings.sum_wca_average
-            existing_ranking.sum_non_wca_single  = new_user_site_rankings.sum_non_wca_single
-            existing_ranking.sum_non_wca_average = new_user_site_rankings.sum_non_wca_average
-            existing_ranking.all_kinchrank       = new_user_site_rankings.all_kinchrank
-            existing_ranking.wca_kinchrank       = new_user_site_rankings.wca_kinchrank
-            existing_ranking.non_wca_kinchrank   = new_user_site_rankings.non_wca_kinchrank
-            DB.session.add(existing_ranking)
+    state = get_event_site_rankings_state(event_id)
+    if not state:
+        state = EventSiteRankingsState(event_id=event_id)
 
-        # If not, create a new one
-        else:
-            DB.session.add(new_user_site_rankings)
+    previously_changed = state.last_changed
+    changed = datetime.utcnow()
+    state.last_changed = changed
 
+    DB.session.add(state)
     DB.session.commit()
 
+    if user_id is not None:
+        __update_live_event_ranks(event_id, user_id, previously_changed, changed)
+    else:
+        with __LIVE_EVENT_RANKS_LOCK:
+            __LIVE_EVENT_RANKS.pop(event_id, None)
 
-def update_one_event_site_rankings_for_user(user_id, new_site_rankings, event):
-    """ Update just one event's info for a user's UserSiteRankings if the record already exists.
-    dict[event ID][(single, single_site_ranking, average, average_site_ranking)] """
+    for listener in __EVENT_PBS_CHANGED_LISTENERS:
+        listener(event_id)
 
-    rankings_record = get_site_rankings_for_user(user_id)
 
-    # Rankings record doesn't yet exist for this user, no need to create a new one
-    if not rankings_record:
-        return
+def add_event_pbs_changed_listener(listener: Callable[[int], None]) -> None:
+    """ Registers a function to be called with an event's ID whenever the event is marked as having changed PBs, after
+    that's been committed. This lets the tasks queue up refreshing anything built from the event's PBs, without this
+    module depending on them. """
 
-    # Get dict representation of existing site rankings data, and then update the entry
-    # for the specified event with the new data for that event
-    existing_data = rankings_record.get_site_rankings_data_as_dict()
-    existing_data[event.id] = new_site_rankings[event.id]
+    __EVENT_PBS_CHANGED_LISTENERS.append(listener)
 
-    # Serialize the modified rankings data back into the rankings record
-    rankings_record.data = json.dumps(existing_data)
 
-    DB.session.add(rankings_record)
+def get_event_site_rankings_state(event_id: int) -> Optional[EventSiteRankingsState]:
+    """ Retrieves the EventSiteRankingsState record for the specified event. """
+
+    return DB.session.\
+        query(EventSiteRankingsState).\
+        filter(EventSiteRankingsState.event_id == event_id).\
+        first()
+
+
+def get_event_site_rankings_states() -> Dict[int, EventSiteRankingsState]:
+    """ Retrieves the EventSiteRankingsState records for all events, as a map of event ID to state. """
+
+    states = DB.session.\
+        query(EventSiteRankingsState).\
+        all()
+
+    return {state.event_id: state for state in states}
+
+
+def save_event_site_rankings_states(states: Iterable[EventSiteRankingsState]) -> None:
+    """ Create or update EventSiteRankingsState records in bulk. """
+
+    for state in states:
+        DB.session.add(state)
     DB.session.commit()
+
+# -------------------------------------------------------------------------------------------------
+#     Stuff for live site ranks, which are kept up-to-date in memory between site rankings runs
+# -------------------------------------------------------------------------------------------------
+
+class _LiveEventRanks:
+    """ In-memory rank indexes of the latest PB singles and averages in an event, the last time the event's PBs changed
+    as of when these were last brought up-to-date, and when that was last checked. """
+
+    def __init__(self, singles: PBRankIndex, averages: PBRankIndex, synced_to: datetime):
+        self.singles    = singles
+        self.averages   = averages
+        self.synced_to  = synced_to
+        self.checked_at = monotonic()
+
+    def get_pbs_and_ranks(self, user_id: int) -> Tuple:
+        """ Returns a tuple of (pb_single, single_rank, pb_average, average_rank) for the specified user. """
+
+        pb_single, single_rank   = self.singles.get_value_and_rank(user_id)
+        pb_average, average_rank = self.averages.get_value_and_rank(user_id)
+
+        return (from_sort_value(pb_single if pb_single is not None else MISSING_SORT_VALUE),
+                single_rank,
+                from_sort_value(pb_average if pb_average is not None else MISSING_SORT_VALUE),
+                average_rank)
+
+
+# Live ranks for each event which has been used in this process, as a map of event ID to _LiveEventRanks. These are
+# loaded the first time each event is used, and each process keeps its own.
+__LIVE_EVENT_RANKS = dict()
+__LIVE_EVENT_RANKS_LOCK = Lock()
+
+
+def get_live_event_site_rankings_for_user(user_id: int) -> Dict[int, Tuple]:
+    """ Retrieves a user's site rankings for all events in the same form as `get_event_site_rankings_for_user`, but
+    with the PBs and ranks in each event reflecting every PB set since site rankings were last calculated. Kinchranks
+    are as of the last calculation. Only the events whose PBs have changed since then need their live ranks, so the
+    others' aren't loaded. """
+
+    site_rankings = get_event_site_rankings_for_user(user_id)
+    if not site_rankings:
+        return site_rankings
+
+    event_states = get_event_site_rankings_states()
+    for event_id, event_rankings in site_rankings.items():
+        state = event_states.get(event_id, None)
+        if state and not state.is_dirty:
+            continue
+
+        live_ranks = __get_live_event_ranks(event_id, event_states)
+        site_rankings[event_id] = live_ranks.get_pbs_and_ranks(user_id) + (event_rankings[4],)
+
+    return site_rankings
+
+
+def get_live_site_ranks_for_user(user_id: int, event_id: int) -> Tuple:
+    """ Retrieves a user's current PBs and site ranks for the specified event, reflecting every PB set since site
+    rankings were last calculated, as a tuple of (pb_single, single_rank, pb_average, average_rank). """
+
+    live_ranks = __get_live_event_ranks(event_id)
+    return live_ranks.get_pbs_and_ranks(user_id)
+
+
+def get_hypothetical_site_rank(event_id: int, value, is_average: bool = False,
+                               user_id: Optional[int] = None) -> HypotheticalSiteRank:
+    """ Returns the site rank and percentile a PB single (or average, if `is_average` is set) with the specified value
+    would have in the specified event, among everybody's current PBs. The value is a raw result value, as it's stored
+    on a result. If `user_id` is set, that user's own PB isn't counted, which gives the rank they'd have with this PB.
+    Once an event's live ranks are loaded, this doesn't touch the database more than once per check interval. """
+
+    live_ranks = __get_live_event_ranks(event_id)
+    index = live_ranks.averages if is_average else live_ranks.singles
+
+    rank, percentile, count = index.rank_percentile_and_count(to_sort_value(value), user_id)
+
+    return HypotheticalSiteRank(rank=rank, percentile=round(percentile, 1), count=count)
+
+
+def __get_live_event_ranks(event_id: int,
+                           event_states: Optional[Dict[int, EventSiteRankingsState]] = None) -> _LiveEventRanks:
+    """ Returns the live ranks for the specified event, loading them if this process doesn't have them yet, or if the
+    event's PBs have changed somewhere else since they were last brought up-to-date here. That's checked at most once
+    per configured interval, against the event's state in `event_states` if supplied, or else from the database. """
+
+    with __LIVE_EVENT_RANKS_LOCK:
+        live_ranks = __LIVE_EVENT_RANKS.get(event_id, None)
+    if live_ranks and monotonic() - live_ranks.checked_at < app.config[__KEY_LIVE_RANKS_CHECK_INTERVAL_SECONDS]:
+        return live_ranks
+
+    if event_states is not None:
+        state = event_states.get(event_id, None)
+    else:
+        state = get_event_site_rankings_state(event_id)
+    last_changed = state.last_changed if state and state.last_changed else datetime.min
+
+    if live_ranks and live_ranks.synced_to >= last_changed:
+        live_ranks.checked_at = monotonic()
+        return live_ranks
+
+    singles = list()
+    averages = list()
+    for user_id, pb_single, pb_average in __get_latest_pbs_for_event(event_id):
+        if pb_single is not None:
+            singles.append((user_id, pb_single))
+        if pb_average is not None:
+            averages.append((user_id, pb_average))
+
+    live_ranks = _LiveEventRanks(PBRankIndex(singles), PBRankIndex(averages), last_changed)
+    with __LIVE_EVENT_RANKS_LOCK:
+        __LIVE_EVENT_RANKS[event_id] = live_ranks
+
+    return live_ranks
+
+
+def __update_live_event_ranks(event_id: int, user_id: int, previously_changed: Optional[datetime],
+                              changed: datetime) -> None:
+    """ Updates this process' live ranks for the specified event with the specified user's current PBs, if they're
+    loaded. If the event's PBs had changed somewhere else since the live ranks were last brought up-to-date, they're
+    dropped instead, and reloaded the next time they're used. """
+
+    with __LIVE_EVENT_RANKS_LOCK:
+        live_ranks = __LIVE_EVENT_RANKS.get(event_id, None)
+    if not live_ranks:
+        return
+
+    if previously_changed and previously_changed > live_ranks.synced_to:
+        with __LIVE_EVENT_RANKS_LOCK:
+            __LIVE_EVENT_RANKS.pop(event_id, None)
+        return
+
+    pb_single, pb_average = None, None
+    for _, single, average in __get_latest_pbs_for_event(event_id, user_id):
+        pb_single  = single if single is not None else pb_single
+        pb_average = average if average is not None else pb_average
+
+    with __LIVE_EVENT_RANKS_LOCK:
+        live_ranks.singles.update(user_id, pb_single)
+        live_ranks.averages.update(user_id, pb_average)
+        live_ranks.synced_to = changed
+
+
+def __get_latest_pbs_for_event(event_id: int, user_id: Optional[int] = None) -> List[Tuple]:
+    """ Retrieves the latest PB singles and averages which don't belong to blacklisted results for the specified event,
+    optionally for just the specified user. Returns a list of (user_id, pb_single, pb_average) tuples, with PBs as sort
+    values, where each tuple's single or average is None if that result isn't the user's latest PB. """
+
+    query = select(UserEventResults.user_id, UserEventResults.single, UserEventResults.average,
+                   UserEventResults.is_latest_pb_single, UserEventResults.is_latest_pb_average).\
+        join(User, UserEventResults.user_id == User.id).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        where(CompetitionEvent.event_id == event_id).\
+        where(UserEventResults.is_complete).\
+        where(or_(UserEventResults.is_latest_pb_single, UserEventResults.is_latest_pb_average)).\
+        where(UserEventResults.is_blacklisted.isnot(True))
+
+    if user_id is not None:
+        query = query.where(UserEventResults.user_id == user_id)
+
+    return [(result_user_id,
+             to_sort_value(single) if is_latest_pb_single else None,
+             to_sort_value(average) if is_latest_pb_average else None)
+            for result_user_id, single, average, is_latest_pb_single, is_latest_pb_average
+            in DB.session.connection().execute(query)]
@@ -0,0 +1,167 @@
+""" Utility module for maintaining and retrieving each user's overall stats: their medal counts, and how many solves,
+competitions, and events they've completed. """
+
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.orm import aliased
+
+from cubersio import DB
+from cubersio.persistence.models import CompetitionEvent, UserEventResults, UserSolve, UserStats
+
+# -------------------------------------------------------------------------------------------------
+
+# The UserStats columns which are counted from each user's results
+__STATS_COLUMNS = ['gold_count', 'silver_count', 'bronze_count', 'solves_count', 'comps_count', 'events_count']
+
+# How many rows to insert at a time when rebuilding every user's stats
+__INSERT_BATCH_SIZE = 5000
+
+# -------------------------------------------------------------------------------------------------
+
+def get_user_stats(user_id: int) -> UserStats:
+    """ Returns the stats for the specified user. If the user doesn't have any stats yet, they're counted from the
+    user's results and saved first. """
+
+    user_stats = DB.session.\
+        query(UserStats).\
+        filter(UserStats.user_id == user_id).\
+        first()
+
+    return user_stats if user_stats else refresh_user_stats(user_id)
+
+
+def refresh_user_stats(user_id: int) -> UserStats:
+    """ Recounts the stats for the specified user from their results, and saves them. Changes to the user's results
+    after this are applied to their stats with `update_user_stats_for_results` and `add_to_user_stats`. """
+
+    stats = __count_stats(user_id).get(user_id, dict())
+
+    user_stats = DB.session.\
+        query(UserStats).\
+        filter(UserStats.user_id == user_id).\
+        first()
+
+    if not user_stats:
+        user_stats = UserStats(user_id=user_id)
+        DB.session.add(user_stats)
+
+    for column in __STATS_COLUMNS:
+        setattr(user_stats, column, stats.get(column, 0))
+
+    DB.session.commit()
+    return user_stats
+
+
+def update_user_stats_for_results(user_id: int,
+                                  results_id: int,
+                                  comp_event_id: int,
+                                  was_complete: bool,
+                                  solves_before: int,
+                                  is_complete: bool,
+                                  solves_after: int) -> None:
+    """ Applies a change to one of a user's results to their stats, given whether the results were complete and how
+    many solves they had before and after the change. Only the solves of complete results are counted, and the user's
+    competitions and events counts change when these results are the first or last complete results the user has in
+    their competition or event. This must be called in the same transaction as the change, after it's been flushed, and
+    doesn't commit. """
+
+    solves_delta = (solves_after if is_complete else 0) - (solves_before if was_complete else 0)
+    deltas = {'solves_count': solves_delta}
+
+    if was_complete != is_complete:
+        other_results_in_comp, other_results_in_event = __count_other_complete_results(user_id, results_id,
+                                                                                       comp_event_id)
+        step = 1 if is_complete else -1
+        if not other_results_in_comp:
+            deltas['comps_count'] = step
+        if not other_results_in_event:
+            deltas['events_count'] = step
+
+    add_to_user_stats(user_id, **deltas)
+
+
+def add_to_user_stats(user_id: int, **deltas: int) -> None:
+    """ Adds the specified amounts to the stats columns of the specified user's stats, like `gold_count=1`. This is an
+    atomic update in the current transaction, which doesn't commit. If the user doesn't have any stats yet, nothing
+    happens, since they'll be counted from scratch the first time they're retrieved. """
+
+    values = {column: getattr(UserStats, column) + delta for column, delta in deltas.items() if delta}
+    if not values:
+        return
+
+    DB.session.execute(update(UserStats).
+                       where(UserStats.user_id == user_id).
+                       values(values).
+                       execution_options(synchronize_session='fetch'))
+
+
+def rebuild_all_user_stats() -> int:
+    """ Recounts the stats for every user with results in bulk, replacing all existing stats, in case the stats have
+    drifted from the results they're counted from. Returns the number of users whose stats were rebuilt. """
+
+    rows = [dict(user_id=user_id, **{column: stats.get(column, 0) for column in __STATS_COLUMNS})
+            for user_id, stats in __count_stats().items()]
+
+    DB.session.execute(delete(UserStats))
+    for i in range(0, len(rows), __INSERT_BATCH_SIZE):
+        DB.session.execute(insert(UserStats.__table__), rows[i:i + __INSERT_BATCH_SIZE])
+    DB.session.commit()
+
+    return len(rows)
+
+# -------------------------------------------------------------------------------------------------
+
+def __count_stats(user_id: Optional[int] = None) -> Dict[int, Dict[str, int]]:
+    """ Counts the stats for the specified user from their results, or for every user if none is specified. Returns
+    a map of user ID to a dict of stats column to count, omitting users without any results. """
+
+    medals_query = select(UserEventResults.user_id,
+                          func.sum(case((UserEventResults.was_gold_medal, 1), else_=0)).label('gold_count'),
+                          func.sum(case((UserEventResults.was_silver_medal, 1), else_=0)).label('silver_count'),
+                          func.sum(case((UserEventResults.was_bronze_medal, 1), else_=0)).label('bronze_count')).\
+        group_by(UserEventResults.user_id)
+
+    participation_query = select(UserEventResults.user_id,
+                                 func.count(func.distinct(CompetitionEvent.competition_id)).label('comps_count'),
+                                 func.count(func.distinct(CompetitionEvent.event_id)).label('events_count')).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        where(UserEventResults.is_complete).\
+        group_by(UserEventResults.user_id)
+
+    solves_query = select(UserEventResults.user_id, func.count(UserSolve.id).label('solves_count')).\
+        join(UserSolve, UserSolve.user_event_results_id == UserEventResults.id).\
+        where(UserEventResults.is_complete).\
+        group_by(UserEventResults.user_id)
+
+    queries = [medals_query, participation_query, solves_query]
+    if user_id is not None:
+        queries = [query.where(UserEventResults.user_id == user_id) for query in queries]
+
+    stats = dict()
+    connection = DB.session.connection()
+    for query in queries:
+        for row in connection.execute(query):
+            counts = row._asdict()
+            stats.setdefault(counts.pop('user_id'), dict()).update(counts)
+
+    return stats
+
+
+def __count_other_complete_results(user_id: int, results_id: int, comp_event_id: int) -> Tuple[int, int]:
+    """ Counts the specified user's complete results, other than the specified results, which are in the same
+    competition as the specified competition event, and which are in the same event. Returns a tuple of those
+    counts. """
+
+    this_comp_event = aliased(CompetitionEvent)
+
+    query = select(func.count(case((CompetitionEvent.competition_id == this_comp_event.competition_id, 1))),
+                   func.count(case((CompetitionEvent.event_id == this_comp_event.event_id, 1)))).\
+        select_from(UserEventResults).\
+        join(CompetitionEvent, UserEventResults.comp_event_id == CompetitionEvent.id).\
+        join(this_comp_event, this_comp_event.id == comp_event_id).\
+        where(UserEventResults.user_id == user_id).\
+        where(UserEventResults.is_complete).\
+        where(UserEventResults.id != results_id)
+
+    return tuple(DB.session.connection().execute(query).one())
@@ -2,15 +2,17 @@
 
 from collections import namedtuple, OrderedDict
 from csv import writer as csv_writer
+from http import HTTPStatus
 from io import StringIO
+import json
 
-from flask import render_template, make_response
+from flask import render_template, make_response, request
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.business.rankings import get_ordered_pb_averages_for_event,\
-    get_ordered_pb_singles_for_event
+from cubersio.business.event_records import get_event_records
 from cubersio.persistence.comp_manager import get_event_by_name
+from cubersio.persistence.user_site_rankings_manager import get_hypothetical_site_rank
 
 # -------------------------------------------------------------------------------------------------
 
@@ -21,6 +23,11 @@ CSV_HEADERS           = ['Username', 'Single (seconds)', 'Average (seconds)']
 CSV_FILENAME_TEMPLATE = '{event_name}_results.csv'
 CSV_EMPTY             = ''
 
+ERR_MSG_NO_SUCH_EVENT = "I don't know what {} is."
+ERR_MSG_BAD_RESULT    = "Please provide a single or average result value, in centiseconds or as DNF."
+
+DNF = 'DNF'
+
 # -------------------------------------------------------------------------------------------------
 
 @app.route('/event/<event_name>/')
@@ -31,8 +38,9 @@ def event_results(event_name):
     if not event:
         return ("I don't know what {} is.".format(event_name), 404)
 
-    singles  = get_ordered_pb_singles_for_event(event.id)
-    averages = get_ordered_pb_averages_for_event(event.id) if event.name != 'MBLD' else list()
+    singles, averages = get_event_records(event.id)
+    if event.name == 'MBLD':
+        averages = list()
 
     title = "{} Records".format(event.name)
 
@@ -49,13 +57,37 @@ def event_results_export(event_name):
     if not event:
         return ("I don't know what {} is.".format(event_name), 404)
 
-    singles  = get_ordered_pb_singles_for_event(event.id)
-    averages = get_ordered_pb_averages_for_event(event.id)
+    singles, averages = get_event_records(event.id)
 
     user_pb_dict = __build_user_pb_pairs(singles, averages)
 
     return __build_csv_output(event.name, user_pb_dict)
 
+# -------------------------------------------------------------------------------------------------
+# API endpoints
+# -------------------------------------------------------------------------------------------------
+
+@app.route('/api/event/<event_name>/rank/')
+def event_hypothetical_rank(event_name):
+    """ A route for finding out what site rank a PB single or average would have in an event, given in the query string
+    as `single` or `average` in centiseconds (or "centi-moves" for FMC, coded MBLD values, or DNF). If the current user
+    is logged in, their own PB isn't counted. Returns a JSON-serialized dictionary of the form:
+    { rank: int, percentile: float, count: int } """
+
+    event = __safe_get_event(event_name)
+    if not event:
+        return ERR_MSG_NO_SUCH_EVENT.format(event_name), HTTPStatus.NOT_FOUND
+
+    is_average = 'single' not in request.args
+    value = request.args.get('average' if is_average else 'single', '')
+    if value != DNF and not value.isdigit():
+        return ERR_MSG_BAD_RESULT, HTTPStatus.BAD_REQUEST
+
+    user_id = current_user.id if current_user.is_authenticated else None
+    hypothetical_rank = get_hypothetical_site_rank(event.id, value, is_average=is_average, user_id=user_id)
+
+    return json.dumps(hypothetical_rank._asdict())
+
 # -------------------------------------------------------------------------------------------------
 
 def __safe_get_event(event_name):
@@ -2,17 +2,18 @@
 
 from http import HTTPStatus
 
-from flask import render_template
+from flask import render_template, request
+from flask_login import current_user
 
 from cubersio import app
-from cubersio.persistence.user_site_rankings_manager import get_user_kinchranks_all_sorted,\
-    get_user_kinchranks_wca_sorted, get_user_kinchranks_non_wca_sorted
+from cubersio.persistence.user_site_rankings_manager import get_kinchranks_page, get_kinchranks_page_for_user,\
+    LEADERBOARD_TYPE_ALL, LEADERBOARD_TYPE_WCA, LEADERBOARD_TYPE_NON_WCA
 
 # -------------------------------------------------------------------------------------------------
 
-__KINCH_TYPE_ALL     = 'all'
-__KINCH_TYPE_WCA     = 'wca'
-__KINCH_TYPE_NON_WCA = 'non_wca'
+__KINCH_TYPE_ALL     = LEADERBOARD_TYPE_ALL
+__KINCH_TYPE_WCA     = LEADERBOARD_TYPE_WCA
+__KINCH_TYPE_NON_WCA = LEADERBOARD_TYPE_NON_WCA
 __VALID_KINCH_TYPES = (__KINCH_TYPE_ALL, __KINCH_TYPE_WCA, __KINCH_TYPE_NON_WCA)
 
 __TITLE_MAP = {
@@ -21,26 +22,32 @@ __TITLE_MAP = {
     __KINCH_TYPE_NON_WCA: 'Kinchranks – Non-WCA',
 }
 
-__RESULTS_RETRIEVER_MAP = {
-    __KINCH_TYPE_ALL:     get_user_kinchranks_all_sorted,
-    __KINCH_TYPE_WCA:     get_user_kinchranks_wca_sorted,
-    __KINCH_TYPE_NON_WCA: get_user_kinchranks_non_wca_sorted,
-}
-
 __INVALID_KINCH_TYPE = "\"{}\" isn't a valid Kinchranks type."
 
+# For retrieving the leaderboard page size from app config
+__KEY_LEADERBOARD_PAGE_SIZE = 'LEADERBOARD_PAGE_SIZE'
+
 # -------------------------------------------------------------------------------------------------
 
 @app.route('/kinchranks/<rank_type>/')
 def kinchranks(rank_type):
-    """ A route for showing Kinchranks. """
+    """ A route for showing a page of Kinchranks. The page starts after the `after` cursor or ends before the `before`
+    cursor, or if `me` is set, is centered on the current user. """
 
     if rank_type not in __VALID_KINCH_TYPES:
         err_msg = __INVALID_KINCH_TYPE.format(rank_type)
         return render_template('error.html', error_message=err_msg), HTTPStatus.NOT_FOUND
 
-    sorted_kinchranks = __RESULTS_RETRIEVER_MAP[rank_type]()
-    formatted_kinchranks = [(format(kr[0], '.3f'), kr[1]) for kr in sorted_kinchranks]
+    page_size = app.config[__KEY_LEADERBOARD_PAGE_SIZE]
+
+    page = None
+    if 'me' in request.args and current_user.is_authenticated:
+        page = get_kinchranks_page_for_user(rank_type, page_size, current_user.id)
+    if not page:
+        page = get_kinchranks_page(rank_type, page_size, request.args.get('after'), request.args.get('before'))
+
+    formatted_kinchranks = [(row.position, format(row.value, '.3f'), row.username) for row in page.rows]
 
     return render_template("records/kinchranks.html", alternative_title="Kinchranks",
-                            title=__TITLE_MAP[rank_type], sorted_kinchranks=formatted_kinchranks)
+                            title=__TITLE_MAP[rank_type], sorted_kinchranks=formatted_kinchranks,
+                            rank_type=rank_type, previous_cursor=page.previous_cursor, next_cursor=page.next_cursor)
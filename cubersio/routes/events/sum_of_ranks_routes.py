@@ -1,24 +1,30 @@
 """ Routes related to displaying overall Sum Of Ranks results. """
 
-from flask import render_template
+from flask import render_template, request
+from flask_login import current_user
 
 from cubersio import app
-from cubersio.persistence.user_site_rankings_manager import get_user_site_rankings_all_sorted_single,\
-    get_user_site_rankings_all_sorted_average, get_user_site_rankings_wca_sorted_average,\
-    get_user_site_rankings_wca_sorted_single, get_user_site_rankings_non_wca_sorted_average,\
-    get_user_site_rankings_non_wca_sorted_single
+from cubersio.persistence.user_site_rankings_manager import get_sum_of_ranks_page, get_sum_of_ranks_page_for_user,\
+    LEADERBOARD_TYPE_ALL, LEADERBOARD_TYPE_WCA, LEADERBOARD_TYPE_NON_WCA
 
 # -------------------------------------------------------------------------------------------------
 
-SOR_TYPE_ALL     = 'all'
-SOR_TYPE_WCA     = 'wca'
-SOR_TYPE_NON_WCA = 'non_wca'
+SOR_TYPE_ALL     = LEADERBOARD_TYPE_ALL
+SOR_TYPE_WCA     = LEADERBOARD_TYPE_WCA
+SOR_TYPE_NON_WCA = LEADERBOARD_TYPE_NON_WCA
+
+SOR_BY_SINGLE  = 'single'
+SOR_BY_AVERAGE = 'average'
+
+# For retrieving the leaderboard page size from app config
+__KEY_LEADERBOARD_PAGE_SIZE = 'LEADERBOARD_PAGE_SIZE'
 
 # -------------------------------------------------------------------------------------------------
 
 @app.route('/sum_of_ranks/<sor_type>/')
 def sum_of_ranks(sor_type):
-    """ A route for showing sum of ranks. """
+    """ A route for showing a page of sum of ranks, by single or by average. The page starts after the `after` cursor
+    or ends before the `before` cursor, or if `me` is set, is centered on the current user. """
 
     if sor_type not in (SOR_TYPE_ALL, SOR_TYPE_WCA, SOR_TYPE_NON_WCA):
         return ("I don't know what kind of Sum of Ranks this is.", 404)
@@ -26,21 +32,26 @@ def sum_of_ranks(sor_type):
     # If "all", get combined Sum of Ranks
     if sor_type == SOR_TYPE_ALL:
         title = "Sum of Ranks – Combined"
-        singles  = get_user_site_rankings_all_sorted_single()
-        averages = get_user_site_rankings_all_sorted_average()
 
     # If "wca", get WCA Sum of Ranks
     elif sor_type == SOR_TYPE_WCA:
         title = "Sum of Ranks – WCA"
-        singles  = get_user_site_rankings_wca_sorted_single()
-        averages = get_user_site_rankings_wca_sorted_average()
 
     # Otherwise must be "non_wca", so get non-WCA Sum of Ranks
     else:
         title = "Sum of Ranks – Non-WCA"
-        singles  = get_user_site_rankings_non_wca_sorted_single()
-        averages = get_user_site_rankings_non_wca_sorted_average()
+
+    sor_by = SOR_BY_AVERAGE if request.args.get('by') == SOR_BY_AVERAGE else SOR_BY_SINGLE
+    is_average = sor_by == SOR_BY_AVERAGE
+    page_size = app.config[__KEY_LEADERBOARD_PAGE_SIZE]
+
+    page = None
+    if 'me' in request.args and current_user.is_authenticated:
+        page = get_sum_of_ranks_page_for_user(sor_type, is_average, page_size, current_user.id)
+    if not page:
+        page = get_sum_of_ranks_page(sor_type, is_average, page_size, request.args.get('after'),
+                                     request.args.get('before'))
 
     return render_template("records/sum_of_ranks.html", title=title,\
-        alternative_title="Sum of Ranks", sor_sorted_by_single=singles,\
-        sor_sorted_by_average=averages)
+        alternative_title="Sum of Ranks", sor_type=sor_type, sor_by=sor_by, sor_rows=page.rows,\
+        previous_cursor=page.previous_cursor, next_cursor=page.next_cursor)
@@ -6,13 +6,15 @@ from flask import render_template, redirect
 from flask_login import current_user
 
 from cubersio import app
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard, get_ranked_results_for_viewer
+from cubersio.business.competition.overall_points import get_overall_points
+from cubersio.business.competition.snapshots import refresh_comp_event_snapshot
 from cubersio.business.user_results import set_medals_on_best_event_results
 from cubersio.business.user_results.personal_bests import recalculate_user_pbs_for_event
 from cubersio.persistence.comp_manager import get_active_competition, get_complete_competitions,\
     get_previous_competition, get_competition, get_all_comp_events_for_comp, get_comp_event_by_id
-from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event,\
-    blacklist_results, unblacklist_results, UserEventResultsDoesNotExistException
-from cubersio.util.sorting import sort_user_results_with_rankings
+from cubersio.persistence.user_results_manager import blacklist_results, unblacklist_results,\
+    UserEventResultsDoesNotExistException
 from cubersio.util.events.resources import sort_comp_events_by_global_sort_order
 
 # -------------------------------------------------------------------------------------------------
@@ -66,69 +68,24 @@ def comp_event_results(comp_event_id):
     # and also apply additional styling on blacklisted results to make them easier to see
     show_admin = current_user.is_admin
 
-    # Store the scrambles so we can show those too
-    scrambles = [s.scramble for s in comp_event.scrambles]
-
-    results = get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted=False)
-    results = list(results)  # take out of the SQLAlchemy BaseQuery and put into a simple list
-
-    if not results:
+    # The leaderboard is cached until any of its results change, so all that's left per view is picking out the
+    # results this viewer can see
+    leaderboard = get_comp_event_leaderboard(comp_event)
+    if not leaderboard.results:
         return "Nobody has participated in this event yet. Maybe you'll be the first!"
 
-    results = filter_blacklisted_results(results, show_admin, current_user)
-
-    # Split the times string into components, add to a list called `"solves_helper` which
-    # is used in the UI to show individual solves, and make sure the length == 5, filled
-    # with empty strings if necessary
-    # TODO put this in business logic somewhere
-    for result in results:
-        if comp_event.Event.name == 'FMC':
-            solves_helper = list()
-            for i, solve in enumerate(result.solves):
-                scramble = solve.Scramble.scramble
-                solution = solve.fmc_explanation
-                moves    = solve.get_friendly_time()
-                solves_helper.append((scramble, solution, moves))
-            while len(solves_helper) < 5:
-                solves_helper.append((None, None, None))
-        else:
-            solves_helper = result.times_string.split(', ')
-            while len(solves_helper) < 5:
-                solves_helper.append('')
-        setattr(result, 'solves_helper', solves_helper)
-
-    # Sort the results
-    results_with_ranks = sort_user_results_with_rankings(results, comp_event.Event.eventFormat)
+    viewer_username = current_user.username if current_user.is_authenticated else None
+    results_with_ranks = get_ranked_results_for_viewer(leaderboard, comp_event.Event.eventFormat, show_admin,
+                                                       viewer_username)
 
     return render_template("results/comp_event_table.html", results=results_with_ranks,
-        comp_event=comp_event, show_admin=show_admin, scrambles=scrambles)
+        comp_event=comp_event, show_admin=show_admin, scrambles=leaderboard.scrambles)
 
 
 def get_overall_performance_data(comp_id):
-    """ TODO: comment """
-
-    user_points = dict()
-
-    for comp_event in get_all_comp_events_for_comp(comp_id):
-        results = list(get_all_complete_user_results_for_comp_event(comp_event.id))
-
-        # If nobody has participated in this particular comp event, skip performing the sorting
-        # and ranking. Ranking package doesn't like empty iterables.
-        if not results:
-            continue
-
-        results_with_ranks = sort_user_results_with_rankings(results, comp_event.Event.eventFormat)
-
-        total_participants = len(results)
-        for i, _, result in results_with_ranks:
-            username = result.User.username
-            if username not in user_points.keys():
-                user_points[username] = 0
-            user_points[username] += (total_participants - i)
-
-    user_points = [(username, points) for username, points in user_points.items()]
-    user_points.sort(key=lambda x: x[1], reverse=True)
+    """ Renders the overall points standings for the specified competition. """
 
+    user_points = get_overall_points(comp_id)
     if not user_points:
         return "Nobody has participated in anything yet this week?"
 
@@ -179,9 +136,10 @@ def blacklist(results_id):
         # Recalculate PBs just for the affected user and event
         recalculate_user_pbs_for_event(results.user_id, results.CompetitionEvent.event_id)
 
-        # Recalculate podiums for this comp and event if the competition isn't active
+        # Recalculate podiums for this comp and event if the competition isn't active, and refreeze its leaderboard
         if not results.CompetitionEvent.Competition.active:
             set_medals_on_best_event_results([results.CompetitionEvent])
+            refresh_comp_event_snapshot(results.CompetitionEvent)
 
         return ('', 204)
 
@@ -206,9 +164,10 @@ def unblacklist(results_id):
         # Recalculate PBs just for the affected user and event
         recalculate_user_pbs_for_event(results.user_id, results.CompetitionEvent.event_id)
 
-        # Recalculate podiums for this comp and event if the competition isn't active
+        # Recalculate podiums for this comp and event if the competition isn't active, and refreeze its leaderboard
         if not results.CompetitionEvent.Competition.active:
             set_medals_on_best_event_results([results.CompetitionEvent])
+            refresh_comp_event_snapshot(results.CompetitionEvent)
 
         return ('', 204)
 
@@ -217,19 +176,3 @@ def unblacklist(results_id):
 
     except Exception as ex:
         return (str(ex), 500)
-
-# -------------------------------------------------------------------------------------------------
-
-def filter_blacklisted_results(results, show_admin, curr_user):
-    """ Filters out the appropriate blacklisted results depending on who is viewing the page.
-    Admins see all results, non-logged viewers see no blacklisted results, and logged-in viewers
-    only see their own. """
-
-    if show_admin:
-        return results
-
-    if not curr_user.is_authenticated:
-        return [r for r in results if not r.is_blacklisted]
-
-    target_username = curr_user.username
-    return [r for r in results if (not r.is_blacklisted) or (r.User.username == target_username)]
@@ -12,6 +12,7 @@ from cubersio.persistence.comp_manager import get_comp_event_by_id
 from cubersio.persistence.settings_manager import SettingCode, SettingType, TRUE_STR,\
     get_default_values_for_settings, get_bulk_settings_for_user_as_dict, get_setting_type
 from cubersio.persistence.user_results_manager import get_event_results_for_user
+from cubersio.persistence.user_site_rankings_manager import get_hypothetical_site_rank
 from cubersio.util.events.resources import EVENTS_NO_SCRAMBLE_PREVIEW, EVENT_FMC, EVENT_MBLD
 
 # -------------------------------------------------------------------------------------------------
@@ -83,6 +84,7 @@ MSG_RESULTS_COMPLETE_PB_SINGLE  = "{excl}!\nYou've finished {event_name} with a
 MSG_RESULTS_COMPLETE_PB_AVERAGE = "{excl}!\nYou've finished {event_name} with a PB average of {result}!"
 MSG_RESULTS_DNF                 = "You've finished {event_name} with a DNF result.\n{encouragement}"
 MSG_RESULTS_DNF_EMOJI           = "{emoji}"
+MSG_RESULTS_PB_SITE_RANK        = "\nThat's #{rank} on the site!"
 
 EVENT_FORMAT_RESULTS_TYPE_MAP = {
     EventFormat.Bo3: 'a best single',
@@ -369,21 +371,21 @@ def __build_done_message(user_results, event_name, event_format):
             event_name=event_name,
             average=user_results.friendly_average(),
             single=user_results.friendly_single()
-        )
+        ) + __build_pb_site_rank_message(user_results, is_average=True)
 
     if user_results.was_pb_single:
         return MSG_RESULTS_COMPLETE_PB_SINGLE.format(
             excl=random_choice(EXCLAMATIONS),
             event_name=event_name,
             result=user_results.friendly_single()
-        )
+        ) + __build_pb_site_rank_message(user_results, is_average=False)
 
     if user_results.was_pb_average:
         return MSG_RESULTS_COMPLETE_PB_AVERAGE.format(
             excl=random_choice(EXCLAMATIONS),
             event_name=event_name,
             result=user_results.friendly_average()
-        )
+        ) + __build_pb_site_rank_message(user_results, is_average=True)
 
     if user_results.friendly_result() == 'DNF':
         if random_choice(range(100)) < 20:
@@ -401,6 +403,16 @@ def __build_done_message(user_results, event_name, event_format):
         result=user_results.friendly_result()
     )
 
+
+def __build_pb_site_rank_message(user_results, is_average):
+    """ Builds a message about the site rank of the user's new PB single or average. """
+
+    value = user_results.average if is_average else user_results.single
+    site_rank = get_hypothetical_site_rank(user_results.CompetitionEvent.event_id, value, is_average=is_average,
+                                           user_id=user_results.user_id)
+
+    return MSG_RESULTS_PB_SITE_RANK.format(rank=site_rank.rank)
+
 # -------------------------------------------------------------------------------------------------
 
 # These are the settings relevant to the operation of the main cubers.io application
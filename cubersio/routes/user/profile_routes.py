@@ -7,14 +7,13 @@ from flask_login import current_user
 
 from cubersio import app
 from cubersio.business.user_history import get_user_competition_history
-from cubersio.persistence.comp_manager import get_user_participated_competitions_count
 from cubersio.persistence.events_manager import get_all_events
 from cubersio.persistence.user_manager import verify_user, unverify_user,\
     set_perma_blacklist_for_user, unset_perma_blacklist_for_user, get_user_by_id,\
     get_user_by_username_case_insensitive
-from cubersio.persistence.user_results_manager import get_user_completed_solves_count,\
-    get_user_medals_count
-from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user
+from cubersio.persistence.user_stats_manager import get_user_stats
+from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user,\
+    get_live_event_site_rankings_for_user
 from cubersio.persistence.settings_manager import get_boolean_setting_for_user, SettingCode
 
 # -------------------------------------------------------------------------------------------------
@@ -40,16 +39,13 @@ def profile(username):
     # Determine whether we're showing blacklisted results
     include_blacklisted = __should_show_blacklisted_results(username, current_user.is_admin)
 
+    # Get the user's medal counts for podiuming, and some other interesting stats. This comes first, since the stats
+    # are saved if the user doesn't have any yet, which expires everything already loaded.
+    stats = get_user_stats(user.id)
+
     # Get the user's competition history
     history = get_user_competition_history(user, include_blacklisted=include_blacklisted)
 
-    # Accumulate a count of medals this user has for podiuming
-    gold_count, silver_count, bronze_count = get_user_medals_count(user.id)
-
-    # Get some other interesting stats
-    solve_count = get_user_completed_solves_count(user.id)
-    comps_count = get_user_participated_competitions_count(user.id)
-
     # Get a dictionary of event ID to names, to facilitate rendering some stuff in the template
     event_id_name_map = {e.id: e.name for e in get_all_events()}
 
@@ -57,8 +53,7 @@ def profile(username):
     # can build their site ranking table
     site_rankings_record = get_site_rankings_for_user(user.id)
     if site_rankings_record:
-        # TODO -- get the raw site rankings record back, sort those, then convert to dict for front-end
-        site_rankings = site_rankings_record.get_site_rankings_and_pbs()
+        site_rankings = get_live_event_site_rankings_for_user(site_rankings_record.user_id)
 
         # Get sum of ranks
         sor_all     = site_rankings_record.get_combined_sum_of_ranks()
@@ -93,12 +88,12 @@ def profile(username):
     missing_wca_association = viewing_self and username == user.reddit_id and not user.wca_id
     missing_reddit_association = viewing_self and username == user.wca_id and not user.reddit_id
 
-    return render_template("user/profile.html", user=user, solve_count=solve_count,
-                           comp_count=comps_count, history=history, rankings=site_rankings,
+    return render_template("user/profile.html", user=user, solve_count=stats.solves_count,
+                           comp_count=stats.comps_count, history=history, rankings=site_rankings,
                            event_id_name_map=event_id_name_map, rankings_ts=rankings_ts,
                            is_admin_viewing=current_user.is_admin, sor_all=sor_all,
-                           sor_wca=sor_wca, sor_non_wca=sor_non_wca, gold_count=gold_count,
-                           silver_count=silver_count, bronze_count=bronze_count,
+                           sor_wca=sor_wca, sor_non_wca=sor_non_wca, gold_count=stats.gold_count,
+                           silver_count=stats.silver_count, bronze_count=stats.bronze_count,
                            viewing_self=viewing_self, kinch_all=kinch_all, kinch_wca=kinch_wca,
                            kinch_non_wca=kinch_non_wca, show_wca_id=show_wca_id,
                            missing_wca_association=missing_wca_association,
@@ -7,11 +7,10 @@ from flask import render_template, redirect, url_for, request
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.persistence.events_manager import get_all_events
+from cubersio.persistence.events_manager import get_all_events_in_global_sort_order
 from cubersio.persistence.settings_manager import get_setting_for_user,\
     set_new_settings_for_user, SettingCode
 from cubersio.routes import api_login_required
-from cubersio.util.events.resources import sort_events_by_global_sort_order
 
 # -------------------------------------------------------------------------------------------------
 
@@ -32,7 +31,7 @@ def events_settings():
     return render_template("user/settings/events_settings.html",
                            is_mobile=request.MOBILE,
                            hidden_event_ids=hidden_event_ids,
-                           events=sort_events_by_global_sort_order(get_all_events()))
+                           events=get_all_events_in_global_sort_order())
 
 
 @app.route('/settings/events/save', methods=['POST'])
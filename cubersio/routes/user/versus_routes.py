@@ -2,30 +2,33 @@
 
 from http import HTTPStatus
 import json
-from random import choice
 
-from flask import render_template, redirect, url_for
+from flask import render_template, redirect, url_for, request
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.util.events.resources import sort_events_by_global_sort_order
-from cubersio.persistence.events_manager import get_all_events
-from cubersio.persistence.user_manager import get_user_by_username, get_all_active_usernames
-from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user
-from cubersio.persistence.user_results_manager import get_user_completed_solves_count, get_user_medals_count
-from cubersio.persistence.comp_manager import get_user_participated_competitions_count
+from cubersio.persistence.events_manager import get_all_events_in_global_sort_order
+from cubersio.persistence.user_manager import get_user_by_username, get_random_active_username,\
+    search_active_usernames
+from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user,\
+    get_live_event_site_rankings_for_user
+from cubersio.persistence.user_stats_manager import get_user_stats
 
 
 NO_SUCH_USER_ERR_MSG = 'There is no user named {}! I picked {} at random instead.'
 EVENT_NOT_PARTICIPATED = (None, None, None, None)
 
+# How many usernames the username search returns by default, and at most
+DEFAULT_USERNAME_SEARCH_LIMIT = 10
+MAX_USERNAME_SEARCH_LIMIT = 50
+
 
 @app.route('/versus/')
 def versus_search():
     """ Displays a landing page for user comparison, with username search boxes that auto-complete
     with the usernames of active users. """
 
-    return render_template("user/versus_search.html", usernames=get_all_active_usernames())
+    return render_template("user/versus_search.html", search_limit=DEFAULT_USERNAME_SEARCH_LIMIT)
 
 
 @app.route('/versus/<username1>/<username2>')
@@ -33,19 +36,15 @@ def user_versus_user(username1, username2, errors=None):
     """ A route for displaying user results head-to-head with the current user. """
 
     errors = list()
-    usernames = None
 
     user1 = get_user_by_username(username1)
     if not user1:
-        usernames = get_all_active_usernames()
-        user1 = get_user_by_username(choice(usernames))
+        user1 = get_user_by_username(get_random_active_username())
         errors.append(NO_SUCH_USER_ERR_MSG.format(username1, user1.username))
 
     user2 = get_user_by_username(username2)
     if not user2:
-        if not usernames:
-            usernames = get_all_active_usernames()
-        user2 = get_user_by_username(choice(usernames))
+        user2 = get_user_by_username(get_random_active_username())
         errors.append(NO_SUCH_USER_ERR_MSG.format(username2, user2.username))
 
     return __render_versus_page_for_users(user1, user2, errors)
@@ -63,7 +62,7 @@ def __render_versus_page_for_users(user1, user2, errors):
 
     # Get a map of event ID to event name, to facilitate rendering the template.
     # Sort it by the global sort order so the event records table has the same ordering as everywhere else.
-    all_sorted_events = sort_events_by_global_sort_order(get_all_events())
+    all_sorted_events = get_all_events_in_global_sort_order()
     event_id_name_map = {e.id: e.name for e in all_sorted_events}
 
     # Get site rankings info for both users.
@@ -84,9 +83,19 @@ def __render_versus_page_for_users(user1, user2, errors):
 
 @app.route('/api/usernames/')
 def usernames():
-    """ A route for retrieving a list of usernames for all active users. """
+    """ A route for searching the usernames of active users, for auto-completing usernames. Returns a JSON-serialized
+    list of up to `limit` usernames which start with `prefix`, ignoring case, in sorted order. """
+
+    prefix = request.args.get('prefix', '')
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_USERNAME_SEARCH_LIMIT))
+    except ValueError:
+        return 'limit must be an integer', HTTPStatus.BAD_REQUEST
+
+    limit = max(0, min(limit, MAX_USERNAME_SEARCH_LIMIT))
 
-    return json.dumps(get_all_active_usernames())
+    return json.dumps(search_active_usernames(prefix, limit))
 
 
 @app.route('/api/site_stats/<username>/')
@@ -136,7 +145,7 @@ def __get_user_site_rankings(user_id):
 
     # Get a map of event ID to event name, to facilitate rendering the template.
     # Sort it by the global sort order so the event records table has the same ordering as everywhere else.
-    all_sorted_events = sort_events_by_global_sort_order(get_all_events())
+    all_sorted_events = get_all_events_in_global_sort_order()
     event_id_name_map = {e.id: e.name for e in all_sorted_events}
 
     site_rankings = dict()
@@ -145,8 +154,7 @@ def __get_user_site_rankings(user_id):
     # can build their site ranking table
     site_rankings_record = get_site_rankings_for_user(user_id)
     if site_rankings_record:
-        # TODO -- get the raw site rankings record back, sort those, then convert to dict for front-end
-        site_rankings = site_rankings_record.get_site_rankings_and_pbs()
+        site_rankings = get_live_event_site_rankings_for_user(site_rankings_record.user_id)
 
     # Iterate over all events, making sure there's an entry in the user site rankings for everything,
     # even events they haven't participated in, in case the other user has done that event.
@@ -160,7 +168,7 @@ def __get_user_site_rankings(user_id):
 def __get_user_site_stats(user_id):
     """ Retrieves a user's stats related to their usage of the site: """
 
-    medals_count = get_user_medals_count(user_id)
+    stats = get_user_stats(user_id)
 
     site_rankings_record = get_site_rankings_for_user(user_id)
     if site_rankings_record:
@@ -181,12 +189,12 @@ def __get_user_site_stats(user_id):
         kinch_non_wca = 0
 
     return {
-        'solve_count':  get_user_completed_solves_count(user_id),
-        'comps_count':  get_user_participated_competitions_count(user_id),
+        'solve_count':  stats.solves_count,
+        'comps_count':  stats.comps_count,
         'medals_count': {
-            'gold':   medals_count[0],
-            'silver': medals_count[1],
-            'bronze': medals_count[2]
+            'gold':   stats.gold_count,
+            'silver': stats.silver_count,
+            'bronze': stats.bronze_count
         },
         'kinchranks': {
             'all': kinch_all,
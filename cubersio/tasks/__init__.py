@@ -6,6 +6,7 @@ from queue_config import huey
 
 from .gift_code_management import *
 from .competition_management import *
+from .event_records import *
 from .reddit import *
 from .scramble_generation import *
 
@@ -3,14 +3,17 @@
 from huey import crontab
 
 from cubersio import app
-from cubersio.business.rankings import calculate_user_site_rankings
+from cubersio.business.event_records import refresh_stale_event_records
+from cubersio.business.rankings import calculate_user_site_rankings, calculate_user_site_rankings_incremental
 from cubersio.business.user_results import set_medals_on_best_event_results
 from cubersio.persistence.comp_manager import get_active_competition, get_all_comp_events_for_comp
 from cubersio.persistence.events_manager import get_all_events
 from cubersio.persistence.user_manager import get_all_users
 from cubersio.persistence.user_results_manager import calculate_latest_user_pbs_for_event
+from cubersio.persistence.user_site_rankings_manager import mark_event_site_rankings_dirty
 from cubersio.business.competition.generation import generate_new_competition
 from cubersio.business.competition.scoring import post_results_thread
+from cubersio.business.competition.snapshots import snapshot_competition
 # from app.tasks.gift_code_management import send_gift_code_winner_approval_pm
 from cubersio.tasks.reddit import prepare_new_competition_notification,\
     prepare_end_of_competition_info_notifications
@@ -26,6 +29,7 @@ if app.config['IS_DEVO']:
 
 else:
     # Run the rankings task several hours after the comp stuff. I think we're having memory issues.
+    # If so, enable RANKINGS_STREAMING to keep the rankings task's memory usage bounded.
     WRAP_WEEKLY_COMP_SCHEDULE = crontab(day_of_week='1', hour='2', minute='0')
     RUN_RANKINGS_SCHEDULE = crontab(day_of_week='1', hour='6', minute='0')
 
@@ -33,19 +37,29 @@ else:
 
 @huey.periodic_task(RUN_RANKINGS_SCHEDULE)
 def run_weekly_site_rankings():
-    """ A periodic task to run the site rankings stuff weekly. """
+    """ A periodic task to run the site rankings stuff weekly. Only the events which have changed since the last run
+    are recalculated. """
     with app.app_context():
-        run_user_site_rankings()
+        run_user_site_rankings(incremental=True)
 
 
 @huey.task()
-def run_user_site_rankings():
-    """ A task to run the calculations to update user site rankings based on the latest data. """
+def run_user_site_rankings(incremental=False, worker_count=None, streaming=None, engine=None):
+    """ A task to run the calculations to update user site rankings based on the latest data. If `incremental` is
+    set, only events whose PBs have changed since the last calculation are recalculated. Calculations are spread
+    across `worker_count` processes, or the configured number of workers if not specified. If `streaming` is set, the
+    calculations run in the bounded-memory streaming mode, otherwise the configured mode is used. Calculations use the
+    specified `engine`, or the configured one if not specified. Afterwards, the materialized event records for any
+    events whose PBs have changed are refreshed. """
     with app.app_context():
         # Let's keep the timing stuff handy, I want to probably send this via Reddit PM later
         # start = utcnow()
         # user_count = get_user_count()
-        calculate_user_site_rankings()
+        if incremental:
+            calculate_user_site_rankings_incremental(worker_count=worker_count, streaming=streaming, engine=engine)
+        else:
+            calculate_user_site_rankings(worker_count=worker_count, streaming=streaming, engine=engine)
+        refresh_stale_event_records()
         # end = utcnow()
 
 
@@ -62,7 +76,10 @@ def wrap_weekly_competition():
 
         post_results_thread_task(current_comp.id)
         prepare_end_of_competition_info_notifications(current_comp.id)
-        generate_new_competition_task()
+
+        # The competition only becomes inactive once the new one is generated, and its results can keep changing
+        # until then, so it's snapshotted right after that
+        huey.enqueue(generate_new_competition_task.s().then(snapshot_competition_task, current_comp.id))
         # send_gift_code_winner_approval_pm(current_comp.id)
 
 
@@ -73,6 +90,14 @@ def post_results_thread_task(comp_id, is_rerun=False):
         post_results_thread(comp_id, is_rerun=is_rerun)
 
 
+@huey.task()
+def snapshot_competition_task(comp_id):
+    """ A task to freeze the specified competition's leaderboards and overall points, now that it's over. """
+    with app.app_context():
+        if not snapshot_competition(comp_id):
+            print("Competition {} is still active, so it wasn't snapshotted".format(comp_id))
+
+
 @huey.task()
 def generate_new_competition_task():
     """ A task to generate a new competition. """
@@ -83,13 +108,20 @@ def generate_new_competition_task():
 
 @huey.task()
 def update_pbs():
+    """ A task to recalculate the latest PB flags for every user in every event. Each event whose flags changed for
+    anybody is marked dirty once at the end, so the next incremental site rankings run picks it up. """
     with app.app_context():
         all_users = get_all_users()
         user_count = len(all_users)
 
         all_events = get_all_events()
+        changed_event_ids = set()
 
         for i, user in enumerate(all_users):
             print("Calculating latest PBs for {} ({}/{})".format(user.username, i + 1, user_count))
             for event in all_events:
-                calculate_latest_user_pbs_for_event(user.id, event.id)
+                if calculate_latest_user_pbs_for_event(user.id, event.id):
+                    changed_event_ids.add(event.id)
+
+        for event_id in sorted(changed_event_ids):
+            mark_event_site_rankings_dirty(event_id)
@@ -0,0 +1,64 @@
+""" Tasks related to keeping each event's materialized records up to date. """
+
+from huey import crontab
+
+from cubersio import app
+from cubersio.business.event_records import refresh_event_records_if_stale, refresh_stale_event_records
+from cubersio.persistence.events_manager import get_all_events
+from cubersio.persistence.user_site_rankings_manager import add_event_pbs_changed_listener
+
+from . import huey
+
+# -------------------------------------------------------------------------------------------------
+
+if app.config['IS_DEVO']:
+    # don't run as periodic in devo
+    REFRESH_STALE_EVENT_RECORDS_SCHEDULE = lambda _ : False
+
+else:
+    # Catches any events whose records weren't refreshed when their PBs changed, like if the refresh task failed
+    REFRESH_STALE_EVENT_RECORDS_SCHEDULE = crontab(minute='*/15')
+
+# Key for the flag which is set while an event has a refresh queued up, so each event only has one queued at a time
+EVENT_RECORDS_REFRESH_PENDING_KEY = 'event-records-refresh-pending-{event_id}'
+
+# -------------------------------------------------------------------------------------------------
+
+@huey.periodic_task(REFRESH_STALE_EVENT_RECORDS_SCHEDULE)
+def refresh_all_stale_event_records():
+    """ A periodic task to refresh the materialized records for every event whose PBs have changed since its records
+    were last refreshed. The pending flags are cleared first, so an event whose queued refresh was lost can have
+    another queued. """
+    with app.app_context():
+        for event in get_all_events():
+            huey.get(EVENT_RECORDS_REFRESH_PENDING_KEY.format(event_id=event.id))
+        refresh_stale_event_records()
+
+
+@huey.task()
+def refresh_event_records_task(event_id):
+    """ A task to refresh the materialized records for the specified event, if its PBs have changed since they were
+    last refreshed. """
+
+    # Clear the pending flag before refreshing, so PBs which change while we're working queue up another refresh
+    huey.get(EVENT_RECORDS_REFRESH_PENDING_KEY.format(event_id=event_id))
+
+    with app.app_context():
+        refresh_event_records_if_stale(event_id)
+
+
+def queue_event_records_refresh(event_id):
+    """ Queues up refreshing the materialized records for the specified event after its PBs have changed, unless a
+    refresh is already queued. The refresh is delayed in case more PBs change in the meantime, except when tasks run
+    immediately, since delayed tasks never run then. """
+
+    if not huey.put_if_empty(EVENT_RECORDS_REFRESH_PENDING_KEY.format(event_id=event_id), True):
+        return
+
+    if huey.immediate:
+        refresh_event_records_task(event_id)
+    else:
+        refresh_event_records_task.schedule((event_id,), delay=app.config['EVENT_RECORDS_REFRESH_DELAY_SECONDS'])
+
+
+add_event_pbs_changed_listener(queue_event_records_refresh)
@@ -5,7 +5,8 @@ from collections import namedtuple
 from huey import crontab  # type: ignore
 
 from cubersio import app
-from cubersio.persistence.events_manager import get_all_events, add_scramble_to_scramble_pool
+from cubersio.persistence.events_manager import get_all_events, get_scramble_pool_counts,\
+    add_scramble_to_scramble_pool
 from cubersio.util.events.resources import get_event_definition_for_name, EVENT_COLL, EVENT_FTO, EVENT_REX
 
 from . import huey
@@ -26,6 +27,7 @@ def check_scramble_pool() -> None:
     """ A periodic task to check the pre-generated pool of scrambles for all events. If the pool is too low for any
     event, queue up a task to generate more scrambles for those events. """
     with app.app_context():
+        scramble_pool_counts = get_scramble_pool_counts()
         for event in get_all_events():
 
             # Don't pre-generate COLL scrambles. The fact we need a specific COLL each week, and that rotates weekly,
@@ -36,7 +38,7 @@ def check_scramble_pool() -> None:
 
             # Determine if the scramble pool is too low for this event. If so, queue up a task to generate enough scrambles
             # for this event to bring the pool up to (2 * number of solves) for that event.
-            num_missing = (2 * event.totalSolves) - len(event.scramble_pool)
+            num_missing = (2 * event.totalSolves) - scramble_pool_counts.get(event.id, 0)
             if num_missing > 0:
                 top_off_scramble_pool(ScramblePoolTopOffInfo(event.id, event.name, num_missing))
 
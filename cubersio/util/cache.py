@@ -0,0 +1,110 @@
+""" Pluggable key/value cache backends. Values are expected to be JSON-serializable, so that the same values can be held
+in-process or in a shared store like Redis. """
+
+from collections import OrderedDict
+import json
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional
+
+# -------------------------------------------------------------------------------------------------
+
+CACHE_BACKEND_MEMORY = 'memory'
+CACHE_BACKEND_REDIS  = 'redis'
+CACHE_BACKEND_NONE   = 'none'
+
+# -------------------------------------------------------------------------------------------------
+
+class CacheBackend:
+    """ The interface for a cache backend. Expired or evicted entries look the same as entries which were never set. """
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Returns the value cached for the key, or None if there isn't one. """
+        raise NotImplementedError()
+
+    def set(self, key: str, value: Any) -> None:
+        """ Caches a value for the key, replacing any existing value. """
+        raise NotImplementedError()
+
+    def delete(self, key: str) -> None:
+        """ Removes the value cached for the key, if there is one. """
+        raise NotImplementedError()
+
+
+class NullCacheBackend(CacheBackend):
+    """ A cache backend which never holds anything, for turning caching off. """
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+
+class LRUCacheBackend(CacheBackend):
+    """ An in-process cache backend holding at most `max_entries` values, evicting the least recently used value when
+    it's full. Values expire `ttl_seconds` after they're set, if it's greater than 0.
+
+    Values are held as-is rather than serialized, so callers mustn't mutate them. Each process has its own cache, so a
+    delete only affects the process it's made in. """
+
+    def __init__(self, max_entries: int, ttl_seconds: int = 0):
+        self.__max_entries = max_entries
+        self.__ttl_seconds = ttl_seconds
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and monotonic() >= expires_at:
+                del self.__entries[key]
+                return None
+
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.__max_entries <= 0:
+            return
+
+        expires_at = monotonic() + self.__ttl_seconds if self.__ttl_seconds > 0 else None
+        with self.__lock:
+            self.__entries[key] = (value, expires_at)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    """ A cache backend holding JSON-serialized values in Redis, shared between every process using the same Redis. Keys
+    are namespaced with `prefix`, and values expire `ttl_seconds` after they're set, if it's greater than 0. """
+
+    def __init__(self, client, prefix: str, ttl_seconds: int = 0):
+        self.__client = client
+        self.__prefix = prefix
+        self.__ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.__client.get(self.__prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any) -> None:
+        self.__client.set(self.__prefix + key, json.dumps(value), ex=self.__ttl_seconds or None)
+
+    def delete(self, key: str) -> None:
+        self.__client.delete(self.__prefix + key)
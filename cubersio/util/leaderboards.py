@@ -0,0 +1,40 @@
+""" Utilities for keyset pagination of the site leaderboards (Sum of Ranks and Kinchranks). A page is identified by a
+cursor holding the leaderboard value and user ID of the row the page starts after (or ends before), so that the next
+page can be found by seeking past that row on an index instead of counting through an offset. Cursors come back from
+the client, so they don't hold positions; those are always worked out from the database. """
+
+from typing import Optional, Tuple, Union
+
+# -------------------------------------------------------------------------------------------------
+
+# (value, user ID) of the row a cursor points at
+LeaderboardCursor = Tuple[Union[int, float], int]
+
+__SEPARATOR = '_'
+
+# -------------------------------------------------------------------------------------------------
+
+def encode_leaderboard_cursor(value: Union[int, float], user_id: int) -> str:
+    """ Encodes a cursor pointing at the leaderboard row with the specified value and user ID into a URL-safe
+    string. """
+
+    return __SEPARATOR.join((repr(value), str(user_id)))
+
+
+def decode_leaderboard_cursor(cursor: Optional[str]) -> Optional[LeaderboardCursor]:
+    """ Decodes a cursor string produced by `encode_leaderboard_cursor` into (value, user ID). Returns None if the
+    cursor is missing or malformed, so a bad cursor just means the first page. """
+
+    if not cursor:
+        return None
+
+    parts = cursor.split(__SEPARATOR)
+    if len(parts) != 2:
+        return None
+
+    value, user_id = parts
+    try:
+        value = int(value) if value.lstrip('-').isdigit() else float(value)
+        return value, int(user_id)
+    except ValueError:
+        return None
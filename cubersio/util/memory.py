@@ -0,0 +1,33 @@
+""" Utility functions for inspecting the memory usage of the current process. """
+
+import resource
+import sys
+
+# -------------------------------------------------------------------------------------------------
+
+__PROC_STATM_PATH = '/proc/self/statm'
+__BYTES_PER_MB    = 1024 * 1024
+
+# -------------------------------------------------------------------------------------------------
+
+def get_current_rss_mb() -> float:
+    """ Returns the current resident set size of this process in megabytes. On platforms without /proc, this falls
+    back to the peak resident set size, which is the best available upper bound. """
+
+    try:
+        with open(__PROC_STATM_PATH) as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * resource.getpagesize() / __BYTES_PER_MB
+    except (OSError, IndexError, ValueError):
+        return get_peak_rss_mb()
+
+
+def get_peak_rss_mb() -> float:
+    """ Returns the peak resident set size of this process in megabytes. """
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS, and in kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return peak_rss / __BYTES_PER_MB
+    return peak_rss / 1024
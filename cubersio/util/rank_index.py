@@ -0,0 +1,108 @@
+""" An in-memory order-statistic index over the latest PBs in an event, for looking up and updating site ranks without
+recalculating the site rankings for everybody. """
+
+from bisect import bisect_left, insort
+from threading import RLock
+from typing import Iterable, Optional, Tuple
+
+from cubersio.util.ranks import DNF_SORT_VALUE, MISSING_SORT_VALUE
+
+# -------------------------------------------------------------------------------------------------
+
+class PBRankIndex:
+    """ Holds every user's latest PB sort value for an event (either singles or averages), along with all of those
+    values in sorted order. A PB's rank is found by bisecting the sorted values, and a user's PB is updated by removing
+    their old value and inserting the new one, both of which keep the values sorted without re-sorting.
+
+    Ranks match the site rankings: DNFs and empty PBs are all tied with each other after every real result, and a user
+    without a PB (or with an empty one) is ranked after everybody who has one.
+
+    Every read and update holds the index's lock, so it can be read by one thread while another updates it. Anything
+    which needs several values to agree with each other should get them from a single call. """
+
+    def __init__(self, user_pbs: Iterable[Tuple[int, int]] = ()):
+        """ Builds the index from (user ID, PB sort value) pairs. """
+
+        self.__user_values = dict(user_pbs)
+        self.__sorted_values = sorted(self.__rank_value(value) for value in self.__user_values.values())
+        self.__lock = RLock()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__sorted_values)
+
+    def get_value(self, user_id: int) -> Optional[int]:
+        """ Returns the specified user's PB sort value, or None if they don't have a PB. """
+
+        with self.__lock:
+            return self.__user_values.get(user_id, None)
+
+    def rank(self, value: int, excluding_user_id: Optional[int] = None) -> int:
+        """ Returns the rank a PB with the specified sort value has, or would have, among the PBs in the index. If
+        `excluding_user_id` is set, that user's own PB isn't counted, which gives the rank they'd have with this PB. """
+
+        rank_value = self.__rank_value(value)
+
+        with self.__lock:
+            rank = bisect_left(self.__sorted_values, rank_value) + 1
+
+            excluded_value = self.__user_values.get(excluding_user_id, None)
+            if excluded_value is not None and self.__rank_value(excluded_value) < rank_value:
+                rank -= 1
+
+            return rank
+
+    def percentile(self, value: int, excluding_user_id: Optional[int] = None) -> float:
+        """ Returns the percentage of PBs in the index which a PB with the specified sort value is at least as fast as.
+        If `excluding_user_id` is set, that user's own PB isn't counted. """
+
+        return self.rank_percentile_and_count(value, excluding_user_id)[1]
+
+    def rank_percentile_and_count(self, value: int, excluding_user_id: Optional[int] = None) -> Tuple[int, float, int]:
+        """ Returns the rank and percentile a PB with the specified sort value has, or would have, along with the number
+        of PBs it's ranked among, all as of the same moment. If `excluding_user_id` is set, that user's own PB isn't
+        counted. """
+
+        with self.__lock:
+            rank = self.rank(value, excluding_user_id)
+
+            count = len(self.__sorted_values)
+            if excluding_user_id in self.__user_values:
+                count -= 1
+
+            percentile = 100.0 * (count - rank + 1) / count if count > 0 else 100.0
+            return rank, percentile, count
+
+    def rank_for_user(self, user_id: int) -> int:
+        """ Returns the specified user's rank. """
+
+        return self.get_value_and_rank(user_id)[1]
+
+    def get_value_and_rank(self, user_id: int) -> Tuple[Optional[int], int]:
+        """ Returns the specified user's PB sort value, or None if they don't have a PB, and their rank. """
+
+        with self.__lock:
+            value = self.__user_values.get(user_id, None)
+            if value is None or value == MISSING_SORT_VALUE:
+                return value, len(self.__sorted_values) + 1
+
+            return value, self.rank(value)
+
+    def update(self, user_id: int, value: Optional[int]) -> None:
+        """ Sets the specified user's PB sort value, replacing any previous value. A value of None removes the user's
+        PB from the index. """
+
+        with self.__lock:
+            previous = self.__user_values.pop(user_id, None)
+            if previous is not None:
+                del self.__sorted_values[bisect_left(self.__sorted_values, self.__rank_value(previous))]
+
+            if value is not None:
+                self.__user_values[user_id] = value
+                insort(self.__sorted_values, self.__rank_value(value))
+
+    @staticmethod
+    def __rank_value(value: int) -> int:
+        """ Empty PBs rank the same as DNFs. """
+
+        return min(value, DNF_SORT_VALUE)
@@ -0,0 +1,151 @@
+""" Vectorized utilities for sorting and ranking results. Results are represented as arrays of integer sort values
+(centiseconds, "centi-moves" for FMC, coded MBLD values), with DNFs and missing results represented by sentinel values
+which sort after all real results. """
+
+from typing import Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+# -------------------------------------------------------------------------------------------------
+
+# Sentinel sort values for DNF and missing results. Both are slower than any conceivable real result, and a DNF sorts
+# before a missing result.
+DNF_SORT_VALUE     = 88888888888
+MISSING_SORT_VALUE = 99999999999
+
+__DNF = 'DNF'
+
+# -------------------------------------------------------------------------------------------------
+
+def to_sort_values(values: Iterable[Union[str, int, None]]) -> np.ndarray:
+    """ Converts an iterable of raw result values (integers or strings holding integers, "DNF", empty strings, or None)
+    into an array of integer sort values, with DNFs and missing results replaced by their sentinel values. """
+
+    return np.fromiter((to_sort_value(value) for value in values), dtype=np.int64)
+
+
+def to_sort_value(value: Union[str, int, None]) -> int:
+    """ Converts a single raw result value into an integer sort value. See `to_sort_values`. """
+
+    if value == __DNF:
+        return DNF_SORT_VALUE
+
+    if value is None or value == '':
+        return MISSING_SORT_VALUE
+
+    return int(value)
+
+
+def from_sort_value(value: int) -> str:
+    """ Converts an integer sort value back into the raw result value as it's stored on a result. """
+
+    if value == DNF_SORT_VALUE:
+        return __DNF
+
+    if value == MISSING_SORT_VALUE:
+        return ''
+
+    return str(value)
+
+
+def sort_order(primary: np.ndarray, secondary: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Returns the indices which stably sort the results by the primary sort values, breaking ties by the secondary
+    sort values if provided. """
+
+    if secondary is None:
+        return np.argsort(primary, kind='stable')
+
+    # lexsort sorts by the last key first
+    return np.lexsort((secondary, primary))
+
+
+def competition_ranks(primary: np.ndarray, secondary: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Takes sort values which are already in sorted order, and returns the competition-style rank of each one.
+    Identical results (by both primary and secondary values, if provided) share the same rank, and the following rank
+    is skipped for each tie. Ex: [12, 13, 14, 14, 15] would have ranks [1, 2, 3, 3, 5].
+
+    DNFs and missing results are sorted DNFs first, but they're all considered tied with each other, since there's no
+    meaningful way to rank one nonexistent result against another. """
+
+    count = len(primary)
+    if not count:
+        return np.empty(0, dtype=np.int64)
+
+    primary = np.minimum(primary, DNF_SORT_VALUE)
+
+    # Flag each position which starts a new group of identical results
+    is_new_rank = np.empty(count, dtype=bool)
+    is_new_rank[0] = True
+    np.not_equal(primary[1:], primary[:-1], out=is_new_rank[1:])
+
+    if secondary is not None:
+        secondary = np.minimum(secondary, DNF_SORT_VALUE)
+        is_new_rank[1:] |= secondary[1:] != secondary[:-1]
+
+    # A new group's rank is its 1-based position, and everything else in the group carries that rank forward
+    positions = np.arange(1, count + 1, dtype=np.int64)
+    return np.maximum.accumulate(np.where(is_new_rank, positions, 0))
+
+
+def visible_ranks_mask(ranks: np.ndarray) -> np.ndarray:
+    """ Takes competition ranks in sorted order, and returns a mask which is True only for the first occurrence of each
+    rank. Tied results after the first are typically displayed without a rank. """
+
+    mask = np.ones(len(ranks), dtype=bool)
+    if len(ranks) > 1:
+        np.not_equal(ranks[1:], ranks[:-1], out=mask[1:])
+
+    return mask
+
+
+def rank_results(primary: np.ndarray,
+                 secondary: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Sorts and ranks results by the primary sort values, breaking ties by the secondary sort values if provided.
+    Returns a tuple of (order, ranks, visible), where `order` holds the indices which sort the input values, and `ranks`
+    and `visible` hold the competition rank and visible-rank mask for each result in sorted order. """
+
+    order = sort_order(primary, secondary)
+
+    sorted_primary = primary[order]
+    sorted_secondary = secondary[order] if secondary is not None else None
+
+    ranks = competition_ranks(sorted_primary, sorted_secondary)
+    return order, ranks, visible_ranks_mask(ranks)
+
+
+def rank_results_by_group(groups: np.ndarray,
+                          primary: np.ndarray,
+                          secondary: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Sorts and ranks results within each group at once, where `groups` holds an integer group ID for each result (for
+    example, the competition event it belongs to). Within a group, results are ranked exactly as `rank_results` would
+    rank that group on its own. Returns a tuple of (order, ranks), where `order` holds the indices which sort the input
+    values by group and then by result, and `ranks` holds each result's competition rank within its group, in sorted
+    order. """
+
+    count = len(primary)
+    if not count:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # lexsort sorts by the last key first
+    keys = (primary, groups) if secondary is None else (secondary, primary, groups)
+    order = np.lexsort(keys)
+
+    sorted_groups = groups[order]
+    sorted_primary = np.minimum(primary[order], DNF_SORT_VALUE)
+
+    is_new_group = np.empty(count, dtype=bool)
+    is_new_group[0] = True
+    np.not_equal(sorted_groups[1:], sorted_groups[:-1], out=is_new_group[1:])
+
+    is_new_rank = is_new_group.copy()
+    is_new_rank[1:] |= sorted_primary[1:] != sorted_primary[:-1]
+    if secondary is not None:
+        sorted_secondary = np.minimum(secondary[order], DNF_SORT_VALUE)
+        is_new_rank[1:] |= sorted_secondary[1:] != sorted_secondary[:-1]
+
+    # A result's rank is the position where its run of identical results starts, relative to where its group starts
+    indices = np.arange(count, dtype=np.int64)
+    group_starts = np.maximum.accumulate(np.where(is_new_group, indices, 0))
+    rank_starts = np.maximum.accumulate(np.where(is_new_rank, indices, 0))
+
+    return order, rank_starts - group_starts + 1
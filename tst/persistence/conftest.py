@@ -0,0 +1,85 @@
+""" Fixtures for tests which run against a real, throwaway database. """
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from cubersio import app, DB
+from cubersio.persistence import user_site_rankings_manager
+from cubersio.persistence.events_manager import invalidate_event_catalog
+from cubersio.persistence.user_manager import invalidate_username_index
+
+
+class QueryCounter:
+    """ Counts the SQL statements executed against an engine while it's in use as a context manager. """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = list()
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.__on_execute)
+        return self
+
+    def __exit__(self, *_):
+        event.remove(self.engine, 'before_cursor_execute', self.__on_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __on_execute(self, _conn, _cursor, statement, *_):
+        self.statements.append(statement)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """ Points the app at an empty in-memory SQLite database with every table created, for the duration of a test. """
+
+    yield from __use_database(monkeypatch, create_engine('sqlite://', poolclass=StaticPool))
+
+
+@pytest.fixture
+def file_database(monkeypatch, tmp_path):
+    """ Points the app at an empty SQLite database file with every table created, for the duration of a test. Unlike
+    the in-memory database, this one can also be opened by worker processes forked during the test. """
+
+    yield from __use_database(monkeypatch, create_engine(f'sqlite:///{tmp_path / "cubersio.sqlite"}'))
+
+
+def __use_database(monkeypatch, engine):
+    """ Points the app at the database behind `engine`, creates every table in it, and yields the app's database
+    handle. Once the test is done, the engine is disposed of. """
+
+    monkeypatch.setitem(DB._app_engines[app], None, engine)
+
+    # Don't run whatever the tasks hook onto changed PBs, if they've been imported, unless a test asks for it
+    monkeypatch.setattr(user_site_rankings_manager, '__EVENT_PBS_CHANGED_LISTENERS', list())
+
+    # Live site ranks are kept per event ID, which would carry over between databases too
+    monkeypatch.setattr(user_site_rankings_manager, '__LIVE_EVENT_RANKS', dict())
+
+    # So would the event catalog, along with the competition event names on UserEventResults, and the username index
+    invalidate_event_catalog()
+    invalidate_username_index()
+
+    with app.app_context():
+        DB.create_all()
+        yield DB
+        DB.session.remove()
+
+    invalidate_event_catalog()
+    invalidate_username_index()
+    engine.dispose()
+
+
+@pytest.fixture
+def count_queries(database):
+    """ Returns a function which starts counting the SQL statements the app executes, for use in a `with` block. Each
+    test starts with an empty session, so nothing counted was already loaded. """
+
+    def start_counting():
+        database.session.expunge_all()
+        return QueryCounter(database.engine)
+
+    return start_counting
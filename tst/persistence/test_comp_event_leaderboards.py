@@ -0,0 +1,126 @@
+""" Tests for building, caching, and invalidating competition event leaderboards. """
+
+import pytest
+
+from cubersio.business import comp_event_leaderboards
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+from cubersio.persistence.comp_event_leaderboards_manager import set_comp_event_leaderboards_cache_backend
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, Scramble, User, UserEventResults
+from cubersio.persistence.user_results_manager import save_event_results
+from cubersio.util.cache import LRUCacheBackend
+
+# Each user's result in the competition event
+RESULTS = [('alice', '1200'), ('bob', '1100'), ('carol', '1300')]
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the results in RESULTS in an active competition's event, and an in-memory leaderboards cache.
+    Returns the IDs of the event and the competition event. """
+
+    session = database.session
+
+    event = Event(name='3x3', totalSolves=5, eventFormat='Ao5')
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=username) for username, _ in RESULTS]
+    session.add_all([event, comp] + users)
+    session.flush()
+
+    comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+    session.add(comp_event)
+    session.flush()
+
+    session.add_all(Scramble(scramble='R U', competition_event_id=comp_event.id) for _ in range(5))
+    session.add_all(__results(user.id, comp_event.id, result) for user, (_, result) in zip(users, RESULTS))
+    session.commit()
+
+    set_comp_event_leaderboards_cache_backend(LRUCacheBackend(16))
+    yield event.id, comp_event.id
+    set_comp_event_leaderboards_cache_backend(None)
+
+
+def __results(user_id, comp_event_id, result):
+    """ Builds complete UserEventResults with the specified result as both single and average. """
+
+    return UserEventResults(user_id=user_id, comp_event_id=comp_event_id, single=result, average=result, result=result,
+                            is_complete=True, is_blacklisted=False, times_string='12.00, 12.00, 12.00, 12.00, 12.00')
+
+
+def __save_new_results(database, username, comp_event_id, event_id, result):
+    """ Saves results for a new user in the competition event, the same way as when they're submitted. """
+
+    user = User(username=username)
+    database.session.add(user)
+    database.session.commit()
+
+    save_event_results(__results(user.id, comp_event_id, result), event_id)
+
+
+def __leaderboard_usernames(database, comp_event_id):
+    """ Reads the competition event's leaderboard as a fresh request would, and returns its usernames in ranked
+    order. """
+
+    comp_event = database.session.get(CompetitionEvent, comp_event_id)
+    leaderboard = get_comp_event_leaderboard(comp_event)
+
+    return [leaderboard.results[i].User.username for _, _, i in leaderboard.public_ranks]
+
+
+def test_leaderboard_is_cached(populated, database, count_queries):
+    """ Test that a competition event's leaderboard is only built once, and then served from the cache. """
+
+    _, comp_event_id = populated
+    assert __leaderboard_usernames(database, comp_event_id) == ['bob', 'alice', 'carol']
+
+    comp_event = database.session.get(CompetitionEvent, comp_event_id)
+    with count_queries() as counter:
+        get_comp_event_leaderboard(comp_event)
+
+    assert counter.count == 0
+
+
+def test_saved_results_invalidate_leaderboard(populated, database):
+    """ Test that saving results invalidates the cached leaderboard, so the next read shows them. """
+
+    event_id, comp_event_id = populated
+    assert __leaderboard_usernames(database, comp_event_id) == ['bob', 'alice', 'carol']
+
+    __save_new_results(database, 'dave', comp_event_id, event_id, '1000')
+
+    assert __leaderboard_usernames(database, comp_event_id) == ['dave', 'bob', 'alice', 'carol']
+
+
+def test_invalidation_reaches_other_processes(populated, database):
+    """ Test that saving results in one process invalidates the leaderboard held in another process' own cache. """
+
+    event_id, comp_event_id = populated
+    other_process_cache = LRUCacheBackend(16)
+
+    set_comp_event_leaderboards_cache_backend(other_process_cache)
+    assert __leaderboard_usernames(database, comp_event_id) == ['bob', 'alice', 'carol']
+
+    set_comp_event_leaderboards_cache_backend(LRUCacheBackend(16))
+    __save_new_results(database, 'dave', comp_event_id, event_id, '1000')
+
+    set_comp_event_leaderboards_cache_backend(other_process_cache)
+    assert __leaderboard_usernames(database, comp_event_id) == ['dave', 'bob', 'alice', 'carol']
+
+
+def test_leaderboard_built_before_invalidation_is_not_served(populated, database, monkeypatch):
+    """ Test that a leaderboard which was built from results that changed while it was being built isn't served once
+    it's cached. """
+
+    event_id, comp_event_id = populated
+    load_results = comp_event_leaderboards.get_all_complete_user_results_for_comp_event
+
+    def load_results_then_save_new_results(*args, **kwargs):
+        monkeypatch.setattr(comp_event_leaderboards, 'get_all_complete_user_results_for_comp_event', load_results)
+        results = load_results(*args, **kwargs)
+        __save_new_results(database, 'dave', comp_event_id, event_id, '1000')
+        return results
+
+    monkeypatch.setattr(comp_event_leaderboards, 'get_all_complete_user_results_for_comp_event',
+                        load_results_then_save_new_results)
+
+    assert __leaderboard_usernames(database, comp_event_id) == ['bob', 'alice', 'carol']
+    assert __leaderboard_usernames(database, comp_event_id) == ['dave', 'bob', 'alice', 'carol']
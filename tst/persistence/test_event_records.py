@@ -0,0 +1,166 @@
+""" Tests for maintaining and reading each event's materialized records. """
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from cubersio.business.event_records import get_event_records, refresh_event_records, refresh_event_records_if_stale
+from cubersio.persistence import user_site_rankings_manager
+from cubersio.persistence.event_records_manager import replace_event_records
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, EventRecord, User, UserEventResults
+from cubersio.persistence.user_site_rankings_manager import get_event_site_rankings_state,\
+    mark_event_site_rankings_dirty
+from cubersio.tasks import huey
+from cubersio.tasks.event_records import EVENT_RECORDS_REFRESH_PENDING_KEY, queue_event_records_refresh,\
+    refresh_all_stale_event_records
+
+# Put Huey in immediate mode so the tasks execute synchronously
+huey.immediate = True
+
+# Each user's PB single and average in the event
+PBS = [('alice', '900', '1100'), ('bob', '800', '1200'), ('carol', '1000', '1000')]
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the PBs in PBS in a single event. Returns the IDs of the event and its competition event. """
+
+    session = database.session
+
+    event = Event(name='3x3', totalSolves=5, eventFormat='Ao5')
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=username) for username, _, _ in PBS]
+    session.add_all([event, comp] + users)
+    session.flush()
+
+    comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+    session.add(comp_event)
+    session.flush()
+
+    for user, (_, single, average) in zip(users, PBS):
+        session.add(__pb_result(user.id, comp_event.id, single, average))
+
+    session.commit()
+    return event.id, comp_event.id
+
+
+def __pb_result(user_id, comp_event_id, single, average):
+    """ Builds a complete UserEventResults which holds the user's latest PB single and average. """
+
+    return UserEventResults(user_id=user_id, comp_event_id=comp_event_id, single=single, average=average,
+                            result=average, is_complete=True, is_blacklisted=False, is_latest_pb_single=True,
+                            is_latest_pb_average=True)
+
+
+def __usernames(personal_bests):
+    return [personal_best.username for personal_best in personal_bests]
+
+
+def test_get_event_records_serves_existing_records(populated, database, count_queries):
+    """ Test that reading an event's records serves the materialized records as they are, even after the event's PBs
+    have changed, without rebuilding them. """
+
+    event_id, comp_event_id = populated
+    refresh_event_records(event_id)
+
+    dave = User(username='dave')
+    database.session.add(dave)
+    database.session.flush()
+    database.session.add(__pb_result(dave.id, comp_event_id, '700', '900'))
+    database.session.commit()
+    mark_event_site_rankings_dirty(event_id)
+
+    with count_queries() as counter:
+        singles, averages = get_event_records(event_id)
+
+    assert __usernames(singles) == ['bob', 'alice', 'carol']
+    assert __usernames(averages) == ['carol', 'alice', 'bob']
+    assert all(statement.lstrip().upper().startswith('SELECT') for statement in counter.statements)
+
+    assert refresh_event_records_if_stale(event_id)
+    assert not refresh_event_records_if_stale(event_id)
+
+    singles, averages = get_event_records(event_id)
+    assert __usernames(singles) == ['dave', 'bob', 'alice', 'carol']
+    assert __usernames(averages) == ['dave', 'carol', 'alice', 'bob']
+
+
+def test_get_event_records_before_first_refresh(populated):
+    """ Test that an event whose records have never been built has no records until they're refreshed. """
+
+    event_id, _ = populated
+
+    assert get_event_records(event_id) == ([], [])
+    assert refresh_event_records_if_stale(event_id)
+    assert [len(records) for records in get_event_records(event_id)] == [3, 3]
+
+
+def test_replace_event_records_locks_state_before_deleting(populated, count_queries):
+    """ Test that replacing an event's records locks its state before deleting the old records. """
+
+    event_id, _ = populated
+    refresh_event_records(event_id)
+
+    with count_queries() as counter:
+        refresh_event_records(event_id)
+
+    statements = [statement.lstrip().upper() for statement in counter.statements]
+    lock = next(i for i, statement in enumerate(statements) if 'FROM EVENT_SITE_RANKINGS_STATE' in statement)
+    delete = next(i for i, statement in enumerate(statements) if statement.startswith('DELETE FROM EVENT_RECORD'))
+
+    assert lock < delete
+
+
+def test_replace_event_records_keeps_newer_records(populated):
+    """ Test that a refresh which finishes after a refresh that started later leaves the newer records alone. """
+
+    event_id, _ = populated
+    started = datetime.utcnow()
+
+    assert refresh_event_records(event_id)
+    assert not replace_event_records(event_id, [], started - timedelta(seconds=1))
+    assert [len(records) for records in get_event_records(event_id)] == [3, 3]
+    assert get_event_site_rankings_state(event_id).records_refreshed >= started
+
+
+def test_event_record_positions_are_unique(populated, database):
+    """ Test that the same position can't be held twice in an event's singles. """
+
+    event_id, _ = populated
+    refresh_event_records(event_id)
+
+    record = database.session.query(EventRecord).filter(EventRecord.event_id == event_id).first()
+    with pytest.raises(IntegrityError):
+        database.session.execute(insert(EventRecord.__table__), [{
+            'event_id': event_id, 'is_average': record.is_average, 'position': record.position, 'rank': 1,
+            'user_id': record.user_id, 'comp_id': record.comp_id, 'personal_best': '1',
+        }])
+
+
+def test_marking_event_dirty_queues_records_refresh(populated, database, monkeypatch):
+    """ Test that marking an event's PBs as changed refreshes its records through the task queue, and that only one
+    refresh is queued up per event at a time until the periodic task clears the pending flags. """
+
+    monkeypatch.setattr(user_site_rankings_manager, '__EVENT_PBS_CHANGED_LISTENERS', [queue_event_records_refresh])
+    event_id, comp_event_id = populated
+
+    mark_event_site_rankings_dirty(event_id)
+    database.session.expire_all()
+
+    assert not get_event_site_rankings_state(event_id).records_are_stale
+    assert [len(records) for records in get_event_records(event_id)] == [3, 3]
+
+    # Pretend a refresh is already queued up, so another one isn't
+    huey.put(EVENT_RECORDS_REFRESH_PENDING_KEY.format(event_id=event_id), True)
+    mark_event_site_rankings_dirty(event_id)
+    database.session.expire_all()
+
+    assert get_event_site_rankings_state(event_id).records_are_stale
+
+    refresh_all_stale_event_records()
+    database.session.expire_all()
+
+    assert not get_event_site_rankings_state(event_id).records_are_stale
+    assert huey.get(EVENT_RECORDS_REFRESH_PENDING_KEY.format(event_id=event_id), peek=True) is None
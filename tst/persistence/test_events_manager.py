@@ -0,0 +1,94 @@
+""" Tests for retrieving events through the event catalog. """
+
+import pytest
+
+from cubersio.persistence.events_manager import get_all_bonus_events, get_all_events,\
+    get_all_events_in_global_sort_order, get_all_non_WCA_events, get_all_WCA_events, get_event_format_for_event,\
+    get_event_info_by_name, get_events_name_id_mapping, get_scramble_pool_counts, invalidate_event_catalog
+from cubersio.persistence.models import Event, ScramblePool
+
+# Inserted in this order, which isn't the global event sort order. 'Not An Event' isn't in the global sort order.
+EVENTS = [('2x2', 'Ao5'), ('Not An Event', 'Bo1'), ('FTO', 'Ao5'), ('3x3', 'Ao5'), ('Kilominx', 'Ao5'),
+          ('6x6', 'Mo3')]
+
+
+@pytest.fixture
+def events(database):
+    """ A database with the events in EVENTS. Returns a map of event name to ID. """
+
+    records = [Event(name=name, eventFormat=event_format, totalSolves=5) for name, event_format in EVENTS]
+    database.session.add_all(records)
+    database.session.commit()
+
+    return {event.name: event.id for event in records}
+
+
+def test_get_all_events(events):
+    """ Test that every event is in the catalog, ordered by ID, and flagged by what kind of event it is. """
+
+    all_events = get_all_events()
+
+    assert [e.name for e in all_events] == [name for name, _ in EVENTS]
+    assert [e.id for e in all_events] == sorted(events.values())
+    assert [e.name for e in get_all_WCA_events()] == ['2x2', '3x3', '6x6']
+    assert [e.name for e in get_all_non_WCA_events()] == ['FTO', 'Kilominx']
+    assert [e.name for e in get_all_bonus_events()] == ['Kilominx']
+    assert get_events_name_id_mapping() == events
+
+
+def test_get_all_events_in_global_sort_order(events):
+    """ Test that events are sorted by the global event sort order, leaving out events which aren't in it. """
+
+    assert [e.name for e in get_all_events_in_global_sort_order()] == ['2x2', '3x3', '6x6', 'FTO', 'Kilominx']
+    assert get_event_info_by_name('Not An Event').sort_order is None
+
+
+def test_get_event_info(events):
+    """ Test looking up a single event's info by name and its format by ID. """
+
+    assert get_event_info_by_name('6x6').id == events['6x6']
+    assert get_event_info_by_name('7x7') is None
+    assert get_event_format_for_event(events['6x6']) == 'Mo3'
+    assert get_event_format_for_event(events['Not An Event']) == 'Bo1'
+
+
+def test_event_catalog_is_loaded_once(events, count_queries):
+    """ Test that the event catalog is loaded in a single query, and then every event helper is served from it. """
+
+    with count_queries() as counter:
+        get_all_events()
+        get_all_WCA_events()
+        get_all_bonus_events()
+        get_all_events_in_global_sort_order()
+        get_events_name_id_mapping()
+        get_event_format_for_event(events['3x3'])
+
+    assert counter.count == 1
+
+
+def test_invalidate_event_catalog(events, database):
+    """ Test that new or changed events are only picked up after the event catalog is invalidated. """
+
+    assert get_event_format_for_event(events['3x3']) == 'Ao5'
+
+    database.session.query(Event).filter(Event.name == '3x3').update({'eventFormat': 'Bo3'})
+    database.session.add(Event(name='Skewb', eventFormat='Ao5', totalSolves=5))
+    database.session.commit()
+
+    assert get_event_format_for_event(events['3x3']) == 'Ao5'
+    assert get_event_info_by_name('Skewb') is None
+
+    invalidate_event_catalog()
+
+    assert get_event_format_for_event(events['3x3']) == 'Bo3'
+    assert get_event_info_by_name('Skewb').is_wca
+
+
+def test_get_scramble_pool_counts(events, database):
+    """ Test that the scramble pool is counted for each event which has any scrambles in it. """
+
+    database.session.add_all(ScramblePool(event_id=events['3x3'], scramble='R U') for _ in range(3))
+    database.session.add(ScramblePool(event_id=events['FTO'], scramble='R U'))
+    database.session.commit()
+
+    assert get_scramble_pool_counts() == {events['3x3']: 3, events['FTO']: 1}
@@ -0,0 +1,141 @@
+""" Tests for calculating and caching a competition's overall points standings. """
+
+import pytest
+
+from cubersio.business.competition.overall_points import calculate_overall_points, get_overall_points
+from cubersio.persistence.comp_manager import get_all_comp_events_for_comp, get_competition_overall_points
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, User, UserEventResults
+from cubersio.persistence.user_results_manager import blacklist_results, unblacklist_results,\
+    get_all_complete_user_results_for_comp_event
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+# Each event in the competition, and each user's (result, single) in it, and whether their results are blacklisted or
+# incomplete. These include results tied on the result but not the single, results tied on both, DNFs, and tied
+# best-of-N singles.
+EVENTS = [('3x3', 'Ao5'), ('FMC', 'Mo3'), ('5BLD', 'Bo3')]
+RESULTS = {
+    '3x3': [('alice', '1200', '1000', ''), ('bob', '1200', '900', ''), ('carol', '1200', '900', ''),
+            ('dave', 'DNF', '1100', ''), ('eve', '800', '700', 'blacklisted'), ('frank', '700', '600', 'incomplete')],
+    'FMC': [('alice', '3000', '28', ''), ('carol', '2900', '27', ''), ('dave', '3000', '28', ''),
+            ('bob', 'DNF', 'DNF', '')],
+    '5BLD': [('eve', '25000', '25000', ''), ('bob', '30000', '30000', ''), ('dave', '30000', '30000', ''),
+             ('alice', 'DNF', 'DNF', '')],
+}
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the results in RESULTS in an active competition, and a result in another competition which
+    mustn't count towards it. Returns the ID of the competition, and a map of (event name, username) to the ID of that
+    user's results in that event. """
+
+    session = database.session
+
+    events = {name: Event(name=name, totalSolves=5, eventFormat=event_format) for name, event_format in EVENTS}
+    comp, other_comp = Competition(title='Comp', active=True), Competition(title='Other comp', active=False)
+    usernames = sorted(set(username for results in RESULTS.values() for username, _, _, _ in results))
+    users = {username: User(username=username) for username in usernames}
+    session.add_all(list(events.values()) + [comp, other_comp] + list(users.values()))
+    session.flush()
+
+    comp_events = {name: CompetitionEvent(competition_id=comp.id, event_id=event.id) for name, event in events.items()}
+    other_comp_event = CompetitionEvent(competition_id=other_comp.id, event_id=events['3x3'].id)
+    session.add_all(list(comp_events.values()) + [other_comp_event])
+    session.flush()
+
+    results = dict()
+    for event_name, event_results in RESULTS.items():
+        for username, result, single, status in event_results:
+            results[(event_name, username)] = UserEventResults(
+                user_id=users[username].id, comp_event_id=comp_events[event_name].id, result=result, single=single,
+                average=result, is_complete=(status != 'incomplete'), is_blacklisted=(status == 'blacklisted'))
+
+    session.add_all(results.values())
+    session.add(UserEventResults(user_id=users['frank'].id, comp_event_id=other_comp_event.id, result='500',
+                                 single='400', average='500', is_complete=True, is_blacklisted=False))
+    session.commit()
+
+    return comp.id, {key: result.id for key, result in results.items()}
+
+
+def __overall_points_per_event(comp_id):
+    """ Calculates the overall points standings the way they were before they were calculated for a whole competition
+    at once, by loading and ranking each event's results separately. """
+
+    user_points = dict()
+
+    for comp_event in get_all_comp_events_for_comp(comp_id):
+        results = list(get_all_complete_user_results_for_comp_event(comp_event.id))
+        if not results:
+            continue
+
+        total_participants = len(results)
+        for i, _, result in sort_user_results_with_rankings(results, comp_event.Event.eventFormat):
+            username = result.User.username
+            if username not in user_points.keys():
+                user_points[username] = 0
+            user_points[username] += (total_participants - i)
+
+    user_points = [(username, points) for username, points in user_points.items()]
+    user_points.sort(key=lambda x: x[1], reverse=True)
+
+    return user_points
+
+
+def __end_competition(database, comp_id):
+    database.session.get(Competition, comp_id).active = False
+    database.session.commit()
+
+
+def test_overall_points_match_per_event_ranking(populated):
+    """ Test that ranking every event at once gives exactly the same standings, in the same order, as ranking each
+    event separately. """
+
+    comp_id, _ = populated
+    overall_points = calculate_overall_points(comp_id)
+
+    assert overall_points == __overall_points_per_event(comp_id)
+    assert [username for username, _ in overall_points] == ['carol', 'bob', 'dave', 'alice', 'eve']
+
+    # Users with the same points keep the order they first appear in
+    assert [points for _, points in overall_points] == [6, 5, 4, 3, 3]
+
+
+def test_overall_points_are_not_cached_while_competition_is_active(populated, database):
+    """ Test that a competition's standings aren't cached while it's still going, since its results still change. """
+
+    comp_id, results_ids = populated
+    assert get_overall_points(comp_id) == __overall_points_per_event(comp_id)
+    assert get_competition_overall_points(comp_id) is None
+
+    database.session.get(UserEventResults, results_ids[('3x3', 'dave')]).result = '500'
+    database.session.commit()
+
+    assert get_overall_points(comp_id) == __overall_points_per_event(comp_id)
+    assert get_overall_points(comp_id)[0] == ('dave', 7)
+
+
+def test_blacklisting_invalidates_cached_overall_points(populated, database):
+    """ Test that a finished competition's standings are cached, and that blacklisting or unblacklisting results in it
+    recalculates them. """
+
+    comp_id, results_ids = populated
+    __end_competition(database, comp_id)
+
+    expected = __overall_points_per_event(comp_id)
+    assert get_overall_points(comp_id) == expected
+    assert get_competition_overall_points(comp_id) is not None
+
+    # Results don't change once a competition is over without going through blacklisting, so this isn't picked up
+    database.session.get(UserEventResults, results_ids[('3x3', 'dave')]).result = '500'
+    database.session.commit()
+    assert get_overall_points(comp_id) == expected
+
+    blacklist_results(results_ids[('3x3', 'carol')], 'note')
+    assert get_competition_overall_points(comp_id) is None
+    assert get_overall_points(comp_id) == __overall_points_per_event(comp_id)
+    assert get_overall_points(comp_id)[:2] == [('dave', 6), ('bob', 3)]
+
+    unblacklist_results(results_ids[('3x3', 'eve')])
+    assert get_overall_points(comp_id) == __overall_points_per_event(comp_id)
+    assert get_overall_points(comp_id)[:2] == [('dave', 7), ('eve', 5)]
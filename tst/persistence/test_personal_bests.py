@@ -0,0 +1,119 @@
+""" Tests for recalculating users' PB flags, and marking the events whose latest PBs changed as dirty. """
+
+import pytest
+
+from cubersio import app
+from cubersio.business.user_results.personal_bests import recalculate_user_pbs_for_event
+from cubersio.commands import recalculate_pbs
+from cubersio.persistence import user_site_rankings_manager
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, User, UserEventResults
+from cubersio.tasks import huey
+from cubersio.tasks.competition_management import update_pbs
+
+# Put Huey in immediate mode so the tasks execute synchronously
+huey.immediate = True
+
+EVENT_NAMES = ['3x3', '2x2', '4x4']
+
+
+@pytest.fixture
+def populated(database):
+    """ A database where alice and bob each have a PB result in two past competitions in every event, with the newer
+    one correctly flagged as their latest PB. Returns a dict of event name to ID. """
+
+    session = database.session
+
+    events = [Event(name=name, totalSolves=5, eventFormat='Ao5') for name in EVENT_NAMES]
+    users = [User(username='alice'), User(username='bob')]
+    comps = [Competition(title=f'Comp {i}', active=False) for i in range(2)]
+    session.add_all(events + users + comps)
+    session.flush()
+
+    for comp in comps:
+        for event in events:
+            comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+            session.add(comp_event)
+            session.flush()
+
+            is_latest = comp is comps[-1]
+            for user in users:
+                session.add(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single='1000',
+                                             average='1200', result='1200', is_complete=True, is_blacklisted=False,
+                                             was_pb_single=True, was_pb_average=True, is_latest_pb_single=is_latest,
+                                             is_latest_pb_average=is_latest))
+
+    session.commit()
+    return {event.name: event.id for event in events}
+
+
+@pytest.fixture
+def dirty_event_ids(monkeypatch):
+    """ Records the ID of every event marked dirty, in order. """
+
+    event_ids = list()
+    monkeypatch.setattr(user_site_rankings_manager, '__EVENT_PBS_CHANGED_LISTENERS', [event_ids.append])
+    return event_ids
+
+
+def __flag_older_results_as_latest(database, event_id):
+    """ Moves the latest PB flags of everybody's results in the specified event onto their older results. """
+
+    for results in database.session.query(UserEventResults).\
+            join(CompetitionEvent).\
+            filter(CompetitionEvent.event_id == event_id):
+        is_older = results.CompetitionEvent.competition_id == 1
+        results.is_latest_pb_single = is_older
+        results.is_latest_pb_average = is_older
+
+    database.session.commit()
+
+
+def test_update_pbs_marks_changed_events_dirty_once(populated, database, dirty_event_ids):
+    """ Test that updating everybody's latest PBs marks only the events whose flags changed as dirty, once each. """
+
+    __flag_older_results_as_latest(database, populated['2x2'])
+
+    update_pbs()
+
+    assert dirty_event_ids == [populated['2x2']]
+
+
+def test_update_pbs_without_changes_marks_nothing_dirty(populated, dirty_event_ids):
+    """ Test that updating everybody's latest PBs doesn't mark any events dirty when no flags changed. """
+
+    update_pbs()
+
+    assert dirty_event_ids == []
+
+
+def test_recalculating_unchanged_pbs_doesnt_mark_event_dirty(populated, dirty_event_ids):
+    """ Test that recalculating a user's PBs which don't move doesn't mark the event dirty. """
+
+    assert not recalculate_user_pbs_for_event(1, populated['3x3'])
+    assert dirty_event_ids == []
+
+
+def test_recalculating_changed_pbs_marks_event_dirty(populated, database, dirty_event_ids):
+    """ Test that recalculating a user's PBs marks the event dirty when the latest PB flags move, unless told not to,
+    and reports the change either way. """
+
+    __flag_older_results_as_latest(database, populated['3x3'])
+
+    assert recalculate_user_pbs_for_event(1, populated['3x3'])
+    assert dirty_event_ids == [populated['3x3']]
+
+    assert recalculate_user_pbs_for_event(2, populated['3x3'], mark_dirty=False)
+    assert dirty_event_ids == [populated['3x3']]
+
+
+def test_recalculate_pbs_command_marks_changed_events_dirty_once(populated, database, dirty_event_ids):
+    """ Test that the command to recalculate everybody's PBs marks each event whose flags changed dirty once, no matter
+    how many users' flags changed in it. """
+
+    __flag_older_results_as_latest(database, populated['2x2'])
+    __flag_older_results_as_latest(database, populated['4x4'])
+
+    result = app.test_cli_runner().invoke(recalculate_pbs)
+
+    assert result.exit_code == 0
+    assert dirty_event_ids == [populated['2x2'], populated['4x4']]
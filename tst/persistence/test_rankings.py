@@ -0,0 +1,294 @@
+""" Tests for calculating user site rankings. """
+
+import json
+import multiprocessing
+
+import pytest
+
+from cubersio import app
+from cubersio.business import rankings
+from cubersio.business.rankings import calculate_user_site_rankings, calculate_user_site_rankings_incremental,\
+    RANKINGS_ENGINE_PYTHON, RANKINGS_ENGINE_SQL
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, EventSiteRankingsState, User,\
+    UserEventResults, UserEventSiteRanking, UserSiteRankings
+from cubersio.persistence import user_site_rankings_manager
+from cubersio.persistence.user_results_manager import save_event_results
+from cubersio.persistence.user_site_rankings_manager import get_event_site_rankings_for_user,\
+    get_live_event_site_rankings_for_user, mark_event_site_rankings_dirty
+
+# How many users have a PB in the event for the memory ceiling tests
+MEMORY_CEILING_USER_COUNT = 300
+
+# The events for the engine equivalence tests, and each user's PB single and average in them, and whether those PBs
+# are blacklisted. These include tied PBs, DNFs, PB singles without an average, coded MBLD results, and a user whose
+# only PB is blacklisted.
+EQUIVALENCE_EVENTS = [('3x3', 'Ao5'), ('2GEN', 'Ao5'), ('MBLD', 'Bo1'), ('FMC', 'Mo3')]
+EQUIVALENCE_PBS = {
+    '3x3': [('alice', '1000', '1200', False), ('bob', '1000', '1200', False), ('carol', '900', 'DNF', False),
+            ('dave', 'DNF', 'DNF', False), ('eve', '1100', '', False), ('frank', '500', '600', True)],
+    '2GEN': [('alice', '800', '900', False), ('carol', '700', '1000', False), ('eve', '800', '900', False),
+             ('gina', '400', '500', True)],
+    'MBLD': [('alice', '94300000', '', False), ('bob', '94300000', '', False), ('carol', 'DNF', '', False),
+             ('dave', '96200001', '', False), ('frank', '93100000', '', True)],
+    'FMC': [('bob', '28', '3100', False), ('dave', '25', 'DNF', False), ('eve', '28', '3000', False)],
+}
+
+# Each site rankings engine, other than the full Python engine the rest are compared against
+ENGINES = {
+    'parallel': lambda: calculate_user_site_rankings(worker_count=2, streaming=False, engine=RANKINGS_ENGINE_PYTHON),
+    'streaming': lambda: calculate_user_site_rankings(streaming=True, engine=RANKINGS_ENGINE_PYTHON),
+    'sql': lambda: calculate_user_site_rankings(engine=RANKINGS_ENGINE_SQL),
+}
+
+# Each way of incrementally recalculating just the changed events' site rankings
+INCREMENTAL_ENGINES = {
+    'python': lambda: calculate_user_site_rankings_incremental(worker_count=1, streaming=False,
+                                                               engine=RANKINGS_ENGINE_PYTHON),
+    'parallel': lambda: calculate_user_site_rankings_incremental(worker_count=2, streaming=False,
+                                                                 engine=RANKINGS_ENGINE_PYTHON),
+    'streaming': lambda: calculate_user_site_rankings_incremental(streaming=True, engine=RANKINGS_ENGINE_PYTHON),
+    'sql': lambda: calculate_user_site_rankings_incremental(engine=RANKINGS_ENGINE_SQL),
+}
+
+
+@pytest.fixture
+def many_users(database):
+    """ A database with MEMORY_CEILING_USER_COUNT users who each have a PB single and average in a single event.
+    Returns the ID of the event. """
+
+    session = database.session
+
+    event = Event(name='3x3', totalSolves=5, eventFormat='Ao5')
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=f'user_{i}') for i in range(MEMORY_CEILING_USER_COUNT)]
+    session.add_all([event, comp] + users)
+    session.flush()
+
+    comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+    session.add(comp_event)
+    session.flush()
+
+    session.add_all(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single=str(1000 + i),
+                                     average=str(1200 + i), result=str(1200 + i), is_complete=True,
+                                     is_latest_pb_single=True, is_latest_pb_average=True)
+                    for i, user in enumerate(users))
+    session.commit()
+
+    return event.id
+
+
+@pytest.fixture
+def over_memory_ceiling(monkeypatch):
+    """ Sets a memory ceiling which the process is always over. Returns a list which the number of memory usage checks
+    and the size of every batch of site rankings saved are recorded in, as ('check', None) and ('save', size). """
+
+    calls = list()
+    save_site_rankings = rankings.bulk_update_site_rankings
+
+    def get_current_rss_mb():
+        calls.append(('check', None))
+        return 1024
+
+    def bulk_update_site_rankings(site_rankings):
+        calls.append(('save', len(site_rankings)))
+        save_site_rankings(site_rankings)
+
+    monkeypatch.setitem(app.config, 'RANKINGS_MEMORY_CEILING_MB', 1)
+    monkeypatch.setattr(rankings, 'get_current_rss_mb', get_current_rss_mb)
+    monkeypatch.setattr(rankings, 'bulk_update_site_rankings', bulk_update_site_rankings)
+
+    return calls
+
+
+def test_streaming_memory_ceiling_shrinks_batches(many_users, database, over_memory_ceiling):
+    """ Test that streaming mode only checks memory usage every so often, and that going over the memory ceiling saves
+    the current batch early and shrinks later batches, rather than saving every user on their own. """
+
+    calculate_user_site_rankings(streaming=True, engine=RANKINGS_ENGINE_PYTHON)
+
+    # Each check saves the current batch and halves the batch size, from 250 down to 25, in between filling batches
+    checks = [call for call, _ in over_memory_ceiling].count('check')
+    saves = [size for call, size in over_memory_ceiling if call == 'save']
+
+    assert checks == MEMORY_CEILING_USER_COUNT // 50
+    assert saves == [50, 50, 50, 31, 19, 25, 25, 25, 25]
+    assert database.session.query(UserSiteRankings).count() == MEMORY_CEILING_USER_COUNT
+
+
+def test_streaming_memory_ceiling_shrinks_incremental_batches(many_users, database, over_memory_ceiling):
+    """ Test that incremental streaming runs also shrink their batches while memory usage is over the ceiling. """
+
+    calculate_user_site_rankings(streaming=False, engine=RANKINGS_ENGINE_PYTHON)
+    mark_event_site_rankings_dirty(many_users)
+    over_memory_ceiling.clear()
+
+    calculate_user_site_rankings_incremental(streaming=True, engine=RANKINGS_ENGINE_PYTHON)
+
+    assert over_memory_ceiling == [('save', 250), ('check', None), ('save', 50), ('check', None)]
+
+    over_memory_ceiling.clear()
+    mark_event_site_rankings_dirty(many_users)
+    calculate_user_site_rankings_incremental(streaming=False, engine=RANKINGS_ENGINE_PYTHON)
+
+    assert over_memory_ceiling == [('save', 250), ('save', 50)]
+
+
+def test_live_site_rankings_only_load_changed_events(database):
+    """ Test that a user's live site rankings only load the live ranks of events whose PBs have changed since site
+    rankings were calculated, and that those reflect the new PBs while the other events keep their stored rankings. """
+
+    session = database.session
+
+    events = [Event(name='3x3', totalSolves=5, eventFormat='Ao5'), Event(name='2x2', totalSolves=5, eventFormat='Ao5')]
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=f'user_{i}') for i in range(3)]
+    session.add_all(events + [comp] + users)
+    session.flush()
+
+    comp_events = [CompetitionEvent(competition_id=comp.id, event_id=event.id) for event in events]
+    session.add_all(comp_events)
+    session.flush()
+
+    for comp_event in comp_events:
+        session.add_all(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single=str(1000 + 100 * i),
+                                         average=str(1200 + 100 * i), result=str(1200 + 100 * i), is_complete=True,
+                                         was_pb_single=True, was_pb_average=True, is_latest_pb_single=True,
+                                         is_latest_pb_average=True)
+                        for i, user in enumerate(users))
+    session.commit()
+
+    calculate_user_site_rankings(streaming=False, engine=RANKINGS_ENGINE_PYTHON)
+    event_ids = [event.id for event in events]
+    slowest_user_id = users[-1].id
+
+    # The slowest user sets the fastest 3x3 results
+    results = session.query(UserEventResults).\
+        filter(UserEventResults.user_id == slowest_user_id).\
+        filter(UserEventResults.comp_event_id == comp_events[0].id).\
+        one()
+    results.single, results.average, results.result = '500', '600', '600'
+    save_event_results(results, event_ids[0])
+
+    stored = get_event_site_rankings_for_user(slowest_user_id)
+    live = get_live_event_site_rankings_for_user(slowest_user_id)
+
+    assert list(getattr(user_site_rankings_manager, '__LIVE_EVENT_RANKS')) == [event_ids[0]]
+    assert live[event_ids[0]][:4] == ('500', 1, '600', 1)
+    assert live[event_ids[1]] == stored[event_ids[1]]
+
+
+@pytest.fixture
+def equivalence_results(file_database):
+    """ A database with the PBs in EQUIVALENCE_PBS, in a file so parallel workers can read it too. Returns a map of
+    (event name, username) to the ID of the results holding that user's PB in that event. """
+
+    session = file_database.session
+
+    events = {name: Event(name=name, totalSolves=5, eventFormat=event_format)
+              for name, event_format in EQUIVALENCE_EVENTS}
+    comp = Competition(title='Comp', active=True)
+    usernames = sorted(set(username for pbs in EQUIVALENCE_PBS.values() for username, _, _, _ in pbs))
+    users = {username: User(username=username) for username in usernames}
+    session.add_all(list(events.values()) + [comp] + list(users.values()))
+    session.flush()
+
+    comp_events = {name: CompetitionEvent(competition_id=comp.id, event_id=event.id) for name, event in events.items()}
+    session.add_all(comp_events.values())
+    session.flush()
+
+    results = dict()
+    for event_name, pbs in EQUIVALENCE_PBS.items():
+        for username, single, average, is_blacklisted in pbs:
+            results[(event_name, username)] = UserEventResults(
+                user_id=users[username].id, comp_event_id=comp_events[event_name].id, single=single, average=average,
+                result=average or single, is_complete=True, is_blacklisted=is_blacklisted, was_pb_single=True,
+                was_pb_average=bool(average), is_latest_pb_single=True, is_latest_pb_average=bool(average))
+
+    session.add_all(results.values())
+    session.commit()
+
+    return {key: result.id for key, result in results.items()}
+
+
+def __calculate_from_scratch(database, calculate):
+    """ Throws away all site rankings and the events' site rankings states, calculates site rankings from scratch with
+    `calculate`, and returns all the resulting rows. """
+
+    database.session.query(UserEventSiteRanking).delete()
+    database.session.query(UserSiteRankings).delete()
+    database.session.query(EventSiteRankingsState).delete()
+    database.session.commit()
+
+    calculate()
+    return __site_rankings_rows(database)
+
+
+def __site_rankings_rows(database):
+    """ Returns every user's UserSiteRankings and UserEventSiteRanking rows, without their IDs and timestamps, as a
+    tuple of (map of user ID to UserSiteRankings row, sorted list of UserEventSiteRanking rows). """
+
+    database.session.expire_all()
+
+    site_rankings = {rankings.user_id: (json.loads(rankings.data), rankings.sum_all_single, rankings.sum_all_average,
+                                        rankings.sum_wca_single, rankings.sum_wca_average, rankings.sum_non_wca_single,
+                                        rankings.sum_non_wca_average, rankings.wca_kinchrank,
+                                        rankings.non_wca_kinchrank, rankings.all_kinchrank)
+                     for rankings in database.session.query(UserSiteRankings)}
+
+    event_site_rankings = sorted((ranking.user_id, ranking.event_id, ranking.pb_single, ranking.single_rank,
+                                  ranking.pb_average, ranking.average_rank, ranking.kinchrank)
+                                 for ranking in database.session.query(UserEventSiteRanking))
+
+    return site_rankings, event_site_rankings
+
+
+@pytest.mark.parametrize('engine', list(ENGINES))
+def test_engines_calculate_identical_site_rankings(equivalence_results, file_database, engine):
+    """ Test that every site rankings engine calculates exactly the same site rankings as the full Python engine. """
+
+    if engine == 'parallel' and multiprocessing.get_start_method() != 'fork':
+        pytest.skip("Parallel workers only share the test's database when they're forked.")
+    if engine == 'sql':
+        assert rankings._sql_engine_supported()
+
+    expected = __calculate_from_scratch(file_database,
+                                        lambda: calculate_user_site_rankings(worker_count=1, streaming=False,
+                                                                             engine=RANKINGS_ENGINE_PYTHON))
+    site_rankings, event_site_rankings = expected
+
+    # Make sure all the edge cases made it into the rankings being compared: blacklisted PBs are left out, so frank and
+    # gina aren't ranked at all, and both tied 3x3 singles are ranked the same
+    assert len(site_rankings) == 5
+    assert len(event_site_rankings) == 5 * len(EQUIVALENCE_EVENTS)
+    assert [rank for _, _, pb_single, rank, _, _, _ in event_site_rankings if pb_single == '1000'] == [2, 2]
+
+    assert __calculate_from_scratch(file_database, ENGINES[engine]) == expected
+
+
+@pytest.mark.parametrize('engine', list(INCREMENTAL_ENGINES))
+def test_incremental_engine_matches_full_calculation(equivalence_results, file_database, engine):
+    """ Test that after some events' PBs change, incrementally recalculating site rankings ends up with exactly the
+    same site rankings as calculating them from scratch. """
+
+    if engine == 'parallel' and multiprocessing.get_start_method() != 'fork':
+        pytest.skip("Parallel workers only share the test's database when they're forked.")
+
+    calculate_user_site_rankings(worker_count=1, streaming=False, engine=RANKINGS_ENGINE_PYTHON)
+    session = file_database.session
+
+    # Bob sets a faster 3x3 single and average, breaking the ties, and carol's 2GEN PBs are blacklisted
+    bob_results = session.get(UserEventResults, equivalence_results[('3x3', 'bob')])
+    bob_results.single, bob_results.average, bob_results.result = '950', '1150', '1150'
+    session.get(UserEventResults, equivalence_results[('2GEN', 'carol')]).is_blacklisted = True
+    session.commit()
+
+    for event_name in ['3x3', '2GEN']:
+        mark_event_site_rankings_dirty(session.query(Event.id).filter(Event.name == event_name).scalar())
+
+    INCREMENTAL_ENGINES[engine]()
+    incremental = __site_rankings_rows(file_database)
+
+    assert incremental == __calculate_from_scratch(file_database,
+                                                   lambda: calculate_user_site_rankings(worker_count=1,
+                                                                                        streaming=False,
+                                                                                        engine=RANKINGS_ENGINE_PYTHON))
@@ -0,0 +1,153 @@
+""" Tests for freezing a finished competition's leaderboards and overall points standings into snapshots. """
+
+import json
+
+import pytest
+
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+from cubersio.business.competition.overall_points import calculate_overall_points
+from cubersio.business.competition.snapshots import refresh_comp_event_snapshot, snapshot_competition
+from cubersio.persistence.comp_event_leaderboards_manager import set_comp_event_leaderboards_cache_backend
+from cubersio.persistence.comp_event_snapshots_manager import get_comp_event_snapshot
+from cubersio.persistence.comp_manager import get_competition_overall_points
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, Scramble, User, UserEventResults
+from cubersio.persistence.user_manager import unverify_user, verify_user
+from cubersio.persistence.user_results_manager import blacklist_results
+from cubersio.util.cache import LRUCacheBackend
+
+# Each user's result in each of the competition's events
+EVENT_NAMES = ['3x3', '2x2']
+RESULTS = [('alice', '1200'), ('bob', '1100'), ('carol', '1300')]
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the results in RESULTS in every event of an active competition, and an in-memory leaderboards
+    cache. Returns the ID of the competition, the IDs of its competition events, and a map of username to user ID. """
+
+    session = database.session
+
+    events = [Event(name=name, totalSolves=5, eventFormat='Ao5') for name in EVENT_NAMES]
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=username, is_verified=False) for username, _ in RESULTS]
+    session.add_all(events + [comp] + users)
+    session.flush()
+
+    comp_events = [CompetitionEvent(competition_id=comp.id, event_id=event.id) for event in events]
+    session.add_all(comp_events)
+    session.flush()
+
+    for comp_event in comp_events:
+        session.add_all(Scramble(scramble='R U', competition_event_id=comp_event.id) for _ in range(5))
+        session.add_all(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single=result, average=result,
+                                         result=result, is_complete=True, is_blacklisted=False,
+                                         times_string='12.00, 12.00, 12.00, 12.00, 12.00')
+                        for user, (_, result) in zip(users, RESULTS))
+    session.commit()
+
+    set_comp_event_leaderboards_cache_backend(LRUCacheBackend(16))
+    yield comp.id, [comp_event.id for comp_event in comp_events], {user.username: user.id for user in users}
+    set_comp_event_leaderboards_cache_backend(None)
+
+
+def __end_competition(database, comp_id):
+    database.session.get(Competition, comp_id).active = False
+    database.session.commit()
+
+
+def __leaderboard(database, comp_event_id):
+    """ Reads the competition event's leaderboard as a fresh request would, as plain lists and tuples so leaderboards
+    read from different places can be compared. """
+
+    database.session.expire_all()
+    leaderboard = get_comp_event_leaderboard(database.session.get(CompetitionEvent, comp_event_id))
+
+    return (leaderboard.results, leaderboard.scrambles, [tuple(rank) for rank in leaderboard.public_ranks],
+            [tuple(rank) for rank in leaderboard.all_ranks])
+
+
+def __usernames_and_verified(database, comp_event_id):
+    results, _, public_ranks, _ = __leaderboard(database, comp_event_id)
+    return [(results[i].User.username, results[i].User.is_verified) for _, _, i in public_ranks]
+
+
+def test_snapshot_round_trip(populated, database, count_queries):
+    """ Test that a finished competition's leaderboards are served from their snapshots exactly as they were built from
+    its results, without loading the results again, and that its overall points standings are cached too. """
+
+    comp_id, comp_event_ids, _ = populated
+    built = [__leaderboard(database, comp_event_id) for comp_event_id in comp_event_ids]
+
+    __end_competition(database, comp_id)
+    assert snapshot_competition(comp_id)
+
+    # A process with an empty cache serves the snapshot
+    set_comp_event_leaderboards_cache_backend(LRUCacheBackend(16))
+    for comp_event_id, leaderboard in zip(comp_event_ids, built):
+        with count_queries() as counter:
+            assert __leaderboard(database, comp_event_id) == leaderboard
+
+        assert not any('FROM user_event_results' in statement for statement in counter.statements)
+
+    assert json.loads(get_competition_overall_points(comp_id)) ==\
+        [[username, points] for username, points in calculate_overall_points(comp_id)]
+
+
+def test_active_competition_is_not_snapshotted(populated):
+    """ Test that a competition which is still going isn't snapshotted, since its results could still change. """
+
+    comp_id, comp_event_ids, _ = populated
+
+    assert not snapshot_competition(comp_id)
+    assert all(get_comp_event_snapshot(comp_event_id) is None for comp_event_id in comp_event_ids)
+    assert get_competition_overall_points(comp_id) is None
+
+
+def test_blacklisting_refreshes_snapshot(populated, database):
+    """ Test that blacklisting results in a finished competition throws away its snapshot and overall points, and
+    that refreshing the competition event's snapshot rebuilds both without the blacklisted results. """
+
+    comp_id, comp_event_ids, user_ids = populated
+    __end_competition(database, comp_id)
+    snapshot_competition(comp_id)
+
+    results_id = database.session.query(UserEventResults.id).\
+        filter(UserEventResults.user_id == user_ids['bob']).\
+        filter(UserEventResults.comp_event_id == comp_event_ids[0]).\
+        scalar()
+    blacklist_results(results_id, 'note')
+
+    assert get_comp_event_snapshot(comp_event_ids[0]) is None
+    assert get_comp_event_snapshot(comp_event_ids[1]) is not None
+    assert get_competition_overall_points(comp_id) is None
+
+    refresh_comp_event_snapshot(database.session.get(CompetitionEvent, comp_event_ids[0]))
+
+    snapshot = get_comp_event_snapshot(comp_event_ids[0])
+    assert [snapshot['results'][i][1][0] for _, _, i in snapshot['public_ranks']] == ['alice', 'carol']
+    assert json.loads(get_competition_overall_points(comp_id)) == [['alice', 2], ['bob', 2], ['carol', 0]]
+    assert [username for username, _ in __usernames_and_verified(database, comp_event_ids[0])] == ['alice', 'carol']
+
+
+@pytest.mark.parametrize('competition_is_over', [False, True])
+def test_verifying_user_invalidates_leaderboards(populated, database, competition_is_over):
+    """ Test that verifying or unverifying a user shows straight away on the leaderboards of every competition event
+    they have results in, whether those are cached or frozen into snapshots. """
+
+    comp_id, comp_event_ids, user_ids = populated
+    if competition_is_over:
+        __end_competition(database, comp_id)
+        snapshot_competition(comp_id)
+
+    for comp_event_id in comp_event_ids:
+        assert __usernames_and_verified(database, comp_event_id)[0] == ('bob', False)
+
+    verify_user(user_ids['bob'])
+
+    for comp_event_id in comp_event_ids:
+        assert __usernames_and_verified(database, comp_event_id)[0] == ('bob', True)
+
+    unverify_user(user_ids['bob'])
+
+    for comp_event_id in comp_event_ids:
+        assert __usernames_and_verified(database, comp_event_id)[0] == ('bob', False)
@@ -0,0 +1,177 @@
+""" Tests for looking up users by username, and searching and picking from the usernames of active users. """
+
+import pytest
+from sqlalchemy import func, select, text
+
+from cubersio import app
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, User, UserEventResults
+from cubersio.persistence.user_manager import add_user_to_username_index, get_random_active_username,\
+    get_user_by_username_case_insensitive, invalidate_username_index, search_active_usernames
+from cubersio.persistence.user_results_manager import blacklist_results, unblacklist_results
+
+# Each user, and whether they have results which aren't blacklisted, blacklisted results, or no results at all
+USERS = [('alice', 'active'), ('Alfred', 'active'), ('albert', 'blacklisted'), ('Bob', 'active'),
+         ('bobby_tables', 'active'), ('al', 'inactive'), ('carol', 'active')]
+ACTIVE_USERNAMES = ['Alfred', 'alice', 'Bob', 'bobby_tables', 'carol']
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the users in USERS, and their results. Returns a map of username to the user's ID, and the ID
+    of the competition event which the results are in. """
+
+    session = database.session
+
+    event = Event(name='3x3', totalSolves=5, eventFormat='Ao5')
+    comp = Competition(title='Comp', active=True)
+    users = [User(username=username) for username, _ in USERS]
+    session.add_all([event, comp] + users)
+    session.flush()
+
+    comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+    session.add(comp_event)
+    session.flush()
+
+    for user, (_, status) in zip(users, USERS):
+        if status != 'inactive':
+            session.add(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single='1000', average='1200',
+                                         result='1200', is_complete=True, is_blacklisted=(status == 'blacklisted')))
+
+    session.commit()
+    return {user.username: user.id for user in users}, comp_event.id
+
+
+@pytest.mark.parametrize('prefix, limit, expected', [
+    ('', 10, ACTIVE_USERNAMES),
+    ('', 2, ['Alfred', 'alice']),
+    ('al', 10, ['Alfred', 'alice']),
+    ('AL', 10, ['Alfred', 'alice']),
+    ('bob', 10, ['Bob', 'bobby_tables']),
+    ('bobb', 10, ['bobby_tables']),
+    ('carol', 10, ['carol']),
+    ('carols', 10, []),
+    ('z', 10, []),
+    ('b', 0, []),
+])
+def test_search_active_usernames(populated, prefix, limit, expected):
+    """ Test that searching active users' usernames finds those which start with the prefix, ignoring case, without
+    users who have no results or only blacklisted results. """
+
+    assert search_active_usernames(prefix, limit) == expected
+
+
+def test_search_active_usernames_query_count(populated, count_queries):
+    """ Test that the username index is built in a single query, and then searched without touching the database. """
+
+    with count_queries() as counter:
+        search_active_usernames('a', 10)
+        search_active_usernames('b', 10)
+        get_random_active_username()
+
+    assert counter.count == 1
+
+
+def test_get_random_active_username(populated):
+    """ Test that random usernames are always picked from active users. """
+
+    assert set(get_random_active_username() for _ in range(50)) <= set(ACTIVE_USERNAMES)
+
+
+def test_get_random_active_username_without_active_users(database):
+    """ Test that no username is picked if there aren't any active users. """
+
+    assert get_random_active_username() is None
+
+
+def test_add_user_to_username_index(populated, count_queries):
+    """ Test that a user who becomes active is added to the username index without rebuilding it, and that adding a
+    user who's already in it doesn't touch the database. """
+
+    user_ids, _ = populated
+    assert search_active_usernames('al', 10) == ['Alfred', 'alice']
+
+    with count_queries() as counter:
+        add_user_to_username_index(user_ids['alice'])
+    assert counter.count == 0
+
+    with count_queries() as counter:
+        add_user_to_username_index(user_ids['al'])
+        assert search_active_usernames('al', 10) == ['al', 'Alfred', 'alice']
+    assert counter.count == 1
+
+
+def test_unblacklisted_user_is_added_to_username_index(populated, database):
+    """ Test that a user whose only results are unblacklisted becomes searchable straight away, and that blacklisting
+    a user's only results removes them once the username index is rebuilt. """
+
+    user_ids, _ = populated
+    assert search_active_usernames('alb', 10) == []
+
+    results_id = database.session.query(UserEventResults.id).\
+        filter(UserEventResults.user_id == user_ids['albert']).\
+        scalar()
+    unblacklist_results(results_id)
+
+    assert search_active_usernames('alb', 10) == ['albert']
+
+    blacklist_results(results_id, 'note')
+    invalidate_username_index()
+
+    assert search_active_usernames('alb', 10) == []
+
+
+def test_username_index_expires(populated, database, monkeypatch):
+    """ Test that the username index is rebuilt once it's older than the configured TTL, picking up users whose
+    results were saved elsewhere. """
+
+    user_ids, comp_event_id = populated
+    assert search_active_usernames('al', 10) == ['Alfred', 'alice']
+
+    database.session.add(UserEventResults(user_id=user_ids['al'], comp_event_id=comp_event_id, single='1000',
+                                          average='1200', result='1200', is_complete=True, is_blacklisted=False))
+    database.session.commit()
+
+    assert search_active_usernames('al', 10) == ['Alfred', 'alice']
+
+    monkeypatch.setitem(app.config, 'USERNAME_INDEX_TTL_SECONDS', 0)
+
+    assert search_active_usernames('al', 10) == ['al', 'Alfred', 'alice']
+
+
+@pytest.mark.parametrize('username, expected', [
+    ('Bob', 'Bob'),
+    ('bob', 'Bob'),
+    ('BOBBY_tables', 'bobby_tables'),
+    ('bo', None),
+    ('nobody', None),
+])
+def test_get_user_by_username_case_insensitive(populated, username, expected):
+    """ Test that users are found by username regardless of case. """
+
+    user = get_user_by_username_case_insensitive(username)
+    assert (user.username if user else None) == expected
+
+
+def test_get_user_by_username_case_insensitive_prefers_exact_case(populated, database, count_queries):
+    """ Test that if several usernames only differ by case, the one cased exactly like the lookup is found, and that
+    each lookup is a single query. """
+
+    database.session.add_all([User(username='BOB'), User(username='boB')])
+    database.session.commit()
+
+    for username in ['Bob', 'BOB', 'boB']:
+        with count_queries() as counter:
+            assert get_user_by_username_case_insensitive(username).username == username
+        assert counter.count == 1
+
+
+def test_get_user_by_username_case_insensitive_uses_index(populated, database):
+    """ Test that looking up a username case-insensitively searches the lowercase username index rather than scanning
+    the users table. """
+
+    query = select(User.id).where(func.lower(User.username) == func.lower('BOB'))
+    connection = database.session.connection()
+    sql = str(query.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    plan = [detail for _, _, _, detail in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+    assert any('ix_users_username_lower' in detail for detail in plan)
@@ -0,0 +1,263 @@
+""" Tests for loading UserEventResults, and the number of queries it takes. """
+
+import pytest
+
+from cubersio.persistence.events_manager import invalidate_event_catalog
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, Scramble, User, UserEventResults,\
+    UserSolve
+from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_and_user,\
+    get_results_for_comp_event, get_all_complete_user_results_for_user_and_event,\
+    get_all_complete_user_results_for_comp_event,\
+    get_pb_sort_values_except_current_comp, get_solves_and_scrambles_for_results,\
+    get_all_complete_user_results_history_for_user
+from cubersio.util.ranks import to_sort_value, DNF_SORT_VALUE
+
+# Each past competition has one of each of these events, and every user has results in all of them
+EVENT_NAMES = ['3x3', 'FMC', '3BLD', 'MBLD']
+USER_COUNT = 3
+
+
+def __populate(database, comp_count):
+    """ Adds `comp_count` competitions, the last of which is active, and complete PB results for every user in every
+    event of each one. Returns the IDs of the competitions. """
+
+    session = database.session
+
+    events = [Event(name=name, totalSolves=5, eventFormat='Ao5') for name in EVENT_NAMES]
+    users = [User(username=f'user_{i}') for i in range(USER_COUNT)]
+    session.add_all(events + users)
+
+    comps = [Competition(title=f'Comp {i}', active=(i == comp_count - 1)) for i in range(comp_count)]
+    session.add_all(comps)
+    session.flush()
+
+    for comp in comps:
+        for event in events:
+            comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+            session.add(comp_event)
+            session.flush()
+
+            for user in users:
+                session.add(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single='1000',
+                                             average='1200', result='1200', is_complete=True, was_pb_single=True,
+                                             is_blacklisted=False, times_string='10.00'))
+
+    session.commit()
+    return [comp.id for comp in comps]
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with several competitions full of results, whose competition events' event names are already
+    cached, like they would be in a running app. """
+
+    comp_ids = __populate(database, comp_count=5)
+    for comp_id in comp_ids:
+        [r.is_fmc for r in get_all_complete_user_results_for_comp_and_user(comp_id, 1)]
+
+    return comp_ids
+
+
+@pytest.mark.parametrize('loader, expected_queries', [
+    (lambda comp_ids: get_all_complete_user_results_for_comp_and_user(comp_ids[0], 1), 1),
+    (lambda comp_ids: get_results_for_comp_event(1), 1),
+    # The competition event's event is subquery-loaded alongside the results
+    (lambda comp_ids: get_all_complete_user_results_for_comp_event(1), 2),
+    (lambda comp_ids: get_all_complete_user_results_for_user_and_event(1, 2), 1),
+    (lambda comp_ids: get_all_complete_user_results_history_for_user(1), 1),
+    (lambda comp_ids: get_all_complete_user_results_history_for_user(1, comps_limit=2, comps_offset=1), 1),
+])
+def test_result_loaders_query_count(populated, count_queries, loader, expected_queries):
+    """ Test that loading results doesn't lazily load each result's competition event and event, whether the results
+    share a competition event or are spread across many. """
+
+    with count_queries() as counter:
+        results = loader(populated)
+        flags = [(r.is_fmc, r.is_blind, r.is_mbld) for r in results]
+
+    assert results
+    assert counter.count == expected_queries, counter.statements
+    assert len(flags) == len(results)
+
+
+def test_result_event_flags(populated, count_queries):
+    """ Test that results know which kind of event they're for, without any queries beyond loading them. """
+
+    with count_queries() as counter:
+        results = get_all_complete_user_results_for_comp_and_user(populated[0], 1)
+        flags = [(r.is_fmc, r.is_blind, r.is_mbld) for r in results]
+
+    # Results are ordered by event, which are in the same order as EVENT_NAMES
+    assert flags == [
+        (False, False, False),
+        (True, False, False),
+        (False, True, False),
+        (False, False, True),
+    ]
+    assert counter.count == 1
+
+
+def test_new_comp_events_are_picked_up(populated, database, count_queries):
+    """ Test that results for a competition event which didn't exist when the event names were cached get the right
+    event flags, at the cost of a single extra query for its competition's competition events. """
+
+    comp_event = CompetitionEvent(competition_id=populated[-1], event_id=2)
+    database.session.add(comp_event)
+    database.session.flush()
+    database.session.add(UserEventResults(user_id=1, comp_event_id=comp_event.id, single='300', average='320',
+                                          result='320', is_complete=True, is_blacklisted=False))
+    database.session.commit()
+    comp_event_id = comp_event.id
+
+    with count_queries() as counter:
+        results = get_results_for_comp_event(comp_event_id)
+        assert [r.is_fmc for r in results] == [True]
+
+    assert counter.count == 2
+    assert 'competition_event.competition_id = ' in counter.statements[-1]
+
+
+def test_event_names_are_looked_up_after_loading(database, count_queries):
+    """ Test that results' event names aren't looked up while they're being loaded, and that the first time they're
+    needed, only the names for the competition events of that one competition are looked up, in a single query. """
+
+    comp_ids = __populate(database, comp_count=3)
+
+    with count_queries() as counter:
+        results = get_all_complete_user_results_for_comp_and_user(comp_ids[1], 1)
+        assert counter.count == 1
+
+        assert [r.is_mbld for r in results] == [False, False, False, True]
+        assert counter.count == 2
+
+    with count_queries() as counter:
+        assert [r.is_fmc for r in get_all_complete_user_results_for_comp_and_user(comp_ids[1], 2)] ==\
+            [False, True, False, False]
+        assert [r.is_fmc for r in get_all_complete_user_results_for_comp_and_user(comp_ids[2], 1)] ==\
+            [False, True, False, False]
+
+    assert counter.count == 3
+
+
+def test_invalidating_event_catalog_forgets_event_names(populated, count_queries):
+    """ Test that invalidating the event catalog also makes results look their event names up again. """
+
+    invalidate_event_catalog()
+
+    with count_queries() as counter:
+        results = get_all_complete_user_results_for_comp_and_user(populated[0], 1)
+        assert [r.is_blind for r in results] == [False, False, True, False]
+
+    assert counter.count == 2
+
+
+def test_missing_comp_events_are_not_remembered(populated, database, count_queries):
+    """ Test that results for a competition event which doesn't exist get no event flags, and that the competition
+    event is looked up again each time rather than being remembered as missing. """
+
+    database.session.add(UserEventResults(user_id=1, comp_event_id=9999, single='300', average='320', result='320',
+                                          is_complete=True, is_blacklisted=False))
+    database.session.commit()
+
+    for _ in range(2):
+        with count_queries() as counter:
+            results = database.session.query(UserEventResults).filter(UserEventResults.comp_event_id == 9999).all()
+            assert [r.is_fmc for r in results] == [False]
+
+        assert counter.count == 2
+
+
+@pytest.mark.parametrize('pbs, expected', [
+    # (single, average, was PB single, was PB average, is blacklisted) in each past competition, then the active one
+    ([('1000', '1200', True, True, False), ('900', '1300', True, False, False), ('800', '1100', True, True, False)],
+     (900, 1200)),
+    ([('DNF', 'DNF', True, True, False), ('900', 'DNF', True, False, False), ('800', '1100', True, True, False)],
+     (900, DNF_SORT_VALUE)),
+    ([('1000', '1200', True, True, False), ('700', '800', True, True, True), ('800', '1100', True, True, False)],
+     (1000, 1200)),
+    ([('1000', '1200', False, False, False), ('700', '800', True, True, True), ('800', '1100', True, True, False)],
+     (None, None)),
+])
+def test_get_pb_sort_values_except_current_comp(database, pbs, expected):
+    """ Test that the best PB single and average sort values come from non-blacklisted PB results outside the active
+    competition. """
+
+    event = Event(name='3x3', totalSolves=5, eventFormat='Ao5')
+    user = User(username='user')
+    comps = [Competition(title=f'Comp {i}', active=(i == len(pbs) - 1)) for i in range(len(pbs))]
+    database.session.add_all([event, user] + comps)
+    database.session.flush()
+
+    for comp, (single, average, was_pb_single, was_pb_average, is_blacklisted) in zip(comps, pbs):
+        comp_event = CompetitionEvent(competition_id=comp.id, event_id=event.id)
+        database.session.add(comp_event)
+        database.session.flush()
+        database.session.add(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single=single,
+                                              average=average, result=average, is_complete=True,
+                                              was_pb_single=was_pb_single, was_pb_average=was_pb_average,
+                                              is_blacklisted=is_blacklisted,
+                                              single_sort_value=to_sort_value(single),
+                                              average_sort_value=to_sort_value(average),
+                                              result_sort_value=to_sort_value(average)))
+    database.session.commit()
+
+    assert get_pb_sort_values_except_current_comp(user.id, event.id) == expected
+
+
+@pytest.mark.parametrize('comps_limit, comps_offset, expected_comps', [
+    (None, 0, [4, 3, 2, 1, 0]),
+    (2, 0, [4, 3]),
+    (2, 3, [1, 0]),
+    (2, 5, []),
+])
+def test_get_all_complete_user_results_history_for_user(populated, count_queries, comps_limit, comps_offset,
+                                                        expected_comps):
+    """ Test that a user's history comes back most recent competition first and then in event order, optionally for
+    just a page of competitions, with each result's competition and event loaded alongside it. """
+
+    with count_queries() as counter:
+        results = get_all_complete_user_results_history_for_user(1, comps_limit=comps_limit, comps_offset=comps_offset)
+        history = [(r.CompetitionEvent.Competition.id, r.CompetitionEvent.Event.name) for r in results]
+
+    assert history == [(populated[i], name) for i in expected_comps for name in EVENT_NAMES]
+    assert all(r.user_id == 1 for r in results)
+    assert counter.count == 1
+
+
+def test_get_solves_and_scrambles_for_results(populated, database, count_queries):
+    """ Test that every result's solves come back grouped by result in scramble order, along with their scrambles,
+    ready to show in a single query. """
+
+    # The first competition's FMC competition event, and its results
+    comp_event_id = 2
+    results_ids = [r.id for r in get_results_for_comp_event(comp_event_id)]
+
+    scrambles = [Scramble(scramble=f'R U F {i}', competition_event_id=comp_event_id) for i in range(3)]
+    database.session.add_all(scrambles)
+    database.session.flush()
+
+    # Add the solves out of order, and leave the last result without any
+    for results_id in results_ids[:-1]:
+        for scramble in reversed(scrambles):
+            database.session.add(UserSolve(user_event_results_id=results_id, scramble_id=scramble.id,
+                                           time=2800 + scramble.id, fmc_explanation=f'solution {scramble.id}'))
+    database.session.commit()
+
+    with count_queries() as counter:
+        solves = get_solves_and_scrambles_for_results(results_ids)
+        helpers = {results_id: [(scramble, solve.fmc_explanation, solve.get_friendly_time())
+                                for solve, scramble in results_solves]
+                   for results_id, results_solves in solves.items()}
+
+    expected = [(f'R U F {i}', f'solution {i + 1}', 28 + (i + 1) / 100) for i in range(3)]
+    assert helpers == {results_id: expected for results_id in results_ids[:-1]}
+    assert counter.count == 1, counter.statements
+
+
+def test_get_solves_and_scrambles_for_no_results(database, count_queries):
+    """ Test that asking for the solves of no results doesn't bother querying. """
+
+    with count_queries() as counter:
+        assert get_solves_and_scrambles_for_results(list()) == dict()
+
+    assert counter.count == 0
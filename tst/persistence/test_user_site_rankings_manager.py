@@ -0,0 +1,166 @@
+""" Tests for paging through the Sum of Ranks and Kinchranks leaderboards. """
+
+import pytest
+
+from cubersio.persistence.models import User, UserSiteRankings
+from cubersio.persistence.user_site_rankings_manager import get_kinchranks_page, get_kinchranks_page_for_user,\
+    get_sum_of_ranks_page, get_sum_of_ranks_page_for_user, LEADERBOARD_TYPE_ALL
+from cubersio.util.leaderboards import encode_leaderboard_cursor
+
+# Each user's sum of ranks and Kinchrank, in leaderboard order for both. Users with the maximum sum of ranks or a
+# Kinchrank of 0 haven't participated, so they aren't on the leaderboards at all.
+SITE_RANKINGS = [('u0', 10, 90.5), ('u1', 12, 80.0), ('u2', 12, 80.0), ('u3', 12, 80.0), ('u4', 15, 70.0),
+                 ('u5', 20, 60.0), ('u6', 20, 60.0), ('u7', 25, 50.0), ('idle_0', 40, 0.0), ('idle_1', 40, 0.0)]
+LEADERBOARD = [username for username, _, _ in SITE_RANKINGS if not username.startswith('idle')]
+
+# Each leaderboard, as functions retrieving a page of it and the page with a user in the middle of it, and a function
+# picking a user's value on it out of their entry in SITE_RANKINGS
+LEADERBOARDS = {
+    'sum_of_ranks': (lambda page_size, after=None, before=None:
+                     get_sum_of_ranks_page(LEADERBOARD_TYPE_ALL, False, page_size, after, before),
+                     lambda page_size, user_id: get_sum_of_ranks_page_for_user(LEADERBOARD_TYPE_ALL, False, page_size,
+                                                                               user_id),
+                     lambda sum_of_ranks, _: sum_of_ranks),
+    'kinchranks': (lambda page_size, after=None, before=None:
+                   get_kinchranks_page(LEADERBOARD_TYPE_ALL, page_size, after, before),
+                   lambda page_size, user_id: get_kinchranks_page_for_user(LEADERBOARD_TYPE_ALL, page_size, user_id),
+                   lambda _, kinchrank: kinchrank),
+}
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the site rankings in SITE_RANKINGS, with users created in the same order so ties are broken in
+    that order too. Returns a map of username to (user ID, sum of ranks, Kinchrank). """
+
+    session = database.session
+
+    users = [User(username=username) for username, _, _ in SITE_RANKINGS]
+    session.add_all(users)
+    session.flush()
+
+    session.add_all(UserSiteRankings(user_id=user.id, data='{}', sum_all_single=sum_of_ranks,
+                                     all_kinchrank=kinchrank)
+                    for user, (_, sum_of_ranks, kinchrank) in zip(users, SITE_RANKINGS))
+    session.commit()
+
+    return {user.username: (user.id, sum_of_ranks, kinchrank)
+            for user, (_, sum_of_ranks, kinchrank) in zip(users, SITE_RANKINGS)}
+
+
+def __positions_and_usernames(page):
+    return [(row.position, row.username) for row in page.rows]
+
+
+def __cursor_for(populated, leaderboard, username):
+    """ Builds the cursor pointing at the specified user's row on the leaderboard. """
+
+    user_id, sum_of_ranks, kinchrank = populated[username]
+    return encode_leaderboard_cursor(LEADERBOARDS[leaderboard][2](sum_of_ranks, kinchrank), user_id)
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+def test_page_forwards_and_backwards(populated, leaderboard):
+    """ Test that paging forwards through a leaderboard and then back again, across tied values, visits every row
+    exactly once each way with the right positions. """
+
+    get_page, _, _ = LEADERBOARDS[leaderboard]
+
+    pages = [get_page(3)]
+    assert pages[0].previous_cursor is None
+    while pages[-1].next_cursor:
+        pages.append(get_page(3, after=pages[-1].next_cursor))
+
+    assert [row for page in pages for row in __positions_and_usernames(page)] == list(enumerate(LEADERBOARD, 1))
+    assert [len(page.rows) for page in pages] == [3, 3, 2]
+
+    backwards_pages = [pages[-1]]
+    while backwards_pages[-1].previous_cursor:
+        backwards_pages.append(get_page(3, before=backwards_pages[-1].previous_cursor))
+
+    assert [__positions_and_usernames(page) for page in backwards_pages] ==\
+        [__positions_and_usernames(page) for page in reversed(pages)]
+    assert backwards_pages[-1].next_cursor == pages[0].next_cursor
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+def test_page_before_start(populated, leaderboard):
+    """ Test that the page before a cursor at or near the start of a leaderboard only holds the rows before it,
+    numbered from the start, and that there's nothing before the first row. """
+
+    get_page, _, _ = LEADERBOARDS[leaderboard]
+
+    page = get_page(3, before=__cursor_for(populated, leaderboard, 'u2'))
+    assert __positions_and_usernames(page) == [(1, 'u0'), (2, 'u1')]
+    assert page.previous_cursor is None
+    assert page.next_cursor == __cursor_for(populated, leaderboard, 'u1')
+
+    page = get_page(3, before=__cursor_for(populated, leaderboard, 'u0'))
+    assert page.rows == []
+    assert page.previous_cursor is None and page.next_cursor is None
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+def test_positions_do_not_come_from_cursors(populated, leaderboard):
+    """ Test that a page's positions are counted from the database, so a cursor which doesn't point at a row on the
+    leaderboard, or which has a position in it, can't renumber the page. """
+
+    get_page, _, value_of = LEADERBOARDS[leaderboard]
+    u3_id, sum_of_ranks, kinchrank = populated['u3']
+
+    page = get_page(2, after=encode_leaderboard_cursor(value_of(sum_of_ranks, kinchrank), u3_id + 100))
+    assert __positions_and_usernames(page) == [(5, 'u4'), (6, 'u5')]
+
+    page = get_page(2, after=f'1000_{encode_leaderboard_cursor(value_of(sum_of_ranks, kinchrank), u3_id)}')
+    assert __positions_and_usernames(page) == [(1, 'u0'), (2, 'u1')]
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+@pytest.mark.parametrize('username, expected', [
+    ('u0', ['u0', 'u1', 'u2', 'u3']),
+    ('u1', ['u0', 'u1', 'u2', 'u3']),
+    ('u4', ['u2', 'u3', 'u4', 'u5']),
+    ('u6', ['u4', 'u5', 'u6', 'u7']),
+    ('u7', ['u4', 'u5', 'u6', 'u7']),
+])
+def test_page_for_user(populated, leaderboard, username, expected):
+    """ Test that the page for a user has them in the middle of it, or as close as possible near either end of the
+    leaderboard, and that paging on from it picks up where it left off. """
+
+    get_page, get_page_for_user, _ = LEADERBOARDS[leaderboard]
+
+    page = get_page_for_user(4, populated[username][0])
+    assert __positions_and_usernames(page) == [(LEADERBOARD.index(u) + 1, u) for u in expected]
+    assert (page.previous_cursor is None) == (expected[0] == LEADERBOARD[0])
+    assert (page.next_cursor is None) == (expected[-1] == LEADERBOARD[-1])
+
+    if page.next_cursor:
+        next_page = get_page(4, after=page.next_cursor)
+        assert next_page.rows[0].position == page.rows[-1].position + 1
+        assert next_page.rows[0].username == LEADERBOARD[page.rows[-1].position]
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+def test_users_who_have_not_participated_are_excluded(populated, leaderboard):
+    """ Test that users with the maximum sum of ranks or a Kinchrank of 0 aren't on the leaderboard, and don't have a
+    page of it. """
+
+    get_page, get_page_for_user, _ = LEADERBOARDS[leaderboard]
+
+    assert [row.username for row in get_page(len(SITE_RANKINGS)).rows] == LEADERBOARD
+    assert get_page_for_user(4, populated['idle_0'][0]) is None
+
+
+@pytest.mark.parametrize('leaderboard', list(LEADERBOARDS))
+@pytest.mark.parametrize('cursor_direction', ['after', 'before'])
+def test_page_is_fetched_in_one_query(populated, leaderboard, cursor_direction, count_queries):
+    """ Test that a page from a cursor, positions and all, is fetched in a single query. """
+
+    get_page, _, _ = LEADERBOARDS[leaderboard]
+
+    with count_queries() as counter:
+        page = get_page(2, **{cursor_direction: __cursor_for(populated, leaderboard, 'u4')})
+
+    assert counter.count == 1
+    assert __positions_and_usernames(page) == ([(6, 'u5'), (7, 'u6')] if cursor_direction == 'after' else
+                                               [(3, 'u2'), (4, 'u3')])
@@ -0,0 +1,242 @@
+""" Tests for maintaining and retrieving users' overall stats. """
+
+import pytest
+
+from cubersio.business.user_results import set_medals_on_best_event_results
+from cubersio.persistence import user_stats_manager
+from cubersio.persistence.comp_manager import get_user_participated_competitions_count
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, Scramble, User, UserEventResults,\
+    UserSolve, UserStats
+from cubersio.persistence.user_results_manager import delete_event_results, delete_user_solve,\
+    get_user_completed_solves_count, get_user_medals_count, save_event_results
+from cubersio.persistence.user_stats_manager import get_user_stats, rebuild_all_user_stats
+
+EVENT_NAMES = ['3x3', '2x2', '4x4']
+USER_COUNT = 3
+
+# For each competition, the events each user has results in as (event index, is complete, medal), for every user
+COMPETITIONS = [
+    [
+        [(0, True, 'gold'), (1, True, 'silver'), (2, False, None)],
+        [(0, True, 'silver'), (1, True, 'gold')],
+        [(0, True, 'bronze')],
+    ],
+    [
+        [(0, True, None)],
+        [(2, True, 'gold')],
+        [],
+    ],
+    [
+        [(1, False, None)],
+        [],
+        [(0, True, None), (1, True, None), (2, True, None)],
+    ],
+]
+
+
+@pytest.fixture
+def populated(database):
+    """ A database with the results in COMPETITIONS, each with a solve for every scramble if it's complete and a single
+    solve if it isn't. Returns the IDs of the users. """
+
+    session = database.session
+
+    events = [Event(name=name, totalSolves=5, eventFormat='Ao5') for name in EVENT_NAMES]
+    users = [User(username=f'user_{i}') for i in range(USER_COUNT)]
+    session.add_all(events + users)
+    session.flush()
+
+    for i, comp_results in enumerate(COMPETITIONS):
+        comp = Competition(title=f'Comp {i}', active=(i == len(COMPETITIONS) - 1))
+        session.add(comp)
+        session.flush()
+
+        comp_events = [CompetitionEvent(competition_id=comp.id, event_id=event.id) for event in events]
+        session.add_all(comp_events)
+        session.flush()
+
+        scrambles = {comp_event.id: [Scramble(scramble='R U', competition_event_id=comp_event.id) for _ in range(5)]
+                     for comp_event in comp_events}
+        session.add_all(s for comp_event_scrambles in scrambles.values() for s in comp_event_scrambles)
+        session.flush()
+
+        for user, user_results in zip(users, comp_results):
+            for event_index, is_complete, medal in user_results:
+                comp_event = comp_events[event_index]
+                results = UserEventResults(user_id=user.id, comp_event_id=comp_event.id, single='1000',
+                                           average='1200', result='1200', is_complete=is_complete,
+                                           was_gold_medal=(medal == 'gold'), was_silver_medal=(medal == 'silver'),
+                                           was_bronze_medal=(medal == 'bronze'))
+                session.add(results)
+                session.flush()
+
+                solve_scrambles = scrambles[comp_event.id] if is_complete else scrambles[comp_event.id][:1]
+                session.add_all(UserSolve(user_event_results_id=results.id, scramble_id=scramble.id, time=1000)
+                                for scramble in solve_scrambles)
+
+    session.commit()
+    return [user.id for user in users]
+
+
+def __stats(user_stats):
+    return (user_stats.gold_count, user_stats.silver_count, user_stats.bronze_count, user_stats.solves_count,
+            user_stats.comps_count, user_stats.events_count)
+
+
+@pytest.mark.parametrize('user_index, expected', [
+    (0, (1, 1, 0, 15, 2, 2)),
+    (1, (2, 1, 0, 15, 2, 3)),
+    (2, (0, 0, 1, 20, 2, 3)),
+])
+def test_get_user_stats(populated, user_index, expected):
+    """ Test that a user's stats are counted from their results the first time they're needed, and agree with counting
+    each stat directly. """
+
+    user_id = populated[user_index]
+    user_stats = get_user_stats(user_id)
+
+    assert __stats(user_stats) == expected
+    assert __stats(user_stats)[:3] == get_user_medals_count(user_id)
+    assert user_stats.solves_count == get_user_completed_solves_count(user_id)
+    assert user_stats.comps_count == get_user_participated_competitions_count(user_id)
+
+
+def test_get_user_stats_without_results(populated, database):
+    """ Test that a user without any results has all-zero stats. """
+
+    user = User(username='newcomer')
+    database.session.add(user)
+    database.session.commit()
+
+    assert __stats(get_user_stats(user.id)) == (0, 0, 0, 0, 0, 0)
+
+
+def test_get_existing_user_stats_query_count(populated, count_queries):
+    """ Test that once a user's stats exist, getting them is a single lookup. """
+
+    get_user_stats(populated[0])
+
+    with count_queries() as counter:
+        get_user_stats(populated[0])
+
+    assert counter.count == 1
+
+
+def test_rebuild_all_user_stats(populated, database):
+    """ Test that rebuilding everybody's stats in bulk gives the same stats as counting each user's, and replaces any
+    stats which had drifted. """
+
+    expected = {user_id: __stats(get_user_stats(user_id)) for user_id in populated}
+    database.session.query(UserStats).filter(UserStats.user_id == populated[0]).update({'gold_count': 99})
+    database.session.commit()
+
+    assert rebuild_all_user_stats() == USER_COUNT
+    assert {user_id: __stats(get_user_stats(user_id)) for user_id in populated} == expected
+
+
+def test_stats_follow_saved_and_deleted_results(populated, database):
+    """ Test that saving and deleting results keeps the user's stats up to date. """
+
+    user_id = populated[0]
+    assert __stats(get_user_stats(user_id)) == (1, 1, 0, 15, 2, 2)
+
+    # Complete the user's incomplete results in the active competition
+    results = database.session.query(UserEventResults).\
+        join(CompetitionEvent).\
+        filter(UserEventResults.user_id == user_id).\
+        filter(CompetitionEvent.competition_id == 3).\
+        one()
+    scramble_ids = [s.id for s in database.session.query(Scramble).filter(
+        Scramble.competition_event_id == results.comp_event_id).order_by(Scramble.id)]
+    database.session.add_all(UserSolve(user_event_results_id=results.id, scramble_id=scramble_id, time=1000)
+                             for scramble_id in scramble_ids[1:])
+    results.is_complete = True
+    results_id = results.id
+    save_event_results(results, event_id=2)
+
+    assert __stats(get_user_stats(user_id)) == (1, 1, 0, 20, 3, 2)
+
+    results = database.session.query(UserEventResults).filter(UserEventResults.id == results_id).one()
+    delete_event_results(results)
+
+    assert __stats(get_user_stats(user_id)) == (1, 1, 0, 15, 2, 2)
+
+
+def __assert_stats_match_recount(database, user_ids):
+    """ Asserts that the users' stats, as maintained from the changes to their results, are the same as counting them
+    from scratch. """
+
+    database.session.expire_all()
+    maintained = {user_id: __stats(get_user_stats(user_id)) for user_id in user_ids}
+
+    rebuild_all_user_stats()
+    database.session.expire_all()
+
+    assert maintained == {user_id: __stats(get_user_stats(user_id)) for user_id in user_ids}
+
+
+def __get_results(database, user_id, comp_id, event_id):
+    return database.session.query(UserEventResults).\
+        join(CompetitionEvent).\
+        filter(UserEventResults.user_id == user_id).\
+        filter(CompetitionEvent.competition_id == comp_id).\
+        filter(CompetitionEvent.event_id == event_id).\
+        one()
+
+
+def test_stats_are_updated_without_recounting(populated, database, monkeypatch):
+    """ Test that every kind of change to a user's results is applied to their stats without recounting them, and
+    leaves them the same as a recount would. """
+
+    for user_id in populated:
+        get_user_stats(user_id)
+
+    def recount(*_):
+        raise AssertionError('Stats were recounted')
+
+    count_stats = getattr(user_stats_manager, '__count_stats')
+    monkeypatch.setattr(user_stats_manager, '__count_stats', recount)
+    first_user, second_user, third_user = populated
+
+    # Deleting a solve from complete results takes it out of the solves count
+    results = __get_results(database, first_user, 1, 1)
+    delete_user_solve(results.solves[-1])
+    assert __stats(get_user_stats(first_user)) == (1, 1, 0, 14, 2, 2)
+
+    # Then making those results incomplete takes the rest of their solves out. The user still has complete results in
+    # the same competition, but the competition's event was the last one with complete results in that event.
+    results = __get_results(database, first_user, 1, 1)
+    results.is_complete = False
+    save_event_results(results, event_id=1)
+    assert __stats(get_user_stats(first_user)) == (1, 1, 0, 10, 2, 2)
+
+    # New complete results in a competition the user hasn't completed anything in yet count towards everything
+    comp_event = database.session.query(CompetitionEvent).\
+        filter(CompetitionEvent.competition_id == 2).\
+        filter(CompetitionEvent.event_id == 2).\
+        one()
+    results = UserEventResults(user_id=third_user, comp_event_id=comp_event.id, single='900', average='1000',
+                               result='1000', is_complete=True)
+    results.solves = [UserSolve(scramble_id=scramble.id, time=1000) for scramble in comp_event.scrambles]
+    save_event_results(results, event_id=2)
+    assert __stats(get_user_stats(third_user)) == (0, 0, 1, 25, 3, 3)
+
+    # Awarding medals in the active competition, where the third user has the only complete results, gives them gold
+    # in every event
+    comp_events = database.session.query(CompetitionEvent).filter(CompetitionEvent.competition_id == 3).all()
+    set_medals_on_best_event_results(comp_events)
+    assert __stats(get_user_stats(third_user)) == (3, 0, 1, 25, 3, 3)
+    assert __stats(get_user_stats(first_user)) == (1, 1, 0, 10, 2, 2)
+
+    # Deleting results with a medal takes away the medal and the solves
+    results = __get_results(database, third_user, 3, 1)
+    delete_event_results(results)
+    assert __stats(get_user_stats(third_user)) == (2, 0, 1, 20, 3, 3)
+
+    # Deleting the only complete results in a competition takes away the competition too
+    results = __get_results(database, third_user, 2, 2)
+    delete_event_results(results)
+    assert __stats(get_user_stats(third_user)) == (2, 0, 1, 15, 2, 3)
+
+    monkeypatch.setattr(user_stats_manager, '__count_stats', count_stats)
+    __assert_stats_match_recount(database, populated)
@@ -25,23 +25,26 @@ def _setup_mock(**kwargs):
 
 
 @patch('cubersio.tasks.scramble_generation.get_all_events')
+@patch('cubersio.tasks.scramble_generation.get_scramble_pool_counts')
 @patch('cubersio.tasks.scramble_generation.top_off_scramble_pool')
-def test_check_scramble_pool(mock_top_off_scramble_pool, mock_get_all_events):
+def test_check_scramble_pool(mock_top_off_scramble_pool, mock_get_scramble_pool_counts, mock_get_all_events):
     """ Test that the scrambler pool checker task makes the appropriate calls to top_off_scramble_pool based on the
     number of remaining scrambles for each event. """
 
     # 3x3 and FTO need scrambles, they are below the 2x weekly scrambles threshold.
     # 10x10 has enough scrambles, and COLL doesn't have its scrambles pre-generated.
     mock_get_all_events.return_value = [
-        _setup_mock(name=EVENT_3x3.name, id=1, scramble_pool=list(range(5)), totalSolves=5),
-        _setup_mock(name=EVENT_10x10.name, id=2, scramble_pool=list(range(5)), totalSolves=1),
-        _setup_mock(name=EVENT_COLL.name, id=3, scramble_pool=list(range(5)), totalSolves=5),
-        _setup_mock(name=EVENT_FTO.name, id=4, scramble_pool=list(), totalSolves=5),
+        _setup_mock(name=EVENT_3x3.name, id=1, totalSolves=5),
+        _setup_mock(name=EVENT_10x10.name, id=2, totalSolves=1),
+        _setup_mock(name=EVENT_COLL.name, id=3, totalSolves=5),
+        _setup_mock(name=EVENT_FTO.name, id=4, totalSolves=5),
     ]
+    mock_get_scramble_pool_counts.return_value = {1: 5, 2: 5, 3: 5}
 
     check_scramble_pool()
 
     mock_get_all_events.assert_called_once()
+    mock_get_scramble_pool_counts.assert_called_once()
     assert mock_top_off_scramble_pool.call_count == 2
     mock_top_off_scramble_pool.assert_has_calls([
         call(ScramblePoolTopOffInfo(1, EVENT_3x3.name, 5)),
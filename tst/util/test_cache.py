@@ -0,0 +1,113 @@
+""" Tests for the pluggable cache backends. """
+
+import pytest
+
+from cubersio.util.cache import LRUCacheBackend, NullCacheBackend, RedisCacheBackend
+
+MODULE = 'cubersio.util.cache'
+
+
+class LocalRedis:
+    """ A local stand-in for a Redis client, supporting just the commands the Redis cache backend uses. """
+
+    def __init__(self):
+        self.values = dict()
+        self.expiries = dict()
+
+    def get(self, key):
+        return self.values.get(key, None)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+        self.expiries[key] = ex
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def test_lru_get_set_delete():
+    cache = LRUCacheBackend(max_entries=2)
+    assert cache.get('a') is None
+
+    cache.set('a', [1, 2])
+    assert cache.get('a') == [1, 2]
+
+    cache.delete('a')
+    assert cache.get('a') is None
+
+    # Deleting something that isn't there is fine
+    cache.delete('a')
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCacheBackend(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    # Reading 'a' makes 'b' the least recently used, so it's evicted when 'c' is added
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_lru_replacing_a_value_does_not_evict():
+    cache = LRUCacheBackend(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 10)
+
+    assert cache.get('a') == 10
+    assert cache.get('b') == 2
+
+
+@pytest.mark.parametrize('ttl_seconds, elapsed_seconds, is_expired', [
+    (0, 10 ** 6, False),
+    (60, 59, False),
+    (60, 60, True),
+    (60, 61, True),
+])
+def test_lru_expiry(mocker, ttl_seconds, elapsed_seconds, is_expired):
+    mocked_monotonic = mocker.patch(MODULE + '.monotonic', return_value=1000)
+    cache = LRUCacheBackend(max_entries=2, ttl_seconds=ttl_seconds)
+    cache.set('a', 1)
+
+    mocked_monotonic.return_value = 1000 + elapsed_seconds
+    assert (cache.get('a') is None) == is_expired
+
+
+def test_lru_with_no_entries_holds_nothing():
+    cache = LRUCacheBackend(max_entries=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_null_holds_nothing():
+    cache = NullCacheBackend()
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    cache.delete('a')
+
+
+def test_redis_round_trips_json():
+    client = LocalRedis()
+    cache = RedisCacheBackend(client, 'prefix:', ttl_seconds=30)
+
+    cache.set('a', {'results': [[1, ['user', True], None]]})
+    assert cache.get('a') == {'results': [[1, ['user', True], None]]}
+    assert set(client.values.keys()) == {'prefix:a'}
+    assert client.expiries['prefix:a'] == 30
+
+    cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_redis_without_ttl_does_not_expire():
+    client = LocalRedis()
+    cache = RedisCacheBackend(client, 'prefix:')
+
+    cache.set('a', 1)
+    assert client.expiries['prefix:a'] is None
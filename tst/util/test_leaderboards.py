@@ -0,0 +1,33 @@
+""" Tests for the leaderboard pagination cursors. """
+
+import pytest
+
+from cubersio.util.leaderboards import encode_leaderboard_cursor, decode_leaderboard_cursor
+
+
+@pytest.mark.parametrize('value, user_id', [
+    (35, 12),
+    (1234, 5),
+    (87.123456789, 42),
+    (0.1, 7),
+    (1e-05, 1),
+])
+def test_cursor_round_trip(value, user_id):
+    cursor = encode_leaderboard_cursor(value, user_id)
+    decoded = decode_leaderboard_cursor(cursor)
+
+    assert decoded == (value, user_id)
+    assert type(decoded[0]) is type(value)
+
+
+@pytest.mark.parametrize('cursor', [
+    None,
+    '',
+    '35',
+    '100_35_12',
+    'abc_12',
+    '35_x',
+    '35.5_',
+])
+def test_decode_malformed_cursor(cursor):
+    assert decode_leaderboard_cursor(cursor) is None
@@ -0,0 +1,134 @@
+""" Tests for the in-memory PB rank index. """
+
+from threading import Event, Thread
+
+import pytest
+
+from cubersio.util.rank_index import PBRankIndex
+from cubersio.util.ranks import DNF_SORT_VALUE, MISSING_SORT_VALUE
+
+# PBs for users 1 through 6, including a tie, a DNF, and an empty PB
+USER_PBS = [(1, 1200), (2, 900), (3, 1200), (4, DNF_SORT_VALUE), (5, 1500), (6, MISSING_SORT_VALUE)]
+
+
+@pytest.mark.parametrize('user_id, expected_rank', [
+    (2, 1),
+    (1, 2),
+    (3, 2),
+    (5, 4),
+    (4, 5),
+    (6, 7),
+    (99, 7),
+])
+def test_rank_for_user(user_id, expected_rank):
+    assert PBRankIndex(USER_PBS).rank_for_user(user_id) == expected_rank
+
+
+@pytest.mark.parametrize('value, expected_rank', [
+    (800, 1),
+    (900, 1),
+    (1000, 2),
+    (1200, 2),
+    (1201, 4),
+    (DNF_SORT_VALUE, 5),
+    (MISSING_SORT_VALUE, 5),
+])
+def test_rank(value, expected_rank):
+    assert PBRankIndex(USER_PBS).rank(value) == expected_rank
+
+
+@pytest.mark.parametrize('user_id, value, expected_ranks', [
+    # Improving an existing PB
+    (5, 1000, {2: 1, 5: 2, 1: 3, 3: 3, 4: 5}),
+    # Tying an existing PB
+    (5, 900, {2: 1, 5: 1, 1: 3, 3: 3, 4: 5}),
+    # A new user's first PB
+    (7, 100, {7: 1, 2: 2, 1: 3, 5: 5, 4: 6, 6: 8}),
+    # Removing a PB
+    (2, None, {1: 1, 3: 1, 5: 3, 4: 4, 2: 6}),
+])
+def test_update(user_id, value, expected_ranks):
+    index = PBRankIndex(USER_PBS)
+    index.update(user_id, value)
+
+    assert index.get_value(user_id) == value
+    for ranked_user_id, expected_rank in expected_ranks.items():
+        assert index.rank_for_user(ranked_user_id) == expected_rank
+
+
+def test_empty_index():
+    index = PBRankIndex()
+
+    assert len(index) == 0
+    assert index.rank(1000) == 1
+    assert index.rank_for_user(1) == 1
+
+
+@pytest.mark.parametrize('value, excluding_user_id, expected_rank, expected_percentile', [
+    (800, None, 1, 100.0),
+    (1200, None, 2, 5 / 6 * 100),
+    (1300, None, 4, 50.0),
+    (DNF_SORT_VALUE, None, 5, 2 / 6 * 100),
+    # User 2 holds the fastest PB, so doesn't count against themselves
+    (1300, 2, 3, 60.0),
+    # User 5's PB is slower than the value, so excluding it doesn't change anything ahead of the value
+    (1300, 5, 4, 40.0),
+    # User 99 doesn't have a PB to exclude
+    (1300, 99, 4, 50.0),
+])
+def test_rank_and_percentile_excluding_user(value, excluding_user_id, expected_rank, expected_percentile):
+    index = PBRankIndex(USER_PBS)
+
+    assert index.rank(value, excluding_user_id) == expected_rank
+    assert index.percentile(value, excluding_user_id) == pytest.approx(expected_percentile)
+
+    rank, percentile, count = index.rank_percentile_and_count(value, excluding_user_id)
+    assert (rank, count) == (expected_rank, 6 - (1 if excluding_user_id in (2, 5) else 0))
+    assert percentile == pytest.approx(expected_percentile)
+
+
+def test_get_value_and_rank():
+    index = PBRankIndex(USER_PBS)
+
+    assert index.get_value_and_rank(1) == (1200, 2)
+    assert index.get_value_and_rank(6) == (MISSING_SORT_VALUE, 7)
+    assert index.get_value_and_rank(99) == (None, 7)
+
+
+def test_reads_while_updating():
+    """ Test that reading the index from several threads while another thread keeps moving PBs around always sees a
+    consistent index, and leaves it the same as building it from the final PBs. """
+
+    index = PBRankIndex((user_id, 1000 + user_id) for user_id in range(1000))
+    errors = list()
+    done = Event()
+
+    def update():
+        for i in range(20000):
+            user_id = i % 1000
+            index.update(user_id, 1000 + (user_id * 7919 + i) % 5000 if i % 10 else None)
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                for user_id in range(0, 1000, 37):
+                    value, rank = index.get_value_and_rank(user_id)
+                    rank, percentile, count = index.rank_percentile_and_count(2000, user_id)
+                    assert 1 <= rank <= count + 1
+                    assert 0.0 <= percentile <= 100.0
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [Thread(target=update)] + [Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+
+    rebuilt = PBRankIndex((user_id, index.get_value(user_id)) for user_id in range(1000)
+                          if index.get_value(user_id) is not None)
+    assert len(rebuilt) == len(index)
+    assert all(index.rank_for_user(user_id) == rebuilt.rank_for_user(user_id) for user_id in range(1000))
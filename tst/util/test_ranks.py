@@ -0,0 +1,86 @@
+""" Tests for utility functions related to sorting and ranking results. """
+
+import pytest
+
+import numpy as np
+
+from cubersio.util.ranks import to_sort_values, from_sort_value, competition_ranks, rank_results, rank_results_by_group,\
+    DNF_SORT_VALUE, MISSING_SORT_VALUE
+
+
+@pytest.mark.parametrize('values, expected_sort_values', [
+    ([], []),
+    ([1234, '567'], [1234, 567]),
+    (['DNF', 1000], [DNF_SORT_VALUE, 1000]),
+    (['', None, '42'], [MISSING_SORT_VALUE, MISSING_SORT_VALUE, 42]),
+])
+def test_to_sort_values(values, expected_sort_values):
+    assert to_sort_values(values).tolist() == expected_sort_values
+
+
+@pytest.mark.parametrize('sort_value, expected_value', [
+    (1234, '1234'),
+    (DNF_SORT_VALUE, 'DNF'),
+    (MISSING_SORT_VALUE, ''),
+])
+def test_from_sort_value(sort_value, expected_value):
+    assert from_sort_value(sort_value) == expected_value
+
+
+@pytest.mark.parametrize('values, expected_ranks', [
+    ([], []),
+    ([12], [1]),
+    ([12, 13, 14, 14, 15], [1, 2, 3, 3, 5]),
+    ([12, 12, 12], [1, 1, 1]),
+    ([12, 'DNF', 'DNF', None], [1, 2, 2, 2]),
+])
+def test_competition_ranks(values, expected_ranks):
+    assert competition_ranks(to_sort_values(values)).tolist() == expected_ranks
+
+
+@pytest.mark.parametrize('primary, secondary, expected_order, expected_ranks, expected_visible', [
+    ([300, 'DNF', 200, None], None, [2, 0, 1, 3], [1, 2, 3, 3], [True, True, True, False]),
+    ([300, 200, 300], [150, 100, 120], [1, 2, 0], [1, 2, 3], [True, True, True]),
+    ([300, 200, 300], [150, 100, 150], [1, 0, 2], [1, 2, 2], [True, True, False]),
+    (['DNF', 'DNF'], [900, 800], [1, 0], [1, 2], [True, True]),
+])
+def test_rank_results(primary, secondary, expected_order, expected_ranks, expected_visible):
+    secondary = to_sort_values(secondary) if secondary is not None else None
+    order, ranks, visible = rank_results(to_sort_values(primary), secondary)
+
+    assert order.tolist() == expected_order
+    assert ranks.tolist() == expected_ranks
+    assert visible.tolist() == expected_visible
+
+
+@pytest.mark.parametrize('groups, primary, secondary, expected_order, expected_ranks', [
+    ([], [], None, [], []),
+    ([1, 1, 1, 1], [300, 'DNF', 200, None], None, [2, 0, 1, 3], [1, 2, 3, 3]),
+    ([2, 1, 2, 1], [300, 300, 200, 100], None, [3, 1, 2, 0], [1, 2, 1, 2]),
+    ([5, 5, 3, 5], [300, 200, 300, 300], [150, 100, 150, 120], [2, 1, 3, 0], [1, 1, 2, 3]),
+    ([1, 2, 1, 2], ['DNF', 'DNF', 'DNF', None], [900, 100, 800, 100], [2, 0, 1, 3], [1, 2, 1, 1]),
+])
+def test_rank_results_by_group(groups, primary, secondary, expected_order, expected_ranks):
+    secondary = to_sort_values(secondary) if secondary is not None else None
+    order, ranks = rank_results_by_group(np.array(groups, dtype=np.int64), to_sort_values(primary), secondary)
+
+    assert order.tolist() == expected_order
+    assert ranks.tolist() == expected_ranks
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rank_results_by_group_matches_rank_results(seed):
+    rng = np.random.default_rng(seed)
+    count = 500
+    groups = rng.integers(0, 8, count)
+    primary = rng.choice([100, 200, 300, DNF_SORT_VALUE, MISSING_SORT_VALUE], count)
+    secondary = rng.choice([50, 60, DNF_SORT_VALUE], count)
+
+    order, ranks = rank_results_by_group(groups, primary, secondary)
+    ranks_by_index = dict(zip(order.tolist(), ranks.tolist()))
+
+    for group in np.unique(groups):
+        indices = np.flatnonzero(groups == group)
+        group_order, group_ranks, _ = rank_results(primary[indices], secondary[indices])
+        for i, rank in zip(indices[group_order].tolist(), group_ranks.tolist()):
+            assert ranks_by_index[i] == rank
@@ -3,43 +3,33 @@
 import pytest
 from itertools import permutations
 
-from cubersio.business.rankings import PersonalBestRecord
 from cubersio.persistence.models import UserEventResults, EventFormat
-from cubersio.util.sorting import sort_personal_best_records, __sort_user_event_results_by_result, \
-    __sort_user_event_results_by_single, sort_user_results_with_rankings
+from cubersio.util.ranks import to_sort_values, rank_results
+from cubersio.util.sorting import sort_user_results_with_rankings
 
 
-_PB1 = PersonalBestRecord(personal_best=500)
-_PB2 = PersonalBestRecord(personal_best=100)
-_PB3 = PersonalBestRecord(personal_best=None)
-_PB4 = PersonalBestRecord(personal_best="DNF")
+_UNSORTED_VALUES = [500, 100, None, "DNF"]
+_CORRECTLY_SORTED_VALUES = [100, 500, "DNF", None]
 
-_UNSORTED_PBS = [_PB1, _PB2, _PB3, _PB4]
-_CORRECTLY_SORTED_PBS = [_PB2, _PB1, _PB4, _PB3]
 
+@pytest.mark.parametrize('unsorted_values', permutations(_UNSORTED_VALUES))
+def test_rank_results_sorts_dnfs_then_missing_results_last(unsorted_values):
+    """ Tests that results are sorted by time, with DNFs after every time and missing results after that. This is how
+    PB records, and results by their `result` field, are sorted. """
 
-@pytest.mark.parametrize('unsorted_pbs', permutations(_UNSORTED_PBS))
-def test_sort_personal_best_records(unsorted_pbs):
-    assert sorted(unsorted_pbs, key=sort_personal_best_records) == _CORRECTLY_SORTED_PBS
+    order, _, _ = rank_results(to_sort_values(unsorted_values))
+    assert [unsorted_values[i] for i in order] == _CORRECTLY_SORTED_VALUES
 
 
-_RESULT1 = UserEventResults(result=500, single=500)
-_RESULT2 = UserEventResults(result=100, single=100)
-_RESULT3 = UserEventResults(result=None, single=None)
-_RESULT4 = UserEventResults(result="DNF", single="DNF")
+@pytest.mark.parametrize('unsorted_singles', permutations(_UNSORTED_VALUES))
+def test_sort_user_results_with_rankings_sorts_tied_results_by_single(unsorted_singles):
+    """ Tests that tied results are sorted by their singles, with DNF singles after every time and missing singles
+    after that. """
 
-_UNSORTED_RESULTS = [_RESULT1, _RESULT2, _RESULT3, _RESULT4]
-_CORRECTLY_SORTED_RESULTS = [_RESULT2, _RESULT1, _RESULT4, _RESULT3]
+    results = [UserEventResults(result=1000, single=single) for single in unsorted_singles]
+    ranked = sort_user_results_with_rankings(results, EventFormat.Ao5)
 
-
-@pytest.mark.parametrize('unsorted_results', permutations(_UNSORTED_RESULTS))
-def test_sort_user_event_results_by_result(unsorted_results):
-    assert sorted(unsorted_results, key=__sort_user_event_results_by_result) == _CORRECTLY_SORTED_RESULTS
-
-
-@pytest.mark.parametrize('unsorted_results', permutations(_UNSORTED_RESULTS))
-def test_sort_user_event_results_by_single(unsorted_results):
-    assert sorted(unsorted_results, key=__sort_user_event_results_by_single) == _CORRECTLY_SORTED_RESULTS
+    assert [result.single for _, _, result in ranked] == _CORRECTLY_SORTED_VALUES
 
 
 @pytest.mark.parametrize('event_format', [EventFormat.Bo1, EventFormat.Bo3])